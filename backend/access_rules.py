@@ -7,26 +7,37 @@ import json
 import os
 from datetime import datetime
 
+from config_registry import CONFIG_REGISTRY, thaw
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'access_rules.json')
+
+
+def _parse_rules(raw):
+    if not isinstance(raw, dict) or not isinstance(raw.get('rules'), list):
+        return {'rules': []}
+    return raw
+
+
+CONFIG_REGISTRY.register('access_rules', RULES_PATH, _parse_rules)
+
 class AccessRules:
     
     @staticmethod
     def get_rules():
-        """Get all access rules"""
-        try:
-            rules_path = os.path.join(os.path.dirname(__file__), 'access_rules.json')
-            if os.path.exists(rules_path):
-                with open(rules_path, 'r') as f:
-                    return json.load(f)
-            return {'rules': []}
-        except:
-            return {'rules': []}
+        """Get all access rules (read-only snapshot; use thaw() before editing)"""
+        return CONFIG_REGISTRY.get('access_rules')
+    
+    @staticmethod
+    def _write_rules(data):
+        with open(RULES_PATH, 'w') as f:
+            json.dump(data, f, indent=2)
+        CONFIG_REGISTRY.invalidate('access_rules')
     
     @staticmethod
     def save_rule(rule, created_by='System', method='AI'):
         """Save new access rule"""
         try:
-            rules_path = os.path.join(os.path.dirname(__file__), 'access_rules.json')
-            data = AccessRules.get_rules()
+            data = thaw(AccessRules.get_rules())
             
             rule['id'] = f"rule_{len(data['rules']) + 1}_{int(datetime.now().timestamp())}"
             rule['created_at'] = datetime.now().isoformat()
@@ -35,8 +46,7 @@ class AccessRules:
             
             data['rules'].append(rule)
             
-            with open(rules_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            AccessRules._write_rules(data)
             
             return {'status': 'success', 'rule_id': rule['id']}
         except Exception as e:
@@ -55,13 +65,11 @@ class AccessRules:
     def delete_rule(rule_id):
         """Delete rule"""
         try:
-            rules_path = os.path.join(os.path.dirname(__file__), 'access_rules.json')
-            data = AccessRules.get_rules()
+            data = thaw(AccessRules.get_rules())
             
             data['rules'] = [r for r in data['rules'] if r['id'] != rule_id]
             
-            with open(rules_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            AccessRules._write_rules(data)
             
             return {'status': 'success'}
         except Exception as e:
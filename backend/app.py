@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, session, redirect
+from flask import Flask, Response, request, jsonify, session, redirect, g, has_request_context
 from flask_cors import CORS
 import boto3
 from botocore.config import Config
@@ -15,6 +15,11 @@ from ai_validator import AIValidator
 from user_sync_engine import UserSyncEngine
 from enforcement_engine import EnforcementEngine
 from persistence import NpamxStore
+from request_repository import RequestRepository
+from session_store import SESSION_STORE, ServerSessionInterface
+from assumed_role_credentials import AssumedRoleCredentialProvider
+from config_registry import CONFIG_REGISTRY, thaw
+from policy_engine import POLICY_ENGINE
 
 load_dotenv()
 
@@ -68,6 +73,7 @@ except ImportError:
 try:
     from onelogin.saml2.auth import OneLogin_Saml2_Auth
     from onelogin.saml2.idp_metadata_parser import OneLogin_Saml2_IdPMetadataParser
+    from onelogin.saml2.settings import OneLogin_Saml2_Settings
     _SAML_AVAILABLE = True
 except ImportError:
     _SAML_AVAILABLE = False
@@ -84,10 +90,26 @@ def prepare_flask_request(request):
     }
 
 
-def init_saml_auth(req):
-    base_path = os.path.join(os.path.dirname(__file__), 'saml')
-    metadata_path = os.path.join(base_path, 'idp_metadata.xml')
-    with open(metadata_path, 'r') as f:
+SAML_BASE_PATH = os.path.join(os.path.dirname(__file__), 'saml')
+SAML_IDP_METADATA_PATH = os.getenv('SAML_IDP_METADATA_PATH') or os.path.join(SAML_BASE_PATH, 'idp_metadata.xml')
+
+# Parsed IdP metadata + validated settings, shared by every login/ACS request.
+# Rebuilt only when idp_metadata.xml (stat key) or the env it depends on changes.
+_SAML_SETTINGS_CACHE = {'entry': (None, None)}
+_SAML_SETTINGS_LOCK = threading.Lock()
+
+
+def _saml_settings_key():
+    st = os.stat(SAML_IDP_METADATA_PATH)
+    return (
+        (st.st_mtime_ns, st.st_size, st.st_ino),
+        os.environ.get('SAML_DEBUG', ''),
+        os.environ.get('APP_BASE_URL', ''),
+    )
+
+
+def _build_saml_settings():
+    with open(SAML_IDP_METADATA_PATH, 'r') as f:
         idp_data = OneLogin_Saml2_IdPMetadataParser.parse(f.read())
     settings = idp_data.copy()
     settings['strict'] = False
@@ -101,16 +123,36 @@ def init_saml_auth(req):
         'url': acs_url,
         'binding': 'urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST',
     }
-    return OneLogin_Saml2_Auth(req, settings)
+    return OneLogin_Saml2_Settings(settings)
+
+
+def _saml_settings():
+    """Cached OneLogin_Saml2_Settings; read-only after construction, so requests share one instance."""
+    key = _saml_settings_key()
+    cached_key, settings = _SAML_SETTINGS_CACHE['entry']
+    if cached_key == key:
+        return settings
+    with _SAML_SETTINGS_LOCK:
+        cached_key, settings = _SAML_SETTINGS_CACHE['entry']
+        if cached_key != key:
+            settings = _build_saml_settings()
+            _SAML_SETTINGS_CACHE['entry'] = (key, settings)
+        return settings
+
+
+def init_saml_auth(req):
+    return OneLogin_Saml2_Auth(req, _saml_settings())
+
+CONFIG_REGISTRY.register(
+    'org_policies',
+    os.path.join(os.path.dirname(__file__), 'org_policies.json'),
+    lambda raw: raw if isinstance(raw, dict) else {},  # Fallback to empty policies
+)
+
 
 def load_org_policies():
-    """Load organizational policies from config file"""
-    try:
-        config_path = os.path.join(os.path.dirname(__file__), 'org_policies.json')
-        with open(config_path, 'r') as f:
-            return json.load(f)
-    except Exception:
-        return {}  # Fallback to empty policies
+    """Organizational policies from config file (read-only snapshot)"""
+    return CONFIG_REGISTRY.get('org_policies')
 
 # Configuration - populated from env when set, else from AWS (fallback avoids blocking on first request)
 CONFIG = {
@@ -130,14 +172,16 @@ AWS_CONFIG = Config(connect_timeout=3, read_timeout=5)
 #   IDC_ASSUME_ROLE_ARN=arn:aws:iam::<mgmt-account-id>:role/<role-name>
 #   IDC_ASSUME_ROLE_SESSION_NAME=npam-idc
 #   IDC_ASSUME_ROLE_EXTERNAL_ID=<optional>
+#   IDC_ASSUME_ROLE_REFRESH_MARGIN_SECONDS=600   (refresh this long before expiry)
+#   MANAGEMENT_ASSUME_ROLE_ARNS=<comma-separated extra roles to keep warm, e.g. per-account management roles>
 _IDC_ASSUME_ROLE_ARN = ''
-_IDC_ASSUMED_CREDS = {
-    'access_key': '',
-    'secret_key': '',
-    'session_token': '',
-    'exp_epoch': 0.0,
-}
-_IDC_ASSUMED_LOCK = threading.Lock()
+
+# STS credentials for assumed roles are refreshed ahead of expiry by a background
+# thread; request threads read the current snapshot without waiting on STS.
+IDC_CREDENTIALS = AssumedRoleCredentialProvider(
+    lambda: boto3.client('sts', config=AWS_CONFIG),
+    refresh_margin_seconds=float(os.getenv('IDC_ASSUME_ROLE_REFRESH_MARGIN_SECONDS') or 600),
+)
 
 
 def _idc_assume_role_arn() -> str:
@@ -150,70 +194,44 @@ def _idc_assume_role_arn() -> str:
     ).strip()
 
 
-def _get_idc_assumed_creds():
-    """Return cached assumed-role creds for Identity Center APIs, or None when not configured."""
-    role_arn = _idc_assume_role_arn()
-    if not role_arn:
-        return None
+def _idc_assume_role_params(role_arn=''):
+    return (
+        str(role_arn or _idc_assume_role_arn()).strip(),
+        str(os.getenv('IDC_ASSUME_ROLE_SESSION_NAME') or 'npam-idc').strip() or 'npam-idc',
+        str(os.getenv('IDC_ASSUME_ROLE_EXTERNAL_ID') or '').strip(),
+    )
 
-    now = time.time()
-    with _IDC_ASSUMED_LOCK:
-        # Reuse cached credentials until 2 minutes before expiry.
-        if (
-            _IDC_ASSUMED_CREDS.get('access_key')
-            and _IDC_ASSUMED_CREDS.get('secret_key')
-            and _IDC_ASSUMED_CREDS.get('session_token')
-            and float(_IDC_ASSUMED_CREDS.get('exp_epoch') or 0) > (now + 120)
-        ):
-            return {
-                'aws_access_key_id': _IDC_ASSUMED_CREDS['access_key'],
-                'aws_secret_access_key': _IDC_ASSUMED_CREDS['secret_key'],
-                'aws_session_token': _IDC_ASSUMED_CREDS['session_token'],
-            }
 
-        params = {
-            'RoleArn': role_arn,
-            'RoleSessionName': str(os.getenv('IDC_ASSUME_ROLE_SESSION_NAME') or 'npam-idc').strip() or 'npam-idc',
-        }
-        ext_id = str(os.getenv('IDC_ASSUME_ROLE_EXTERNAL_ID') or '').strip()
-        if ext_id:
-            params['ExternalId'] = ext_id
+def _get_idc_assumed_creds(role_arn=''):
+    """Return assumed-role creds for Identity Center APIs (or another management role), or None when not configured."""
+    arn, session_name, external_id = _idc_assume_role_params(role_arn)
+    if not arn:
+        return None
+    return IDC_CREDENTIALS.get(arn, session_name, external_id)
 
-        sts = boto3.client('sts', config=AWS_CONFIG)
-        resp = sts.assume_role(**params)
-        creds = (resp or {}).get('Credentials') or {}
-
-        access_key = str(creds.get('AccessKeyId') or '').strip()
-        secret_key = str(creds.get('SecretAccessKey') or '').strip()
-        session_token = str(creds.get('SessionToken') or '').strip()
-        exp = creds.get('Expiration')
-        exp_epoch = now + 900
+
+def _prime_idc_assumed_creds():
+    """Register configured roles so the first request finds credentials already fetched."""
+    arns = [_idc_assume_role_arn()]
+    arns.extend(a.strip() for a in str(os.getenv('MANAGEMENT_ASSUME_ROLE_ARNS') or '').split(','))
+    for arn in arns:
+        if not arn:
+            continue
         try:
-            if exp is not None:
-                exp_epoch = float(exp.timestamp())  # datetime from botocore
-        except Exception:
-            pass
-        if not (access_key and secret_key and session_token):
-            raise RuntimeError('AssumeRole returned empty credentials')
+            IDC_CREDENTIALS.register(*_idc_assume_role_params(arn))
+        except Exception as e:
+            print(f"AssumeRole prime skipped for {arn}: {e}")
 
-        _IDC_ASSUMED_CREDS['access_key'] = access_key
-        _IDC_ASSUMED_CREDS['secret_key'] = secret_key
-        _IDC_ASSUMED_CREDS['session_token'] = session_token
-        _IDC_ASSUMED_CREDS['exp_epoch'] = exp_epoch
 
-        return {
-            'aws_access_key_id': access_key,
-            'aws_secret_access_key': secret_key,
-            'aws_session_token': session_token,
-        }
+_prime_idc_assumed_creds()
 
 
-def _aws_client(service_name, *, region_name=None, assume_idc_role=False):
+def _aws_client(service_name, *, region_name=None, assume_idc_role=False, assume_role_arn=''):
     kwargs = {'config': AWS_CONFIG}
     if region_name:
         kwargs['region_name'] = region_name
-    if assume_idc_role:
-        assumed = _get_idc_assumed_creds()
+    if assume_idc_role or assume_role_arn:
+        assumed = _get_idc_assumed_creds(assume_role_arn)
         if assumed:
             kwargs.update(assumed)
     return boto3.client(service_name, **kwargs)
@@ -434,19 +452,20 @@ def _normalize_feature_flags(raw, base=None):
     return out
 
 
-def _load_feature_flags():
-    try:
-        if os.path.exists(FEATURE_FLAGS_PATH):
-            with open(FEATURE_FLAGS_PATH, 'r') as f:
-                data = json.load(f)
-            if isinstance(data, dict):
-                source = data.get('features') if isinstance(data.get('features'), dict) else data
-                return _normalize_feature_flags(source, FEATURE_FLAG_DEFAULTS)
-    except Exception:
-        pass
+def _parse_feature_flags(data):
+    if isinstance(data, dict):
+        source = data.get('features') if isinstance(data.get('features'), dict) else data
+        return _normalize_feature_flags(source, FEATURE_FLAG_DEFAULTS)
     return dict(FEATURE_FLAG_DEFAULTS)
 
 
+CONFIG_REGISTRY.register('feature_flags', FEATURE_FLAGS_PATH, _parse_feature_flags)
+
+
+def _load_feature_flags():
+    return thaw(CONFIG_REGISTRY.get('feature_flags'))
+
+
 def _save_feature_flags(flags):
     normalized = _normalize_feature_flags(flags, FEATURE_FLAG_DEFAULTS)
     os.makedirs(os.path.dirname(FEATURE_FLAGS_PATH) or '.', exist_ok=True)
@@ -455,6 +474,7 @@ def _save_feature_flags(flags):
             'features': normalized,
             'updated_at': datetime.now().isoformat()
         }, f, indent=2)
+    CONFIG_REGISTRY.invalidate('feature_flags')
     return normalized
 
 
@@ -533,42 +553,36 @@ def _break_glass_seed_email():
     _BREAK_GLASS_SEED_CACHE['email'] = email
     return email
 
-def _load_pam_admins():
-    """Load list of PAM admins: [{'email': str, 'role': str}, ...]. Email is lowercase. Backward-compat: old {'emails': [...]} migrated to role Admin."""
+def _normalize_pam_admins(data):
+    """Normalize stored PAM admin data to [{'email', 'role'}, ...]. Backward-compat: old {'emails': [...]} migrated to role Admin."""
     admins = []
-    try:
-        if os.path.exists(PAM_ADMINS_PATH):
-            with open(PAM_ADMINS_PATH, 'r') as f:
-                data = json.load(f)
-            if isinstance(data, list):
-                admins = [
-                    {
-                        'email': str((x.get('email') if isinstance(x, dict) else x) or '').strip().lower(),
-                        'role': _normalize_pam_role(x.get('role') if isinstance(x, dict) else 'Admin')
-                    }
-                    for x in data
-                    if str((x.get('email') if isinstance(x, dict) else x) or '').strip()
-                ]
-            elif isinstance(data, dict):
-                stored_admins = data.get('pam_admins')
-                if isinstance(stored_admins, list):
-                    admins = [
-                        {
-                            'email': str(a.get('email') or '').strip().lower(),
-                            'role': _normalize_pam_role(a.get('role') or 'Admin')
-                        }
-                        for a in stored_admins
-                        if isinstance(a, dict) and str(a.get('email') or '').strip()
-                    ]
-                else:
-                    emails = data.get('emails') or []
-                    if emails:
-                        admins = [{'email': str(e).strip().lower(), 'role': 'Admin'} for e in emails if str(e).strip()]
-        seed = os.getenv('PAM_ADMIN_SEED_EMAIL', '').strip()
-        if seed and '@' in seed and not admins:
-            admins = [{'email': seed.lower(), 'role': 'Admin'}]
-    except Exception:
-        admins = []
+    if isinstance(data, list):
+        admins = [
+            {
+                'email': str((x.get('email') if isinstance(x, dict) else x) or '').strip().lower(),
+                'role': _normalize_pam_role(x.get('role') if isinstance(x, dict) else 'Admin')
+            }
+            for x in data
+            if str((x.get('email') if isinstance(x, dict) else x) or '').strip()
+        ]
+    elif isinstance(data, dict):
+        stored_admins = data.get('pam_admins')
+        if isinstance(stored_admins, list):
+            admins = [
+                {
+                    'email': str(a.get('email') or '').strip().lower(),
+                    'role': _normalize_pam_role(a.get('role') or 'Admin')
+                }
+                for a in stored_admins
+                if isinstance(a, dict) and str(a.get('email') or '').strip()
+            ]
+        else:
+            emails = data.get('emails') or []
+            if emails:
+                admins = [{'email': str(e).strip().lower(), 'role': 'Admin'} for e in emails if str(e).strip()]
+    seed = os.getenv('PAM_ADMIN_SEED_EMAIL', '').strip()
+    if seed and '@' in seed and not admins:
+        admins = [{'email': seed.lower(), 'role': 'Admin'}]
 
     # Seed one break-glass super user (if configured) for root-style admin bootstrap.
     super_seed = _break_glass_seed_email()
@@ -595,17 +609,69 @@ def _load_pam_admins():
         existing = dedup.get(email)
         if not existing or role_priority.get(role, 0) >= role_priority.get(existing.get('role') or '', 0):
             dedup[email] = {'email': email, 'role': role}
+    return list(dedup.values())
 
-    normalized = list(dedup.values())
 
-    # Persist normalized state (format upgrades + break-glass seed) if needed.
+# In-memory PAM admin index. Every admin API request authorizes against it, so
+# it is rebuilt only when pam_admins.json changes on disk (stat key: mtime,
+# size, inode; the other gunicorn worker's atomic writes change the inode) or
+# a seed setting changes.
+_PAM_ADMIN_INDEX = {'key': None, 'admins': (), 'by_email': {}, 'by_local': {}}
+_PAM_ADMIN_INDEX_LOCK = threading.Lock()
+
+
+def _pam_admins_file_key():
     try:
-        if normalized:
-            _save_pam_admins(normalized)
-    except Exception:
-        pass
+        st = os.stat(PAM_ADMINS_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
-    return normalized
+
+def _set_pam_admin_index(key, admins):
+    by_email = {}
+    by_local = {}
+    for a in admins:
+        by_email[a['email']] = a
+        by_local.setdefault(_identity_local_part(a['email']), []).append(a)
+    _PAM_ADMIN_INDEX.update(key=key, admins=tuple(admins), by_email=by_email, by_local=by_local)
+
+
+def _pam_admin_index():
+    """Current admin index; reads and normalizes the file only when it changed."""
+    seed_key = (os.getenv('PAM_ADMIN_SEED_EMAIL', '').strip(), _break_glass_seed_email())
+    key = (_pam_admins_file_key(), seed_key)
+    if _PAM_ADMIN_INDEX['key'] == key:
+        return _PAM_ADMIN_INDEX
+    with _PAM_ADMIN_INDEX_LOCK:
+        key = (_pam_admins_file_key(), seed_key)
+        if _PAM_ADMIN_INDEX['key'] == key:
+            return _PAM_ADMIN_INDEX
+        data = None
+        try:
+            if key[0] is not None:
+                with open(PAM_ADMINS_PATH, 'r') as f:
+                    data = json.load(f)
+        except Exception:
+            data = None
+        try:
+            admins = _normalize_pam_admins(data)
+        except Exception:
+            admins = []
+        # Persist normalized state (format upgrades + break-glass seed) only when it differs from the file.
+        if admins and data != {'pam_admins': admins}:
+            try:
+                _write_pam_admins_file(admins)
+                key = (_pam_admins_file_key(), seed_key)
+            except Exception:
+                pass
+        _set_pam_admin_index(key, admins)
+        return _PAM_ADMIN_INDEX
+
+
+def _load_pam_admins():
+    """Load list of PAM admins: [{'email': str, 'role': str}, ...]. Email is lowercase. Returns copies callers may modify."""
+    return [dict(a) for a in _pam_admin_index()['admins']]
 
 
 def _pam_admin_record_for_email(email):
@@ -613,10 +679,8 @@ def _pam_admin_record_for_email(email):
     em = str(email or '').strip().lower()
     if not em:
         return None
-    for admin in _load_pam_admins():
-        if str(admin.get('email') or '').strip().lower() == em:
-            return admin
-    return None
+    admin = _pam_admin_index()['by_email'].get(em)
+    return dict(admin) if admin else None
 
 
 def _identity_local_part(value):
@@ -715,21 +779,20 @@ def _pam_admin_record_for_identity(email='', nameid='', hints=None):
     if not local_parts:
         return None
 
+    by_local = _pam_admin_index()['by_local']
     candidates = []
-    for admin in _load_pam_admins():
-        a_email = str(admin.get('email') or '').strip().lower()
-        a_local = _identity_local_part(a_email)
-        if a_local in local_parts:
-            candidates.append((admin, a_local))
+    for lp in local_parts:
+        for admin in by_local.get(lp, ()):
+            candidates.append((admin, lp))
     if len(candidates) == 1:
-        return candidates[0][0]
+        return dict(candidates[0][0])
     if len(candidates) > 1:
         # Prefer exact local-part match from explicit email first.
         em_local = _identity_local_part(email)
         if em_local:
             for admin, a_local in candidates:
                 if a_local == em_local:
-                    return admin
+                    return dict(admin)
     return None
 
 def _save_pam_admins(admins):
@@ -746,9 +809,26 @@ def _save_pam_admins(admins):
         if e and '@' in e and e not in seen:
             seen.add(e)
             out.append({'email': e, 'role': r})
-    os.makedirs(os.path.dirname(PAM_ADMINS_PATH) or '.', exist_ok=True)
-    with open(PAM_ADMINS_PATH, 'w') as f:
-        json.dump({'pam_admins': out}, f, indent=2)
+    with _PAM_ADMIN_INDEX_LOCK:
+        _write_pam_admins_file(out)
+        # Force the next read to re-normalize (seeds may apply on top of what was saved).
+        _PAM_ADMIN_INDEX['key'] = None
+
+
+def _write_pam_admins_file(admins):
+    """Write pam_admins.json atomically (temp file + rename), so readers never see a torn file."""
+    directory = os.path.dirname(PAM_ADMINS_PATH) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f'.pam_admins.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'pam_admins': admins}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, PAM_ADMINS_PATH)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def _infer_env_from_account_name(name: str) -> str:
     n = str(name or '').strip().lower()
@@ -775,28 +855,34 @@ def _normalize_env_tag(value, default=''):
     return str(default or '').strip().lower()
 
 
-def _load_org_hierarchy_tags():
+def _parse_org_hierarchy_tags(data):
     out = {'roots': {}, 'ous': {}, 'accounts': {}, 'updated_at': ''}
-    try:
-        if os.path.exists(ORG_HIERARCHY_TAGS_PATH):
-            with open(ORG_HIERARCHY_TAGS_PATH, 'r') as f:
-                data = json.load(f) or {}
-            if isinstance(data, dict):
-                for key in ('roots', 'ous', 'accounts'):
-                    block = data.get(key)
-                    if isinstance(block, dict):
-                        cleaned = {}
-                        for k, v in block.items():
-                            tag = _normalize_env_tag(v)
-                            if tag:
-                                cleaned[str(k).strip()] = tag
-                        out[key] = cleaned
-                out['updated_at'] = str(data.get('updated_at') or '')
-    except Exception:
-        pass
+    if isinstance(data, dict):
+        for key in ('roots', 'ous', 'accounts'):
+            block = data.get(key)
+            if isinstance(block, dict):
+                cleaned = {}
+                for k, v in block.items():
+                    tag = _normalize_env_tag(v)
+                    if tag:
+                        cleaned[str(k).strip()] = tag
+                out[key] = cleaned
+        out['updated_at'] = str(data.get('updated_at') or '')
     return out
 
 
+CONFIG_REGISTRY.register('org_hierarchy_tags', ORG_HIERARCHY_TAGS_PATH, _parse_org_hierarchy_tags)
+
+
+def _org_hierarchy_tags_snapshot():
+    """Read-only tags for lookups; _load_org_hierarchy_tags() returns an editable copy."""
+    return CONFIG_REGISTRY.get('org_hierarchy_tags')
+
+
+def _load_org_hierarchy_tags():
+    return thaw(_org_hierarchy_tags_snapshot())
+
+
 def _save_org_hierarchy_tags(tags):
     cleaned = {
         'roots': {},
@@ -815,6 +901,7 @@ def _save_org_hierarchy_tags(tags):
     os.makedirs(os.path.dirname(ORG_HIERARCHY_TAGS_PATH) or '.', exist_ok=True)
     with open(ORG_HIERARCHY_TAGS_PATH, 'w') as f:
         json.dump(cleaned, f, indent=2)
+    CONFIG_REGISTRY.invalidate('org_hierarchy_tags')
     return cleaned
 
 
@@ -854,7 +941,7 @@ def _save_org_hierarchy_cache(payload):
 
 
 def _effective_env_from_tags(account_id='', ou_chain=None, root_id='', fallback='nonprod', tags=None):
-    tags = tags or _load_org_hierarchy_tags()
+    tags = tags or _org_hierarchy_tags_snapshot()
     account_id = str(account_id or '').strip()
     if account_id:
         account_tag = _normalize_env_tag((tags.get('accounts') or {}).get(account_id))
@@ -889,7 +976,7 @@ def _account_ou_chain_from_meta(account_meta):
 
 
 def _apply_org_tag_overrides_to_accounts(accounts):
-    tags = _load_org_hierarchy_tags()
+    tags = _org_hierarchy_tags_snapshot()
     updated = {}
     for key, value in (accounts or {}).items():
         acct = dict(value or {})
@@ -923,7 +1010,7 @@ def _build_org_hierarchy_tree(org_client):
     Returns {'organization': {...}, 'roots': [...], 'errors': [...]}
     """
     result = {'organization': {}, 'roots': [], 'errors': []}
-    tags = _load_org_hierarchy_tags()
+    tags = _org_hierarchy_tags_snapshot()
 
     try:
         org = org_client.describe_organization().get('Organization', {})
@@ -1276,6 +1363,7 @@ def initialize_aws_config():
             print(f"Organizations error: {e}")
             # Already set current account above
         
+        _invalidate_account_index()
         print(f"Final config - Accounts: {len(CONFIG['accounts'])}, Permission Sets: {len(CONFIG['permission_sets'])}")
         
     except Exception as e:
@@ -1289,6 +1377,24 @@ def initialize_aws_config():
 NPAMX_DB_PATH = os.getenv('NPAMX_DB_PATH') or os.path.join(os.path.dirname(__file__), 'data', 'npamx.db')
 STORE = NpamxStore(NPAMX_DB_PATH)
 
+# Server-side sessions: the cookie carries only an opaque ID; data lives in STORE (web_sessions).
+SESSION_STORE.attach(STORE)
+# Sessions are keyed by NameID; the resolved email is stored too so admins can revoke/list by email.
+app.session_interface = ServerSessionInterface(SESSION_STORE, email_of=lambda _s: _current_request_identity().get('email'))
+
+# Request tiering: closed requests older than this many days stay in SQLite and are
+# read on demand (see request_repository.py). 0 keeps every request in memory.
+REQUEST_HOT_DAYS = float(os.getenv('NPAMX_REQUEST_HOT_DAYS') or 30)
+
+def _request_hot_cutoff():
+    """ISO timestamp before which closed requests are cold, or None when tiering is off."""
+    if REQUEST_HOT_DAYS <= 0:
+        return None
+    return (datetime.now() - timedelta(days=REQUEST_HOT_DAYS)).isoformat()
+
+def _promote_approvals(request_id, approvals):
+    approvals_db.setdefault(request_id, approvals)
+
 def _load_requests():
     global requests_db, approvals_db
     try:
@@ -1298,19 +1404,34 @@ def _load_requests():
             rcount, acount = STORE.import_legacy_requests_json(legacy_path)
             print(f"Migrated legacy JSON storage -> SQLite: requests={rcount}, approvals={acount}")
 
-        requests_db, approvals_db = STORE.load_all()
-        print(f"Loaded {len(requests_db)} requests from {NPAMX_DB_PATH}")
+        cutoff = _request_hot_cutoff()
+        loaded, approvals_db = STORE.load_all(closed_before=cutoff)
+        requests_db = RequestRepository(loaded, cold=STORE if cutoff else None, on_promote=_promote_approvals)
+        print(f"Loaded {len(requests_db)} requests from {NPAMX_DB_PATH}" + (f" (closed before {cutoff[:10]} served from SQLite)" if cutoff else ''))
     except Exception as e:
         print(f"Could not load requests from SQLite: {e}")
-        requests_db = {}
+        requests_db = RequestRepository()
         approvals_db = {}
 
 def _save_requests():
     try:
-        STORE.sync_from_memory(requests_db, approvals_db)
+        deleted = requests_db.pending_deletes()
+        STORE.sync_from_memory(requests_db, approvals_db, deleted=deleted)
+        requests_db.deletes_saved(deleted)
     except Exception as e:
         print(f"Could not save requests to SQLite: {e}")
 
+def _save_request(request_id):
+    """Persist one resident request (with its approvals) instead of syncing the whole store."""
+    req = requests_db.peek(request_id)
+    if not isinstance(req, dict):
+        return
+    try:
+        approvals = {request_id: approvals_db[request_id]} if request_id in approvals_db else {}
+        STORE.sync_from_memory({request_id: req}, approvals)
+    except Exception as e:
+        print(f"Could not save request {request_id} to SQLite: {e}")
+
 _load_requests()
 
 def build_resource_arns(selected_resources, account_id, services):
@@ -2096,6 +2217,12 @@ def break_glass_login():
     })
 
 
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    """End the current session server-side; the session cookie stops working immediately."""
+    session.clear()
+    return jsonify({'ok': True})
+
 def _email_from_saml_session():
     """Return the user's email from SAML session or break-glass session. Never return the literal 'Email' (claim name)."""
     if session.get('auth_type') == 'break_glass':
@@ -2142,18 +2269,54 @@ def _email_from_saml_session():
     return email
 
 
+from identity_cache import IDENTITY_CACHE
+
+IDENTITY_CACHE.attach(STORE)
+
+
+def _request_memo(key, compute):
+    """Memoize compute() on flask.g for the rest of the current request (no-op outside a request)."""
+    if not has_request_context():
+        return compute()
+    memo = g.get('_identity_memo')
+    if memo is None:
+        memo = g._identity_memo = {}
+    if key not in memo:
+        memo[key] = compute()
+    return memo[key]
+
+
 def _resolve_identity_center_identity(nameid='', email_hint='', hints=None):
     """
     Best-effort resolution from AWS Identity Center user record.
-    Returns: {'email': str, 'display_name': str}
+    Returns: {'email': str, 'display_name': str, 'user_id': str}
+
+    Memoized per request and cached across requests by NameID (IDENTITY_CACHE).
     """
+    cache_key = str(nameid or email_hint or '').strip().lower()
+
+    def _resolve():
+        if cache_key:
+            cached = IDENTITY_CACHE.lookup(cache_key, 'email', 'display_name', 'user_id')
+            if cached is not None:
+                return cached
+        resolved = _lookup_identity_center_identity(nameid=nameid, email_hint=email_hint, hints=hints)
+        if resolved.pop('complete', False) and cache_key:
+            IDENTITY_CACHE.put(cache_key, **resolved)
+        return resolved
+
+    return dict(_request_memo(('idc_identity', cache_key), _resolve) if cache_key else _resolve())
+
+
+def _lookup_identity_center_identity(nameid='', email_hint='', hints=None):
+    """Live Identity Store lookup behind _resolve_identity_center_identity. 'complete' is False when lookups failed."""
     identity_store_id = str(CONFIG.get('identity_store_id') or '').strip()
     if not identity_store_id:
-        return {'email': '', 'display_name': ''}
+        return {'email': '', 'display_name': '', 'user_id': ''}
 
     def _from_user(u):
         if not isinstance(u, dict):
-            return {'email': '', 'display_name': ''}
+            return {'email': '', 'display_name': '', 'user_id': '', 'complete': True}
         out_email = ''
         emails = u.get('Emails') or []
         for e in emails:
@@ -2170,7 +2333,7 @@ def _resolve_identity_center_identity(nameid='', email_hint='', hints=None):
         if not display:
             n = u.get('Name') or {}
             display = (str(n.get('GivenName') or '').strip() + ' ' + str(n.get('FamilyName') or '').strip()).strip()
-        return {'email': out_email, 'display_name': display}
+        return {'email': out_email, 'display_name': display, 'user_id': str(u.get('UserId') or ''), 'complete': True}
 
     try:
         identitystore = _identitystore_client()
@@ -2202,6 +2365,7 @@ def _resolve_identity_center_identity(nameid='', email_hint='', hints=None):
                 pass
 
         seen = set()
+        failed = False
         for attr_path, attr_value in candidates:
             v = str(attr_value or '').strip()
             if not v:
@@ -2219,10 +2383,13 @@ def _resolve_identity_center_identity(nameid='', email_hint='', hints=None):
                 if users:
                     return _from_user(users[0])
             except Exception:
+                failed = True
                 continue
+        # Not found is cacheable (briefly); a failed lookup is not.
+        return {'email': '', 'display_name': '', 'user_id': '', 'complete': not failed}
     except Exception:
         pass
-    return {'email': '', 'display_name': ''}
+    return {'email': '', 'display_name': '', 'user_id': ''}
 
 
 def _display_name_from_saml_session(email='', nameid=''):
@@ -2399,9 +2566,14 @@ def _display_name_from_identity_center(email=''):
 def _current_request_identity():
     """
     Resolve identity context for the current HTTP request from SAML session.
-    Returns {'nameid': str, 'email': str, 'hints': dict}.
+    Returns {'nameid': str, 'email': str, 'hints': dict}. Memoized per request.
     """
     nameid = str(session.get('user') or '').strip()
+    ident = _request_memo(('request_identity', nameid), lambda: _compute_request_identity(nameid))
+    return {'nameid': ident['nameid'], 'email': ident['email'], 'hints': list(ident['hints']) if ident['hints'] else {}}
+
+
+def _compute_request_identity(nameid):
     hints = _saml_identity_hints() if nameid else {}
     email = ''
     if nameid:
@@ -2642,11 +2814,14 @@ from intent_classifier import IntentClassifier
 from conversation_manager import ConversationManager
 from guardrails_generator import GuardrailsGenerator
 from scp_manager import SCPManager
+from scp_bulk import SCPBulkOperations
 from access_rules import AccessRules
 from help_assistant import HelpAssistant
 from scp_troubleshoot import SCPTroubleshoot
 from unified_assistant import UnifiedAssistant
 
+SCPBulkOperations.attach(STORE)
+
 @app.route('/api/generate-permissions', methods=['POST'])
 def generate_permissions():
     print("\n" + "="*80)
@@ -2670,39 +2845,16 @@ def generate_permissions():
     print(f"🔒 Checking access rules for user: {user_email}")
     rules = AccessRules.get_rules()
     print(f"📋 Total rules: {len(rules.get('rules', []))}")
-    
-    for rule in rules.get('rules', []):
-        if not rule.get('enabled'):
-            continue
-        
-        # Check if user is in restricted group
-        groups_path = os.path.join(os.path.dirname(__file__), 'user_groups.json')
-        with open(groups_path, 'r') as f:
-            groups_data = json.load(f)
-        
-        user_groups = [g['id'] for g in groups_data['groups'] if user_email in g.get('members', [])]
-        print(f"👤 User {user_email} is in groups: {user_groups}")
-        print(f"🚫 Rule restricts groups: {rule.get('groups', [])}")
-        
-        if any(g in rule.get('groups', []) for g in user_groups):
-            print(f"✅ User matched restricted group!")
-            # User is in restricted group - check if requesting denied service
-            use_case_lower = use_case.lower()
-            denied_services = rule.get('denied_services', [])
-            print(f"🚫 Denied services: {denied_services}")
-            print(f"📝 Use case: {use_case_lower}")
-            
-            # Also check selected_resources for denied services
-            selected_service_ids = list(selected_resources.keys()) if selected_resources else []
-            print(f"📦 Selected services: {selected_service_ids}")
-            
-            for denied_service in denied_services:
-                # Check both use case text and selected resources
-                if denied_service.lower() in use_case_lower or denied_service in selected_service_ids:
-                    print(f"❌ BLOCKED: User requested denied service {denied_service}")
-                    return jsonify({
-                        'error': f'❌ Access Denied\n\nYour group is restricted from requesting {denied_service.upper()} access.\n\nAllowed services: {", ".join([s.upper() for s in rule.get("allowed_services", [])])}\n\nContact your administrator for access to other services.'
-                    }), 403
+    user_groups = _local_group_ids_for_member(user_email)
+    print(f"👤 User {user_email} is in groups: {user_groups}")
+    decision = POLICY_ENGINE.decide({
+        'user_groups': user_groups,
+        'use_case': use_case,
+        'selected_services': list(selected_resources.keys()) if selected_resources else [],
+    }, stages=('access_rules',))
+    if not decision['allowed']:
+        print(f"❌ BLOCKED: {decision['trace'][-1]['detail']}")
+        return jsonify({'error': decision['error']}), 403
     
     print(f"✅ Access rules check passed for {user_email}")
     print(f"📦 Selected resources: {list(selected_resources.keys()) if selected_resources else 'None'}")
@@ -3098,43 +3250,23 @@ def request_access():
         ):
             return jsonify({'error': 'You can only request access for yourself unless you are a PAM admin'}), 403
     
-    # CHECK ACCESS RULES: Enforce group-based restrictions
-    rules = AccessRules.get_rules()
-    for rule in rules.get('rules', []):
-        if not rule.get('enabled'):
-            continue
-        
-        # Check if user is in restricted group
-        groups_path = os.path.join(os.path.dirname(__file__), 'user_groups.json')
-        with open(groups_path, 'r') as f:
-            groups_data = json.load(f)
-        
-        user_groups = [g['id'] for g in groups_data['groups'] if user_email in g.get('members', [])]
-        
-        if any(g in rule.get('groups', []) for g in user_groups):
-            # User is in restricted group - check if requesting denied service
-            use_case = data.get('use_case', '').lower()
-            denied_services = rule.get('denied_services', [])
-            
-            for denied_service in denied_services:
-                if denied_service in use_case:
-                    return jsonify({
-                        'error': f'❌ Access Denied\n\nYour group is restricted from requesting {denied_service.upper()} access.\n\nAllowed services: {", ".join([s.upper() for s in rule.get("allowed_services", [])])}\n\nContact your administrator for access to other services.'
-                    }), 403
-    
-    # ENFORCEMENT: Apply strict organizational policies
-    org_policies = load_org_policies()  # Load from config/database
-    allowed, violations, action = EnforcementEngine.enforce_policy(data, org_policies)
+    # CHECK ACCESS RULES + ENFORCEMENT: group restrictions, then strict organizational policies
+    decision = POLICY_ENGINE.decide(
+        dict(data, user_groups=_local_group_ids_for_member(user_email)),
+        stages=('access_rules', 'org_policies'),
+    )
+    if decision['stage'] == 'access_rules':
+        return jsonify({'error': decision['error']}), 403
     
-    print(f"🔒 Enforcement check: allowed={allowed}, violations={violations}")
+    print(f"🔒 Enforcement check: allowed={decision['allowed']}, violations={decision['violations']}")
     
-    if not allowed:
+    if not decision['allowed']:
         # STRICT ENFORCEMENT: Block request
-        recommendations = EnforcementEngine.get_recommendation(data, org_policies)
-        print(f"❌ Request blocked: {violations}")
+        recommendations = EnforcementEngine.get_recommendation(data, load_org_policies())
+        print(f"❌ Request blocked: {decision['violations']}")
         return jsonify({
-            'error': 'Request blocked by organizational policy',
-            'violations': violations,
+            'error': decision['error'],
+            'violations': decision['violations'],
             'recommendations': recommendations,
             'enforcement': 'STRICT'
         }), 403
@@ -3227,8 +3359,8 @@ def request_access():
         access_request['ai_generated'] = False
     
     # Store enforcement metadata
-    access_request['enforcement_action'] = action
-    access_request['policy_violations'] = violations
+    access_request['enforcement_action'] = decision['effect']
+    access_request['policy_violations'] = decision['violations']
     
     # Determine approval requirements based on account type and access type
     account_name = CONFIG['accounts'].get(access_request['account_id'], {}).get('name', '').lower()
@@ -3259,7 +3391,10 @@ def request_access():
 
 @app.route('/api/requests', methods=['GET'])
 def get_requests():
-    """List requests: non-admins see only their own; PAM admins see all."""
+    """
+    List requests: non-admins see only their own; PAM admins see all.
+    Optional filters: ?status= and ?approver= (a role in approval_required), e.g. the pending-approval view.
+    """
     caller_email = (_email_from_saml_session() or _current_request_identity().get('email') or '').strip().lower()
     is_admin = bool(_pam_admin_record_for_identity(
         email=caller_email,
@@ -3267,13 +3402,14 @@ def get_requests():
         hints=(_current_request_identity().get('hints') or [])
     ))
     out = []
-    for r in requests_db.values():
+    rows = requests_db.select(
+        user=None if is_admin else caller_email,
+        status=str(request.args.get('status') or '').strip() or None,
+        approver=str(request.args.get('approver') or '').strip() or None,
+    )
+    for _, r in rows:
         if not isinstance(r, dict):
             continue
-        if not is_admin:
-            req_email = (r.get('user_email') or '').strip().lower()
-            if req_email != caller_email:
-                continue
         if r.get('type') == 'database_access':
             out.append(_sanitize_database_request_for_client(r))
         else:
@@ -3321,7 +3457,7 @@ def get_database_requests():
         page_size = 100
 
     items = []
-    for req_id, req in requests_db.items():
+    for req_id, req in requests_db.select(type='database_access', user=user_email):
         if not isinstance(req, dict) or req.get('type') != 'database_access':
             continue
         if str(req.get('user_email') or '').strip().lower() != user_email.lower():
@@ -3623,6 +3759,8 @@ def revoke_access(request_id):
                 return jsonify({'error': f'Vault revoke failed: {e}'}), 502
         else:
             print(f"Database revoke for {request_id}: no lease_id (e.g. not yet activated); marking revoked only.")
+        _release_vault_role_for_request(access_request, request_id, req_plane)
+        DB_CONNECTION_POOLS.evict_owner(request_id)
         try:
             cleanup_result = _cleanup_database_iam_access(access_request, request_id=request_id, reason='admin_revoke')
             if cleanup_result.get('status') in ('error', 'partial'):
@@ -3736,7 +3874,7 @@ def admin_list_database_sessions():
     _load_requests()
     sessions = []
     now = datetime.now()
-    for req_id, req in requests_db.items():
+    for req_id, req in requests_db.select(type='database_access', status='active'):
         if not isinstance(req, dict) or req.get('type') != 'database_access':
             continue
         status = str(req.get('status') or '').strip().lower()
@@ -3757,6 +3895,45 @@ def admin_list_database_sessions():
     return jsonify({'sessions': sessions})
 
 
+@app.route('/api/admin/db-terminal-stats', methods=['GET'])
+def admin_db_terminal_stats():
+    """PAM terminal runtime stats: admission queue, connection pools, cost gate and schema cache."""
+    try:
+        return jsonify({
+            'admission': QUERY_ADMISSION.stats(),
+            'connection_pools': DB_CONNECTION_POOLS.stats(),
+            'cost_gate': QUERY_COST_GATE.stats(),
+            'schema_cache': SCHEMA_CACHE.stats(),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/db-query-report', methods=['GET'])
+def admin_db_query_report():
+    """
+    Per-instance or per-user query latency and volume from the audit telemetry.
+
+    Query params: group_by=instance|user (default instance), hours (default 24, max 720), limit (default 50).
+    """
+    try:
+        group_by = str(request.args.get('group_by') or 'instance').strip().lower()
+        if group_by not in ('instance', 'user'):
+            return jsonify({'error': "group_by must be 'instance' or 'user'"}), 400
+        try:
+            hours = max(1, min(int(request.args.get('hours') or 24), 720))
+            limit = max(1, min(int(request.args.get('limit') or 50), 1000))
+        except ValueError:
+            return jsonify({'error': 'hours and limit must be integers'}), 400
+        since = int(time.time()) - hours * 3600
+        return jsonify({
+            'group_by': group_by,
+            'hours': hours,
+            'since': datetime.utcfromtimestamp(since).isoformat() + 'Z',
+            'groups': STORE.query_metrics_report(since_epoch=since, group_by=group_by, limit=limit),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/revoke-database-sessions', methods=['POST'])
 def admin_revoke_database_sessions():
     """Revoke selected database access sessions. Calls Vault lease revoke with full lease_id; Vault runs revocation_statements."""
@@ -3801,6 +3978,8 @@ def admin_revoke_database_sessions():
                     continue
         else:
             print(f"Admin revoke for {req_id}: no lease_id; marking revoked only.", flush=True)
+        _release_vault_role_for_request(req, req_id, req_plane)
+        DB_CONNECTION_POOLS.evict_owner(req_id)
         try:
             cleanup_result = _cleanup_database_iam_access(req, request_id=req_id, reason='admin_bulk_revoke')
             print(f"IAM cleanup result for {req_id}: {cleanup_result}", flush=True)
@@ -4227,7 +4406,7 @@ def _db_open_request_uses_permission_set(permission_set_arn, exclude_request_id=
         return False
     skip_id = str(exclude_request_id or '').strip()
     now = datetime.now()
-    for rid, req in (requests_db or {}).items():
+    for rid, req in requests_db.select(type='database_access', status=('active', 'approved')):
         if str(rid) == skip_id:
             continue
         if not isinstance(req, dict) or req.get('type') != 'database_access':
@@ -4647,32 +4826,18 @@ def get_admin_analytics():
     try:
         thirtyDaysAgo = datetime.now() - timedelta(days=30)
         
-        user_first_request = {}
-        for req in requests_db.values():
-            email = req['user_email']
-            req_date = datetime.fromisoformat(req['created_at'].replace('Z', '+00:00'))
-            if email not in user_first_request or req_date < user_first_request[email]:
-                user_first_request[email] = req_date
-        
-        new_users = sum(1 for date in user_first_request.values() if date >= thirtyDaysAgo)
+        new_users = sum(1 for first in requests_db.first_created_by_user().values() if first >= thirtyDaysAgo)
         
-        user_request_counts = {}
-        for req in requests_db.values():
-            email = req['user_email']
-            user_request_counts[email] = user_request_counts.get(email, 0) + 1
+        repeated_users = sum(1 for count in requests_db.index_keys('user').values() if count > 3)
         
-        repeated_users = sum(1 for count in user_request_counts.values() if count > 3)
-        
-        exceptional_users = set()
-        for req in requests_db.values():
-            if req.get('permission_set', '').lower().find('admin') != -1:
-                exceptional_users.add(req['user_email'])
+        admin_sets = [ps for ps in requests_db.index_keys('permission_set') if 'admin' in ps]
+        exceptional_users = requests_db.users_with(admin_sets) if admin_sets else set()
         
         return jsonify({
             'new_users': new_users,
             'repeated_users': repeated_users,
             'exceptional_users': len(exceptional_users),
-            'pending_approvals': len([r for r in requests_db.values() if r['status'] == 'pending']),
+            'pending_approvals': len([r for _, r in requests_db.select(status='pending') if r['status'] == 'pending']),
             'weekly_activity': [12, 19, 8, 15, 22, 3, 7],
             'request_types': {'AWS': 45, 'Applications': 25, 'Databases': 20, 'Kubernetes': 10}
         })
@@ -4768,6 +4933,7 @@ def update_account_tag(account_id):
         
         if account_id in CONFIG['accounts']:
             CONFIG['accounts'][account_id]['environment'] = environment
+            _invalidate_account_index()
             print(f"Account {account_id} tagged as {environment}")
             return jsonify({'status': 'success', 'account_id': account_id, 'environment': environment})
         else:
@@ -4850,6 +5016,7 @@ def sync_accounts_from_ou():
                             synced_count += 1
                             print(f"Auto-tagged {account_id} as {environment} (OU: {ou_name})")
         
+        _invalidate_account_index()
         return jsonify({
             'status': 'success',
             'synced_count': synced_count,
@@ -4998,7 +5165,7 @@ def get_approved_instances():
         print(f"Looking for approved instances for {user_email}")
         print(f"Total requests in DB: {len(requests_db)}")
         
-        for req_id, req in requests_db.items():
+        for req_id, req in requests_db.select(type='instance_access', user=user_email, status='approved'):
             print(f"Request {req_id}: type={req.get('type')}, email={req.get('user_email')}, status={req.get('status')}")
             
             if (req.get('type') == 'instance_access' and 
@@ -5097,13 +5264,12 @@ def cleanup_expired_instance_access():
         now = datetime.now()
         cleaned_count = 0
         
-        for request_id, access_request in list(requests_db.items()):
+        # Expiry index: only requests already past expires_at.
+        for request_id, access_request in requests_db.expiring(now, status='auto_approved'):
             if 'instance_id' not in access_request:
                 continue
             
-            expires_at = datetime.fromisoformat(access_request['expires_at'].replace('Z', '+00:00'))
-            
-            if expires_at <= now and access_request.get('status') == 'auto_approved' and access_request.get('user_created'):
+            if access_request.get('status') == 'auto_approved' and access_request.get('user_created'):
                 # Remove user from instance
                 instance_id = access_request['instance_id']
                 username = access_request['username']
@@ -5325,17 +5491,12 @@ def background_cleanup():
             
             now = datetime.now()
             changed = False
-            for request_id, access_request in list(requests_db.items()):
+            # The expiry index yields only requests already past expires_at.
+            for request_id, access_request in requests_db.expiring(now, status='auto_approved'):
                 if 'instance_id' not in access_request:
                     continue
                 
-                expires_at_str = access_request.get('expires_at', '')
-                if not expires_at_str:
-                    continue
-                    
-                expires_at = datetime.fromisoformat(expires_at_str.replace('Z', '+00:00').replace('+00:00', ''))
-                
-                if expires_at <= now and access_request.get('status') == 'auto_approved' and access_request.get('user_created'):
+                if access_request.get('status') == 'auto_approved' and access_request.get('user_created'):
                     instance_id = access_request['instance_id']
                     username = access_request['username']
                     
@@ -5349,45 +5510,42 @@ def background_cleanup():
                         changed = True
             
             # Cleanup expired database access - revoke DB users
-            for request_id, access_request in list(requests_db.items()):
+            for request_id, access_request in requests_db.expiring(now, type='database_access', status=('active', 'approved')):
                 if access_request.get('type') != 'database_access':
                     continue
                 status = str(access_request.get('status') or '').lower()
                 if status not in ('active', 'approved'):
                     continue
-                expires_at_str = access_request.get('expires_at', '')
-                if not expires_at_str:
-                    continue
-                expires_at = datetime.fromisoformat(expires_at_str.replace('Z', '+00:00').replace('+00:00', ''))
-                if expires_at <= now:
-                    try:
-                        # Vault handles revocation automatically via lease TTL. We only:
-                        # 1) best-effort revoke the lease early (optional)
-                        # 2) mark request expired in NPAMX and clear sensitive fields
-                        req_account_env = _request_account_env(access_request)
-                        req_plane = _request_execution_plane(access_request)
-                        access_request['account_env'] = req_account_env
-                        access_request['execution_plane'] = req_plane
-                        lease_id = str(access_request.get('vault_lease_id') or access_request.get('lease_id') or '').strip()
-                        if lease_id:
-                            try:
-                                VaultManager.revoke_lease(lease_id, plane=req_plane)
-                            except Exception:
-                                pass
+                try:
+                    # Vault handles revocation automatically via lease TTL. We only:
+                    # 1) best-effort revoke the lease early (optional)
+                    # 2) mark request expired in NPAMX and clear sensitive fields
+                    req_account_env = _request_account_env(access_request)
+                    req_plane = _request_execution_plane(access_request)
+                    access_request['account_env'] = req_account_env
+                    access_request['execution_plane'] = req_plane
+                    lease_id = str(access_request.get('vault_lease_id') or access_request.get('lease_id') or '').strip()
+                    if lease_id:
                         try:
-                            cleanup_result = _cleanup_database_iam_access(access_request, request_id=request_id, reason='expired_cleanup')
-                            if cleanup_result.get('status') in ('error', 'partial'):
-                                print(f"IAM cleanup warning for expired request {request_id}: {cleanup_result}")
-                        except Exception as cleanup_err:
-                            print(f"IAM cleanup exception for expired request {request_id}: {cleanup_err}")
-                        access_request['status'] = 'EXPIRED'
-                        access_request['expired_at'] = now.isoformat()
-                        access_request['vault_token'] = ''
-                        access_request['password'] = ''
-                        access_request['db_password'] = ''
-                    except Exception as db_err:
-                        print(f"❌ DB expiry handling error: {db_err}")
-                    changed = True
+                            VaultManager.revoke_lease(lease_id, plane=req_plane)
+                        except Exception:
+                            pass
+                    _release_vault_role_for_request(access_request, request_id, req_plane)
+                    DB_CONNECTION_POOLS.evict_owner(request_id)
+                    try:
+                        cleanup_result = _cleanup_database_iam_access(access_request, request_id=request_id, reason='expired_cleanup')
+                        if cleanup_result.get('status') in ('error', 'partial'):
+                            print(f"IAM cleanup warning for expired request {request_id}: {cleanup_result}")
+                    except Exception as cleanup_err:
+                        print(f"IAM cleanup exception for expired request {request_id}: {cleanup_err}")
+                    access_request['status'] = 'EXPIRED'
+                    access_request['expired_at'] = now.isoformat()
+                    access_request['vault_token'] = ''
+                    access_request['password'] = ''
+                    access_request['db_password'] = ''
+                except Exception as db_err:
+                    print(f"❌ DB expiry handling error: {db_err}")
+                changed = True
 
             # Cleanup stale in-memory DB chat conversations/state to prevent unbounded growth.
             try:
@@ -5406,11 +5564,22 @@ def background_cleanup():
             except Exception:
                 pass
 
+            DB_CONNECTION_POOLS.prune()
+
             if changed:
                 try:
                     _save_requests()
                 except Exception:
                     pass
+
+            _sweep_deferred_vault_roles()
+
+            # Evict requests that have been closed for longer than the hot window.
+            cutoff = _request_hot_cutoff()
+            if cutoff:
+                demoted = requests_db.demote(cutoff, save=_save_requests)
+                if demoted:
+                    print(f"🧊 Moved {demoted} closed requests out of memory")
         except Exception as e:
             print(f"❌ Background cleanup error: {e}")
 
@@ -5491,16 +5660,16 @@ def search_identity_center_groups():
         identitystore = _identitystore_client()
         groups = []
         for page in identitystore.get_paginator('list_groups').paginate(IdentityStoreId=identity_store_id):
-            for g in page.get('Groups', []):
+            for grp in page.get('Groups', []):
                 groups.append({
-                    'group_id': g.get('GroupId'),
-                    'display_name': g.get('DisplayName', ''),
-                    'description': g.get('Description', ''),
+                    'group_id': grp.get('GroupId'),
+                    'display_name': grp.get('DisplayName', ''),
+                    'description': grp.get('Description', ''),
                 })
         q_lower = q.lower()
-        groups = [g for g in groups
-                  if q_lower in (g.get('display_name') or '').lower()
-                  or q_lower in (g.get('description') or '').lower()]
+        groups = [grp for grp in groups
+                  if q_lower in (grp.get('display_name') or '').lower()
+                  or q_lower in (grp.get('description') or '').lower()]
         return jsonify({'groups': groups})
     except Exception as e:
         return jsonify({'error': str(e), 'groups': []}), 500
@@ -5516,18 +5685,18 @@ def list_identity_center_groups():
         identitystore = _identitystore_client()
         groups = []
         for page in identitystore.get_paginator('list_groups').paginate(IdentityStoreId=identity_store_id):
-            for g in page.get('Groups', []):
+            for grp in page.get('Groups', []):
                 groups.append({
-                    'group_id': g.get('GroupId'),
-                    'display_name': g.get('DisplayName', ''),
-                    'description': g.get('Description', ''),
+                    'group_id': grp.get('GroupId'),
+                    'display_name': grp.get('DisplayName', ''),
+                    'description': grp.get('Description', ''),
                 })
         search = (request.args.get('search') or request.args.get('q') or '').strip()
         if search:
             q_lower = search.lower()
-            groups = [g for g in groups
-                      if q_lower in (g.get('display_name') or '').lower()
-                      or q_lower in (g.get('description') or '').lower()]
+            groups = [grp for grp in groups
+                      if q_lower in (grp.get('display_name') or '').lower()
+                      or q_lower in (grp.get('description') or '').lower()]
         return jsonify({'groups': groups})
     except Exception as e:
         return jsonify({'error': str(e), 'groups': []}), 500
@@ -5882,6 +6051,7 @@ def sync_from_identity_center():
         if status.get('status') == 'success':
             identity_center_synced_users = users
             identity_center_synced_groups = groups
+            IDENTITY_CACHE.clear()
 
         return jsonify({
             'status': status['status'],
@@ -5904,6 +6074,7 @@ def sync_from_ad():
                 return jsonify({'error': f'{field} is required'}), 400
         
         users, groups, status = UserSyncEngine.sync_from_active_directory(ad_config)
+        IDENTITY_CACHE.clear()
         
         return jsonify({
             'status': status['status'],
@@ -6030,12 +6201,139 @@ def push_to_identity_center():
         
         identity_store_id = CONFIG.get('identity_store_id')
         result = UserSyncEngine.push_to_identity_center(identity_store_id, users, groups)
+        IDENTITY_CACHE.clear()
         
         return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@app.route('/api/admin/identity-cache/invalidate', methods=['POST'])
+def invalidate_identity_cache():
+    """
+    Drop cached identity resolutions / group keys after out-of-band user or group changes.
+    Body: {email?, nameid?, user_id?}; empty body clears the whole cache.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        email = str(data.get('email') or '').strip()
+        nameid = str(data.get('nameid') or '').strip()
+        user_id = str(data.get('user_id') or '').strip()
+        if email or nameid or user_id:
+            removed = IDENTITY_CACHE.invalidate(nameid=nameid, email=email, user_id=user_id)
+        else:
+            removed = IDENTITY_CACHE.clear()
+        return jsonify({'status': 'ok', 'removed': removed, 'cache': IDENTITY_CACHE.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/config-cache', methods=['GET', 'POST'])
+def config_cache():
+    """
+    Loaded JSON config snapshots (path, version, load count). POST {name?} forces a
+    re-read of one config, or all of them, after editing files out of band.
+    """
+    try:
+        if request.method == 'POST':
+            name = str((request.get_json(silent=True) or {}).get('name') or '').strip()
+            if name and name not in CONFIG_REGISTRY.stats()['files']:
+                return jsonify({'error': f'Unknown config: {name}'}), 400
+            CONFIG_REGISTRY.invalidate(name)
+        return jsonify({'status': 'ok', 'cache': CONFIG_REGISTRY.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/account-index', methods=['GET', 'POST'])
+def account_index():
+    """
+    Materialized account metadata (environment and its source, OU chain, execution plane).
+    GET ?account_id= returns one account; POST rebuilds the index.
+    """
+    try:
+        if request.method == 'POST':
+            _invalidate_account_index()
+        index = _account_index()
+        account_id = str(request.args.get('account_id') or '').strip()
+        if account_id:
+            meta = index['accounts'].get(account_id)
+            if not meta:
+                return jsonify({'error': 'Account not found in index'}), 404
+            return jsonify({'status': 'ok', 'account': meta})
+        return jsonify({
+            'status': 'ok',
+            'count': len(index['accounts']),
+            'built_at': index['built_at'],
+            'build_ms': index['build_ms'],
+            'accounts': index['accounts'],
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/policy-decision', methods=['POST'])
+def explain_policy_decision():
+    """
+    Dry-run the policy decision point for a request payload and return the decision with its trace.
+    Body: request fields (user_email, account_id, use_case, ai_permissions/actions, duration_hours,
+    user_role, is_jit, org_id, user_team) and optional `stages`.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid payload. JSON object expected.'}), 400
+        ctx = dict(data)
+        if 'user_groups' not in ctx:
+            ctx['user_groups'] = _local_group_ids_for_member(str(data.get('user_email') or '').strip())
+        if not ctx.get('account_env'):
+            ctx['account_env'] = _resolve_account_environment(data.get('account_id'))
+        stages = data.get('stages')
+        if stages is not None and not isinstance(stages, list):
+            return jsonify({'error': 'stages must be a list'}), 400
+        try:
+            decision = POLICY_ENGINE.decide(ctx, stages=stages) if stages else POLICY_ENGINE.decide(ctx)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'status': 'ok', 'decision': decision, 'engine': POLICY_ENGINE.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/sessions', methods=['GET'])
+def list_active_sessions():
+    """Active server-side sessions, most recently used first. Optional ?user= and ?limit=."""
+    try:
+        user = str(request.args.get('user') or '').strip().lower()
+        try:
+            limit = int(request.args.get('limit') or 500)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        sessions = SESSION_STORE.active_sessions(user=user, limit=limit)
+        return jsonify({'status': 'ok', 'count': len(sessions), 'sessions': sessions, 'store': SESSION_STORE.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/sessions/revoke', methods=['POST'])
+def revoke_sessions():
+    """End sessions server-side. Body: {user} (every session of that user) and/or {session_ids: [...]} from /api/admin/sessions."""
+    try:
+        data = request.get_json(silent=True) or {}
+        user = str(data.get('user') or data.get('user_email') or '').strip().lower()
+        session_ids = data.get('session_ids') or []
+        if not isinstance(session_ids, list):
+            return jsonify({'error': 'session_ids must be a list'}), 400
+        if not user and not session_ids:
+            return jsonify({'error': 'user or session_ids is required'}), 400
+        revoked = SESSION_STORE.revoke([str(s) for s in session_ids]) if session_ids else 0
+        if user:
+            revoked += SESSION_STORE.revoke_user(user)
+        from audit_log import log_pam_action
+        actor = _email_from_saml_session() or str(session.get('user') or '')
+        log_pam_action(actor, 'sessions_revoked', details={'user': user, 'session_ids': len(session_ids), 'revoked': revoked}, ip=request.remote_addr)
+        if not revoked:
+            return jsonify({'error': 'No matching sessions (match by email, SAML NameID or session id)', 'revoked': 0}), 404
+        return jsonify({'status': 'ok', 'revoked': revoked})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/delete-permissions-config', methods=['GET'])
 def get_delete_permissions_config():
     """Get current delete permissions configuration"""
@@ -6659,7 +6957,7 @@ def delete_access_rule(rule_id):
 def manage_user_groups():
     """Get all user groups or create new group"""
     try:
-        groups_path = os.path.join(os.path.dirname(__file__), 'user_groups.json')
+        groups_path = LOCAL_USER_GROUPS_PATH
         
         if request.method == 'GET':
             with open(groups_path, 'r') as f:
@@ -6680,7 +6978,7 @@ def manage_user_groups():
             group_id = group_name.lower().replace(' ', '_')
             
             # Check if group already exists
-            if any(g['id'] == group_id for g in groups_data['groups']):
+            if any(grp['id'] == group_id for grp in groups_data['groups']):
                 return jsonify({'error': 'Group already exists'}), 400
             
             # Add new group
@@ -6696,6 +6994,7 @@ def manage_user_groups():
             # Save
             with open(groups_path, 'w') as f:
                 json.dump(groups_data, f, indent=2)
+            CONFIG_REGISTRY.invalidate('user_groups')
             
             print(f"✅ Group created: {group_name} ({group_id})")
             
@@ -6754,7 +7053,7 @@ def manage_org_users():
                 json.dump(users_data, f, indent=2)
             
             # Add user to group members
-            groups_path = os.path.join(os.path.dirname(__file__), 'user_groups.json')
+            groups_path = LOCAL_USER_GROUPS_PATH
             with open(groups_path, 'r') as f:
                 groups_data = json.load(f)
             
@@ -6765,6 +7064,8 @@ def manage_org_users():
             
             with open(groups_path, 'w') as f:
                 json.dump(groups_data, f, indent=2)
+            CONFIG_REGISTRY.invalidate('user_groups')
+            IDENTITY_CACHE.invalidate(email=data['email'])
             
             user_name = data.get('name', '')
             print(f"✅ User created: {user_name} ({data.get('email')}) in group {data.get('group_id')}")
@@ -6799,6 +7100,7 @@ def save_guardrails():
         # Store in file (in production, use database)
         with open(GUARDRAILS_CONFIG_PATH, 'w') as f:
             json.dump(payload, f, indent=2)
+        CONFIG_REGISTRY.invalidate('guardrails')
 
         print(
             "✅ Guardrails saved: "
@@ -6901,6 +7203,62 @@ def detach_scp(policy_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/scps/<policy_id>/bulk', methods=['POST'])
+def bulk_attach_detach_scp(policy_id):
+    """Attach/detach an SCP across many targets concurrently. Returns a job for progress polling.
+
+    Body: {"action": "attach"|"detach", "target_ids": [...], "ou_accounts": ["ou-..."], "wait": false}
+    `ou_accounts` expands each OU/root to every account in its subtree.
+    """
+    try:
+        data = request.get_json() or {}
+        action = str(data.get('action') or '').strip().lower()
+        if action not in ('attach', 'detach'):
+            return jsonify({'error': "action must be 'attach' or 'detach'"}), 400
+        target_ids = data.get('target_ids') or []
+        ou_accounts = data.get('ou_accounts') or []
+        if not isinstance(target_ids, list) or not isinstance(ou_accounts, list):
+            return jsonify({'error': 'target_ids and ou_accounts must be lists'}), 400
+        targets = SCPBulkOperations.resolve_targets(target_ids=target_ids, ou_accounts=ou_accounts)
+        if not targets:
+            return jsonify({'error': 'No targets resolved'}), 400
+        from audit_log import log_pam_action
+        actor = _current_request_identity().get('email') or ''
+        ip = request.remote_addr
+
+        def _audit_bulk_finished(snapshot):
+            log_pam_action(actor, 'scp_bulk_finished', details={
+                'job_id': snapshot['job_id'], 'policy_id': policy_id, 'action': action,
+                'status': snapshot['status'], 'counts': snapshot['counts'],
+            }, ip=ip)
+
+        # Audit the start before any target runs: with wait=True the job may finish inside start().
+        job_id = str(uuid.uuid4())
+        log_pam_action(actor, f'scp_bulk_{action}', details={
+            'job_id': job_id, 'policy_id': policy_id, 'target_count': len(targets),
+            'target_ids': [t['id'] for t in targets], 'ou_accounts': ou_accounts,
+        }, ip=ip)
+        job = SCPBulkOperations.start(
+            policy_id,
+            action,
+            targets,
+            requested_by=actor,
+            wait=_as_bool(data.get('wait'), False),
+            on_complete=_audit_bulk_finished,
+            job_id=job_id,
+        )
+        return jsonify(job), 202 if job['status'] == 'running' else 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/scps/bulk-jobs/<job_id>', methods=['GET'])
+def get_scp_bulk_job(job_id):
+    """Progress and per-target results of a bulk SCP job"""
+    job = SCPBulkOperations.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/api/admin/accounts/<account_id>/scps', methods=['GET'])
 def get_account_scps(account_id):
     """Get SCPs attached to account"""
@@ -6910,6 +7268,18 @@ def get_account_scps(account_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/accounts/<account_id>/scps/evaluate', methods=['GET'])
+def evaluate_account_scps(account_id):
+    """Check whether actions (?action=s3:PutObject&action=...) are blocked by the account's effective SCPs"""
+    try:
+        actions = [a.strip() for a in request.args.getlist('action') if a.strip()]
+        if not actions:
+            return jsonify({'error': 'At least one action is required'}), 400
+        result = SCPManager.evaluate_actions(account_id, actions)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/ai/config', methods=['GET', 'POST'])
 def manage_ai_config():
     """Get or update Bedrock AI configuration"""
@@ -6971,9 +7341,20 @@ def manage_ai_config():
         return jsonify({'error': str(e)}), 500
 
 # Database endpoints
-from database_manager import create_database_user, execute_query, generate_password
+from database_manager import create_database_user, execute_query, generate_password, stream_query_ndjson
+from db_connection_pool import DB_CONNECTION_POOLS
+from db_replica_router import REPLICA_ROUTER, is_select_only
+from query_admission import QUERY_ADMISSION, AdmissionRejected, release_after
+from query_cost_gate import QUERY_COST_GATE
+from schema_cache import SCHEMA_CACHE, load_mysql_schema
+from sql_lexer import analyze as sql_analyze
 from vault_manager import VaultManager
 
+_SCHEMA_CHANGING_VERBS = frozenset({'CREATE', 'ALTER', 'DROP', 'RENAME', 'TRUNCATE'})
+# PyMySQL errors worth retrying on the primary: access denied (user not replicated yet), can't connect, lost connection.
+_REPLICA_RETRY_ERROR_RE = re.compile(r'^\((?:1045|2003|2005|2006|2013),')
+_REPLICA_RETRY_SECONDS = float(os.getenv('DB_REPLICA_RETRY_SECONDS') or 60)
+
 # Database AI conversation storage
 db_conversations = {}
 # Tracks structured DB request state across turns (prevents loops, enforces strict flow).
@@ -7151,6 +7532,66 @@ def _resolve_db_connect_proxy_endpoint(account_env='', execution_plane=''):
         port = 3306
     return host, port, plane
 
+def _db_read_endpoint(route, plane):
+    """
+    Where the PAM terminal reaches a replica-routed session.
+
+    DB_CONNECT_PROXY_READER_HOST/PORT: proxy listener that forwards to the instance's read endpoint.
+    DB_REPLICA_DIRECT_CONNECT=true: connect to the replica endpoint itself (NPAMX inside the DB network).
+    Returns (host, port) or None when replicas cannot be reached.
+    """
+    reader_host = _plane_env('DB_CONNECT_PROXY_READER_HOST', plane)
+    if reader_host:
+        try:
+            return reader_host, int(_plane_env('DB_CONNECT_PROXY_READER_PORT', plane) or 3306)
+        except ValueError:
+            return reader_host, 3306
+    if _plane_env('DB_REPLICA_DIRECT_CONNECT', plane).lower() in ('1', 'true', 'yes') and (route or {}).get('host'):
+        return route['host'], int(route.get('port') or 3306)
+    return None
+
+def _db_read_route(req, refresh=False, request_id=''):
+    """
+    Read-replica routing decision for a DB session, recorded on the request as `db_route`.
+
+    Only SELECT-only sessions are routed, and only when DB_REPLICA_ROUTING_ENABLED is set for the plane
+    and a read endpoint is reachable (see _db_read_endpoint). Everything else reads from the primary.
+    """
+    route = req.get('db_route')
+    if isinstance(route, dict) and route.get('target') and not refresh:
+        return route
+    plane = _request_execution_plane(req)
+    if _plane_env('DB_REPLICA_ROUTING_ENABLED', plane).lower() not in ('1', 'true', 'yes'):
+        # Not recorded, so enabling routing later applies to existing sessions.
+        return {'target': 'primary', 'reason': 'routing_disabled'}
+    instance_id = str(req.get('db_instance_id') or '').strip()
+    region = str(req.get('db_region') or os.getenv('AWS_REGION') or 'ap-south-1').strip()
+    decided_at = datetime.now().isoformat()
+    if not is_select_only(req.get('permissions'), req.get('role')):
+        route = {'target': 'primary', 'reason': 'not_select_only', 'decided_at': decided_at}
+    elif not instance_id or instance_id.lower() == 'manual':
+        route = {'target': 'primary', 'reason': 'no_rds_instance', 'decided_at': decided_at}
+    elif not _plane_env('DB_CONNECT_PROXY_READER_HOST', plane) and _plane_env('DB_REPLICA_DIRECT_CONNECT', plane).lower() not in ('1', 'true', 'yes'):
+        route = {'target': 'primary', 'reason': 'no_read_endpoint_configured', 'decided_at': decided_at}
+    else:
+        try:
+            max_lag = float(_plane_env('DB_REPLICA_MAX_LAG_SECONDS', plane) or 5)
+        except ValueError:
+            max_lag = 5.0
+        route = REPLICA_ROUTER.choose(instance_id, region, max_lag_seconds=max_lag)
+    req['db_route'] = route
+    print(f"DB route for {req.get('id') or ''}: {route.get('target')} ({route.get('reason')})", flush=True)
+    request_id = request_id or str(req.get('id') or '')
+    if not refresh and request_id:
+        # First use of a session activated before routing was enabled (activation saves on its own).
+        _save_request(request_id)
+    return route
+
+def _db_route_summary(route):
+    """Client-safe view of a routing decision (never the real DB endpoints)."""
+    route = route if isinstance(route, dict) else {}
+    return {k: route.get(k) for k in ('target', 'reason', 'kind', 'lag_seconds', 'decided_at', 'fallback') if route.get(k) is not None}
+
 def _normalize_permissions_list(value):
     if isinstance(value, list):
         return [str(v).strip() for v in value if str(v).strip()]
@@ -7202,21 +7643,21 @@ def _default_guardrails_config():
         'databaseWriteControls': []
     }
 
-def _load_guardrails_config():
+def _parse_guardrails_config(raw):
     data = _default_guardrails_config()
-    try:
-        if os.path.exists(GUARDRAILS_CONFIG_PATH):
-            with open(GUARDRAILS_CONFIG_PATH, 'r') as f:
-                raw = json.load(f) or {}
-            if isinstance(raw, dict):
-                data.update(raw)
-    except Exception:
-        pass
+    if isinstance(raw, dict):
+        data.update(raw)
     for key in ('serviceRestrictions', 'deleteRestrictions', 'createRestrictions', 'customGuardrails', 'databaseWriteControls'):
         if not isinstance(data.get(key), list):
             data[key] = []
     return data
 
+CONFIG_REGISTRY.register('guardrails', GUARDRAILS_CONFIG_PATH, _parse_guardrails_config)
+
+def _load_guardrails_config():
+    """Guardrails config (read-only snapshot)"""
+    return CONFIG_REGISTRY.get('guardrails')
+
 def _normalize_db_write_rule(rule):
     r = rule if isinstance(rule, dict) else {}
     enabled = bool(r.get('enabled', True))
@@ -7235,13 +7676,13 @@ def _normalize_db_write_rule(rule):
             allowed_users.append(email)
 
     allowed_groups = []
-    for g in (r.get('allowed_groups') or r.get('allowedGroups') or []):
-        if isinstance(g, dict):
-            gid = str(g.get('group_id') or g.get('id') or '').strip()
-            name = str(g.get('display_name') or g.get('name') or '').strip()
-            source = str(g.get('source') or 'identity_center').strip().lower() or 'identity_center'
+    for grp in (r.get('allowed_groups') or r.get('allowedGroups') or []):
+        if isinstance(grp, dict):
+            gid = str(grp.get('group_id') or grp.get('id') or '').strip()
+            name = str(grp.get('display_name') or grp.get('name') or '').strip()
+            source = str(grp.get('source') or 'identity_center').strip().lower() or 'identity_center'
         else:
-            gid = str(g or '').strip()
+            gid = str(grp or '').strip()
             name = ''
             source = 'identity_center'
         if not gid and not name:
@@ -7268,42 +7709,64 @@ def _is_db_write_request(perms):
     ops = [str(p or '').strip().upper() for p in _normalize_permissions_list(perms)]
     return any(op in _DB_WRITE_OPS for op in ops)
 
+def _parse_local_user_groups(raw):
+    """user_groups.json plus member indexes: exact member -> group ids, lowercase member -> id/name keys."""
+    groups = raw.get('groups') if isinstance(raw, dict) else None
+    groups = [grp for grp in (groups if isinstance(groups, list) else []) if isinstance(grp, dict)]
+    ids_by_member = {}
+    keys_by_member = {}
+    for grp in groups:
+        gid = grp.get('id')
+        keys = {k for k in (str(gid or '').strip().lower(), str(grp.get('name') or '').strip().lower()) if k}
+        for m in (grp.get('members') or []):
+            if not isinstance(m, str):
+                continue
+            ids = ids_by_member.setdefault(m, [])
+            if gid not in ids:
+                ids.append(gid)
+            keys_by_member.setdefault(m.strip().lower(), set()).update(keys)
+    return {'groups': groups, 'ids_by_member': ids_by_member, 'keys_by_member': keys_by_member}
+
+
+CONFIG_REGISTRY.register('user_groups', LOCAL_USER_GROUPS_PATH, _parse_local_user_groups)
+
+
+def _local_group_ids_for_member(member):
+    """IDs of local groups listing `member` exactly (as request_access matches)."""
+    if not isinstance(member, str):
+        return []
+    return list(CONFIG_REGISTRY.get('user_groups')['ids_by_member'].get(member) or ())
+
 def _local_group_keys_for_user(email):
     email_l = str(email or '').strip().lower()
     if not email_l:
         return set()
-    keys = set()
-    try:
-        if not os.path.exists(LOCAL_USER_GROUPS_PATH):
-            return keys
-        with open(LOCAL_USER_GROUPS_PATH, 'r') as f:
-            data = json.load(f) or {}
-        for g in (data.get('groups') or []):
-            if not isinstance(g, dict):
-                continue
-            members = {str(m or '').strip().lower() for m in (g.get('members') or [])}
-            if email_l in members:
-                gid = str(g.get('id') or '').strip().lower()
-                name = str(g.get('name') or '').strip().lower()
-                if gid:
-                    keys.add(gid)
-                if name:
-                    keys.add(name)
-    except Exception:
-        pass
-    return keys
+    return set(CONFIG_REGISTRY.get('user_groups')['keys_by_member'].get(email_l) or ())
 
 def _identity_center_group_keys_for_user(email):
+    """Lowercase Identity Center group IDs and names for a user (cached in IDENTITY_CACHE under the email)."""
     email_l = str(email or '').strip().lower()
     if not email_l:
         return set()
+    cached = IDENTITY_CACHE.lookup(email_l, 'group_keys')
+    if cached is not None:
+        return set(cached['group_keys'])
+    keys, user_id, complete = _lookup_identity_center_group_keys(email_l)
+    if complete:
+        IDENTITY_CACHE.put(email_l, group_keys=frozenset(keys), user_id=user_id)
+    return keys
+
+
+def _lookup_identity_center_group_keys(email_l):
+    """Returns (keys, user_id, complete); complete is False when a lookup failed and the result must not be cached."""
     keys = set()
+    user_id = ''
     try:
         user = _find_identity_center_user_by_email(email_l)
         user_id = str((user or {}).get('UserId') or '').strip()
         identity_store_id = str(CONFIG.get('identity_store_id') or '').strip()
         if not user_id or not identity_store_id:
-            return keys
+            return keys, user_id, bool(identity_store_id)
 
         identitystore = _identitystore_client()
         group_ids = set()
@@ -7321,8 +7784,8 @@ def _identity_center_group_keys_for_user(email):
         if not group_ids:
             try:
                 for page in identitystore.get_paginator('list_groups').paginate(IdentityStoreId=identity_store_id):
-                    for g in page.get('Groups', []) or []:
-                        gid = str(g.get('GroupId') or '').strip()
+                    for grp in page.get('Groups', []) or []:
+                        gid = str(grp.get('GroupId') or '').strip()
                         if not gid:
                             continue
                         members_page = identitystore.list_group_memberships(
@@ -7343,17 +7806,61 @@ def _identity_center_group_keys_for_user(email):
         if group_ids:
             try:
                 for page in identitystore.get_paginator('list_groups').paginate(IdentityStoreId=identity_store_id):
-                    for g in page.get('Groups', []) or []:
-                        gid = str(g.get('GroupId') or '').strip()
+                    for grp in page.get('Groups', []) or []:
+                        gid = str(grp.get('GroupId') or '').strip()
                         if gid and gid in group_ids:
-                            name = str(g.get('DisplayName') or '').strip().lower()
+                            name = str(grp.get('DisplayName') or '').strip().lower()
                             if name:
                                 keys.add(name)
             except Exception:
-                pass
+                return keys, user_id, False
     except Exception:
-        pass
-    return keys
+        return keys, user_id, False
+    return keys, user_id, True
+
+_DB_WRITE_GUARDRAIL_DEFAULT_REASON = (
+    'Write actions are blocked by database guardrails for this account and database instance. '
+    'Please contact an administrator if you need an exception.'
+)
+
+# Blocking databaseWriteControls rules compiled per guardrails config version: (config version, buckets).
+_DB_WRITE_GUARDRAIL_INDEX = {'entry': (None, None)}
+_DB_WRITE_GUARDRAIL_LOCK = threading.Lock()
+
+
+def _compile_db_write_guardrails(raw_rules):
+    """
+    Bucket enabled blocking rules by (account_id, db_instance_id); '' is the wildcard on either side.
+    Each bucket: {'count', 'allowed_users', 'allowed_group_keys', 'reason': (rule position, reason)}.
+    """
+    buckets = {}
+    for pos, raw in enumerate(raw_rules or []):
+        rule = _normalize_db_write_rule(raw)
+        if not rule.get('enabled') or not rule.get('block_write_actions'):
+            continue
+        key = (rule['account_id'], rule['db_instance_id'])
+        bucket = buckets.setdefault(key, {'count': 0, 'allowed_users': set(), 'allowed_group_keys': set(), 'reason': None})
+        bucket['count'] += 1
+        bucket['allowed_users'].update(em for em in rule['allowed_users'] if em)
+        for grp in rule['allowed_groups']:
+            bucket['allowed_group_keys'].update(k for k in (grp['id'].lower(), grp['name'].lower()) if k)
+        if rule['reason'] and bucket['reason'] is None:
+            bucket['reason'] = (pos, rule['reason'])
+    return buckets
+
+
+def _db_write_guardrail_buckets():
+    version = CONFIG_REGISTRY.entry_version('guardrails')
+    cached_version, buckets = _DB_WRITE_GUARDRAIL_INDEX['entry']
+    if cached_version == version:
+        return buckets
+    with _DB_WRITE_GUARDRAIL_LOCK:
+        cached_version, buckets = _DB_WRITE_GUARDRAIL_INDEX['entry']
+        if cached_version != version:
+            buckets = _compile_db_write_guardrails(_load_guardrails_config().get('databaseWriteControls'))
+            _DB_WRITE_GUARDRAIL_INDEX['entry'] = (version, buckets)
+        return buckets
+
 
 def _evaluate_db_write_guardrail(account_id, db_instance_id, user_email, perms):
     """
@@ -7363,67 +7870,33 @@ def _evaluate_db_write_guardrail(account_id, db_instance_id, user_email, perms):
     if not _is_db_write_request(perms):
         return {'blocked': False, 'reason': '', 'matched_rules': 0}
 
-    cfg = _load_guardrails_config()
-    rules = [_normalize_db_write_rule(r) for r in (cfg.get('databaseWriteControls') or [])]
     account_id = str(account_id or '').strip()
     db_instance_id = str(db_instance_id or '').strip()
     user_email_l = str(user_email or '').strip().lower()
 
-    matched_rules = []
-    for rule in rules:
-        if not rule.get('enabled') or not rule.get('block_write_actions'):
-            continue
-        r_acc = str(rule.get('account_id') or '').strip()
-        r_db = str(rule.get('db_instance_id') or '').strip()
-        if r_acc and account_id and r_acc != account_id:
-            continue
-        if r_acc and not account_id:
-            continue
-        if r_db and db_instance_id and r_db != db_instance_id:
-            continue
-        if r_db and not db_instance_id:
-            continue
-        matched_rules.append(rule)
-
-    if not matched_rules:
+    # A rule scoped to an account/instance only matches requests naming it; '' matches any.
+    buckets = _db_write_guardrail_buckets()
+    keys = {(a, d) for a in {account_id, ''} for d in {db_instance_id, ''}}
+    matched = [buckets[k] for k in keys if k in buckets]
+    matched_count = sum(b['count'] for b in matched)
+    if not matched_count:
         return {'blocked': False, 'reason': '', 'matched_rules': 0}
 
-    allowed_users = set()
-    allowed_group_keys = set()
-    for rule in matched_rules:
-        for em in (rule.get('allowed_users') or []):
-            if em:
-                allowed_users.add(str(em).strip().lower())
-        for g in (rule.get('allowed_groups') or []):
-            gid = str((g or {}).get('id') or '').strip().lower()
-            gname = str((g or {}).get('name') or '').strip().lower()
-            if gid:
-                allowed_group_keys.add(gid)
-            if gname:
-                allowed_group_keys.add(gname)
-
-    if user_email_l and user_email_l in allowed_users:
-        return {'blocked': False, 'reason': '', 'matched_rules': len(matched_rules)}
-
-    if allowed_group_keys:
+    if user_email_l and any(user_email_l in b['allowed_users'] for b in matched):
+        return {'blocked': False, 'reason': '', 'matched_rules': matched_count}
+
+    if any(b['allowed_group_keys'] for b in matched):
         local_keys = _local_group_keys_for_user(user_email_l)
-        if local_keys.intersection(allowed_group_keys):
-            return {'blocked': False, 'reason': '', 'matched_rules': len(matched_rules)}
+        if any(not local_keys.isdisjoint(b['allowed_group_keys']) for b in matched):
+            return {'blocked': False, 'reason': '', 'matched_rules': matched_count}
         idc_keys = _identity_center_group_keys_for_user(user_email_l)
-        if idc_keys.intersection(allowed_group_keys):
-            return {'blocked': False, 'reason': '', 'matched_rules': len(matched_rules)}
+        if any(not idc_keys.isdisjoint(b['allowed_group_keys']) for b in matched):
+            return {'blocked': False, 'reason': '', 'matched_rules': matched_count}
 
-    reason = ''
-    for rule in matched_rules:
-        reason = str(rule.get('reason') or '').strip()
-        if reason:
-            break
-    if not reason:
-        reason = (
-            'Write actions are blocked by database guardrails for this account and database instance. '
-            'Please contact an administrator if you need an exception.'
-        )
-    return {'blocked': True, 'reason': reason, 'matched_rules': len(matched_rules)}
+    # Reason of the first matching rule (in config order) that has one.
+    reasons = [b['reason'] for b in matched if b['reason']]
+    reason = min(reasons)[1] if reasons else _DB_WRITE_GUARDRAIL_DEFAULT_REASON
+    return {'blocked': True, 'reason': reason, 'matched_rules': matched_count}
 
 _READ_ONLY_DB_OPS = {'SELECT', 'SHOW', 'EXPLAIN', 'DESCRIBE', 'ANALYZE'}
 _SENSITIVE_CLASSIFICATIONS = {'pii', 'sensitive', 'confidential', 'restricted', 'phi', 'pci'}
@@ -7742,34 +8215,21 @@ def _auth_mode_user_hint(profile):
         "This RDS instance uses password-based access in NPAMX. After approval, time-limited credentials will appear in My Requests under Database Access."
     )
 
-def _resolve_account_environment(account_id):
-    """Resolve account environment (prod/nonprod/sandbox) from config/policies; default to nonprod."""
-    acct = str(account_id or '').strip()
-    if not acct:
-        return 'nonprod'
-
+def _account_environment_from(acct, account_meta, policies, tags):
+    """(environment, source) for one account; the precedence _resolve_account_environment has always used."""
     # org_policies.json overrides (preferred)
     try:
-        policies = load_org_policies() or {}
         env = ((policies.get('accounts') or {}).get(acct) or {}).get('environment')
         if env:
-            return str(env).strip().lower()
+            return str(env).strip().lower(), 'org_policies'
     except Exception:
         pass
 
     # CONFIG entry (prefer effective environment resolved from org hierarchy tags)
-    accounts_cfg = CONFIG.get('accounts') or {}
-    account_meta = (accounts_cfg.get(acct) or {})
-    if not account_meta and isinstance(accounts_cfg, dict):
-        for _, meta in accounts_cfg.items():
-            if str((meta or {}).get('id') or '').strip() == acct:
-                account_meta = meta or {}
-                break
-
     for key in ('effective_environment', 'environment', 'source_environment'):
         cfg_env = _normalize_env_tag(account_meta.get(key))
         if cfg_env:
-            return cfg_env
+            return cfg_env, f'config.{key}'
 
     # Last-mile fallback from persisted hierarchy tags.
     try:
@@ -7778,21 +8238,113 @@ def _resolve_account_environment(account_id):
             ou_chain=_account_ou_chain_from_meta(account_meta),
             root_id=str(account_meta.get('root_id') or '').strip(),
             fallback='',
-            tags=_load_org_hierarchy_tags(),
+            tags=tags,
         )
         env_from_tags = _normalize_env_tag(env_from_tags)
         if env_from_tags:
-            return env_from_tags
+            return env_from_tags, 'hierarchy_tags'
     except Exception:
         pass
 
     # Infer from account name as fallback
     name = str(account_meta.get('name') or '').lower()
     if 'prod' in name or 'production' in name:
-        return 'prod'
+        return 'prod', 'account_name'
     if 'sandbox' in name:
-        return 'sandbox'
-    return 'nonprod'
+        return 'sandbox', 'account_name'
+    return 'nonprod', 'default'
+
+
+# Materialized account metadata (environment, OU chain, plane, name) for every account known to
+# CONFIG['accounts'], org_policies.json or the hierarchy tags. Rebuilt lazily when either config
+# file changes or CONFIG['accounts'] is replaced; in-place edits call _invalidate_account_index().
+# Entry: (accounts dict it was built from, config key, index).
+_ACCOUNT_INDEX = {'entry': (None, None, None)}
+_ACCOUNT_INDEX_LOCK = threading.Lock()
+
+
+def _account_index_key(accounts_cfg):
+    return (
+        CONFIG_REGISTRY.entry_version('org_policies'),
+        CONFIG_REGISTRY.entry_version('org_hierarchy_tags'),
+        len(accounts_cfg) if isinstance(accounts_cfg, dict) else 0,
+    )
+
+
+def _build_account_index(accounts_cfg):
+    started = time.perf_counter()
+    policies = load_org_policies() or {}
+    tags = _org_hierarchy_tags_snapshot()
+    metas = {}
+    if isinstance(accounts_cfg, dict):
+        # Keyed entries win over a match on the 'id' field, as the old linear scan did.
+        for meta in accounts_cfg.values():
+            acct = str((meta or {}).get('id') or '').strip()
+            if acct:
+                metas.setdefault(acct, meta or {})
+        for key, meta in accounts_cfg.items():
+            if str(key).strip():
+                metas[str(key).strip()] = meta or {}
+    ids = set(metas)
+    ids.update(str(k).strip() for k in (policies.get('accounts') or {}) if str(k).strip())
+    ids.update(str(k).strip() for k in (tags.get('accounts') or {}) if str(k).strip())
+
+    accounts = {}
+    for acct in ids:
+        meta = metas.get(acct) or {}
+        env, source = _account_environment_from(acct, meta, policies, tags)
+        accounts[acct] = {
+            'account_id': acct,
+            'name': str(meta.get('name') or '').strip(),
+            'environment': env,
+            'environment_source': source,
+            'root_id': str(meta.get('root_id') or '').strip(),
+            'ou_chain': _account_ou_chain_from_meta(meta),
+            'execution_plane': _resolve_execution_plane(env),
+        }
+    return {
+        'accounts': accounts,
+        'built_at': datetime.now().isoformat(),
+        'build_ms': round((time.perf_counter() - started) * 1000.0, 3),
+    }
+
+
+def _account_index():
+    accounts_cfg = CONFIG.get('accounts')
+    key = _account_index_key(accounts_cfg)
+    built_from, cached_key, index = _ACCOUNT_INDEX['entry']
+    if index is not None and built_from is accounts_cfg and cached_key == key:
+        return index
+    with _ACCOUNT_INDEX_LOCK:
+        built_from, cached_key, index = _ACCOUNT_INDEX['entry']
+        if index is not None and built_from is accounts_cfg and cached_key == key:
+            return index
+        index = _build_account_index(accounts_cfg)
+        _ACCOUNT_INDEX['entry'] = (accounts_cfg, key, index)
+        return index
+
+
+def _invalidate_account_index():
+    _ACCOUNT_INDEX['entry'] = (None, None, None)
+
+
+def _account_metadata(account_id):
+    """Indexed metadata for an account, or None when no config source knows it."""
+    acct = str(account_id or '').strip()
+    if not acct:
+        return None
+    return _account_index()['accounts'].get(acct)
+
+
+def _resolve_account_environment(account_id):
+    """Resolve account environment (prod/nonprod/sandbox) from config/policies; default to nonprod."""
+    meta = _account_metadata(account_id)
+    return meta['environment'] if meta else 'nonprod'
+
+
+def _resolve_account_execution_plane(account_id):
+    meta = _account_metadata(account_id)
+    return meta['execution_plane'] if meta else _resolve_execution_plane('nonprod')
 
 
 def _env_plane_suffixes(plane):
@@ -7856,6 +8408,8 @@ def _request_execution_plane(req):
     plane = str(req.get('execution_plane') or '').strip().lower()
     if plane in ('prod', 'nonprod', 'sandbox'):
         return plane
+    if not _normalize_env_tag(req.get('account_env')):
+        return _resolve_account_execution_plane(req.get('account_id'))
     return _resolve_execution_plane(_request_account_env(req))
 
 
@@ -7884,6 +8438,84 @@ def _is_db_request_expired(req, now=None):
         return False
 
 
+def _db_request_expiry_epoch(req):
+    """Session expiry as epoch seconds (None when unknown), e.g. to bound pooled DB connections."""
+    expires_at_str = str((req or {}).get('expires_at') or '').strip()
+    if not expires_at_str:
+        return None
+    try:
+        return datetime.fromisoformat(expires_at_str.replace('Z', '+00:00').replace('+00:00', '')).timestamp()
+    except Exception:
+        return None
+
+
+# Roles kept at release because another request still held them: role -> plane.
+# Re-checked by background_cleanup so a role whose last holders close on
+# different workers at the same moment is still deleted.
+_deferred_vault_roles = {}
+
+
+def _vault_role_holders(role_name, request_id):
+    """
+    Open DB requests other than request_id that use role_name: sessions saved by any
+    worker, corrected by this worker's not-yet-saved changes.
+    """
+    holders = set()
+    for rid in STORE.vault_role_holders(role_name, exclude_request_id=request_id):
+        resident = requests_db.peek(rid)
+        if resident is None or str(resident.get('status') or '').strip().lower() in ('active', 'approved'):
+            holders.add(rid)
+    for rid, req in requests_db.select(type='database_access', status=('active', 'approved')):
+        if rid != request_id and str(req.get('vault_role_name') or '').strip() == role_name:
+            holders.add(rid)
+    return holders
+
+
+def _release_vault_role_for_request(req, request_id, plane):
+    """Drop the request's reference to its (shared) Vault role; the role is deleted when unused."""
+    role_name = str(req.get('vault_role_name') or '').strip()
+    if not role_name:
+        return
+    try:
+        holders = _vault_role_holders(role_name, request_id)
+        if VaultManager.release_database_role(role_name, request_id, plane=plane, holders=holders):
+            _deferred_vault_roles.pop(role_name, None)
+            print(f"Vault role {role_name} deleted (no remaining sessions)", flush=True)
+        elif holders:
+            _deferred_vault_roles[role_name] = plane
+    except Exception as e:
+        print(f"Vault role release failed for {request_id}: {e}", flush=True)
+
+
+def _sweep_deferred_vault_roles():
+    """Delete deferred Vault roles whose remaining holders have all closed."""
+    for role_name, plane in list(_deferred_vault_roles.items()):
+        try:
+            holders = _vault_role_holders(role_name, '')
+            if holders:
+                continue
+            _deferred_vault_roles.pop(role_name, None)
+            if VaultManager.release_database_role(role_name, '', plane=plane, holders=holders):
+                print(f"Vault role {role_name} deleted (no remaining sessions)", flush=True)
+        except Exception as e:
+            print(f"Vault role sweep failed for {role_name}: {e}", flush=True)
+
+
+def _seed_vault_role_references():
+    """Rebuild Vault role reference counts from open DB sessions after a restart."""
+    for rid, req in requests_db.select(type='database_access', status=('active', 'approved')):
+        if not isinstance(req, dict) or req.get('type') != 'database_access':
+            continue
+        if str(req.get('status') or '').strip().lower() not in ('active', 'approved'):
+            continue
+        role_name = str(req.get('vault_role_name') or '').strip()
+        if role_name:
+            VaultManager.register_role_reference(role_name, rid, plane=_request_execution_plane(req))
+
+
+_seed_vault_role_references()
+
+
 def _activate_database_access_request(request_id: str, force_retry: bool = False) -> dict:
     """
     Activate an approved DB access request by minting time-bound credentials.
@@ -8140,6 +8772,11 @@ def _activate_database_access_request(request_id: str, force_retry: bool = False
         _save_requests()
         return {'status': 'approved', 'error': str(e)}
 
+    if effective_auth != 'iam':
+        try:
+            _db_read_route(req, refresh=True)
+        except Exception as e:
+            print(f"DB route decision skipped for {rid}: {e}", flush=True)
     _save_requests()
     return {'status': req.get('status', 'ACTIVE')}
 
@@ -9403,7 +10040,7 @@ def request_database_access():
 
         # Policy-based validation and approval routing (PROD/NONPROD/PII)
         account_env = _resolve_account_environment(account_id)
-        execution_plane = _resolve_execution_plane(account_env)
+        execution_plane = _resolve_account_execution_plane(account_id)
         tags_present = bool(auth_profile.get('classification_tag_present') or auth_profile.get('tags_present'))
         data_classification = str(auth_profile.get('data_classification') or '').strip()
         is_pii = bool(auth_profile.get('is_pii'))
@@ -9536,7 +10173,7 @@ def get_approved_databases():
         if not user_email:
             return jsonify({'databases': approved_databases})
         
-        for req_id, req in requests_db.items():
+        for req_id, req in requests_db.select(type='database_access', user=user_email, status=('active', 'approved')):
             status = str(req.get('status') or '').lower()
             if (req.get('type') == 'database_access' and
                 str(req.get('user_email') or '').strip().lower() == user_email and
@@ -9698,7 +10335,8 @@ def get_database_request_credentials(request_id):
                 'activation_progress': _activation_progress_for_response(req)
             }), 400
 
-        return jsonify({
+        read_route = _db_route_summary(_db_read_route(req, request_id=request_id))
+        payload = {
             'request_id': request_id,
             'effective_auth': 'password',
             'proxy_host': proxy_host,
@@ -9710,7 +10348,13 @@ def get_database_request_credentials(request_id):
             'vault_token': token,  # backward-compat (UI may still read vault_token)
             'database': db_name,
             'expires_at': str(req.get('expires_at') or '').strip(),
-        })
+            'read_route': read_route,
+        }
+        if read_route.get('target') == 'replica' and _plane_env('DB_CONNECT_PROXY_READER_HOST', req_plane):
+            # SQL clients should read through the reader listener too.
+            reader_host, reader_port = _db_read_endpoint(req.get('db_route'), req_plane)
+            payload.update(read_proxy_host=reader_host, read_proxy_port=reader_port)
+        return jsonify(payload)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -9874,90 +10518,277 @@ def internal_create_db_session():
         return jsonify(result), 500
     return jsonify(result)
 
+def _resolve_pam_db_session(data):
+    """
+    Validate a PAM terminal call against its JIT request and resolve the session's connection settings.
+
+    Returns (session, None) or (None, (response, status)). Credentials come from the backend record only.
+    """
+    request_id = data.get('request_id')
+    user_email = data.get('user_email')
+    db_name = data.get('dbName')
+
+    if not request_id or not user_email:
+        return None, (jsonify({'error': 'Request ID and user email required for audit'}), 400)
+
+    # Time-based enforcement: validate access is still valid
+    if request_id not in requests_db:
+        return None, (jsonify({'error': 'Access request not found'}), 404)
+
+    db_request = requests_db[request_id]
+    if db_request.get('type') != 'database_access':
+        return None, (jsonify({'error': 'Invalid request type'}), 400)
+    if db_request.get('user_email') != user_email:
+        return None, (jsonify({'error': 'Access denied: user mismatch'}), 403)
+    if str(db_request.get('status') or '').lower() not in ('active',):
+        return None, (jsonify({'error': 'Access not active. Please wait for approval.'}), 403)
+
+    if _is_db_request_expired(db_request):
+        return None, (jsonify({'error': 'Access expired. Please request new database access.'}), 403)
+
+    # MVP 2: Resolve credentials from backend - never trust client
+    databases = db_request.get('databases', [])
+    if not databases:
+        return None, (jsonify({'error': 'No database in request'}), 400)
+    db_info = databases[0]
+    # Users must connect only via proxy. For PAM Terminal, backend also connects via proxy when configured.
+    req_account_env = _request_account_env(db_request)
+    req_plane = _request_execution_plane(db_request)
+    proxy_host, proxy_port, _ = _resolve_db_connect_proxy_endpoint(
+        account_env=req_account_env,
+        execution_plane=req_plane
+    )
+    if not proxy_host or proxy_host == 'proxy-not-configured':
+        return None, (jsonify({'error': 'Database access service is not configured. Please contact an administrator.'}), 500)
+    host = proxy_host
+    port = int(proxy_port or 3306)
+    # Only databases on the approved request: schema completions are cached per instance/database,
+    # so a cached entry would otherwise answer for a database the user's grant does not cover.
+    approved_dbs = [str(d.get('name') or '').strip() for d in databases if isinstance(d, dict)]
+    approved_dbs = [n for n in approved_dbs if n] or [str(db_request.get('db_name') or '').strip()]
+    db_name = str(db_name or '').strip()
+    if db_name and db_name not in approved_dbs:
+        return None, (jsonify({'error': f'Access denied: database {db_name} is not part of this request'}), 403)
+    database = db_name or db_info.get('name', '')
+    username = db_request.get('db_username')
+    effective_auth = _normalize_auth_choice(db_request.get('effective_auth')) or 'password'
+    # Vault password is stored as password/vault_token (ephemeral). Legacy fallback: db_password.
+    password = db_request.get('password') or db_request.get('vault_token') or db_request.get('db_password')
+
+    if effective_auth == 'iam':
+        return None, (jsonify({
+            'error': (
+                'PAM terminal is disabled for IAM-auth requests. '
+                'Use "Get login details", generate token locally with your own AWS Identity Center credentials, '
+                'and connect from your SQL client.'
+            )
+        }), 400)
+
+    if not all([host, username, password, database]):
+        return None, (jsonify({'error': 'Database credentials not available. Request may have expired.'}), 400)
+
+    # Execute directly (DB privileges enforce allowed operations; proxy is a TCP router outside NPAMX).
+    ssl_cfg = None
+    if effective_auth == 'iam':
+        # Many IAM-auth DBs require TLS. Allow ops to configure a CA bundle path.
+        ca_path = str(os.getenv('DB_SSL_CA_BUNDLE') or '').strip()
+        if ca_path:
+            ssl_cfg = {'ca': ca_path}
+        elif str(os.getenv('DB_SSL_REQUIRE') or '').strip().lower() in ('1', 'true', 'yes'):
+            ssl_cfg = {}
+    primary_kwargs = dict(
+        host=host, port=port, username=username, password=password, database=database, ssl=ssl_cfg,
+        pool_owner=request_id, pool_expires_at=_db_request_expiry_epoch(db_request), auth_mode=effective_auth,
+    )
+    connect_kwargs = primary_kwargs
+    read_target = 'primary'
+    route = _db_read_route(db_request, request_id=request_id)
+    if route.get('target') == 'replica':
+        fallback = route.get('fallback') or {}
+        if time.time() < float(fallback.get('retry_at') or 0):
+            # The replica refused this session recently (see _replica_fallback); stay on the primary until retry_at.
+            endpoint = None
+        else:
+            ok, why = REPLICA_ROUTER.revalidate(route)
+            endpoint = _db_read_endpoint(route, req_plane) if ok else None
+            if not endpoint:
+                # Replica lagging/unreachable right now: read from the primary, keep the decision for later queries.
+                route['fallback'] = {'reason': why or 'no_read_endpoint_configured', 'at': datetime.now().isoformat()}
+        if endpoint:
+            connect_kwargs = dict(primary_kwargs, host=endpoint[0], port=endpoint[1])
+            read_target = 'replica'
+            route.pop('fallback', None)
+    return {
+        'request_id': request_id,
+        'user_email': user_email,
+        'db_request': db_request,
+        'account_env': req_account_env,
+        'role': db_request.get('role', 'read_only'),
+        'database': database,
+        # Schema/plan caches stay keyed by the primary: replicas serve the same schema.
+        'instance_key': str(db_request.get('db_instance_id') or db_info.get('id') or db_info.get('host') or ''),
+        'read_target': read_target,
+        'connect_kwargs': connect_kwargs,
+        'primary_connect_kwargs': primary_kwargs,
+    }, None
+
+def _replica_fallback(session, error):
+    """
+    The replica refused/dropped the session (e.g. its DB user has not replicated yet): read from the
+    primary for DB_REPLICA_RETRY_SECONDS, then let revalidation move the session back. The route's
+    target is left as is; the fallback note is transient and saved with the next background save.
+    """
+    route = session['db_request'].get('db_route')
+    if isinstance(route, dict):
+        route['fallback'] = {
+            'reason': f"replica_unreachable: {str(error)[:200]}",
+            'at': datetime.now().isoformat(),
+            'retry_at': time.time() + _REPLICA_RETRY_SECONDS,
+        }
+
+@app.route('/api/databases/schema', methods=['POST'])
+def database_schema_completions():
+    """Schema-aware completions for the PAM terminal (cached per instance/database, loaded via the user's session)."""
+    try:
+        started = time.perf_counter()
+        data = request.get_json() or {}
+        session, err = _resolve_pam_db_session(data)
+        if err:
+            return err
+        connect_kwargs = session['connect_kwargs']
+
+        def _load():
+            return load_mysql_schema(
+                lambda sql: execute_query(query=sql, result_format='columnar', **connect_kwargs)
+            )
+
+        try:
+            snapshot, status = SCHEMA_CACHE.get(
+                session['instance_key'], session['database'], _load, refresh=bool(data.get('refresh'))
+            )
+        except RuntimeError as e:
+            return jsonify({'error': f'Could not load schema: {e}'}), 502
+
+        table = str(data.get('table') or '').strip()
+        kinds = data.get('kinds') if isinstance(data.get('kinds'), list) else None
+        response = {
+            'database': session['database'],
+            'suggestions': snapshot.complete(str(data.get('prefix') or ''), table=table, kinds=kinds, limit=data.get('limit') or 50),
+            'cache': status,
+            'age_seconds': round(max(0.0, time.time() - snapshot.loaded_at), 1),
+            'tables': snapshot.table_count,
+            'truncated': snapshot.truncated,
+        }
+        if table and data.get('include_indexes'):
+            t = snapshot.table(table)
+            response['indexes'] = (t or {}).get('indexes', [])
+        response['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/databases/execute-query', methods=['POST'])
 def execute_database_query():
     """Execute SQL query with time-based access enforcement (PAM Terminal only)."""
     try:
         data = request.get_json() or {}
-        request_id = data.get('request_id')
-        user_email = data.get('user_email')
         query = data.get('query', '').strip()
-        db_name = data.get('dbName')
-        
-        if not request_id or not user_email:
-            return jsonify({'error': 'Request ID and user email required for audit'}), 400
-        
-        # Time-based enforcement: validate access is still valid
-        if request_id not in requests_db:
-            return jsonify({'error': 'Access request not found'}), 404
-        
-        db_request = requests_db[request_id]
-        if db_request.get('type') != 'database_access':
-            return jsonify({'error': 'Invalid request type'}), 400
-        if db_request.get('user_email') != user_email:
-            return jsonify({'error': 'Access denied: user mismatch'}), 403
-        if str(db_request.get('status') or '').lower() not in ('active',):
-            return jsonify({'error': 'Access not active. Please wait for approval.'}), 403
-
-        if _is_db_request_expired(db_request):
-            return jsonify({'error': 'Access expired. Please request new database access.'}), 403
-        
-        # MVP 2: Resolve credentials from backend - never trust client
-        databases = db_request.get('databases', [])
-        if not databases:
-            return jsonify({'error': 'No database in request'}), 400
-        db_info = databases[0]
-        # Users must connect only via proxy. For PAM Terminal, backend also connects via proxy when configured.
-        req_account_env = _request_account_env(db_request)
-        req_plane = _request_execution_plane(db_request)
-        proxy_host, proxy_port, _ = _resolve_db_connect_proxy_endpoint(
-            account_env=req_account_env,
-            execution_plane=req_plane
-        )
-        if not proxy_host or proxy_host == 'proxy-not-configured':
-            return jsonify({'error': 'Database access service is not configured. Please contact an administrator.'}), 500
-        host = proxy_host
-        port = int(proxy_port or 3306)
-        database = db_name or db_info.get('name', '')
-        username = db_request.get('db_username')
-        effective_auth = _normalize_auth_choice(db_request.get('effective_auth')) or 'password'
-        # Vault password is stored as password/vault_token (ephemeral). Legacy fallback: db_password.
-        password = db_request.get('password') or db_request.get('vault_token') or db_request.get('db_password')
+        session, err = _resolve_pam_db_session(data)
+        if err:
+            return err
+        request_id = session['request_id']
+        user_email = session['user_email']
+        req_account_env = session['account_env']
+        database = session['database']
+        # Admission control: bounded in-flight queries per user/session/instance with a short fair queue.
+        try:
+            ticket = QUERY_ADMISSION.acquire(user_email, request_id, session['instance_key'])
+        except AdmissionRejected as e:
+            resp = jsonify({'error': str(e), 'code': 'DB_QUERY_THROTTLED', 'reason': e.reason, 'retry_after': e.retry_after})
+            resp.headers['Retry-After'] = str(e.retry_after)
+            return resp, 429
+        # Streaming responses release the slot when the stream ends.
+        handed_off = False
+        try:
+            result_format = str(data.get('format') or 'rows').strip().lower()
+            role = session['role']
+            query_kwargs = dict(
+                session['connect_kwargs'], query=query, max_rows=data.get('max_rows'), max_bytes=data.get('max_bytes'),
+            )
 
-        if effective_auth == 'iam':
-            return jsonify({
-                'error': (
-                    'PAM terminal is disabled for IAM-auth requests. '
-                    'Use "Get login details", generate token locally with your own AWS Identity Center credentials, '
-                    'and connect from your SQL client.'
+            # Optional EXPLAIN pre-flight: reject (or require a justification for) very expensive reads.
+            audit_payload = None
+            cost = QUERY_COST_GATE.check(
+                env=req_account_env,
+                instance_key=session['instance_key'],
+                database=database,
+                query=query,
+                run_explain=lambda sql: execute_query(**dict(query_kwargs, query=sql, max_rows=1000)),
+                justification=str(data.get('cost_justification') or ''),
+            )
+            if not cost['allowed']:
+                reason = '; '.join(cost['reasons'])
+                if cost['action'] == 'justify':
+                    msg = f'Query looks expensive ({reason}). Add a justification to run it anyway.'
+                    code = 'QUERY_COST_JUSTIFICATION_REQUIRED'
+                else:
+                    msg = f'Query rejected by the cost limit for {req_account_env or "this"} environment ({reason}). Add a selective WHERE/LIMIT.'
+                    code = 'QUERY_COST_REJECTED'
+                try:
+                    from audit_log import log_db_query
+                    log_db_query(user_email, request_id, role, query, allowed=False, error=msg, payload={'cost_gate': cost})
+                except Exception:
+                    pass
+                return jsonify({'error': msg, 'code': code, 'requires_justification': cost['action'] == 'justify', 'cost': cost}), 403
+            if cost['justified']:
+                audit_payload = {'cost_gate': cost, 'cost_justification': str(data.get('cost_justification') or '').strip()[:MAX_JUSTIFICATION_LENGTH]}
+
+            if result_format == 'ndjson':
+                if session['read_target'] == 'replica':
+                    # A stream cannot be retried once handed off: check the replica accepts this session first.
+                    probe = execute_query(**dict(query_kwargs, query='SELECT 1', max_rows=1))
+                    if _REPLICA_RETRY_ERROR_RE.match(str(probe.get('error') or '')):
+                        _replica_fallback(session, probe['error'])
+                        query_kwargs = dict(query_kwargs, **session['primary_connect_kwargs'])
+                # Chunked streaming: rows are written as they are read from the server-side cursor.
+                def _audit_stream(summary):
+                    from audit_log import build_query_metrics, log_db_query
+                    rows = summary['row_count'] if summary.get('affected_rows') is None else summary['affected_rows']
+                    err = summary.get('error')
+                    metrics = build_query_metrics(summary, source='terminal', instance=session['instance_key'], db_name=database, queue_ms=ticket.waited_ms)
+                    log_db_query(user_email, request_id, role, query, allowed=(err is None), rows_returned=rows, error=err, payload=audit_payload, metrics=metrics)
+
+                handed_off = True
+                return Response(
+                    release_after(stream_query_ndjson(on_complete=_audit_stream, **query_kwargs), ticket),
+                    mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-store'},
                 )
-            }), 400
-        
-        if not all([host, username, password, database]):
-            return jsonify({'error': 'Database credentials not available. Request may have expired.'}), 400
 
-        # Execute directly (DB privileges enforce allowed operations; proxy is a TCP router outside NPAMX).
-        ssl_cfg = None
-        if effective_auth == 'iam':
-            # Many IAM-auth DBs require TLS. Allow ops to configure a CA bundle path.
-            ca_path = str(os.getenv('DB_SSL_CA_BUNDLE') or '').strip()
-            if ca_path:
-                ssl_cfg = {'ca': ca_path}
-            elif str(os.getenv('DB_SSL_REQUIRE') or '').strip().lower() in ('1', 'true', 'yes'):
-                ssl_cfg = {}
-        result = execute_query(host=host, port=port, username=username, password=password, database=database, query=query, ssl=ssl_cfg)
-        
-        # MVP 2: Audit log
-        try:
-            from audit_log import log_db_query
-            rows = len(result.get('results', [])) if isinstance(result.get('results'), list) else result.get('affected_rows')
-            err = result.get('error')
-            role = db_request.get('role', 'read_only')
-            log_db_query(user_email, request_id, role, query, allowed=(err is None), rows_returned=rows, error=err)
-        except Exception:
-            pass
+            result = execute_query(result_format=result_format, **query_kwargs)
+            if session['read_target'] == 'replica' and _REPLICA_RETRY_ERROR_RE.match(str(result.get('error') or '')):
+                _replica_fallback(session, result['error'])
+                result = execute_query(result_format=result_format, **dict(query_kwargs, **session['primary_connect_kwargs']))
+            if not result.get('error') and _SCHEMA_CHANGING_VERBS.intersection(sql_analyze(query).verbs):
+                SCHEMA_CACHE.invalidate(session['instance_key'], database)
         
-        return jsonify(result)
+            # MVP 2: Audit log
+            try:
+                from audit_log import build_query_metrics, log_db_query
+                if result.get('affected_rows') is not None:
+                    rows = result.get('affected_rows')
+                else:
+                    rows = result.get('row_count')
+                err = result.get('error')
+                metrics = build_query_metrics(result, source='terminal', instance=session['instance_key'], db_name=database, queue_ms=ticket.waited_ms)
+                log_db_query(user_email, request_id, role, query, allowed=(err is None), rows_returned=rows, error=err, payload=audit_payload, metrics=metrics)
+            except Exception:
+                pass
+        
+            return jsonify(result)
+        finally:
+            if not handed_off:
+                ticket.release()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
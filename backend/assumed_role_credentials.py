@@ -0,0 +1,216 @@
+"""
+Assumed-role credential provider
+================================
+
+Keeps STS AssumeRole credentials for one or more target roles (the Identity
+Center management role, per-account management roles, ...) fresh in the
+background so request threads never wait on an STS round trip.
+
+How it works:
+- Each (role_arn, session_name, external_id) is registered once and gets an
+  entry holding an immutable credentials snapshot.
+- A single daemon thread refreshes every entry ahead of expiry (default:
+  10 minutes before, or half the session lifetime for short sessions).
+- Readers fetch the current snapshot without taking a lock; the refresher
+  swaps the snapshot reference atomically.
+- If a refresh fails, the previous credentials keep being served until they
+  actually expire while the refresher retries with backoff.
+
+Only the very first lookup of a role that has never been fetched waits, and
+it waits on the refresher (bounded by `initial_wait_seconds`), not on STS
+while holding a shared lock. Call `register()` at startup to prime roles.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable
+
+
+class _RoleEntry:
+    __slots__ = ("role_arn", "session_name", "external_id", "snapshot", "next_refresh", "failures", "last_error", "ready")
+
+    def __init__(self, role_arn: str, session_name: str, external_id: str):
+        self.role_arn = role_arn
+        self.session_name = session_name
+        self.external_id = external_id
+        # (access_key, secret_key, session_token, exp_epoch) or None
+        self.snapshot = None
+        self.next_refresh = 0.0
+        self.failures = 0
+        self.last_error = ""
+        self.ready = threading.Event()
+
+
+class AssumedRoleCredentialProvider:
+    def __init__(
+        self,
+        sts_client_factory: Callable,
+        *,
+        refresh_margin_seconds: float = 600,
+        retry_base_seconds: float = 5,
+        retry_max_seconds: float = 120,
+        initial_wait_seconds: float = 10,
+        duration_seconds: int | None = None,
+    ):
+        self._sts_client_factory = sts_client_factory
+        self._refresh_margin = float(refresh_margin_seconds)
+        self._retry_base = float(retry_base_seconds)
+        self._retry_max = float(retry_max_seconds)
+        self._initial_wait = float(initial_wait_seconds)
+        self._duration_seconds = duration_seconds
+        self._entries: dict[tuple[str, str, str], _RoleEntry] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._thread_pid = 0
+        self._stopped = False
+
+    @staticmethod
+    def _key(role_arn: str, session_name: str = "", external_id: str = "") -> tuple[str, str, str]:
+        return (
+            str(role_arn or "").strip(),
+            str(session_name or "").strip() or "npam",
+            str(external_id or "").strip(),
+        )
+
+    def _ensure_thread(self) -> None:
+        # Gunicorn forks workers after import; a thread started in the parent
+        # does not exist in the child, so (re)start per process.
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread_pid = pid
+            self._thread = threading.Thread(target=self._run, name="assumed-role-refresher", daemon=True)
+            self._thread.start()
+
+    def register(self, role_arn: str, session_name: str = "", external_id: str = "") -> tuple[str, str, str]:
+        """Register a role for background refresh (idempotent). Returns the entry key."""
+        key = self._key(role_arn, session_name, external_id)
+        if not key[0]:
+            raise ValueError("role_arn is required")
+        entry = self._entries.get(key)
+        if entry is None:
+            with self._cond:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = _RoleEntry(*key)
+                    self._entries[key] = entry
+                    self._cond.notify_all()
+        self._ensure_thread()
+        return key
+
+    def get(self, role_arn: str, session_name: str = "", external_id: str = "") -> dict | None:
+        """
+        Return boto3 client kwargs for the role, or None when role_arn is empty.
+
+        Raises RuntimeError when no valid credentials are available (never
+        fetched successfully, or expired and every refresh has failed).
+        """
+        key = self._key(role_arn, session_name, external_id)
+        if not key[0]:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or self._thread is None or self._thread_pid != os.getpid():
+            self.register(*key)
+            entry = self._entries[key]
+
+        snap = entry.snapshot
+        if snap is None or snap[3] <= time.time():
+            if snap is None:
+                entry.ready.wait(self._initial_wait)
+            snap = entry.snapshot
+            if snap is None or snap[3] <= time.time():
+                detail = f": {entry.last_error}" if entry.last_error else ""
+                raise RuntimeError(f"No valid assumed-role credentials for {key[0]}{detail}")
+        return {
+            "aws_access_key_id": snap[0],
+            "aws_secret_access_key": snap[1],
+            "aws_session_token": snap[2],
+        }
+
+    def stats(self) -> list[dict]:
+        """Per-role refresh state (no secrets)."""
+        now = time.time()
+        out = []
+        for entry in list(self._entries.values()):
+            snap = entry.snapshot
+            out.append({
+                "role_arn": entry.role_arn,
+                "session_name": entry.session_name,
+                "has_credentials": snap is not None,
+                "expires_in_seconds": int(snap[3] - now) if snap else None,
+                "next_refresh_in_seconds": max(0, int(entry.next_refresh - now)),
+                "consecutive_failures": entry.failures,
+                "last_error": entry.last_error,
+            })
+        return out
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _assume(self, entry: _RoleEntry) -> tuple[str, str, str, float]:
+        params = {"RoleArn": entry.role_arn, "RoleSessionName": entry.session_name}
+        if entry.external_id:
+            params["ExternalId"] = entry.external_id
+        if self._duration_seconds:
+            params["DurationSeconds"] = int(self._duration_seconds)
+        now = time.time()
+        resp = self._sts_client_factory().assume_role(**params)
+        creds = (resp or {}).get("Credentials") or {}
+        access_key = str(creds.get("AccessKeyId") or "").strip()
+        secret_key = str(creds.get("SecretAccessKey") or "").strip()
+        session_token = str(creds.get("SessionToken") or "").strip()
+        if not (access_key and secret_key and session_token):
+            raise RuntimeError("AssumeRole returned empty credentials")
+        exp_epoch = now + 900
+        exp = creds.get("Expiration")
+        try:
+            if exp is not None:
+                exp_epoch = float(exp.timestamp())  # datetime from botocore
+        except Exception:
+            pass
+        return access_key, secret_key, session_token, exp_epoch
+
+    def _refresh(self, entry: _RoleEntry) -> None:
+        try:
+            snap = self._assume(entry)
+        except Exception as e:
+            entry.failures += 1
+            entry.last_error = str(e)
+            delay = min(self._retry_max, self._retry_base * (2 ** min(entry.failures - 1, 10)))
+            entry.next_refresh = time.time() + delay
+            print(f"AssumeRole refresh failed for {entry.role_arn} (attempt {entry.failures}): {e}", flush=True)
+            if entry.snapshot is None:
+                # Unblock first-time waiters so they fail fast instead of hanging.
+                entry.ready.set()
+            return
+        lifetime = max(0.0, snap[3] - time.time())
+        margin = min(self._refresh_margin, lifetime / 2)
+        entry.snapshot = snap
+        entry.failures = 0
+        entry.last_error = ""
+        entry.next_refresh = snap[3] - margin
+        entry.ready.set()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.time()
+                due = [e for e in self._entries.values() if e.next_refresh <= now]
+                if not due:
+                    upcoming = [e.next_refresh for e in self._entries.values()]
+                    timeout = (min(upcoming) - now) if upcoming else None
+                    self._cond.wait(timeout)
+                    continue
+            for entry in due:
+                self._refresh(entry)
@@ -14,9 +14,12 @@ def _ensure_audit_dir():
     os.makedirs(AUDIT_DIR, exist_ok=True)
 
 
-def log_db_query(user_email, request_id, role, query, allowed, rows_returned=None, error=None):
+def log_db_query(user_email, request_id, role, query, allowed, rows_returned=None, error=None, payload=None, metrics=None):
     """
     Append audit log entry. Immutable append-only.
+
+    metrics: optional execution telemetry stored next to the audit row
+    (see query_metrics / build_query_metrics).
     """
     _ensure_audit_dir()
     ts = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -39,12 +42,35 @@ def log_db_query(user_email, request_id, role, query, allowed, rows_returned=Non
             rows_returned=int(rows_returned) if rows_returned is not None else None,
             error=error,
             query=query,
-            payload={},
+            payload=payload or {},
+            metrics=metrics,
         )
     except Exception:
         pass
 
 
+def build_query_metrics(result, *, source, instance, db_name, queue_ms=None):
+    """Telemetry for one statement from an execute_query result / stream summary."""
+    result = result if isinstance(result, dict) else {}
+    timing = result.get('timing') or {}
+    rows = result.get('affected_rows')
+    if rows is None:
+        rows = result.get('row_count')
+    return {
+        'source': source,
+        'instance': instance,
+        'db_name': db_name,
+        'duration_ms': timing.get('duration_ms'),
+        'acquire_ms': timing.get('acquire_ms'),
+        'first_row_ms': timing.get('first_row_ms'),
+        'queue_ms': queue_ms,
+        'rows': rows,
+        'bytes': result.get('bytes'),
+        'truncated': bool(result.get('truncated')),
+        'error_class': result.get('error_class') or ('other' if result.get('error') else ''),
+    }
+
+
 def log_pam_action(actor_email, action, request_id=None, details=None, ip=None):
     """
     Audit log for PAM-sensitive actions: approve, deny, revoke, admin changes.
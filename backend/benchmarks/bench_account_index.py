@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the materialized account index (app._account_index).
+
+  python benchmarks/bench_account_index.py
+  python benchmarks/bench_account_index.py --accounts 2000 --iterations 50000
+
+Generates `--accounts` accounts in CONFIG['accounts'] (keyed by id, with OU
+paths and a mix of environments), org_policies.json overrides for some of
+them and hierarchy tags for roots, OUs and accounts. "legacy" is the
+per-call resolution this index replaced (policy file read, scan of
+CONFIG['accounts'], tag file read); "index" is _resolve_account_environment
+and _resolve_account_execution_plane.
+
+Correctness: both agree for every account and for unknown IDs, a hierarchy
+tag saved through the app and a replaced CONFIG['accounts'] show up on the
+next lookup.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-accounts-")
+atexit.register(shutil.rmtree, _TMP, True)
+_POLICIES = os.path.join(_TMP, "org_policies.json")
+
+os.environ["ORG_HIERARCHY_TAGS_PATH"] = os.path.join(_TMP, "org_hierarchy_tags.json")
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP, "pam_admins.json"))
+
+import app as npamx  # noqa: E402
+from config_registry import CONFIG_REGISTRY  # noqa: E402
+
+CONFIG_REGISTRY.register("org_policies", _POLICIES, lambda raw: raw if isinstance(raw, dict) else {})
+
+
+def legacy_resolve(account_id):
+    """_resolve_account_environment before the index (for timing only)."""
+    acct = str(account_id or "").strip()
+    if not acct:
+        return "nonprod"
+    try:
+        with open(_POLICIES) as f:
+            policies = json.load(f) or {}
+        env = ((policies.get("accounts") or {}).get(acct) or {}).get("environment")
+        if env:
+            return str(env).strip().lower()
+    except Exception:
+        pass
+    accounts_cfg = npamx.CONFIG.get("accounts") or {}
+    account_meta = (accounts_cfg.get(acct) or {})
+    if not account_meta and isinstance(accounts_cfg, dict):
+        for _, meta in accounts_cfg.items():
+            if str((meta or {}).get("id") or "").strip() == acct:
+                account_meta = meta or {}
+                break
+    for key in ("effective_environment", "environment", "source_environment"):
+        cfg_env = npamx._normalize_env_tag(account_meta.get(key))
+        if cfg_env:
+            return cfg_env
+    try:
+        with open(npamx.ORG_HIERARCHY_TAGS_PATH) as f:
+            tags = npamx._parse_org_hierarchy_tags(json.load(f))
+        env_from_tags = npamx._normalize_env_tag(npamx._effective_env_from_tags(
+            account_id=acct,
+            ou_chain=npamx._account_ou_chain_from_meta(account_meta),
+            root_id=str(account_meta.get("root_id") or "").strip(),
+            fallback="",
+            tags=tags,
+        ))
+        if env_from_tags:
+            return env_from_tags
+    except Exception:
+        pass
+    name = str(account_meta.get("name") or "").lower()
+    if "prod" in name or "production" in name:
+        return "prod"
+    if "sandbox" in name:
+        return "sandbox"
+    return "nonprod"
+
+
+def _generate(n: int, seed: int) -> list:
+    rng = random.Random(seed)
+    accounts = {}
+    for i in range(n):
+        acct = str(100000000000 + i)
+        ou_path = [f"ou-{i % 7}", f"ou-{i % 7}-{i % 31}"]
+        meta = {"id": acct, "name": rng.choice(["payments-prod", "data-dev", "sandbox-x", "shared"]) + f"-{i}",
+                "root_id": "r-root", "ou_path": ou_path}
+        if i % 4 == 0:
+            meta["environment"] = rng.choice(["prod", "nonprod", "sandbox"])
+        accounts[acct] = meta
+    # A few accounts keyed by alias rather than id, found through the 'id' scan.
+    for i in range(0, n, 50):
+        acct = str(100000000000 + i)
+        accounts[f"alias-{i}"] = accounts.pop(acct)
+    npamx.CONFIG["accounts"] = accounts
+    with open(_POLICIES, "w") as f:
+        json.dump({"accounts": {str(100000000000 + i): {"environment": "prod"} for i in range(0, n, 9)}}, f)
+    npamx._save_org_hierarchy_tags({
+        "roots": {"r-root": "nonprod"},
+        "ous": {"ou-3": "prod", "ou-5-12": "sandbox"},
+        "accounts": {str(100000000000 + i): "sandbox" for i in range(0, n, 13)},
+    })
+    return [str(100000000000 + i) for i in range(n)] + ["999999999999", ""]
+
+
+def check_correctness(ids: list) -> int:
+    failures = 0
+    for acct in ids:
+        legacy, indexed = legacy_resolve(acct), npamx._resolve_account_environment(acct)
+        plane = npamx._resolve_account_execution_plane(acct)
+        if legacy != indexed or plane != npamx._resolve_execution_plane(legacy):
+            failures += 1
+            print(f"FAIL {acct!r}: legacy={legacy} index={indexed} plane={plane}")
+
+    target = ids[1]
+    tags = npamx._load_org_hierarchy_tags()
+    tags["accounts"][target] = "sandbox"
+    npamx._save_org_hierarchy_tags(tags)
+    if npamx._resolve_account_environment(target) != legacy_resolve(target):
+        failures += 1
+        print("FAIL saved hierarchy tag not reflected")
+
+    npamx.CONFIG["accounts"] = dict(npamx.CONFIG["accounts"], **{"555555555555": {"id": "555555555555", "name": "core", "environment": "prod"}})
+    if npamx._resolve_account_environment("555555555555") != "prod":
+        failures += 1
+        print("FAIL replaced CONFIG['accounts'] not reflected")
+    print(f"correctness: {failures} failures over {len(ids)} accounts")
+    return failures
+
+
+def benchmark(ids: list, iterations: int, seed: int) -> None:
+    rng = random.Random(seed)
+    sample = [rng.choice(ids) for _ in range(iterations)]
+    npamx._invalidate_account_index()
+    start = time.perf_counter()
+    npamx._account_index()
+    print(f"index build: {len(ids)} accounts in {(time.perf_counter() - start) * 1000:.1f}ms")
+    for label, fn in (("legacy", legacy_resolve), ("index", npamx._resolve_account_environment)):
+        n = iterations if label == "index" else max(1, iterations // 20)
+        start = time.perf_counter()
+        for acct in sample[:n]:
+            fn(acct)
+        print(f"{label:<7} n={n:<7} {(time.perf_counter() - start) / n * 1e6:9.2f}us/lookup")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    ids = _generate(args.accounts, args.seed)
+    if not args.no_bench:
+        benchmark(ids, args.iterations, args.seed)
+    return 1 if check_correctness(ids) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
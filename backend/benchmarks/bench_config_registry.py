@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the JSON config registry (config_registry.py).
+
+  python benchmarks/bench_config_registry.py
+  python benchmarks/bench_config_registry.py --rules 50 --groups 500 --iterations 5000
+
+The workload is the access-rule check at the top of request_access: load the
+access rules, find the caller's local groups, then load the org policies.
+"legacy" re-opens and parses access_rules.json and org_policies.json per
+call and user_groups.json once per enabled rule, as before; "registry" reads
+the snapshots. Reported per check: file opens (counted by wrapping
+builtins.open) and mean time.
+
+Correctness: a file rewritten behind the registry's back is picked up on the
+next get(), a save through AccessRules is visible immediately, and snapshots
+reject mutation.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import builtins
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-config-")
+atexit.register(shutil.rmtree, _TMP, True)
+_RULES = os.path.join(_TMP, "access_rules.json")
+_GROUPS = os.path.join(_TMP, "user_groups.json")
+_POLICIES = os.path.join(_TMP, "org_policies.json")
+
+os.environ["LOCAL_USER_GROUPS_PATH"] = _GROUPS
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP, "pam_admins.json"))
+
+import access_rules  # noqa: E402
+import app as npamx  # noqa: E402
+from access_rules import AccessRules  # noqa: E402
+from config_registry import CONFIG_REGISTRY  # noqa: E402
+
+# Point the registered files at the generated ones.
+CONFIG_REGISTRY.register("access_rules", _RULES, access_rules._parse_rules)
+CONFIG_REGISTRY.register("org_policies", _POLICIES, lambda raw: raw if isinstance(raw, dict) else {})
+access_rules.RULES_PATH = _RULES
+
+
+def _write(path: str, data) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def _generate(rules: int, groups: int, members: int) -> None:
+    _write(_GROUPS, {"groups": [
+        {"id": f"group_{g}", "name": f"Group {g}", "members": [f"user{g * members + m}@example.com" for m in range(members)]}
+        for g in range(groups)
+    ]})
+    _write(_RULES, {"rules": [
+        {"id": f"rule_{r}", "enabled": True, "groups": [f"group_{(r * 7) % groups}"], "denied_services": ["iam"], "allowed_services": ["s3"]}
+        for r in range(rules)
+    ]})
+    _write(_POLICIES, {"accounts": {str(100000000000 + a): {"environment": "prod" if a % 3 == 0 else "nonprod"} for a in range(200)}})
+
+
+def legacy_check(user_email: str):
+    """request_access before the registry (for timing only)."""
+    with open(_RULES) as f:
+        rules = json.load(f)
+    matched = []
+    for rule in rules.get("rules", []):
+        if not rule.get("enabled"):
+            continue
+        with open(_GROUPS) as f:
+            groups_data = json.load(f)
+        user_groups = [g["id"] for g in groups_data["groups"] if user_email in g.get("members", [])]
+        if any(g in rule.get("groups", []) for g in user_groups):
+            matched.append(rule["id"])
+    with open(_POLICIES) as f:
+        json.load(f)
+    return matched
+
+
+def registry_check(user_email: str):
+    rules = AccessRules.get_rules()
+    user_groups = npamx._local_group_ids_for_member(user_email)
+    matched = [
+        rule["id"] for rule in rules.get("rules", [])
+        if rule.get("enabled") and any(g in rule.get("groups", []) for g in user_groups)
+    ]
+    npamx.load_org_policies()
+    return matched
+
+
+class _OpenCounter:
+    def __init__(self):
+        self.count = 0
+        self._open = builtins.open
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self._open(*args, **kwargs)
+
+    def __enter__(self):
+        builtins.open = self
+        return self
+
+    def __exit__(self, *exc):
+        builtins.open = self._open
+
+
+def check_correctness(users: list) -> int:
+    failures = 0
+    for user in users:
+        if legacy_check(user) != registry_check(user):
+            failures += 1
+            print(f"FAIL {user}: legacy={legacy_check(user)} registry={registry_check(user)}")
+
+    _write(_POLICIES, {"accounts": {"1": {"environment": "sandbox"}}, "marker": "x" * 7})
+    st = os.stat(_POLICIES)
+    os.utime(_POLICIES, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    if npamx.load_org_policies().get("marker") != "x" * 7:
+        failures += 1
+        print("FAIL out-of-band edit of org_policies.json not picked up")
+
+    before = len(AccessRules.get_rules()["rules"])
+    AccessRules.save_rule({"enabled": True, "groups": ["group_0"], "denied_services": ["ec2"]}, created_by="bench")
+    if len(AccessRules.get_rules()["rules"]) != before + 1:
+        failures += 1
+        print("FAIL saved rule not visible on the next get_rules()")
+
+    try:
+        AccessRules.get_rules()["rules"].append({})
+        failures += 1
+        print("FAIL snapshot accepted a mutation")
+    except TypeError:
+        pass
+    print(f"correctness: {failures} failures")
+    return failures
+
+
+def benchmark(users: list, iterations: int) -> None:
+    for label, fn in (("legacy", legacy_check), ("registry", registry_check)):
+        fn(users[0])  # warm
+        with _OpenCounter() as opens:
+            start = time.perf_counter()
+            for i in range(iterations):
+                fn(users[i % len(users)])
+            elapsed = time.perf_counter() - start
+        print(f"{label:<9} n={iterations:<6} opens/check={opens.count / iterations:6.2f} "
+              f"{elapsed / iterations * 1e6:9.1f}us/check")
+    print(f"registry loads: { {k: v['loads'] for k, v in CONFIG_REGISTRY.stats()['files'].items()} }")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=20)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    _generate(args.rules, args.groups, args.members)
+    CONFIG_REGISTRY.invalidate()
+    users = [f"user{i}@example.com" for i in range(0, args.groups * args.members, 37)] + ["nobody@example.com"]
+    if not args.no_bench:
+        benchmark(users, args.iterations)
+    return 1 if check_correctness(users) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
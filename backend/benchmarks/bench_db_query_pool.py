@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-query latency of database_manager.execute_query with and
+without the credential-scoped connection pool, against a local MySQL/MariaDB.
+
+  docker run -d --name bench-mysql -e MYSQL_ROOT_PASSWORD=root -p 3306:3306 mysql:8
+  python benchmarks/bench_db_query_pool.py --user root --password root --database mysql
+
+Add --ssl-ca <bundle> to include the TLS handshake in the unpooled numbers
+(closer to RDS + proxy in production).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import execute_query  # noqa: E402
+from db_connection_pool import DB_CONNECTION_POOLS  # noqa: E402
+
+
+def _run(label: str, args, pooled: bool) -> list[float]:
+    samples = []
+    ssl = {"ca": args.ssl_ca} if args.ssl_ca else None
+    extra = {"pool_owner": "bench", "pool_expires_at": time.time() + 3600} if pooled else {}
+    for i in range(args.iterations + args.warmup):
+        start = time.perf_counter()
+        result = execute_query(
+            host=args.host, port=args.port, username=args.user, password=args.password,
+            database=args.database, query=args.query, ssl=ssl, **extra,
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        if result.get("error"):
+            raise SystemExit(f"{label}: query failed: {result['error']}")
+        if i >= args.warmup:
+            samples.append(elapsed)
+    samples.sort()
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(f"{label:<10} n={len(samples)} mean={statistics.mean(samples):7.3f}ms p50={statistics.median(samples):7.3f}ms p95={p95:7.3f}ms")
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", default="mysql")
+    parser.add_argument("--query", default="SELECT 1")
+    parser.add_argument("--ssl-ca", default="")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    args = parser.parse_args()
+
+    unpooled = _run("unpooled", args, pooled=False)
+    pooled = _run("pooled", args, pooled=True)
+    print(f"pool stats: {DB_CONNECTION_POOLS.stats()}")
+    print(f"p50 speedup: {statistics.median(unpooled) / statistics.median(pooled):.2f}x")
+    DB_CONNECTION_POOLS.evict_owner("bench")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
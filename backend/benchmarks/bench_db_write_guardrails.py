@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the compiled database write guardrails
+(app._evaluate_db_write_guardrail).
+
+  python benchmarks/bench_db_write_guardrails.py
+  python benchmarks/bench_db_write_guardrails.py --rules 10000 --checks 50000
+
+Generates `--rules` databaseWriteControls rules over `--accounts` accounts
+and 20 instances each: instance-scoped, account-wide, instance-only and
+global rules, some disabled, some with allowed users or local / Identity
+Center groups. Identity Center group keys for the test users are seeded
+into IDENTITY_CACHE so no AWS call is made. "legacy" is the evaluator this
+replaced (re-normalize and scan every rule per check); "compiled" is the
+bucketed index.
+
+Correctness: both return the same decision, reason and matched rule count
+for every sampled request, and a saved guardrails file takes effect on
+the next check.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-guardrails-")
+atexit.register(shutil.rmtree, _TMP, True)
+_GUARDRAILS = os.path.join(_TMP, "guardrails_config.json")
+_GROUPS = os.path.join(_TMP, "user_groups.json")
+
+os.environ["GUARDRAILS_CONFIG_PATH"] = _GUARDRAILS
+os.environ["LOCAL_USER_GROUPS_PATH"] = _GROUPS
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP, "pam_admins.json"))
+
+import app as npamx  # noqa: E402
+from identity_cache import IDENTITY_CACHE, IdentityCache  # noqa: E402
+
+
+def legacy_evaluate(account_id, db_instance_id, user_email, perms):
+    """_evaluate_db_write_guardrail before compilation (for timing only)."""
+    if not npamx._is_db_write_request(perms):
+        return {"blocked": False, "reason": "", "matched_rules": 0}
+    with open(_GUARDRAILS) as f:
+        cfg = json.load(f)
+    rules = [npamx._normalize_db_write_rule(r) for r in (cfg.get("databaseWriteControls") or [])]
+    account_id = str(account_id or "").strip()
+    db_instance_id = str(db_instance_id or "").strip()
+    user_email_l = str(user_email or "").strip().lower()
+    matched_rules = []
+    for rule in rules:
+        if not rule.get("enabled") or not rule.get("block_write_actions"):
+            continue
+        r_acc, r_db = rule["account_id"], rule["db_instance_id"]
+        if (r_acc and r_acc != account_id) or (r_db and r_db != db_instance_id):
+            continue
+        matched_rules.append(rule)
+    if not matched_rules:
+        return {"blocked": False, "reason": "", "matched_rules": 0}
+    allowed_users = {em for r in matched_rules for em in r["allowed_users"] if em}
+    allowed_group_keys = {k for r in matched_rules for g in r["allowed_groups"] for k in (g["id"].lower(), g["name"].lower()) if k}
+    if user_email_l and user_email_l in allowed_users:
+        return {"blocked": False, "reason": "", "matched_rules": len(matched_rules)}
+    if allowed_group_keys:
+        if npamx._local_group_keys_for_user(user_email_l) & allowed_group_keys:
+            return {"blocked": False, "reason": "", "matched_rules": len(matched_rules)}
+        if npamx._identity_center_group_keys_for_user(user_email_l) & allowed_group_keys:
+            return {"blocked": False, "reason": "", "matched_rules": len(matched_rules)}
+    reason = next((r["reason"] for r in matched_rules if r["reason"]), "") or npamx._DB_WRITE_GUARDRAIL_DEFAULT_REASON
+    return {"blocked": True, "reason": reason, "matched_rules": len(matched_rules)}
+
+
+def _accounts(n: int) -> list:
+    return [str(200000000000 + i) for i in range(n)]
+
+
+def _generate(rules: int, accounts: int, users: list, seed: int) -> None:
+    rng = random.Random(seed)
+    accts = _accounts(accounts)
+    out = []
+    for i in range(rules):
+        kind = rng.random()
+        acct = rng.choice(accts) if kind < 0.995 else ""
+        db = f"db-{rng.randrange(20)}" if kind < 0.8 or 0.995 <= kind < 0.998 else ""
+        rule = {
+            "enabled": rng.random() > 0.1,
+            "blockWriteActions": rng.random() > 0.1,
+            "accountId": acct,
+            "dbInstanceId": db,
+            "reason": f"rule {i}" if rng.random() > 0.5 else "",
+        }
+        if rng.random() < 0.2:
+            rule["allowedUsers"] = [{"email": rng.choice(users).upper()}]
+        if rng.random() < 0.2:
+            g = rng.randrange(10)
+            rule["allowedGroups"] = [{"group_id": f"idc-{g}", "display_name": f"IDC Group {g}"} if rng.random() < 0.5 else f"local_{g}"]
+        out.append(rule)
+    with open(_GUARDRAILS, "w") as f:
+        json.dump({"databaseWriteControls": out}, f)
+    with open(_GROUPS, "w") as f:
+        json.dump({"groups": [{"id": f"local_{g}", "name": f"Local {g}", "members": users[g::10]} for g in range(10)]}, f)
+    for n, user in enumerate(users):
+        IDENTITY_CACHE.put(user, group_keys=[f"idc-{n % 10}", f"idc group {n % 10}"])
+
+
+def _requests(n: int, accounts: int, users: list, seed: int) -> list:
+    rng = random.Random(seed + 1)
+    accts = _accounts(accounts) + [""]
+    return [
+        (rng.choice(accts), rng.choice([f"db-{rng.randrange(20)}", ""]), rng.choice(users + [""]), ["UPDATE"])
+        for _ in range(n)
+    ]
+
+
+def check_correctness(requests: list) -> int:
+    failures = 0
+    for req in requests:
+        legacy, compiled = legacy_evaluate(*req), npamx._evaluate_db_write_guardrail(*req)
+        if legacy != compiled:
+            failures += 1
+            if failures <= 5:
+                print(f"FAIL {req}: legacy={legacy} compiled={compiled}")
+    with open(_GUARDRAILS, "w") as f:
+        json.dump({"databaseWriteControls": [{"enabled": True, "block_write_actions": True, "reason": "freeze"}]}, f)
+    npamx.CONFIG_REGISTRY.invalidate("guardrails")
+    if npamx._evaluate_db_write_guardrail("1", "db", "x@example.com", ["DELETE"]) != {"blocked": True, "reason": "freeze", "matched_rules": 1}:
+        failures += 1
+        print("FAIL saved guardrails not applied on the next check")
+    # Another gunicorn worker's cache (same NpamxStore) drops group keys invalidated here.
+    other = IdentityCache()
+    other.attach(npamx.STORE, check_seconds=0)
+    other.put("user0@example.com", group_keys=frozenset({"idc-0"}))
+    other.put("user1@example.com", group_keys=frozenset({"idc-1"}))
+    IDENTITY_CACHE.invalidate(email="user0@example.com")
+    if other.lookup("user0@example.com", "group_keys") is not None or other.lookup("user1@example.com", "group_keys") is None:
+        failures += 1
+        print("FAIL invalidate() not applied (only) to that user in the other worker")
+    IDENTITY_CACHE.clear()
+    if other.lookup("user1@example.com", "group_keys") is not None:
+        failures += 1
+        print("FAIL clear() not applied in the other worker")
+    print(f"correctness: {failures} failures over {len(requests)} requests")
+    return failures
+
+
+def benchmark(requests: list, checks: int) -> None:
+    start = time.perf_counter()
+    npamx._db_write_guardrail_buckets()
+    print(f"compile: {len(npamx._DB_WRITE_GUARDRAIL_INDEX['entry'][1])} buckets in {(time.perf_counter() - start) * 1000:.1f}ms")
+    for label, fn, n in (("legacy", legacy_evaluate, max(1, checks // 100)), ("compiled", npamx._evaluate_db_write_guardrail, checks)):
+        samples = []
+        for i in range(n):
+            t0 = time.perf_counter()
+            fn(*requests[i % len(requests)])
+            samples.append((time.perf_counter() - t0) * 1e6)
+        samples.sort()
+        print(f"{label:<9} n={n:<7} mean={sum(samples) / n:9.1f}us p99={samples[int(n * 0.99) - 1 if n >= 100 else -1]:9.1f}us")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=5000)
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    users = [f"user{i}@example.com" for i in range(100)]
+    _generate(args.rules, args.accounts, users, args.seed)
+    requests = _requests(2000, args.accounts, users, args.seed)
+    if not args.no_bench:
+        benchmark(requests, args.checks)
+    return 1 if check_correctness(requests) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark the PAM admin authorization check behind enforce_admin_api_access.
+
+  python benchmarks/bench_pam_admin_auth.py
+  python benchmarks/bench_pam_admin_auth.py --admins 500 --iterations 5000
+
+Compares the previous path (read + normalize pam_admins.json, write it back,
+linear scan on every request) against the in-memory admin index, for an
+exact email hit, a local-part (NameID) hit and a non-admin miss. Runs against
+a temporary PAM_ADMINS_PATH; nothing outside it is modified.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-bench-")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ["PAM_ADMINS_PATH"] = os.path.join(_TMP, "pam_admins.json")
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+
+import app as npamx  # noqa: E402
+
+
+def _legacy_record(email: str, nameid: str):
+    """The per-request load/normalize/save + linear scan this index replaced (for timing only)."""
+    with open(npamx.PAM_ADMINS_PATH) as f:
+        admins = npamx._normalize_pam_admins(json.load(f))
+    with open(npamx.PAM_ADMINS_PATH, "w") as f:
+        json.dump({"pam_admins": admins}, f, indent=2)
+    em = email.lower()
+    for a in admins:
+        if a["email"] == em:
+            return a
+    local = npamx._identity_local_part(nameid or email)
+    matches = [a for a in admins if npamx._identity_local_part(a["email"]) == local]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _indexed_record(email: str, nameid: str):
+    return npamx._pam_admin_record_for_identity(email=email, nameid=nameid)
+
+
+def _time(fn, args, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--admins", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    admins = [{"email": f"admin{i:05d}@example.com", "role": "Admin" if i % 3 else "Manager"} for i in range(args.admins)]
+    npamx._save_pam_admins(admins)
+    last = admins[-1]["email"]
+    cases = (
+        ("email hit", (last, last)),
+        ("nameid hit", ("", last.split("@")[0])),
+        ("miss", ("someone@example.com", "someone@example.com")),
+    )
+    failures = 0
+    with npamx.app.test_request_context():
+        for label, case in cases:
+            if _legacy_record(*case) != _indexed_record(*case):
+                failures += 1
+                print(f"MISMATCH {label}: legacy={_legacy_record(*case)} indexed={_indexed_record(*case)}")
+            for impl, fn in (("legacy", _legacy_record), ("index", _indexed_record)):
+                samples = _time(fn, case, args.iterations)
+                p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+                print(f"{impl:<6} {label:<10} admins={args.admins} n={len(samples)} mean={statistics.mean(samples):8.1f}us "
+                      f"p50={statistics.median(samples):8.1f}us p95={p95:8.1f}us")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the policy decision point (policy_engine.POLICY_ENGINE).
+
+  python benchmarks/bench_policy_engine.py
+  python benchmarks/bench_policy_engine.py --rules 20000 --patterns 5000 --decisions 20000
+
+Synthetic corpus: `--rules` access rules over `--groups` groups,
+org_policies.json with `--accounts` accounts and 50 roles with forbidden
+action substrings, and a policy template whose levels carry `--patterns`
+action patterns (exact names, `prefix*` and `*infix*` globs).
+
+"legacy" is the chain of evaluators the engine replaced: the AccessRules
+scan (rules file read per call), EnforcementEngine.enforce_policy over
+org_policies.json read per call, the list-based StrictPolicies action
+checks, duration and approval, and the template check with a regex per
+pattern per action. "engine" is one POLICY_ENGINE.decide() over all stages.
+
+Correctness: both chains reach the same outcome (denying stage, message,
+violations, approval, template allow/deny split) for every sampled request;
+POST /api/request-access (app.request_access, which now asks the engine)
+stores an allowed request with the engine's effect and violations and
+rejects a blocked one.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-policy-")
+atexit.register(shutil.rmtree, _TMP, True)
+_RULES = os.path.join(_TMP, "access_rules.json")
+_POLICIES = os.path.join(_TMP, "org_policies.json")
+_STRICT = os.path.join(_TMP, "policy_config.json")
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP, "pam_admins.json"))
+
+import access_rules  # noqa: E402
+from config_registry import CONFIG_REGISTRY  # noqa: E402
+from enforcement_engine import EnforcementEngine  # noqa: E402
+from policy_engine import POLICY_ENGINE  # noqa: E402
+from policy_template_engine import PolicyTemplateEngine  # noqa: E402
+from strict_policies import StrictPolicies  # noqa: E402
+
+CONFIG_REGISTRY.register("access_rules", _RULES, access_rules._parse_rules)
+CONFIG_REGISTRY.register("org_policies", _POLICIES, lambda raw: raw if isinstance(raw, dict) else {})
+CONFIG_REGISTRY.register("strict_policies", _STRICT, StrictPolicies._parse_config)
+
+SERVICES = ["ec2", "s3", "rds", "lambda", "logs", "dynamodb", "sqs", "sns", "kms", "iam", "ssm", "ecs"]
+VERBS = ["Describe", "List", "Get", "Put", "Update", "Delete", "Create", "Start", "Stop", "Terminate", "Invoke", "Attach"]
+
+
+# ----------------------------------------------------------------------
+# Previous evaluators (for timing only)
+# ----------------------------------------------------------------------
+
+def _legacy_matches(action, pattern):
+    return re.match(f"^{pattern.replace('*', '.*')}$", action) is not None
+
+
+def legacy_validate_actions(actions, account_environment):
+    if not actions or not isinstance(actions, list):
+        return False, "Actions must be a non-empty list", None
+    with open(_STRICT) as f:
+        cfg = {**StrictPolicies._default_config, **json.load(f)}
+    for action in actions:
+        action_lower = action.lower()
+        if action in StrictPolicies.ALWAYS_FORBIDDEN_ACTIONS:
+            if any(w in action_lower for w in ["create", "runinstances"]):
+                return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", f"Infrastructure provisioning requests should be submitted through DevOps. Please contact {cfg['contact_emails']['create']} or create a JIRA ticket."
+            if "iam:" in action_lower or "assumerole" in action_lower:
+                return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", f"IAM and security actions require special approval. Please contact {cfg['contact_emails']['iam']}."
+            return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", None
+        if action in StrictPolicies.CONFIGURABLE_DELETE_ACTIONS:
+            is_prod = account_environment in ["prod", "production"]
+            if is_prod and not cfg["allow_delete_prod"]:
+                return False, "❌ Delete actions disabled in production", f"Delete actions in production require special approval. Please contact {cfg['contact_emails']['delete']} for L3-Delete permission set requests."
+            if not is_prod and not cfg["allow_delete_nonprod"]:
+                return False, "❌ Delete actions disabled", f"Delete actions are currently disabled. Please contact {cfg['contact_emails']['delete']} for delete permission requests."
+        if "*" in action:
+            if not any(p in action_lower for p in ["get", "list", "describe", "read", "view", "fetch", "query", "scan"]):
+                return False, f"❌ POLICY VIOLATION: Wildcard action '{action}' is not allowed for write operations", None
+        if any(f in action_lower for f in ["createuser", "createrole", "attachpolicy"]):
+            return False, f"❌ POLICY VIOLATION: Action '{action}' can lead to privilege escalation", None
+    return True, None, None
+
+
+def legacy_template(org_id, user_role, user_team, actions, env):
+    template = PolicyTemplateEngine.get_template(org_id)
+    config = template["config"]
+    level_config = PolicyTemplateEngine.map_user_to_level(org_id, user_role, user_team)["config"]
+    global_deny = config.get("global_guardrails", {}).get("always_deny", [])
+    allowed, denied = [], []
+    for action in actions:
+        if any(_legacy_matches(action, p) for p in global_deny) or any(_legacy_matches(action, p) for p in level_config.get("denied_actions", [])):
+            denied.append(action)
+        elif any(_legacy_matches(action, p) for p in level_config.get("allowed_actions", [])):
+            allowed.append(action)
+        else:
+            denied.append(action)
+    approval = level_config.get("requires_approval", False)
+    if (config.get("account_classifications", {}).get(env) or {}).get("requires_dual_approval"):
+        approval = True
+    return len(allowed) > 0, allowed, denied, approval
+
+
+def legacy_decide(ctx):
+    with open(_RULES) as f:
+        rules = json.load(f)
+    use_case = ctx["use_case"].lower()
+    for rule in rules.get("rules", []):
+        if not rule.get("enabled"):
+            continue
+        if any(g in rule.get("groups", []) for g in ctx["user_groups"]):
+            for denied in rule.get("denied_services", []):
+                if denied in use_case:
+                    return ("access_rules", f"❌ Access Denied\n\nYour group is restricted from requesting {denied.upper()} access.\n\nAllowed services: {', '.join([s.upper() for s in rule.get('allowed_services', [])])}\n\nContact your administrator for access to other services.")
+    with open(_POLICIES) as f:
+        org = json.load(f)
+    allowed, violations, _action = EnforcementEngine.enforce_policy(ctx, org)
+    if not allowed:
+        return ("org_policies", violations)
+    actions = ctx["ai_permissions"]["actions"]
+    ok, error, guidance = legacy_validate_actions(actions, ctx["account_env"])
+    if not ok:
+        return ("strict_actions", error, guidance)
+    ok, error = StrictPolicies.validate_duration(ctx["duration_hours"], ctx["account_env"])
+    if not ok:
+        return ("duration", error)
+    required, approval_type = StrictPolicies.requires_approval(actions, ctx["account_env"])
+    ok, t_allowed, t_denied, t_required = legacy_template(ctx["org_id"], ctx["user_role"], ctx["user_team"], actions, ctx["account_env"])
+    if not ok:
+        return ("template", t_denied)
+    return ("", violations, required or t_required, approval_type, t_allowed, t_denied)
+
+
+def engine_decide(ctx):
+    d = POLICY_ENGINE.decide(ctx, stages=("access_rules", "org_policies", "strict_actions", "duration", "approval", "template"))
+    if d["stage"] == "access_rules":
+        return ("access_rules", d["error"])
+    if d["stage"] == "org_policies":
+        return ("org_policies", d["violations"])
+    if d["stage"] == "strict_actions":
+        return ("strict_actions", d["error"], d["guidance"])
+    if d["stage"] == "duration":
+        return ("duration", d["error"])
+    template = d["trace"][-1]["detail"]
+    if d["stage"] == "template":
+        return ("template", template["denied"])
+    return ("", d["violations"], d["approval_required"], d["approval_type"], template["allowed"], template["denied"])
+
+
+# ----------------------------------------------------------------------
+# Corpus
+# ----------------------------------------------------------------------
+
+def _generate(args, rng) -> str:
+    groups = [f"group_{g}" for g in range(args.groups)]
+    rules = []
+    for i in range(args.rules):
+        rules.append({
+            "id": f"rule_{i}",
+            "enabled": rng.random() > 0.1,
+            "groups": rng.sample(groups, 2),
+            "denied_services": rng.sample(SERVICES, 1) if rng.random() < 0.05 else [f"svc{i}"],
+            "allowed_services": rng.sample(SERVICES, 2),
+        })
+    with open(_RULES, "w") as f:
+        json.dump({"rules": rules}, f)
+
+    roles = {f"role_{r}": {"forbidden_actions": [f"{rng.choice(SERVICES)}:{rng.choice(VERBS).lower()}{k}" for k in range(30)] + (["kms:"] if r % 5 == 0 else [])} for r in range(50)}
+    accounts = {str(300000000000 + a): {"environment": rng.choice(["prod", "nonprod"]), "jit_required": rng.random() < 0.05, "max_duration_hours": rng.choice([8, 24, 120])} for a in range(args.accounts)}
+    with open(_POLICIES, "w") as f:
+        json.dump({"accounts": accounts, "roles": roles, "environments": {"prod": {"allow_delete": False}, "nonprod": {"allow_delete": True}},
+                   "contacts": {"delete_operations": "security@example.com"}}, f)
+    with open(_STRICT, "w") as f:
+        json.dump({"allow_delete_nonprod": True}, f)
+
+    def patterns(n):
+        out = []
+        for k in range(n):
+            svc, verb = rng.choice(SERVICES), rng.choice(VERBS)
+            kind = rng.random()
+            out.append(f"{svc}:{verb}{k}" if kind < 0.6 else f"{svc}:{verb}*" if kind < 0.9 else f"*{verb}{k}*")
+        return out
+
+    template = {
+        "name": "Bench Policy",
+        "levels": {level: {"allowed_actions": patterns(args.patterns), "denied_actions": patterns(max(1, args.patterns // 10)), "requires_approval": level != "L1"} for level in ("L1", "L2", "L3")},
+        "global_guardrails": {"always_deny": ["iam:*", "organizations:*"] + patterns(50)},
+        "account_classifications": {"prod": {"requires_dual_approval": True}},
+    }
+    org_id = "bench"
+    PolicyTemplateEngine.create_template(org_id, template)
+    return org_id
+
+
+def _requests(args, org_id, rng) -> list:
+    out = []
+    for _ in range(2000):
+        actions = [f"{rng.choice(SERVICES)}:{rng.choice(VERBS)}{rng.randrange(args.patterns)}" for _ in range(rng.randint(1, 6))]
+        if rng.random() < 0.1:
+            actions.append(rng.choice(["s3:DeleteObject", "iam:CreateUser", "ec2:Describe*", "s3:Put*"]))
+        out.append({
+            "user_groups": [f"group_{rng.randrange(args.groups)}" for _ in range(3)],
+            "use_case": f"need {rng.choice(SERVICES)} access for svc{rng.randrange(args.rules * 2)} debugging",
+            "account_id": str(300000000000 + rng.randrange(args.accounts)),
+            "account_env": rng.choice(["prod", "nonprod", "sandbox"]),
+            "is_jit": rng.random() < 0.5,
+            "duration_hours": rng.choice([2, 8, 24, 200]),
+            "user_role": f"role_{rng.randrange(60)}",
+            "user_team": rng.choice(["devops", "developers", "platform"]),
+            "org_id": org_id,
+            "ai_permissions": {"actions": actions},
+        })
+    return out
+
+
+def check_correctness(requests: list) -> int:
+    failures, stages = 0, {}
+    for ctx in requests:
+        legacy, engine = legacy_decide(ctx), engine_decide(ctx)
+        stages[legacy[0] or "allow"] = stages.get(legacy[0] or "allow", 0) + 1
+        if legacy != engine:
+            failures += 1
+            if failures <= 5:
+                print(f"FAIL {ctx['use_case']!r}: legacy={legacy!r:.200} engine={engine!r:.200}")
+    print(f"outcomes: {stages}")
+    print(f"correctness: {failures} failures over {len(requests)} requests")
+    return failures
+
+
+def check_request_access() -> int:
+    """Drive POST /api/request-access through the Flask handler: one allowed, one blocked request."""
+    import app as npamx  # here, after the synthetic checks: importing app re-points the config registry
+
+    from flask import session
+
+    failures = 0
+    allowed, capped = "300000000001", "300000000002"
+    policies = os.path.join(_TMP, "org_policies_endpoint.json")
+    with open(policies, "w") as f:
+        json.dump({"accounts": {capped: {"environment": "nonprod", "max_duration_hours": 2}}}, f)
+    CONFIG_REGISTRY.register("org_policies", policies, lambda raw: raw if isinstance(raw, dict) else {})
+    npamx.CONFIG["accounts"] = {a: {"id": a, "name": "Sandbox"} for a in (allowed, capped)}
+    arn = "arn:aws:sso:::permissionSet/ReadOnlyAccess"
+    npamx.CONFIG["permission_sets"] = [{"name": "ReadOnlyAccess", "arn": arn}]
+
+    def submit(account):
+        body = {"account_id": account, "permission_set": arn, "duration_hours": 4, "justification": "investigate incident"}
+        with npamx.app.test_request_context("/api/request-access", method="POST", json=body):
+            session["user"] = "alice@example.com"
+            resp = npamx.app.make_response(npamx.request_access())
+            return resp.status_code, resp.get_json() or {}
+
+    status, data = submit(allowed)
+    stored = npamx.requests_db.get(data.get("request_id") or "")
+    if status != 200 or stored is None:
+        failures += 1
+        print(f"FAIL request-access allowed request: {status} {data}")
+    elif (stored.get("enforcement_action"), stored.get("policy_violations"), stored.get("status")) != ("ALLOW", [], "pending"):
+        failures += 1
+        print(f"FAIL request-access stored {stored.get('enforcement_action')!r} {stored.get('policy_violations')!r} {stored.get('status')!r}")
+
+    status, data = submit(capped)
+    if status != 403 or [v["rule"] for v in data.get("violations") or []] != ["MAX_DURATION_EXCEEDED"]:
+        failures += 1
+        print(f"FAIL request-access blocked request: {status} {data}")
+    print(f"request-access: {failures} failures")
+    return failures
+
+
+def benchmark(requests: list, decisions: int) -> None:
+    CONFIG_REGISTRY.invalidate("access_rules")
+    start = time.perf_counter()
+    POLICY_ENGINE.compiled()
+    print(f"compile: {(time.perf_counter() - start) * 1000:.1f}ms")
+    for label, fn, n in (("legacy", legacy_decide, max(1, decisions // 50)), ("engine", engine_decide, decisions)):
+        samples = []
+        for i in range(n):
+            t0 = time.perf_counter()
+            fn(requests[i % len(requests)])
+            samples.append((time.perf_counter() - t0) * 1e6)
+        samples.sort()
+        print(f"{label:<7} n={n:<6} p50={statistics.median(samples):9.1f}us p99={samples[max(0, int(n * 0.99) - 1)]:9.1f}us")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=1000)
+    parser.add_argument("--accounts", type=int, default=5000)
+    parser.add_argument("--patterns", type=int, default=2000)
+    parser.add_argument("--decisions", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    org_id = _generate(args, rng)
+    requests = _requests(args, org_id, rng)
+    failures = check_correctness(requests)
+    if not args.no_bench:
+        benchmark(requests, args.decisions)
+    failures += check_request_access()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
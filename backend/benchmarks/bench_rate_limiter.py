@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the GCRA rate limiter (rate_limiter.py) used by
+security.init_rate_limit.
+
+  python benchmarks/bench_rate_limiter.py
+  python benchmarks/bench_rate_limiter.py --keys 10000 --requests 200000 --threads 8
+
+Correctness: a burst of exactly `max_requests` is admitted, the next request
+is limited with a positive retry_after, two limiter instances on one SQLite
+file share state (as two gunicorn workers would), and idle keys are evicted.
+
+Benchmark: per-request overhead at `--keys` distinct keys (each request
+picks a random key, limit 200/min, as for the per-IP global limit) and for
+one hot key, for the previous timestamp-list limiter, the striped in-memory
+GCRA limiter and the SQLite-backed one, single-threaded and with `--threads`
+threads, plus the in-memory state size.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rate_limiter import MemoryRateLimiter, SQLiteRateLimiter  # noqa: E402
+
+
+class LegacyRateLimiter:
+    """The timestamp-list limiter this module replaced (for timing only)."""
+
+    def __init__(self):
+        self._store = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def check(self, key, max_requests, window_seconds):
+        now = time.time()
+        with self._lock:
+            times = self._store[key]
+            times[:] = [t for t in times if now - t < window_seconds]
+            if len(times) >= max_requests:
+                return False, 1.0
+            times.append(now)
+        return True, 0.0
+
+
+def check_correctness(sqlite_path: str) -> int:
+    failures = 0
+    for label, limiter in (("memory", MemoryRateLimiter(stripes=4)), ("sqlite", SQLiteRateLimiter(sqlite_path))):
+        results = [limiter.check("burst", 10, 60)[0] for _ in range(10)]
+        allowed, retry_after = limiter.check("burst", 10, 60)
+        if not all(results) or allowed or retry_after <= 0:
+            failures += 1
+            print(f"FAIL {label}: burst={results} eleventh allowed={allowed} retry_after={retry_after:.2f}")
+    a, b = SQLiteRateLimiter(sqlite_path), SQLiteRateLimiter(sqlite_path)
+    shared = [a.check("shared", 4, 60)[0] for _ in range(2)] + [b.check("shared", 4, 60)[0] for _ in range(3)]
+    if shared != [True, True, True, True, False]:
+        failures += 1
+        print(f"FAIL sqlite shared state across instances: {shared}")
+    m = MemoryRateLimiter(stripes=1, sweep_interval=0)
+    m.check("idle", 100, 0.01)
+    time.sleep(0.02)
+    m.check("other", 100, 60)
+    if m.stats()["keys"] != 1:
+        failures += 1
+        print(f"FAIL idle key not evicted: {m.stats()}")
+    print(f"correctness: {failures} failures")
+    return failures
+
+
+def _run(limiter, keys: list, requests: int, threads: int, seed: int) -> float:
+    per_thread = requests // threads
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        check = limiter.check
+        for _ in range(per_thread):
+            check(rng.choice(keys), 200, 60)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return (time.perf_counter() - start) / (per_thread * threads) * 1e6
+
+
+def _state_kib(factory, keys: list) -> float:
+    limiter = factory()
+    tracemalloc.start()
+    for key in keys:
+        for _ in range(5):
+            limiter.check(key, 200, 60)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return mem / 1024
+
+
+def benchmark(args, sqlite_path: str) -> None:
+    keys = [f"global:10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(args.keys)]
+    factories = (
+        ("legacy", LegacyRateLimiter),
+        ("gcra", MemoryRateLimiter),
+        ("sqlite", lambda: SQLiteRateLimiter(sqlite_path)),
+    )
+    for label, factory in factories:
+        requests = args.requests if label != "sqlite" else max(args.threads, args.requests // 10)
+        for scenario, scenario_keys in ((f"keys={args.keys}", keys), ("hot key", keys[:1])):
+            for threads in (1, args.threads):
+                us = _run(factory(), scenario_keys, requests, threads, args.seed)
+                print(f"{label:<7} {scenario:<11} threads={threads:<2} n={requests:<7} {us:7.2f}us/request")
+        if label != "sqlite":
+            print(f"{label:<7} state for {args.keys} keys x 5 requests: {_state_kib(factory, keys):.0f} KiB")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="npamx-ratelimit-") as tmp:
+        failures = check_correctness(os.path.join(tmp, "check.db"))
+        if not args.no_bench:
+            benchmark(args, os.path.join(tmp, "bench.db"))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark the indexed request store (request_repository.RequestRepository).
+
+  python benchmarks/bench_request_repository.py
+  python benchmarks/bench_request_repository.py --requests 250000 --users 5000
+
+Generates `--requests` requests over `--users` users, most of them closed
+history (expired, revoked, denied) and a small open set (pending, approved,
+active), in the shapes app.py stores: database_access, instance_access and
+account access requests. "scan" is the full requests_db pass each listing
+used to make; "index" is the repository query the listing now uses.
+
+Correctness: every listing returns the same rows in the same order as the
+scan; after random in-place updates (status, approvals, expiry, owner,
+deletes) every index matches a from-scratch rebuild; /api/admin/analytics
+returns the same numbers as the old implementation (users compared
+case-insensitively, as the user index does).
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-requests-")
+atexit.register(shutil.rmtree, _TMP, True)
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP, "pam_admins.json"))
+
+import app as npamx  # noqa: E402
+from request_repository import RequestRepository  # noqa: E402
+
+CLOSED = ["expired", "EXPIRED", "revoked", "denied", "rejected", "failed"]
+OPEN = ["pending", "approved", "active", "auto_approved"]
+
+
+def _generate(n: int, users: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    now = datetime.now()
+    out = {}
+    for i in range(n):
+        open_ = rng.random() < 0.03
+        status = rng.choice(OPEN) if open_ else rng.choice(CLOSED)
+        created = now - timedelta(days=rng.uniform(0, 2 if open_ else 720))
+        expires = created + timedelta(hours=rng.choice([1, 4, 8, 72]))
+        kind = rng.random()
+        req = {
+            "id": f"req-{i}",
+            "user_email": f"user{rng.randrange(users)}@example.com",
+            "status": status,
+            "created_at": created.isoformat(),
+            "expires_at": expires.isoformat(),
+            "account_id": str(100000000000 + rng.randrange(300)),
+            "approval_required": rng.choice([["manager"], ["security_lead"], ["self"], ["manager", "security_lead"]]),
+        }
+        if kind < 0.5:
+            req.update(type="database_access", db_instance_id=f"db-{rng.randrange(200)}", databases=[{"name": "app", "engine": "mysql"}])
+        elif kind < 0.7:
+            req.update(type="instance_access", instance_id=f"i-{rng.randrange(1000)}", instances=[], username=f"u{i}", user_created=True)
+        else:
+            req.update(permission_set=rng.choice(["ReadOnlyAccess", "PowerUser", "AdministratorAccess", "custom-admin-db"]))
+        if rng.random() < 0.01:
+            req["user_email"] = req["user_email"].upper()
+        out[req["id"]] = req
+    return out
+
+
+# ----------------------------------------------------------------------
+# Listings: the scan each one used to do (for timing only) and the index query now used
+# ----------------------------------------------------------------------
+
+def _listings(users: int):
+    now = datetime.now()
+    me = "user7@example.com"
+
+    def expired(r):
+        return npamx._is_db_request_expired(r, now=now)
+
+    return {
+        "my requests": (
+            lambda db: [rid for rid, r in db.items() if (r.get("user_email") or "").strip().lower() == me],
+            lambda repo: [rid for rid, _ in repo.select(user=me)],
+        ),
+        "my db requests": (
+            lambda db: [rid for rid, r in db.items() if r.get("type") == "database_access" and str(r.get("user_email") or "").strip().lower() == me],
+            lambda repo: [rid for rid, _ in repo.select(type="database_access", user=me)],
+        ),
+        "approved dbs": (
+            lambda db: [rid for rid, r in db.items() if r.get("type") == "database_access" and str(r.get("user_email") or "").strip().lower() == me
+                        and str(r.get("status") or "").lower() in ("active", "approved") and not expired(r)],
+            lambda repo: [rid for rid, r in repo.select(type="database_access", user=me, status=("active", "approved")) if not expired(r)],
+        ),
+        "active db sessions": (
+            lambda db: [rid for rid, r in db.items() if r.get("type") == "database_access" and str(r.get("status") or "").strip().lower() == "active" and not expired(r)],
+            lambda repo: [rid for rid, r in repo.select(type="database_access", status="active") if not expired(r)],
+        ),
+        "pending for manager": (
+            lambda db: [rid for rid, r in db.items() if r.get("status") == "pending" and "manager" in [str(x).lower() for x in r.get("approval_required") or []]],
+            lambda repo: [rid for rid, r in repo.select(status="pending", approver="manager") if r.get("status") == "pending"],
+        ),
+        "cleanup: expired db": (
+            lambda db: [rid for rid, r in db.items() if r.get("type") == "database_access" and str(r.get("status") or "").lower() in ("active", "approved")
+                        and r.get("expires_at") and datetime.fromisoformat(r["expires_at"]) <= now],
+            lambda repo: [rid for rid, _ in repo.expiring(now, type="database_access", status=("active", "approved"))],
+        ),
+        "cleanup: expired instances": (
+            lambda db: [rid for rid, r in db.items() if "instance_id" in r and r.get("expires_at") and datetime.fromisoformat(r["expires_at"]) <= now
+                        and r.get("status") == "auto_approved" and r.get("user_created")],
+            lambda repo: [rid for rid, r in repo.expiring(now, status="auto_approved") if "instance_id" in r and r.get("status") == "auto_approved" and r.get("user_created")],
+        ),
+    }
+
+
+def legacy_analytics(db: dict) -> dict:
+    """get_admin_analytics before the indexes (for timing only)."""
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    first = {}
+    for req in db.values():
+        email = req["user_email"].strip().lower()
+        d = datetime.fromisoformat(req["created_at"].replace("Z", "+00:00"))
+        if email not in first or d < first[email]:
+            first[email] = d
+    counts = {}
+    for req in db.values():
+        email = req["user_email"].strip().lower()
+        counts[email] = counts.get(email, 0) + 1
+    exceptional = {req["user_email"].strip().lower() for req in db.values() if "admin" in (req.get("permission_set") or "").lower()}
+    return {
+        "new_users": sum(1 for d in first.values() if d >= thirty_days_ago),
+        "repeated_users": sum(1 for c in counts.values() if c > 3),
+        "exceptional_users": len(exceptional),
+        "pending_approvals": len([r for r in db.values() if r["status"] == "pending"]),
+    }
+
+
+def _indexed_analytics() -> dict:
+    with npamx.app.test_request_context("/api/admin/analytics"):
+        data = npamx.get_admin_analytics().get_json()
+    return {k: data[k] for k in ("new_users", "repeated_users", "exceptional_users", "pending_approvals")}
+
+
+def _rebuilt(repo: RequestRepository) -> RequestRepository:
+    return RequestRepository({rid: dict(r) for rid, r in repo.items()})
+
+
+def _index_state(repo: RequestRepository):
+    return repo._index, sorted(repo._keys.items()), [(d, rid) for d, _, rid in repo._expires], [(d, rid) for d, _, rid in repo._created]
+
+
+def check_correctness(data: dict, users: int, seed: int) -> int:
+    failures = 0
+    repo = RequestRepository(data)
+    for name, (scan, query) in _listings(users).items():
+        if scan(data) != query(repo):
+            failures += 1
+            print(f"FAIL {name}: scan and index differ")
+
+    npamx.requests_db = repo
+    if legacy_analytics(data) != _indexed_analytics():
+        failures += 1
+        print(f"FAIL analytics: legacy={legacy_analytics(data)} indexed={_indexed_analytics()}")
+
+    rng = random.Random(seed + 1)
+    rids = list(repo)
+    for _ in range(5000):
+        rid = rng.choice(rids)
+        req = repo.get(rid)
+        if req is None:
+            continue
+        op = rng.random()
+        if op < 0.4:
+            req["status"] = rng.choice(OPEN + CLOSED)
+        elif op < 0.55:
+            req["expires_at"] = (datetime.now() + timedelta(hours=rng.uniform(-10, 10))).isoformat()
+        elif op < 0.65:
+            req.update(user_email=f"user{rng.randrange(users)}@example.com", approval_required=["security_lead"])
+        elif op < 0.72:
+            req.pop("db_instance_id", None)
+        elif op < 0.8:
+            repo[rid] = dict(req, status="revoked")
+        elif op < 0.88:
+            repo.pop(rid)
+        else:
+            repo[f"new-{rid}"] = dict(req, id=f"new-{rid}")
+    if _index_state(repo) != _index_state(_rebuilt(repo)):
+        failures += 1
+        print("FAIL indexes diverge from a rebuild after in-place updates")
+    plain = {rid: dict(r) for rid, r in repo.items()}
+    for name, (scan, query) in _listings(users).items():
+        if scan(plain) != query(repo):
+            failures += 1
+            print(f"FAIL {name} after updates: scan and index differ")
+    print(f"correctness: {failures} failures")
+    return failures
+
+
+def benchmark(data: dict, users: int, iterations: int) -> None:
+    start = time.perf_counter()
+    repo = RequestRepository(data)
+    print(f"build: {len(repo)} requests in {(time.perf_counter() - start) * 1000:.0f}ms  {repo.stats()['indexes']}")
+    for name, (scan, query) in _listings(users).items():
+        rows = len(query(repo))
+        timings = []
+        for fn, arg, n in ((scan, data, max(1, iterations // 20)), (query, repo, iterations)):
+            t0 = time.perf_counter()
+            for _ in range(n):
+                fn(arg)
+            timings.append((time.perf_counter() - t0) / n * 1000)
+        print(f"{name:<27} rows={rows:<6} scan={timings[0]:8.2f}ms index={timings[1]:8.3f}ms")
+    npamx.requests_db = repo
+    t0 = time.perf_counter()
+    legacy_analytics(data)
+    t1 = time.perf_counter()
+    _indexed_analytics()
+    t2 = time.perf_counter()
+    print(f"{'analytics (first call)':<27} {'':<11} scan={(t1 - t0) * 1000:8.2f}ms index={(t2 - t1) * 1000:8.3f}ms")
+    # Steady state: a few requests change between dashboard loads.
+    rng = random.Random(7)
+    rids = list(repo)
+    t_scan = t_index = 0.0
+    for _ in range(10):
+        for rid in rng.sample(rids, 20):
+            repo[rid]["status"] = "expired"
+            data[rid]["status"] = "expired"
+        t0 = time.perf_counter()
+        legacy_analytics(data)
+        t1 = time.perf_counter()
+        _indexed_analytics()
+        t_scan, t_index = t_scan + t1 - t0, t_index + time.perf_counter() - t1
+    print(f"{'analytics':<27} {'':<11} scan={t_scan * 100:8.2f}ms index={t_index * 100:8.3f}ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    data = _generate(args.requests, args.users, args.seed)
+    if not args.no_bench:
+        benchmark(data, args.users, args.iterations)
+    return 1 if check_correctness(data, args.users, args.seed) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
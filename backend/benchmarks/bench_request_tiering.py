@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark request tiering (NpamxStore.load_all(closed_before=...)
+with RequestRepository(cold=STORE)).
+
+  python benchmarks/bench_request_tiering.py
+  python benchmarks/bench_request_tiering.py --requests 500000 --hot-days 30
+
+Writes a `--requests` history to SQLite through sync_from_memory: mostly
+closed requests (expired, revoked, denied, ...) spread over two years, a
+small open set (pending, approved, active) and approvals for about a third
+of them. "full" is the boot path before tiering (every request loaded into
+requests_db); "tiered" loads only open and recently closed requests. Each
+boot runs in a fresh interpreter that imports only persistence and
+request_repository, so startup time and RSS are those of the request store
+alone (not Flask/boto3); "save" is one _save_requests() afterwards, which
+rewrites every resident request.
+
+Correctness (on `--check-requests` requests, through app.py): exactly the
+open and recently closed requests are resident; every lookup and listing
+returns what a fully loaded repository returns; cold requests are promoted
+with their approvals; deletes reach SQLite without touching other cold
+approvals; approvals reset in memory (modify_request) stay reset after a
+reload; demote() evicts aged closed requests that stay readable; a
+reload sees every change; /api/admin/analytics matches the full-history
+numbers throughout.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-tiering-")
+atexit.register(shutil.rmtree, _TMP, True)
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP, "pam_admins.json"))
+
+from persistence import NpamxStore  # noqa: E402
+from request_repository import RequestRepository  # noqa: E402
+
+CLOSED = ["expired", "EXPIRED", "revoked", "denied", "rejected", "failed"]
+OPEN = ["pending", "approved", "active", "auto_approved"]
+
+
+def _generate(n: int, users: int, seed: int) -> tuple[dict, dict]:
+    rng = random.Random(seed)
+    now = datetime.now()
+    requests, approvals = {}, {}
+    for i in range(n):
+        open_ = rng.random() < 0.03
+        status = rng.choice(OPEN) if open_ else rng.choice(CLOSED)
+        created = now - timedelta(days=rng.uniform(0, 2 if open_ else 720))
+        expires = created + timedelta(hours=rng.choice([1, 4, 8, 72]))
+        rid = f"req-{i:07d}"
+        req = {
+            "id": rid,
+            "user_email": f"user{rng.randrange(users)}@example.com",
+            "status": status,
+            "created_at": created.isoformat(),
+            "expires_at": expires.isoformat(),
+            "account_id": str(100000000000 + rng.randrange(300)),
+            "approval_required": rng.choice([["manager"], ["security_lead"], ["self"], ["manager", "security_lead"]]),
+            "justification": f"Ticket OPS-{rng.randrange(100000)}: investigate incident",
+            "duration_hours": rng.choice([1, 4, 8, 72]),
+        }
+        if not open_ and rng.random() < 0.2:
+            req["modified_at"] = (created + timedelta(hours=rng.uniform(0, 96))).isoformat()
+        kind = rng.random()
+        if kind < 0.5:
+            req.update(type="database_access", db_instance_id=f"db-{rng.randrange(200)}", engine="mysql",
+                       databases=[{"name": "app", "engine": "mysql"}], role="read_only", permissions=["SELECT"])
+        elif kind < 0.7:
+            req.update(type="instance_access", instance_id=f"i-{rng.randrange(1000):08x}", instances=[], username=f"u{i}", user_created=True)
+        else:
+            req.update(type="aws_access", permission_set=rng.choice(["ReadOnlyAccess", "PowerUser", "AdministratorAccess", "custom-admin-db"]))
+        if rng.random() < 0.01:
+            req["user_email"] = req["user_email"].upper()
+        requests[rid] = req
+        if rng.random() < 0.35:
+            approvals[rid] = [
+                {"approver_role": role, "approver_email": f"lead{rng.randrange(50)}@example.com", "approved_at": (created + timedelta(minutes=5)).isoformat()}
+                for role in req["approval_required"]
+            ]
+    return requests, approvals
+
+
+def _cutoff(hot_days: float) -> str:
+    return (datetime.now() - timedelta(days=hot_days)).isoformat()
+
+
+def _is_hot(req: dict, cutoff: str) -> bool:
+    last = max(str(req.get(f) or "") for f in ("created_at", "modified_at", "expires_at"))
+    return str(req.get("status") or "").strip().lower() not in NpamxStore.closed_statuses or last >= cutoff
+
+
+def legacy_analytics(db: dict) -> dict:
+    """get_admin_analytics over the whole history, as before the indexes (for comparison)."""
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    first, counts, exceptional = {}, {}, set()
+    for req in db.values():
+        email = req["user_email"].strip().lower()
+        d = datetime.fromisoformat(req["created_at"].replace("Z", "+00:00"))
+        first[email] = min(d, first.get(email, d))
+        counts[email] = counts.get(email, 0) + 1
+        if "admin" in (req.get("permission_set") or "").lower():
+            exceptional.add(email)
+    return {
+        "new_users": sum(1 for d in first.values() if d >= thirty_days_ago),
+        "repeated_users": sum(1 for c in counts.values() if c > 3),
+        "exceptional_users": len(exceptional),
+        "pending_approvals": sum(1 for r in db.values() if r["status"] == "pending"),
+    }
+
+
+# ----------------------------------------------------------------------
+# Boot measurement (runs in a child interpreter)
+# ----------------------------------------------------------------------
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_boot(db_path: str, hot_days: float) -> dict:
+    """What app._load_requests does at startup, timed; hot_days <= 0 loads everything."""
+    before = _rss_mb()
+    t0 = time.perf_counter()
+    store = NpamxStore(db_path)
+    cutoff = _cutoff(hot_days) if hot_days > 0 else None
+    loaded, approvals = store.load_all(closed_before=cutoff)
+    repo = RequestRepository(loaded, cold=store if cutoff else None)
+    seconds = time.perf_counter() - t0
+    del loaded
+    rss = _rss_mb()
+    # One _save_requests(): sync_from_memory rewrites every resident request (same values here).
+    t0 = time.perf_counter()
+    store.sync_from_memory(repo, approvals, deleted=repo.pending_deletes())
+    save = time.perf_counter() - t0
+    return {"resident": len(repo), "approvals": len(approvals), "seconds": seconds, "rss_mb": rss, "rss_delta_mb": rss - before, "save": save}
+
+
+def _boot_in_child(db_path: str, hot_days: float) -> dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure-boot", db_path, "--hot-days", str(hot_days)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+# ----------------------------------------------------------------------
+# Correctness (through app.py)
+# ----------------------------------------------------------------------
+
+_LISTINGS = [
+    {"user": "user7@example.com"},
+    {"type": "database_access", "user": "USER7@example.com"},
+    {"type": "database_access", "user": "user7@example.com", "status": ("active", "approved")},
+    {"status": "expired"},
+    {"status": ("pending", "revoked"), "account": "100000000007"},
+    {"approver": "manager", "user": "user3@example.com"},
+    {"db_instance": "db-5"},
+    {"permission_set": "AdministratorAccess"},
+    {},
+]
+
+
+def check_correctness(n: int, users: int, seed: int, hot_days: float) -> int:
+    import app as npamx  # here, so --measure-boot children stay free of Flask/boto3
+
+    failures = 0
+
+    def check(ok, msg):
+        nonlocal failures
+        if not ok:
+            failures += 1
+            print(f"FAIL {msg}")
+
+    def analytics() -> dict:
+        with npamx.app.test_request_context("/api/admin/analytics"):
+            data = npamx.get_admin_analytics().get_json()
+        return {k: data[k] for k in ("new_users", "repeated_users", "exceptional_users", "pending_approvals")}
+
+    def rows(result) -> list:
+        return sorted((rid, dict(r)) for rid, r in result)
+
+    data, approvals = _generate(n, users, seed)
+    npamx.STORE.sync_from_memory(data, approvals)
+    npamx.REQUEST_HOT_DAYS = hot_days
+    npamx._load_requests()
+    repo = npamx.requests_db
+    cutoff = _cutoff(hot_days)
+    expected_hot = {rid for rid, r in data.items() if _is_hot(r, cutoff)}
+    check(set(dict.keys(repo)) == expected_hot, f"resident set: {len(repo)} vs expected {len(expected_hot)}")
+    check(set(npamx.approvals_db) == {rid for rid in approvals if rid in expected_hot}, "only resident approvals are loaded")
+
+    full = RequestRepository({rid: dict(r) for rid, r in data.items()})
+    for criteria in _LISTINGS:
+        check(rows(repo.select(**criteria)) == rows(full.select(**criteria)), f"select({criteria})")
+    check(analytics() == legacy_analytics(data), f"analytics: {analytics()} vs {legacy_analytics(data)}")
+
+    rng = random.Random(seed + 1)
+    cold = sorted(set(data) - expected_hot)
+    for rid in rng.sample(cold, min(200, len(cold))):
+        check(rid in repo, f"{rid} in requests_db")
+        check(dict(repo[rid]) == data[rid], f"requests_db[{rid}] matches SQLite")
+        check(npamx.approvals_db.get(rid) == approvals.get(rid), f"approvals of {rid} promoted")
+    check("no-such-request" not in repo and repo.get("no-such-request") is None, "missing request stays missing")
+    check(analytics() == legacy_analytics(data), "analytics after promotions")
+
+    # Update a promoted request, delete a promoted and a still-cold one, then save.
+    promoted = next(rid for rid in cold if dict.__contains__(repo, rid))
+    repo[promoted]["status"] = "revoked"
+    repo[promoted]["modified_at"] = datetime.now().isoformat()
+    data[promoted] = dict(repo[promoted])
+    gone = [next(rid for rid in cold if dict.__contains__(repo, rid) and rid != promoted and rid in approvals),
+            next(rid for rid in reversed(cold) if not dict.__contains__(repo, rid) and rid in approvals)]
+    for rid in gone:
+        repo.pop(rid, None)
+        npamx.approvals_db.pop(rid, None)
+        data.pop(rid)
+        approvals.pop(rid)
+    npamx._save_requests()
+    for rid in gone:
+        check(npamx.STORE.get_request(rid) is None and rid not in repo, f"deleted {rid} is gone from SQLite")
+    check(analytics() == legacy_analytics(data), "analytics after deletes")
+
+    # Age one open request past the window: demote() evicts it, lookups still find it.
+    aged = next(rid for rid in sorted(expected_hot) if rid in data and str(data[rid]["status"]).lower() in ("approved", "active"))
+    old = (datetime.now() - timedelta(days=hot_days + 10)).isoformat()
+    repo[aged].update(status="expired", created_at=old, expires_at=old, modified_at=old)
+    data[aged] = dict(repo[aged])
+    demoted = repo.demote(npamx._request_hot_cutoff(), save=npamx._save_requests)
+    check(demoted >= 1 and not dict.__contains__(repo, aged), f"demote evicts aged closed requests ({demoted})")
+    check(analytics() == legacy_analytics(data), "analytics after demotion")
+    check(aged in repo and dict(repo[aged]) == data[aged], "demoted request is served from SQLite")
+
+    # modify_request resets approvals with `del approvals_db[rid]`: the reset must survive a reload.
+    reset = next(rid for rid in sorted(npamx.approvals_db) if dict.__contains__(repo, rid))
+    del npamx.approvals_db[reset]
+    approvals.pop(reset, None)
+    npamx._save_requests()
+    check(npamx.STORE.get_request(reset)[1] == [], "approvals reset in memory are removed from SQLite")
+
+    everything, stored_approvals = npamx.STORE.load_all()
+    check(everything == data, "SQLite holds every request with its latest state")
+    check(stored_approvals == approvals, "cold approvals survive saves; deleted ones are gone")
+    npamx._load_requests()
+    check(analytics() == legacy_analytics(data), "analytics after reload")
+    check(reset not in npamx.approvals_db and npamx.approvals_db.get(reset, []) == [], "reset approvals stay gone after a reload")
+    print(f"correctness: {failures} failures")
+    return failures
+
+
+def benchmark(n: int, users: int, seed: int, hot_days: float) -> None:
+    db_path = os.path.join(_TMP, "history.db")
+    data, approvals = _generate(n, users, seed)
+    store = NpamxStore(db_path)
+    t0 = time.perf_counter()
+    store.sync_from_memory(data, approvals)
+    print(f"history: {n} requests, {sum(len(v) for v in approvals.values())} approvals written in {time.perf_counter() - t0:.1f}s "
+          f"({os.path.getsize(db_path) / 2**20:.0f}MB)")
+    cold_ids = [rid for rid, r in data.items() if not _is_hot(r, _cutoff(hot_days))]
+    del data, approvals
+
+    for label, days in (("full", 0), ("tiered", hot_days)):
+        m = _boot_in_child(db_path, days)
+        print(f"{label:<7} boot={m['seconds']:6.2f}s resident={m['resident']:>7} approvals={m['approvals']:>7} "
+              f"RSS={m['rss_mb']:7.1f}MB (+{m['rss_delta_mb']:.1f}MB for requests) save={m['save']:6.2f}s")
+
+    loaded, _ = store.load_all(closed_before=_cutoff(hot_days))
+    repo = RequestRepository(loaded, cold=store)
+    rng = random.Random(seed)
+    for label, fn in (
+        ("cold lookup (promotes)", lambda: repo[rng.choice(cold_ids)]),
+        ("missing lookup", lambda: "no-such-request" in repo),
+        ("user listing (hot+cold)", lambda: repo.select(type="database_access", user=f"user{rng.randrange(users)}@example.com")),
+        ("open listing (hot only)", lambda: repo.select(type="database_access", status=("active", "approved"))),
+    ):
+        samples = []
+        for _ in range(200):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+        print(f"{label:<25} p50={statistics.median(samples):7.3f}ms max={max(samples):7.3f}ms")
+    t0 = time.perf_counter()
+    repo.first_created_by_user()
+    print(f"{'analytics summary (first)':<25} {(time.perf_counter() - t0) * 1000:7.1f}ms  {repo.stats()['promotions']} promotions")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--check-requests", type=int, default=20000)
+    parser.add_argument("--hot-days", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bench", action="store_true")
+    parser.add_argument("--measure-boot", metavar="DB", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure_boot:
+        print(json.dumps(measure_boot(args.measure_boot, args.hot_days)))
+        return 0
+    if not args.no_bench:
+        benchmark(args.requests, args.users, args.seed, args.hot_days)
+    return 1 if check_correctness(args.check_requests, max(50, args.users // 25), args.seed, args.hot_days) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Login throughput with and without the cached SAML settings (app._saml_settings).
+
+  python benchmarks/bench_saml_login.py
+  python benchmarks/bench_saml_login.py --iterations 500 --threads 4
+
+A throwaway IdP is generated locally: an RSA key and self-signed certificate
+(openssl CLI) and an IdP metadata file pointing at them. app.py is loaded
+with SAML_IDP_METADATA_PATH set to that file. Two request types are timed:
+
+- login: init_saml_auth + auth.login() (AuthnRequest redirect URL)
+- acs:   init_saml_auth + process_response() of a Response signed by the
+         test IdP, i.e. signature validation of a real assertion
+
+"rebuild" constructs settings per request from the metadata file, as
+init_saml_auth did before; "cached" uses the shared settings object. The
+difference is the per-sign-in cost the cache removes.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.TemporaryDirectory(prefix="npamx-saml-")
+_KEY = os.path.join(_TMP.name, "idp.key")
+_CERT = os.path.join(_TMP.name, "idp.crt")
+_METADATA = os.path.join(_TMP.name, "idp_metadata.xml")
+_IDP_ENTITY = "https://idp.test.local/saml"
+_BASE_URL = "http://npamx.test.local"
+
+subprocess.run(
+    ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+     "-subj", "/CN=npamx-test-idp", "-keyout", _KEY, "-out", _CERT],
+    check=True, capture_output=True,
+)
+with open(_CERT) as f:
+    _CERT_PEM = f.read()
+_CERT_B64 = "".join(line for line in _CERT_PEM.splitlines() if "-----" not in line)
+with open(_KEY) as f:
+    _KEY_PEM = f.read()
+
+with open(_METADATA, "w") as f:
+    f.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<md:EntityDescriptor xmlns:md="urn:oasis:names:tc:SAML:2.0:metadata" entityID="{_IDP_ENTITY}">
+  <md:IDPSSODescriptor WantAuthnRequestsSigned="false" protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+    <md:KeyDescriptor use="signing">
+      <ds:KeyInfo xmlns:ds="http://www.w3.org/2000/09/xmldsig#"><ds:X509Data><ds:X509Certificate>{_CERT_B64}</ds:X509Certificate></ds:X509Data></ds:KeyInfo>
+    </md:KeyDescriptor>
+    <md:NameIDFormat>urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress</md:NameIDFormat>
+    <md:SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect" Location="https://idp.test.local/sso"/>
+    <md:SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST" Location="https://idp.test.local/sso"/>
+  </md:IDPSSODescriptor>
+</md:EntityDescriptor>
+""")
+
+os.environ["SAML_IDP_METADATA_PATH"] = _METADATA
+os.environ["APP_BASE_URL"] = _BASE_URL
+os.environ.setdefault("NPAMX_DB_PATH", os.path.join(_TMP.name, "npamx.db"))
+os.environ.setdefault("NPAMX_DATA_DIR", _TMP.name)
+os.environ.setdefault("PAM_ADMINS_PATH", os.path.join(_TMP.name, "pam_admins.json"))
+
+import app as npamx  # noqa: E402
+from onelogin.saml2.auth import OneLogin_Saml2_Auth  # noqa: E402
+from onelogin.saml2.utils import OneLogin_Saml2_Utils  # noqa: E402
+
+
+def _signed_response(email: str) -> str:
+    now = datetime.now(timezone.utc)
+    fmt = "%Y-%m-%dT%H:%M:%SZ"
+    issued, until = now.strftime(fmt), (now + timedelta(minutes=5)).strftime(fmt)
+    acs = f"{_BASE_URL}/saml/acs"
+    xml = f"""<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="_{uuid.uuid4().hex}" Version="2.0" IssueInstant="{issued}" Destination="{acs}"><saml:Issuer>{_IDP_ENTITY}</saml:Issuer><samlp:Status><samlp:StatusCode Value="urn:oasis:names:tc:SAML:2.0:status:Success"/></samlp:Status><saml:Assertion ID="_{uuid.uuid4().hex}" Version="2.0" IssueInstant="{issued}"><saml:Issuer>{_IDP_ENTITY}</saml:Issuer><saml:Subject><saml:NameID Format="urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress">{email}</saml:NameID><saml:SubjectConfirmation Method="urn:oasis:names:tc:SAML:2.0:cm:bearer"><saml:SubjectConfirmationData NotOnOrAfter="{until}" Recipient="{acs}"/></saml:SubjectConfirmation></saml:Subject><saml:Conditions NotBefore="{issued}" NotOnOrAfter="{until}"><saml:AudienceRestriction><saml:Audience>pam-flask-app</saml:Audience></saml:AudienceRestriction></saml:Conditions><saml:AuthnStatement AuthnInstant="{issued}" SessionIndex="_{uuid.uuid4().hex}"><saml:AuthnContext><saml:AuthnContextClassRef>urn:oasis:names:tc:SAML:2.0:ac:classes:PasswordProtectedTransport</saml:AuthnContextClassRef></saml:AuthnContext></saml:AuthnStatement><saml:AttributeStatement><saml:Attribute Name="email"><saml:AttributeValue>{email}</saml:AttributeValue></saml:Attribute></saml:AttributeStatement></saml:Assertion></samlp:Response>"""
+    signed = OneLogin_Saml2_Utils.add_sign(xml, _KEY_PEM, _CERT_PEM)
+    return base64.b64encode(signed if isinstance(signed, bytes) else signed.encode()).decode()
+
+
+def _request(post_data=None) -> dict:
+    return {
+        "https": "off",
+        "http_host": "npamx.test.local",
+        "server_port": "80",
+        "script_name": "/saml/acs" if post_data else "/api/login",
+        "get_data": {},
+        "post_data": post_data or {},
+    }
+
+
+def _rebuild_auth(req):
+    """Settings built from the metadata file per request, as before the cache (for timing only)."""
+    return OneLogin_Saml2_Auth(req, npamx._build_saml_settings())
+
+
+def _login(make_auth, _response):
+    make_auth(_request()).login()
+
+
+def _acs(make_auth, response):
+    auth = make_auth(_request({"SAMLResponse": response}))
+    auth.process_response()
+    if auth.get_errors() or not auth.get_nameid():
+        raise RuntimeError(f"ACS failed: {auth.get_errors()} {auth.get_last_error_reason()}")
+
+
+def _run(fn, make_auth, responses: list, iterations: int, threads: int):
+    samples = []
+    lock = threading.Lock()
+    per_thread = iterations // threads
+
+    def worker(n):
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            fn(make_auth, responses[(n * per_thread + i) % len(responses)])
+            local.append((time.perf_counter() - start) * 1000.0)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return len(samples) / elapsed, samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    responses = [_signed_response(f"user{i}@example.com") for i in range(50)]
+    _acs(npamx.init_saml_auth, responses[0])  # sanity: the test IdP's response validates
+    for label, fn in (("login", _login), ("acs", _acs)):
+        for impl, make_auth in (("rebuild", _rebuild_auth), ("cached", npamx.init_saml_auth)):
+            for threads in (1, args.threads):
+                rate, samples = _run(fn, make_auth, responses, args.iterations, threads)
+                p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+                print(f"{label:<5} {impl:<7} threads={threads:<2} n={len(samples)} {rate:8.0f} req/s "
+                      f"p50={statistics.median(samples):7.2f}ms p95={p95:7.2f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        _TMP.cleanup()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Check and benchmark server-side sessions (session_store.SESSION_STORE).
+
+  python benchmarks/bench_session_store.py
+  python benchmarks/bench_session_store.py --users 2000 --requests 50000
+
+Logs in `--users` users whose SAML attributes carry `--groups` group
+entries, then replays authenticated requests through the Flask test
+request context. "cookie" is Flask's default signed-cookie session (the
+whole session dict in the cookie, re-verified and re-parsed per request);
+"server" is ServerSessionInterface (cookie holds an ID, LRU in front of
+SQLite).
+
+Correctness: a session survives a cold cache, login rotates the ID, a
+second store over the same database (another worker) sees a revocation
+within its revalidation window, idle and absolute timeouts end sessions,
+and a late write never re-creates a revoked session.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_TMP = tempfile.mkdtemp(prefix="npamx-sessions-")
+atexit.register(shutil.rmtree, _TMP, True)
+
+from flask import Flask, session  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+from persistence import NpamxStore  # noqa: E402
+from session_store import ServerSessionInterface, SessionStore, session_key  # noqa: E402
+
+STORE = NpamxStore(os.path.join(_TMP, "npamx.db"))
+
+
+def _app(interface) -> Flask:
+    app = Flask(__name__)
+    app.secret_key = "bench"
+    app.session_interface = interface
+    return app
+
+
+def _attributes(email: str, groups: int) -> dict:
+    return {
+        "email": [email],
+        "name": [email.split("@")[0].title()],
+        "groups": [str(uuid.uuid4()) for _ in range(groups)],
+    }
+
+
+def _finish(app) -> str:
+    """Save the current request's session; return the Set-Cookie session value ("" when none was set)."""
+    resp = app.response_class()
+    app.session_interface.save_session(app, session._get_current_object(), resp)
+    header = resp.headers.get("Set-Cookie") or ""
+    return header.split(";", 1)[0].split("=", 1)[1] if header.startswith("session=") else ""
+
+
+def _login(app, email: str, groups: int, cookie: str = "") -> str:
+    """One SAML login request (optionally on an existing session); returns the new session cookie."""
+    with app.test_request_context("/saml/acs", method="POST", headers={"Cookie": f"session={cookie}"} if cookie else {}):
+        session["user"] = email
+        session["attributes"] = _attributes(email, groups)
+        return _finish(app)
+
+
+def _request(app, cookie: str):
+    """One authenticated API request: the context push opens the session, then it is saved."""
+    with app.test_request_context("/api/requests", headers={"Cookie": f"session={cookie}"}):
+        user = session.get("user")
+        _finish(app)
+        return user
+
+
+def check_correctness(groups: int) -> int:
+    failures = 0
+
+    def check(ok, msg):
+        nonlocal failures
+        if not ok:
+            failures += 1
+            print(f"FAIL {msg}")
+
+    worker_a = SessionStore(revalidate_seconds=0.2, touch_seconds=0)
+    worker_b = SessionStore(revalidate_seconds=0.2, touch_seconds=0)
+    worker_a.attach(STORE)
+    worker_b.attach(STORE)
+    app_a, app_b = _app(ServerSessionInterface(worker_a)), _app(ServerSessionInterface(worker_b))
+
+    sid = _login(app_a, "alice@example.com", groups)
+    check(len(sid) < 64, f"cookie should hold only an ID, got {len(sid)} chars")
+    check(_request(app_b, sid) == "alice@example.com", "other worker loads the session from SQLite")
+    worker_a.clear_cache()
+    check(_request(app_a, sid) == "alice@example.com", "session survives a cold cache")
+
+    rotated = _login(app_a, "bob@example.com", groups, cookie=sid)
+    check(rotated and rotated != sid, "login as another user rotates the session ID")
+    check(_request(app_a, sid) is None, "pre-login session ID is dead after rotation")
+
+    _request(app_b, rotated)
+    check(worker_a.revoke_user("bob@example.com") == 1, "revoke_user deletes the session row")
+    check(_request(app_a, rotated) is None, "revoking worker drops the session immediately")
+    time.sleep(0.25)
+    check(_request(app_b, rotated) is None, "other worker sees the revocation after revalidation")
+
+    sid = _login(app_a, "carol@example.com", groups)
+    with app_a.test_request_context("/api/x", headers={"Cookie": f"session={sid}"}):
+        worker_b.revoke_user("carol@example.com")
+        session["note"] = "late write"
+        _finish(app_a)
+    check(STORE.get_web_session(session_key(sid)) is None, "late write does not re-create a revoked session")
+
+    # IdPs whose NameID is not the email: the resolved email is stored beside it.
+    app_nameid = _app(ServerSessionInterface(worker_a, email_of=lambda _s: "Frank@Example.com"))
+    sid = _login(app_nameid, "idc-7f3a9c", groups)
+    listed = worker_b.active_sessions(user="frank@example.com")
+    check([s["email"] for s in listed] == ["frank@example.com"], f"active_sessions finds the session by email, got {listed}")
+    check(worker_b.revoke_user("frank@example.com") == 1, "revoke_user matches the resolved email")
+    check(_request(app_nameid, sid) is None, "session revoked by email is dead")
+
+    sid = _login(app_a, "dave@example.com", groups)
+    worker_a.idle_seconds = 0.1
+    time.sleep(0.15)
+    check(_request(app_a, sid) is None, "idle timeout ends the session")
+    worker_a.idle_seconds, worker_a.absolute_seconds = 1800, 0
+    sid = _login(app_a, "erin@example.com", groups)
+    check(_request(app_a, sid) is None, "absolute timeout ends the session")
+    print(f"correctness: {failures} failures")
+    return failures
+
+
+def benchmark(users: int, groups: int, requests: int) -> None:
+    rng = random.Random(1)
+    store = SessionStore(max_entries=max(users, 1))
+    store.attach(STORE)
+    for label, app in (("cookie", _app(SecureCookieSessionInterface())), ("server", _app(ServerSessionInterface(store)))):
+        cookies = [_login(app, f"user{i}@example.com", groups) for i in range(users)]
+        samples = []
+        for _ in range(requests):
+            cookie = rng.choice(cookies)
+            t0 = time.perf_counter()
+            _request(app, cookie)
+            samples.append((time.perf_counter() - t0) * 1e6)
+        samples.sort()
+        print(
+            f"{label:<7} cookie={len(cookies[0]):>6}B  p50={statistics.median(samples):8.1f}us "
+            f"p99={samples[max(0, int(requests * 0.99) - 1)]:8.1f}us"
+        )
+    print(f"server store: {store.stats()}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    failures = check_correctness(args.groups)
+    if not args.no_bench:
+        benchmark(args.users, args.groups, args.requests)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
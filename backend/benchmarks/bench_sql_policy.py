@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Check, fuzz and benchmark the token-based SQL policy (sql_lexer) used by
+sql_enforcer.enforce_select_only and prompt_injection_guard.validate_sql_query.
+
+  python benchmarks/bench_sql_policy.py              # corpus + fuzz + benchmark
+  python benchmarks/bench_sql_policy.py --fuzz 20000 --seed 7
+
+Corpus: benchmarks/sql_corpus.jsonl, one {"query", "select_only",
+"read_limited_write"} object per line with the expected decisions.
+
+Fuzzing mutates corpus queries and checks invariants that must hold for any
+input: evaluation never raises, is deterministic, is case-insensitive, does
+not change when whitespace between tokens is replaced by comments, and does
+not block an allowed query because a blocked keyword was added inside a
+string literal. Time per character is tracked to catch super-linear inputs.
+
+The benchmark compares the previous regex-per-rule implementation against
+the single-pass lexer on multi-kilobyte queries.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from prompt_injection_guard import validate_sql_query  # noqa: E402
+from sql_enforcer import BLOCKED_PATTERNS, PROXY_POLICY, enforce_select_only  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql_corpus.jsonl")
+
+_LEGACY_PATTERNS = [
+    r"\bINSERT\b", r"\bUPDATE\b", r"\bDELETE\b", r"\bDROP\b", r"\bTRUNCATE\b", r"\bCREATE\b", r"\bALTER\b",
+    r"\bGRANT\b", r"\bREVOKE\b", r"\bEXEC\b", r"\bEXECUTE\b", r"\bCALL\b", r"\bINTO\s+OUTFILE\b",
+    r"\bINTO\s+DUMPFILE\b", r"\bLOAD_FILE\b", r"\bINTO\s+",
+]
+
+
+def _legacy_enforce(query: str) -> bool:
+    """The regex-per-rule check this module replaced (for timing only)."""
+    for pattern in _LEGACY_PATTERNS:
+        if re.search(pattern, query, re.IGNORECASE):
+            return False
+    q = query.strip()
+    while q.startswith("--") or q.startswith("/*"):
+        idx = q.find("\n") if q.startswith("--") else q.find("*/")
+        q = q[idx + (1 if q.startswith("--") else 2):].strip() if idx >= 0 else ""
+    return bool(re.match(r"^(\w+)", q))
+
+
+def _load_corpus() -> list[dict]:
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_corpus(corpus) -> int:
+    failures = 0
+    for case in corpus:
+        got_select = enforce_select_only(case["query"])[0]
+        got_write = validate_sql_query(case["query"], role="read_limited_write")[0]
+        if got_select != case["select_only"] or got_write != case["read_limited_write"]:
+            failures += 1
+            print(f"MISMATCH {case['query']!r}: select_only={got_select} (want {case['select_only']}), "
+                  f"read_limited_write={got_write} (want {case['read_limited_write']})")
+    print(f"corpus: {len(corpus)} cases, {failures} mismatches")
+    return failures
+
+
+_NOISE = ["'", '"', "`", "/*", "*/", "/*!", "--", "-- ", "#", "\n", ";", "(", ")", ".", "\\", "@", "0x", "DROP", "INTO", "é", "\x00"]
+
+
+def _mutate(rng: random.Random, q: str) -> str:
+    op = rng.randrange(4)
+    pos = rng.randrange(len(q) + 1)
+    if op == 0:
+        return q[:pos] + rng.choice(_NOISE) + q[pos:]
+    if op == 1 and q:
+        end = min(len(q), pos + rng.randrange(1, 8))
+        return q[:pos] + q[end:]
+    if op == 2:
+        return q[:pos]
+    return q[:pos] + rng.choice(_NOISE) * rng.randrange(1, 64) + q[pos:]
+
+
+def _decision(q: str):
+    a = PROXY_POLICY.evaluate(q)
+    return (bool(a.error), a.denied, tuple(a.verbs))
+
+
+def fuzz(corpus, iterations: int, seed: int) -> int:
+    rng = random.Random(seed)
+    base = [c["query"] for c in corpus if c["query"]]
+    allowed = [c["query"] for c in corpus if c["select_only"]]
+    failures = 0
+    worst_ns_per_char = 0.0
+    for i in range(iterations):
+        q = rng.choice(base)
+        for _ in range(rng.randrange(1, 4)):
+            q = _mutate(rng, q)
+        start = time.perf_counter_ns()
+        try:
+            first = _decision(q)
+            enforce_select_only(q)
+            validate_sql_query(q, role="read_limited_write")
+        except Exception as e:  # pragma: no cover - reported, not raised
+            failures += 1
+            print(f"EXCEPTION {type(e).__name__}: {e} for {q!r}")
+            continue
+        elapsed = time.perf_counter_ns() - start
+        if len(q) >= 64:
+            worst_ns_per_char = max(worst_ns_per_char, elapsed / len(q))
+        if _decision(q) != first:
+            failures += 1
+            print(f"NONDETERMINISTIC {q!r}")
+        if not first[0] and _decision(q.upper()) != first and _decision(q.lower()) != first:
+            # Literal contents change case too, so only flag when neither direction agrees.
+            failures += 1
+            print(f"CASE-SENSITIVE {q!r}")
+
+    for _ in range(max(1, iterations // 10)):
+        q = rng.choice(allowed)
+        plain = not any(marker in q for marker in ("'", '"', "`", "--", "#", "/*"))
+        if plain and enforce_select_only(q.replace(" ", "/**/"))[0] is not True:
+            failures += 1
+            print(f"COMMENT-SPACING changed decision for {q!r}")
+        word = rng.choice(BLOCKED_PATTERNS)[0]
+        hidden = f"{q.rstrip(';')} /* {word} */" if rng.random() < 0.5 else q.replace("SELECT", f"SELECT '{word}' AS w,", 1)
+        if hidden != q and not enforce_select_only(hidden)[0]:
+            failures += 1
+            print(f"LITERAL/COMMENT keyword blocked {hidden!r}")
+    print(f"fuzz: {iterations} mutated queries, {failures} failures, worst {worst_ns_per_char:.0f} ns/char")
+    return failures
+
+
+def _make_query(target_len: int, rng: random.Random) -> str:
+    parts = ["SELECT"]
+    i = 0
+    while sum(len(p) + 1 for p in parts) < target_len - 80:
+        i += 1
+        kind = i % 4
+        if kind == 0:
+            parts.append(f"o.col_{i},")
+        elif kind == 1:
+            parts.append(f"CASE WHEN o.status_{i} = 'pending {i}' THEN 1 ELSE 0 END AS flag_{i},")
+        elif kind == 2:
+            parts.append(f"COALESCE(`c{i}`, 'n/a -- not a comment') AS c{i}, /* note {i} */")
+        else:
+            parts.append(f"(SELECT MAX(x.v) FROM items x WHERE x.oid = o.id AND x.kind = {rng.randrange(100)}) AS m{i},")
+    parts.append("o.id FROM orders o WHERE o.created_at > '2024-01-01' ORDER BY o.id LIMIT 100")
+    return " ".join(parts)
+
+
+def _time(fn, query: str, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples
+
+
+def benchmark(iterations: int, seed: int) -> None:
+    rng = random.Random(seed)
+    for size in (1024, 4096, 9500):
+        query = _make_query(size, rng)
+        assert enforce_select_only(query)[0], "benchmark query should be allowed"
+        for label, fn in (("regex", _legacy_enforce), ("lexer", enforce_select_only)):
+            samples = _time(fn, query, iterations)
+            p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+            print(f"{label:<6} {len(query):>5} chars n={len(samples)} mean={statistics.mean(samples):8.1f}us "
+                  f"p50={statistics.median(samples):8.1f}us p95={p95:8.1f}us")
+    # The legacy patterns block this query (keyword inside a literal); the lexer allows it.
+    sample = "SELECT 'please update your address' AS reminder"
+    print(f"false positive check: regex allows={_legacy_enforce(sample)} lexer allows={enforce_select_only(sample)[0]}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=5000, help="mutated queries to evaluate (0 to skip)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    corpus = _load_corpus()
+    failures = check_corpus(corpus)
+    if args.fuzz:
+        failures += fuzz(corpus, args.fuzz, args.seed)
+    if not args.no_bench:
+        benchmark(args.iterations, args.seed)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark DB activation latency against a local Vault dev server,
+with and without the keep-alive connection pool in VaultManager.
+
+Setup (Vault dev server + MySQL/MariaDB on localhost):
+  vault server -dev -dev-root-token-id=root &
+  export VAULT_ADDR=http://127.0.0.1:8200 VAULT_TOKEN=root
+  vault auth enable approle
+  vault secrets enable database
+  vault write database/config/my-mysql plugin_name=mysql-database-plugin \\
+      connection_url="{{username}}:{{password}}@tcp(127.0.0.1:3306)/" \\
+      username=root password=root allowed_roles="*"
+  vault policy write npamx - <<'P'
+  path "database/*" { capabilities = ["create", "read", "update", "delete", "list"] }
+  path "sys/leases/revoke" { capabilities = ["update"] }
+  P
+  vault write auth/approle/role/npamx token_policies=npamx
+  export VAULT_ROLE_ID=$(vault read -field=role_id auth/approle/role/npamx/role-id)
+  export VAULT_SECRET_ID=$(vault write -f -field=secret_id auth/approle/role/npamx/secret-id)
+
+Run from backend/:
+  python benchmarks/bench_vault_activation.py --iterations 50 --database test
+
+Each iteration runs create_database_session (role write + creds read) and
+revokes the lease, i.e. the activation + cleanup path. The AppRole login is
+cached per plane, so `--fresh-login` clears the token cache every iteration
+to include the login round trip as well.
+
+`--no-bench` only runs the offline check of shared-role release across two
+workers (persisted holders decide; no Vault server needed).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from persistence import NpamxStore  # noqa: E402
+from vault_manager import VaultManager  # noqa: E402
+
+
+def check_role_release() -> int:
+    """Two workers share role R; each knows only its own reference."""
+    failures = 0
+    store = NpamxStore(os.path.join(tempfile.mkdtemp(prefix="npamx-vault-"), "npamx.db"))
+
+    def req(status):
+        return {"type": "database_access", "status": status, "vault_role_name": "jit_r", "user_email": "a@example.com"}
+
+    deleted = []
+    real_delete = VaultManager.delete_database_role
+    VaultManager.delete_database_role = staticmethod(lambda role_name, plane="": deleted.append(role_name) or True)
+    VaultManager._role_cache.clear()
+    try:
+        # Worker 1 holds A, worker 2 holds B; both saved.
+        store.sync_from_memory({"A": req("active"), "B": req("active")}, {})
+        VaultManager.register_role_reference("jit_r", "A")
+        # Worker 1 releases A while B is still open: the role must stay.
+        holders = store.vault_role_holders("jit_r", exclude_request_id="A")
+        if VaultManager.release_database_role("jit_r", "A", holders=holders) or deleted or holders != ["B"]:
+            print(f"FAIL: role deleted while B is open (holders={holders}, deleted={deleted})")
+            failures += 1
+        # Worker 2 (no cache entry) releases B after A was saved closed: the role goes.
+        store.sync_from_memory({"A": req("expired"), "B": req("active")}, {})
+        holders = store.vault_role_holders("jit_r", exclude_request_id="B")
+        if not VaultManager.release_database_role("jit_r", "B", holders=holders) or deleted != ["jit_r"]:
+            print(f"FAIL: last release did not delete the role (holders={holders}, deleted={deleted})")
+            failures += 1
+    finally:
+        VaultManager.delete_database_role = staticmethod(real_delete)
+        VaultManager._role_cache.clear()
+    print(f"role release check: {'ok' if not failures else f'{failures} failure(s)'}")
+    return failures
+
+
+def _run(label: str, pool_size: int, args) -> list[float]:
+    os.environ["VAULT_HTTP_POOL_SIZE"] = str(pool_size)
+    VaultManager.reset_http_pools()
+    VaultManager._cached_tokens.clear()
+    samples = []
+    for i in range(args.iterations + args.warmup):
+        if args.fresh_login:
+            VaultManager._cached_tokens.clear()
+        start = time.perf_counter()
+        session = VaultManager.create_database_session(
+            request_id=f"bench{i:04d}{pool_size}",
+            engine=args.engine,
+            db_names=[args.database],
+            allowed_ops=["SELECT"],
+            duration_hours=1,
+            requester="bench@example.com",
+        )
+        VaultManager.revoke_lease(session["lease_id"])
+        elapsed = (time.perf_counter() - start) * 1000
+        if i >= args.warmup:
+            samples.append(elapsed)
+    samples.sort()
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{label:<12} n={len(samples)} mean={statistics.mean(samples):7.2f}ms "
+        f"p50={statistics.median(samples):7.2f}ms p95={p95:7.2f}ms pools={VaultManager.http_pool_stats()}"
+    )
+    return samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--engine", default="mysql")
+    parser.add_argument("--database", default="test")
+    parser.add_argument("--fresh-login", action="store_true")
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+    failures = check_role_release()
+    if args.no_bench:
+        return 1 if failures else 0
+    if not os.getenv("VAULT_ADDR"):
+        print("VAULT_ADDR is not set (see module docstring for setup)", file=sys.stderr)
+        return 2
+
+    no_pool = _run("no-keepalive", 0, args)
+    pooled = _run("pooled", int(os.getenv("BENCH_POOL_SIZE") or 4), args)
+    print(f"p50 speedup: {statistics.median(no_pool) / statistics.median(pooled):.2f}x")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
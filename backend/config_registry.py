@@ -0,0 +1,182 @@
+"""
+Hot-reloading registry for the JSON configuration files
+=======================================================
+
+Org policies, feature flags, guardrails, access rules, strict policies,
+org hierarchy tags and local user groups were each `open()`ed and parsed
+on every call, sometimes once per loop iteration (request_access re-read
+user_groups.json for every access rule). Each file is now registered once
+with a parser and served from an in-memory snapshot:
+
+- the parser turns the raw JSON (None when the file is missing or invalid)
+  into the normalized structure callers need, including derived indexes
+- snapshots are deep-frozen (read-only dict/list subclasses), so a caller cannot
+  corrupt what other requests see; `thaw()` returns a mutable deep copy for
+  code that edits and saves a config
+- `get()` stats the file (mtime_ns, size, inode) and re-parses only when it
+  changed, so edits made by another worker or by hand are picked up on the
+  next call; the snapshot is swapped in one assignment
+- writers in this process call `invalidate()` after saving, which covers
+  rewrites too quick for the filesystem's mtime granularity
+
+Every swap bumps `version` (and the entry's own version), so caches derived
+from configuration can key on it instead of re-deriving per request.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+
+
+class FrozenDict(dict):
+    """dict that refuses mutation; still a dict for json/jsonify and isinstance checks."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("configuration snapshots are read-only; use config_registry.thaw() for a mutable copy")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class FrozenList(list):
+    """list that refuses mutation (see FrozenDict)."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("configuration snapshots are read-only; use config_registry.thaw() for a mutable copy")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = remove = pop = clear = sort = reverse = _readonly
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def thaw(value):
+    """Mutable deep copy of a snapshot (dicts and lists)."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    if isinstance(value, frozenset):
+        return set(value)
+    return value
+
+
+def _stat_key(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class _Entry:
+    __slots__ = ("name", "path", "parse", "state", "loads")
+
+    def __init__(self, name: str, path: str, parse):
+        self.name = name
+        self.path = path
+        self.parse = parse
+        # (stat key, snapshot, version); replaced as a whole.
+        self.state = (False, None, 0)
+        self.loads = 0
+
+
+class ConfigRegistry:
+    def __init__(self):
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def register(self, name: str, path: str, parse=None) -> None:
+        """
+        Register (or re-point) a config file. parse(raw) receives the decoded
+        JSON, or None when the file is missing or unreadable, and returns the
+        normalized snapshot (frozen by the registry).
+        """
+        with self._lock:
+            self._entries[name] = _Entry(name, path, parse or (lambda raw: raw))
+
+    def path(self, name: str) -> str:
+        return self._entries[name].path
+
+    def _load(self, entry: _Entry, key):
+        raw = None
+        if key is not None:
+            try:
+                with open(entry.path, "r") as f:
+                    raw = json.load(f)
+            except (OSError, ValueError):
+                raw = None
+        snapshot = freeze(entry.parse(raw))
+        self.version += 1
+        entry.loads += 1
+        entry.state = (key, snapshot, self.version)
+        return snapshot
+
+    def get(self, name: str):
+        """Current snapshot of a registered config (re-parsed only when the file changed)."""
+        entry = self._entries[name]
+        key = _stat_key(entry.path)
+        cached_key, snapshot, _version = entry.state
+        if cached_key == key:
+            return snapshot
+        with self._lock:
+            cached_key, snapshot, _version = entry.state
+            if cached_key == key:
+                return snapshot
+            return self._load(entry, key)
+
+    def entry_version(self, name: str) -> int:
+        self.get(name)
+        return self._entries[name].state[2]
+
+    def invalidate(self, name: str = "") -> None:
+        """Force a re-parse on next get() (after this process wrote the file)."""
+        with self._lock:
+            for entry in ([self._entries[name]] if name else list(self._entries.values())):
+                entry.state = (False, entry.state[1], entry.state[2])
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "files": {
+                e.name: {"path": e.path, "version": e.state[2], "loads": e.loads, "exists": os.path.exists(e.path)}
+                for e in self._entries.values()
+            },
+        }
+
+
+# Process-wide registry; each owning module registers its files at import.
+CONFIG_REGISTRY = ConfigRegistry()
@@ -2,9 +2,18 @@
 Use PyMySQL (pure Python) instead of mysql-connector-python to avoid
 mysql_native_password plugin .so loading errors on some systems.
 """
-import pymysql
+import datetime
+import decimal
+import json
+import os
 import secrets
 import string
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+from db_connection_pool import DB_CONNECTION_POOLS, changes_session_state
 
 def generate_password(length=16):
     """Generate random password"""
@@ -55,49 +64,331 @@ def create_database_user(host, port, admin_user, admin_password, new_user, new_p
     except Exception as e:
         return {'error': str(e)}
 
-def execute_query(host, port, username, password, database, query, *, ssl=None, connect_timeout=10, read_timeout=30, write_timeout=30, client_flag=0, auth_plugin_map=None):
+# Result caps for PAM terminal queries (per statement). Callers may lower them, never raise them.
+MAX_RESULT_ROWS = int(os.getenv('DB_QUERY_MAX_ROWS') or 5000)
+MAX_RESULT_BYTES = int(os.getenv('DB_QUERY_MAX_BYTES') or 8 * 1024 * 1024)
+STREAM_CHUNK_ROWS = 500
+
+
+def _effective_cap(requested, ceiling):
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return ceiling
+    return max(1, min(requested, ceiling))
+
+
+def _json_value(value):
+    """Make a column value JSON-safe (dates, decimals, binary)."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return '0x' + raw.hex()
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, datetime.timedelta)):
+        return str(value)
+    return str(value)
+
+
+def _row_size(row):
+    # Approximate wire/JSON size; cheap enough to run per row.
+    return sum(len(v) if isinstance(v, str) else 8 for v in row) + 2 * len(row)
+
+
+# MySQL error codes -> coarse classes recorded with query telemetry.
+_ERROR_CLASSES = {
+    1044: 'access_denied', 1045: 'access_denied', 1142: 'access_denied', 1143: 'access_denied', 1227: 'access_denied',
+    1064: 'syntax', 1049: 'not_found', 1054: 'not_found', 1146: 'not_found',
+    1205: 'lock_timeout', 1213: 'deadlock', 1317: 'cancelled', 3024: 'timeout',
+    2003: 'connection', 2005: 'connection', 2006: 'connection', 2013: 'connection_lost',
+}
+
+
+def error_class(exc):
+    """Coarse, stable class for a query failure (for telemetry, not for users)."""
+    code = exc.args[0] if isinstance(exc, pymysql.err.MySQLError) and exc.args and isinstance(exc.args[0], int) else None
+    if code in _ERROR_CLASSES:
+        return _ERROR_CLASSES[code]
+    if isinstance(exc, pymysql.err.ProgrammingError):
+        return 'syntax'
+    if isinstance(exc, pymysql.err.IntegrityError):
+        return 'integrity'
+    if isinstance(exc, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+        return 'connection'
+    if isinstance(exc, TimeoutError):
+        return 'timeout'
+    if isinstance(exc, RuntimeError) and 'pooled database connection' in str(exc):
+        return 'pool_timeout'
+    if isinstance(exc, RuntimeError) and 'session' in str(exc).lower():
+        return 'session_closed'
+    return 'other'
+
+
+def _timing(state):
+    """Milliseconds since the call started: total, connection checkout, first row."""
+    def ms(value):
+        return round(value, 2) if value is not None else None
+    return {
+        'duration_ms': ms((time.monotonic() - state['started']) * 1000.0),
+        'acquire_ms': ms(state['acquire_ms']),
+        'first_row_ms': ms(state['first_row_ms']),
+    }
+
+
+def _mark(state, key):
+    if state[key] is None:
+        state[key] = (time.monotonic() - state['started']) * 1000.0
+
+
+def _connect_kwargs(host, port, username, password, database, *, ssl, connect_timeout, read_timeout, write_timeout, client_flag, auth_plugin_map):
+    kwargs = {
+        "host": host,
+        "port": port,
+        "user": username,
+        "password": password,
+        "database": database,
+        "connect_timeout": int(connect_timeout or 10),
+        "read_timeout": int(read_timeout or 30),
+        "write_timeout": int(write_timeout or 30),
+    }
+    if ssl:
+        kwargs["ssl"] = ssl
+    if client_flag:
+        kwargs["client_flag"] = int(client_flag)
+    if auth_plugin_map:
+        kwargs["auth_plugin_map"] = auth_plugin_map
+    return kwargs
+
+
+@contextmanager
+def _checked_out_connection(kwargs, state, *, pool_owner=None, pool_expires_at=None, auth_mode='password'):
+    """Yield a connection (pooled when pool_owner is set). Set state['discard'] to drop it afterwards."""
+    if not pool_owner:
+        conn = pymysql.connect(**kwargs)
+        _mark(state, 'acquire_ms')
+        try:
+            yield conn
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        return
+    kwargs = dict(kwargs)
+    pool, pc = DB_CONNECTION_POOLS.acquire(
+        host=kwargs.pop("host"),
+        port=kwargs.pop("port"),
+        user=kwargs.pop("user"),
+        password=kwargs.pop("password"),
+        database=kwargs.pop("database"),
+        auth_mode=auth_mode,
+        owner=pool_owner,
+        expires_at=pool_expires_at,
+        connect_kwargs=kwargs,
+    )
+    _mark(state, 'acquire_ms')
+    try:
+        yield pc.conn
+    finally:
+        DB_CONNECTION_POOLS.release(pool, pc, discard=state.get('discard', False))
+
+
+def _iter_capped_rows(cursor, max_rows, max_bytes, state):
+    """Yield JSON-safe row lists from an unbuffered cursor until exhausted or a cap is hit."""
+    while True:
+        batch = cursor.fetchmany(STREAM_CHUNK_ROWS)
+        if not batch:
+            return
+        for row in batch:
+            if state['row_count'] >= max_rows:
+                state['truncated_reason'] = 'max_rows'
+                return
+            values = [_json_value(v) for v in row]
+            size = _row_size(values)
+            if state['bytes'] + size > max_bytes:
+                state['truncated_reason'] = 'max_bytes'
+                return
+            state['row_count'] += 1
+            state['bytes'] += size
+            _mark(state, 'first_row_ms')
+            yield values
+
+
+def _new_result_state():
+    return {
+        'row_count': 0, 'bytes': 0, 'truncated_reason': '', 'discard': False,
+        'started': time.monotonic(), 'acquire_ms': None, 'first_row_ms': None,
+    }
+
+
+def execute_query(host, port, username, password, database, query, *, ssl=None, connect_timeout=10, read_timeout=30, write_timeout=30, client_flag=0, auth_plugin_map=None, pool_owner=None, pool_expires_at=None, auth_mode='password', max_rows=None, max_bytes=None, result_format='rows', on_connect=None):
     """Execute SQL query.
 
     Notes:
     - `ssl` can be provided for IAM auth / TLS-required databases (dict passed to PyMySQL).
     - `auth_plugin_map` can be provided to enable special auth plugins when required.
+    - `pool_owner` (the JIT request id) enables connection pooling scoped to that
+      session; `pool_expires_at` (epoch seconds) stops reuse once the session expires.
+    - Rows are read through an unbuffered server-side cursor and capped at
+      `max_rows` / `max_bytes` (bounded by DB_QUERY_MAX_ROWS / DB_QUERY_MAX_BYTES);
+      a capped result carries `truncated: true`.
+    - Any statement that returns a result set (SELECT, SHOW, DESCRIBE, WITH, ...)
+      returns rows; the cursor decides, not the query prefix.
+    - `result_format='columnar'` returns {'columns': [...], 'rows': [[...]]}
+      instead of a list of dicts.
+    - `on_connect(conn)` is called before the statement runs, e.g. to record
+      `conn.thread_id()` so the query can be cancelled with `kill_query`.
+    - Every result carries `timing` (duration_ms, acquire_ms, first_row_ms);
+      failures also carry `error_class` (see `error_class`).
+    """
+    kwargs = _connect_kwargs(
+        host, port, username, password, database, ssl=ssl, connect_timeout=connect_timeout,
+        read_timeout=read_timeout, write_timeout=write_timeout, client_flag=client_flag, auth_plugin_map=auth_plugin_map,
+    )
+    max_rows = _effective_cap(max_rows, MAX_RESULT_ROWS)
+    max_bytes = _effective_cap(max_bytes, MAX_RESULT_BYTES)
+    state = _new_result_state()
+    state['discard'] = bool(pool_owner) and changes_session_state(query)
+    try:
+        with _checked_out_connection(kwargs, state, pool_owner=pool_owner, pool_expires_at=pool_expires_at, auth_mode=auth_mode) as conn:
+            if on_connect:
+                on_connect(conn)
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(query)
+                if cursor.description is None:
+                    conn.commit()
+                    _mark(state, 'first_row_ms')
+                    return {'affected_rows': cursor.rowcount, 'timing': _timing(state)}
+                columns = [d[0] for d in cursor.description]
+                rows = list(_iter_capped_rows(cursor, max_rows, max_bytes, state))
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                # Broken/timed-out connection: never hand it out again.
+                state['discard'] = True
+                raise
+            finally:
+                if state['truncated_reason'] or state['discard']:
+                    # Unread rows are still on the wire; closing the SSCursor would drain them all.
+                    state['discard'] = True
+                else:
+                    cursor.close()
+        if result_format == 'columnar':
+            result = {'columns': columns, 'rows': rows}
+        else:
+            result = {'results': [dict(zip(columns, r)) for r in rows]}
+        result['row_count'] = state['row_count']
+        result['bytes'] = state['bytes']
+        result['truncated'] = bool(state['truncated_reason'])
+        if state['truncated_reason']:
+            result['truncated_reason'] = state['truncated_reason']
+        result['timing'] = _timing(state)
+        return result
+    except Exception as e:
+        return {'error': str(e), 'error_class': error_class(e), 'timing': _timing(state)}
+
+
+def stream_query_ndjson(host, port, username, password, database, query, *, ssl=None, connect_timeout=10, read_timeout=30, write_timeout=30, pool_owner=None, pool_expires_at=None, auth_mode='password', max_rows=None, max_bytes=None, on_complete=None):
+    """Generator of NDJSON lines for a streaming (chunked) HTTP response.
+
+    Lines: {"type":"columns","columns":[...]}, then {"type":"rows","rows":[[...]]}
+    per chunk, then {"type":"end","row_count":n,"bytes":b,"truncated":bool}.
+    Statements without a result set produce {"type":"result","affected_rows":n};
+    failures produce {"type":"error","error":"..."}. `on_complete(summary)` is
+    called once at the end (also when the client disconnects mid-stream).
+    """
+    kwargs = _connect_kwargs(
+        host, port, username, password, database, ssl=ssl, connect_timeout=connect_timeout,
+        read_timeout=read_timeout, write_timeout=write_timeout, client_flag=0, auth_plugin_map=None,
+    )
+    max_rows = _effective_cap(max_rows, MAX_RESULT_ROWS)
+    max_bytes = _effective_cap(max_bytes, MAX_RESULT_BYTES)
+    state = _new_result_state()
+    state['discard'] = bool(pool_owner) and changes_session_state(query)
+    summary = {'error': None, 'error_class': '', 'affected_rows': None, 'row_count': 0, 'bytes': 0, 'truncated': False}
+    finished = False
+    try:
+        with _checked_out_connection(kwargs, state, pool_owner=pool_owner, pool_expires_at=pool_expires_at, auth_mode=auth_mode) as conn:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(query)
+                if cursor.description is None:
+                    conn.commit()
+                    _mark(state, 'first_row_ms')
+                    summary['affected_rows'] = cursor.rowcount
+                    finished = True
+                    yield json.dumps({'type': 'result', 'affected_rows': cursor.rowcount}) + '\n'
+                    return
+                yield json.dumps({'type': 'columns', 'columns': [d[0] for d in cursor.description]}) + '\n'
+                chunk = []
+                for values in _iter_capped_rows(cursor, max_rows, max_bytes, state):
+                    chunk.append(values)
+                    if len(chunk) >= STREAM_CHUNK_ROWS:
+                        yield json.dumps({'type': 'rows', 'rows': chunk}) + '\n'
+                        chunk = []
+                if chunk:
+                    yield json.dumps({'type': 'rows', 'rows': chunk}) + '\n'
+                finished = True
+                end = {'type': 'end', 'row_count': state['row_count'], 'bytes': state['bytes'], 'truncated': bool(state['truncated_reason'])}
+                if state['truncated_reason']:
+                    end['truncated_reason'] = state['truncated_reason']
+                yield json.dumps(end) + '\n'
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                state['discard'] = True
+                raise
+            finally:
+                if state['truncated_reason'] or state['discard'] or not finished:
+                    state['discard'] = True
+                else:
+                    cursor.close()
+    except GeneratorExit:
+        summary['error'] = 'client disconnected'
+        summary['error_class'] = 'cancelled'
+        raise
+    except Exception as e:
+        summary['error'] = str(e)
+        summary['error_class'] = error_class(e)
+        yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+    finally:
+        summary['row_count'] = state['row_count']
+        summary['bytes'] = state['bytes']
+        summary['truncated'] = bool(state['truncated_reason'])
+        summary['timing'] = _timing(state)
+        if on_complete:
+            try:
+                on_complete(summary)
+            except Exception:
+                pass
+
+
+def kill_query(host, port, username, password, thread_id, *, ssl=None, connect_timeout=5):
+    """Cancel the statement running on connection `thread_id` (KILL QUERY) from a side connection.
+
+    A user can always kill its own threads, so the session credentials are enough.
     """
     try:
         kwargs = {
             "host": host,
-            "port": port,
+            "port": int(port),
             "user": username,
             "password": password,
-            "database": database,
-            "cursorclass": pymysql.cursors.DictCursor,
-            "connect_timeout": int(connect_timeout or 10),
-            "read_timeout": int(read_timeout or 30),
-            "write_timeout": int(write_timeout or 30),
+            "connect_timeout": int(connect_timeout or 5),
+            "read_timeout": 10,
+            "write_timeout": 10,
         }
         if ssl:
             kwargs["ssl"] = ssl
-        if client_flag:
-            kwargs["client_flag"] = int(client_flag)
-        if auth_plugin_map:
-            kwargs["auth_plugin_map"] = auth_plugin_map
-
         conn = pymysql.connect(**kwargs)
-        cursor = conn.cursor()
-        
-        cursor.execute(query)
-        
-        if query.strip().upper().startswith('SELECT'):
-            results = cursor.fetchall()
-            cursor.close()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("KILL QUERY %s", (int(thread_id),))
+        finally:
             conn.close()
-            return {'results': results}
-        else:
-            conn.commit()
-            affected = cursor.rowcount
-            cursor.close()
-            conn.close()
-            return {'affected_rows': affected}
-            
+        return {'success': True}
     except Exception as e:
         return {'error': str(e)}
 
@@ -5,49 +5,210 @@ TEACHING: This is the ENFORCEMENT POINT. It is the ONLY component that connects
 to the database. Users never see credentials; they send queries through Flask,
 which forwards to us. We enforce SELECT-only and log everything.
 
+The proxy runs on aiohttp. PyMySQL is blocking, so every statement runs on a
+bounded worker pool while the event loop keeps accepting requests:
+
+- every query has an execution deadline (`timeout_sec`, capped at
+  DB_PROXY_QUERY_TIMEOUT_SEC); when it passes, or the caller disconnects, the
+  proxy sends `KILL QUERY <thread id>` so the statement stops on the database
+  too, not only in the proxy
+- concurrent queries are capped per user (DB_PROXY_MAX_PER_USER) and per
+  database instance (DB_PROXY_MAX_PER_INSTANCE); over the cap -> 429
+- GET /health and GET /stats report in-flight counts, outcomes and latency
+  percentiles
+
 Run: python database_proxy.py
 Listens on: http://127.0.0.1:5002 (internal only - not exposed to internet)
 """
 
+from __future__ import annotations
+
+import asyncio
+import collections
+import datetime
+import functools
+import logging
 import os
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
 
 # Import our enforcer and database executor
 from sql_enforcer import enforce_select_only
-from database_manager import execute_query
+from database_manager import MAX_RESULT_ROWS, execute_query, kill_query
+from audit_log import build_query_metrics, log_db_query
 
-app = Flask(__name__)
-CORS(app)  # Only for localhost; in production, restrict origin
+logger = logging.getLogger("database_proxy")
 
 # Config
-MAX_ROWS = 10000
-QUERY_TIMEOUT_SEC = 30
-GUARDRAILS_OFF = os.getenv('GUARDRAILS_OFF', 'false').lower() == 'true'
+# execute_query caps every result at DB_QUERY_MAX_ROWS; use the same limit rather than a larger one it would clamp.
+MAX_ROWS = MAX_RESULT_ROWS
+QUERY_TIMEOUT_SEC = float(os.getenv("DB_PROXY_QUERY_TIMEOUT_SEC") or 30)
+MAX_PER_USER = int(os.getenv("DB_PROXY_MAX_PER_USER") or 2)
+MAX_PER_INSTANCE = int(os.getenv("DB_PROXY_MAX_PER_INSTANCE") or 8)
+MAX_WORKERS = int(os.getenv("DB_PROXY_MAX_WORKERS") or 32)
+GUARDRAILS_OFF = os.getenv("GUARDRAILS_OFF", "false").lower() == "true"
+
+# Seconds after the deadline before PyMySQL gives up on the socket itself, in case KILL QUERY fails.
+_READ_TIMEOUT_GRACE_SEC = 5
+_LATENCY_WINDOW = 1000
+
+_QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS), thread_name_prefix="db-proxy-query")
+# Kills get their own small pool so they are never stuck behind the queries they cancel.
+_KILL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="db-proxy-kill")
+# Audit writes hit SQLite; one thread keeps them ordered and off the event loop.
+_AUDIT_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-proxy-audit")
+
+
+class ProxyStats:
+    """In-flight counts, outcome counters and a rolling latency window (event-loop thread only)."""
+
+    OUTCOMES = ("ok", "error", "blocked", "rejected", "timeout", "cancelled")
+
+    def __init__(self, window: int = _LATENCY_WINDOW):
+        self.started_at = time.time()
+        self.in_flight_by_user = collections.Counter()
+        self.in_flight_by_instance = collections.Counter()
+        self.outcomes = collections.Counter({k: 0 for k in self.OUTCOMES})
+        self.kills = {"sent": 0, "failed": 0}
+        self.latencies_ms = collections.deque(maxlen=window)
+
+    def try_admit(self, user: str, instance: str) -> str:
+        """Reserve a slot; returns '' or the name of the cap that was hit."""
+        if self.in_flight_by_user[user] >= MAX_PER_USER:
+            return "user"
+        if self.in_flight_by_instance[instance] >= MAX_PER_INSTANCE:
+            return "instance"
+        self.in_flight_by_user[user] += 1
+        self.in_flight_by_instance[instance] += 1
+        return ""
+
+    def release(self, user: str, instance: str) -> None:
+        for counter, key in ((self.in_flight_by_user, user), (self.in_flight_by_instance, instance)):
+            counter[key] -= 1
+            if counter[key] <= 0:
+                del counter[key]
 
+    def record(self, outcome: str, started: float | None = None) -> None:
+        self.outcomes[outcome] += 1
+        if started is not None:
+            self.latencies_ms.append((time.monotonic() - started) * 1000.0)
 
-def log_proxy_action(user_email: str, request_id: str, query: str, allowed: bool, rows: int = 0, error: str = None):
-    """Log every query attempt for audit. In production, write to file/DB/audit service."""
-    import datetime
+    def latency_summary(self) -> dict:
+        samples = sorted(self.latencies_ms)
+        if not samples:
+            return {"samples": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+
+        return {
+            "samples": len(samples),
+            "mean_ms": round(sum(samples) / len(samples), 2),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": round(samples[-1], 2),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_seconds": int(time.time() - self.started_at),
+            "in_flight": sum(self.in_flight_by_instance.values()),
+            "in_flight_by_instance": dict(self.in_flight_by_instance),
+            "users_in_flight": len(self.in_flight_by_user),
+            "outcomes": dict(self.outcomes),
+            "kills": dict(self.kills),
+            "latency": self.latency_summary(),
+            "limits": {
+                "query_timeout_sec": QUERY_TIMEOUT_SEC,
+                "max_per_user": MAX_PER_USER,
+                "max_per_instance": MAX_PER_INSTANCE,
+                "max_workers": MAX_WORKERS,
+            },
+        }
+
+
+STATS = ProxyStats()
+
+
+def log_proxy_action(user_email: str, request_id: str, query: str, allowed: bool, rows: int = 0, error: str = None, duration_ms: float = None, role: str = "", metrics: dict = None):
+    """Log every query attempt, and persist it with its telemetry to the audit store (off the event loop)."""
     action = "ALLOWED" if allowed else "BLOCKED"
     msg = f"[{datetime.datetime.now().isoformat()}] {action} | user={user_email} | request_id={request_id} | rows={rows} | error={error or '-'}"
+    if duration_ms is not None:
+        msg += f" | duration_ms={duration_ms:.1f}"
     if not allowed:
         msg += f" | query_preview={query[:100]}..."
-    print(msg)
-    # TODO: Write to audit_log table or external service
+    logger.info(msg)
+    _AUDIT_EXECUTOR.submit(log_db_query, user_email, request_id, role, query, allowed, rows_returned=rows, error=error, metrics=metrics)
+
+
+def _metrics(result: dict, instance: str, database: str, conn_state: dict, started: float, error_class: str = "") -> dict:
+    result = dict(result or {})
+    timing = dict(result.get("timing") or {})
+    # Proxy view of the duration: includes the wait for a worker thread.
+    timing["duration_ms"] = round((time.monotonic() - started) * 1000.0, 2)
+    result["timing"] = timing
+    if error_class:
+        result["error_class"] = error_class
+    picked_up = conn_state.get("picked_up")
+    queue_ms = round((picked_up - started) * 1000.0, 2) if picked_up else None
+    return build_query_metrics(result, source="proxy", instance=instance, db_name=database, queue_ms=queue_ms)
+
+
+def _run_query(conn_state: dict, **kwargs) -> dict:
+    conn_state["picked_up"] = time.monotonic()
+    return execute_query(**kwargs)
 
 
-@app.route('/health', methods=['GET'])
-def health():
+def _validate(query: str, role: str):
+    # ENFORCEMENT: Role-based SQL validation (read_limited_write allows INSERT/UPDATE/DELETE)
+    if GUARDRAILS_OFF:
+        return True, None
+    if role in ("read_limited_write", "read_full_write", "admin"):
+        try:
+            from prompt_injection_guard import validate_sql_query
+            return validate_sql_query(query, role=role)
+        except Exception:
+            return enforce_select_only(query)
+    return enforce_select_only(query)
+
+
+async def _kill_running_query(conn_info: dict, thread_id) -> None:
+    if not thread_id:
+        return
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        _KILL_EXECUTOR,
+        functools.partial(kill_query, conn_info["host"], conn_info["port"], conn_info["username"], conn_info["password"], thread_id),
+    )
+    if result.get("error"):
+        STATS.kills["failed"] += 1
+        logger.warning("KILL QUERY %s on %s:%s failed: %s", thread_id, conn_info["host"], conn_info["port"], result["error"])
+    else:
+        STATS.kills["sent"] += 1
+
+
+async def health(request):
     """Health check for monitoring."""
-    return jsonify({'status': 'ok', 'service': 'database-proxy'})
+    return web.json_response({
+        "status": "ok",
+        "service": "database-proxy",
+        "in_flight": sum(STATS.in_flight_by_instance.values()),
+        "latency": STATS.latency_summary(),
+    })
+
+
+async def stats(request):
+    return web.json_response(STATS.snapshot())
 
 
-@app.route('/execute', methods=['POST'])
-def execute():
+async def execute(request):
     """
     Execute a read-only query. Called by Flask backend only (internal).
-    
+
     Expects JSON:
     {
         "host": "db.example.com",
@@ -57,70 +218,122 @@ def execute():
         "database": "mydb",
         "query": "SELECT * FROM users LIMIT 10",
         "user_email": "user@company.com",   # for audit
-        "request_id": "uuid-..."            # for audit
+        "request_id": "uuid-...",           # for audit
+        "timeout_sec": 30                   # optional, capped at DB_PROXY_QUERY_TIMEOUT_SEC
     }
-    
+
     TEACHING: We receive credentials from Flask over localhost. The user/browser
     never sees them. Flask got them from Vault or its internal store.
     """
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'error': 'JSON body required'}), 400
-        
-        host = data.get('host')
-        port = int(data.get('port', 3306))
-        username = data.get('username')
-        password = data.get('password')
-        database = data.get('database', '')
-        query = (data.get('query') or '').strip()
-        user_email = data.get('user_email', 'unknown')
-        request_id = data.get('request_id', 'unknown')
-        
-        if not all([host, username, password, query]):
-            return jsonify({'error': 'Missing required fields: host, username, password, query'}), 400
-        
-        role = data.get('role', 'read_only')
-        
-        # ENFORCEMENT: Role-based SQL validation (read_limited_write allows INSERT/UPDATE/DELETE)
-        if not GUARDRAILS_OFF:
-            if role in ('read_limited_write', 'read_full_write', 'admin'):
-                try:
-                    from prompt_injection_guard import validate_sql_query
-                    is_valid, err_msg = validate_sql_query(query, role=role)
-                except Exception:
-                    is_valid, err_msg = enforce_select_only(query)
-            else:
-                is_valid, err_msg = enforce_select_only(query)
-            if not is_valid:
-                log_proxy_action(user_email, request_id, query, allowed=False, error=err_msg)
-                return jsonify({'error': err_msg}), 400
-        
-        # Execute (database_manager handles connection)
-        result = execute_query(
+        data = await request.json()
+    except Exception:
+        data = None
+    if not data:
+        return web.json_response({"error": "JSON body required"}, status=400)
+
+    host = data.get("host")
+    username = data.get("username")
+    password = data.get("password")
+    database = data.get("database", "")
+    query = (data.get("query") or "").strip()
+    user_email = data.get("user_email", "unknown")
+    request_id = data.get("request_id", "unknown")
+    if not all([host, username, password, query]):
+        return web.json_response({"error": "Missing required fields: host, username, password, query"}, status=400)
+    try:
+        port = int(data.get("port", 3306))
+        timeout_sec = min(QUERY_TIMEOUT_SEC, float(data.get("timeout_sec") or QUERY_TIMEOUT_SEC))
+    except (TypeError, ValueError):
+        return web.json_response({"error": "port and timeout_sec must be numbers"}, status=400)
+    timeout_sec = max(1.0, timeout_sec)
+
+    role = data.get("role", "read_only")
+    is_valid, err_msg = _validate(query, role)
+    if not is_valid:
+        STATS.record("blocked")
+        log_proxy_action(user_email, request_id, query, allowed=False, error=err_msg, role=role)
+        return web.json_response({"error": err_msg}, status=400)
+
+    instance = f"{host}:{port}"
+    cap = STATS.try_admit(user_email, instance)
+    if cap:
+        STATS.record("rejected")
+        limit = MAX_PER_USER if cap == "user" else MAX_PER_INSTANCE
+        return web.json_response(
+            {"error": f"Too many concurrent queries for this {cap} (limit {limit}). Retry shortly.", "code": "DB_PROXY_BUSY"},
+            status=429,
+            headers={"Retry-After": "1"},
+        )
+
+    conn_info = {"host": host, "port": port, "username": username, "password": password}
+    conn_state = {}
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    pending = _QUERY_EXECUTOR.submit(
+        functools.partial(
+            _run_query,
+            conn_state,
             host=host,
             port=port,
             username=username,
             password=password,
             database=database,
-            query=query
-        )
-        
-        if 'error' in result:
-            log_proxy_action(user_email, request_id, query, allowed=False, error=result['error'])
-            return jsonify(result), 500
-        
-        rows = len(result.get('results', [])) if isinstance(result.get('results'), list) else result.get('affected_rows', 0)
-        log_proxy_action(user_email, request_id, query, allowed=True, rows=rows)
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-if __name__ == '__main__':
-    port = int(os.getenv('DB_PROXY_PORT', 5002))
-    # Bind to 127.0.0.1 only - not exposed to network
-    app.run(host='127.0.0.1', port=port, debug=False)
+            query=query,
+            read_timeout=int(timeout_sec) + _READ_TIMEOUT_GRACE_SEC,
+            max_rows=MAX_ROWS,
+            on_connect=lambda conn: conn_state.__setitem__("thread_id", conn.thread_id()),
+        ),
+    )
+    # The slot is held until the worker thread is really done with the database, not just until we answer
+    # (a cancelled asyncio wrapper completes at once; the executor future only when the thread returns).
+    pending.add_done_callback(lambda _f: loop.call_soon_threadsafe(STATS.release, user_email, instance))
+    job = asyncio.wrap_future(pending, loop=loop)
+
+    try:
+        result = await asyncio.wait_for(asyncio.shield(job), timeout=timeout_sec)
+    except asyncio.TimeoutError:
+        # A query still queued behind the pool never starts; a running one is stopped by the kill.
+        job.cancel()
+        await _kill_running_query(conn_info, conn_state.get("thread_id"))
+        STATS.record("timeout", started)
+        error = f"Query exceeded the {timeout_sec:g}s execution limit and was cancelled"
+        log_proxy_action(user_email, request_id, query, allowed=False, error=error, duration_ms=(time.monotonic() - started) * 1000.0,
+                         role=role, metrics=_metrics({}, instance, database, conn_state, started, error_class="timeout"))
+        return web.json_response({"error": error, "code": "DB_QUERY_TIMEOUT"}, status=504)
+    except asyncio.CancelledError:
+        # Caller went away (browser closed / Flask gave up): stop the statement on the database.
+        job.cancel()
+        await asyncio.shield(_kill_running_query(conn_info, conn_state.get("thread_id")))
+        STATS.record("cancelled", started)
+        log_proxy_action(user_email, request_id, query, allowed=False, error="client disconnected", duration_ms=(time.monotonic() - started) * 1000.0,
+                         role=role, metrics=_metrics({}, instance, database, conn_state, started, error_class="cancelled"))
+        raise
+
+    duration_ms = (time.monotonic() - started) * 1000.0
+    metrics = _metrics(result, instance, database, conn_state, started)
+    if "error" in result:
+        STATS.record("error", started)
+        log_proxy_action(user_email, request_id, query, allowed=False, error=result["error"], duration_ms=duration_ms, role=role, metrics=metrics)
+        return web.json_response(result, status=500)
+
+    STATS.record("ok", started)
+    rows = len(result.get("results", [])) if isinstance(result.get("results"), list) else result.get("affected_rows", 0)
+    log_proxy_action(user_email, request_id, query, allowed=True, rows=rows, duration_ms=duration_ms, role=role, metrics=metrics)
+    return web.json_response(result)
+
+
+def create_app() -> web.Application:
+    app = web.Application(client_max_size=1024 * 1024)
+    app.router.add_get("/health", health)
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/execute", execute)
+    return app
+
 
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("DB_PROXY_LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    port = int(os.getenv("DB_PROXY_PORT", 5002))
+    # Bind to 127.0.0.1 only - not exposed to network.
+    # handler_cancellation: cancel the handler when the caller disconnects, which triggers KILL QUERY.
+    web.run_app(create_app(), host="127.0.0.1", port=port, handler_cancellation=True, access_log=None)
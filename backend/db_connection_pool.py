@@ -0,0 +1,298 @@
+"""
+Pooled, credential-scoped MySQL connections for the PAM DB terminal
+==================================================================
+
+`execute_query` used to open and close a PyMySQL connection for every query,
+paying TCP (+TLS, +auth) on each keystroke-driven statement. This module
+keeps a small pool per (host, port, user, database, auth mode):
+
+- bounded: at most `max_size` connections per key; callers wait up to
+  `acquire_timeout` for a free one
+- idle timeout and max lifetime per connection
+- health check (`ping`) before reusing a connection that sat idle
+- owner-scoped: each pool is tied to the JIT request that owns the
+  credentials and its expiry; `evict_owner()` (revoke) or passing the expiry
+  closes everything at once, so no pooled connection outlives the session
+
+Connections run with autocommit on (no stale REPEATABLE READ snapshots when
+reused); an open transaction is rolled back on release, and connections
+whose session state was changed (USE/SET/LOCK/BEGIN/temporary tables) are
+closed instead of being returned.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+_SESSION_STATE_RE = re.compile(
+    r"^\s*(?:USE|SET|LOCK|UNLOCK|START|BEGIN|XA|CREATE\s+TEMPORARY|PREPARE|DEALLOCATE)\b",
+    re.IGNORECASE,
+)
+
+
+def changes_session_state(query: str) -> bool:
+    return bool(_SESSION_STATE_RE.match(str(query or "")))
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class _Pool:
+    def __init__(self, key, connect_kwargs: dict, fingerprint: str, owner: str, expires_at: float | None, max_size: int):
+        self.key = key
+        self.connect_kwargs = connect_kwargs
+        self.fingerprint = fingerprint
+        self.owner = owner
+        self.expires_at = expires_at
+        self.max_size = max_size
+        self.idle: list[_PooledConnection] = []
+        self.in_use = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+
+class MySQLConnectionPools:
+    def __init__(
+        self,
+        *,
+        max_size: int = 4,
+        max_pools: int = 256,
+        idle_timeout: float = 60,
+        max_lifetime: float = 600,
+        ping_after_idle: float = 5,
+        acquire_timeout: float = 5,
+    ):
+        self.max_size = max(1, int(max_size))
+        self.max_pools = max(1, int(max_pools))
+        self.idle_timeout = float(idle_timeout)
+        self.max_lifetime = float(max_lifetime)
+        self.ping_after_idle = float(ping_after_idle)
+        self.acquire_timeout = float(acquire_timeout)
+        self._pools: dict[tuple, _Pool] = {}
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self.stats_counters = {"created": 0, "reused": 0, "discarded": 0, "evicted_pools": 0}
+
+    @staticmethod
+    def _fingerprint(password: str, ssl) -> str:
+        return hashlib.sha256(f"{password}\0{sorted((ssl or {}).items()) if isinstance(ssl, dict) else ssl}".encode("utf-8")).hexdigest()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    # ---- pool lookup / eviction ----
+
+    def _close_pool(self, pool: _Pool) -> None:
+        with pool.cond:
+            pool.closed = True
+            idle, pool.idle = pool.idle, []
+            pool.cond.notify_all()
+        for pc in idle:
+            self._close_quietly(pc.conn)
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _get_pool(self, key, connect_kwargs, fingerprint, owner, expires_at) -> _Pool:
+        stale = None
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and (pool.fingerprint != fingerprint or pool.closed):
+                # Credentials changed for the same user (new session): never mix them.
+                stale = self._pools.pop(key)
+                pool = None
+            if pool is None:
+                if len(self._pools) >= self.max_pools:
+                    # Evict the pool with nothing checked out that was used least recently.
+                    candidates = [p for p in self._pools.values() if p.in_use == 0]
+                    if candidates:
+                        victim = min(candidates, key=lambda p: max([pc.last_used for pc in p.idle] or [0]))
+                        self._pools.pop(victim.key, None)
+                        self.stats_counters["evicted_pools"] += 1
+                        stale = stale or victim
+                pool = _Pool(key, connect_kwargs, fingerprint, owner, expires_at, self.max_size)
+                self._pools[key] = pool
+            else:
+                pool.owner = owner or pool.owner
+                pool.expires_at = expires_at if expires_at is not None else pool.expires_at
+        if stale is not None:
+            self._close_pool(stale)
+        return pool
+
+    def evict_owner(self, owner: str) -> int:
+        """Close every pooled connection belonging to a JIT request (revoke/expiry)."""
+        owner = str(owner or "").strip()
+        if not owner:
+            return 0
+        with self._lock:
+            victims = [p for p in self._pools.values() if p.owner == owner]
+            for p in victims:
+                self._pools.pop(p.key, None)
+        for p in victims:
+            self._close_pool(p)
+        return len(victims)
+
+    def prune(self) -> None:
+        """Drop expired pools and idle/over-age connections."""
+        now_mono = time.monotonic()
+        now_wall = time.time()
+        with self._lock:
+            self._last_prune = now_mono
+            expired = [p for p in self._pools.values() if p.expires_at is not None and p.expires_at <= now_wall]
+            for p in expired:
+                self._pools.pop(p.key, None)
+            pools = list(self._pools.values())
+        for p in expired:
+            self._close_pool(p)
+        for p in pools:
+            drop = []
+            with p.cond:
+                keep = []
+                for pc in p.idle:
+                    if now_mono - pc.last_used > self.idle_timeout or now_mono - pc.created_at > self.max_lifetime:
+                        drop.append(pc)
+                    else:
+                        keep.append(pc)
+                p.idle = keep
+                empty = not p.idle and p.in_use == 0
+            for pc in drop:
+                self._close_quietly(pc.conn)
+            if empty:
+                with self._lock:
+                    if self._pools.get(p.key) is p and p.in_use == 0 and not p.idle:
+                        self._pools.pop(p.key, None)
+
+    # ---- checkout / release ----
+
+    def acquire(self, *, host, port, user, password, database, auth_mode="password", owner="", expires_at=None, connect_kwargs=None):
+        """Return (pool, _PooledConnection). Always pair with release()."""
+        if expires_at is not None and expires_at <= time.time():
+            self.evict_owner(owner)
+            raise RuntimeError("Database session expired")
+        if time.monotonic() - self._last_prune > 10:
+            self.prune()
+        key = (str(host), int(port), str(user), str(database), str(auth_mode or "password"))
+        kwargs = dict(connect_kwargs or {})
+        kwargs.update({"host": host, "port": int(port), "user": user, "password": password, "database": database, "autocommit": True})
+        pool = self._get_pool(key, kwargs, self._fingerprint(password, kwargs.get("ssl")), owner, expires_at)
+
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with pool.cond:
+                if pool.closed:
+                    raise RuntimeError("Database session closed")
+                pc = None
+                while pool.idle:
+                    candidate = pool.idle.pop()
+                    now = time.monotonic()
+                    if now - candidate.created_at > self.max_lifetime or now - candidate.last_used > self.idle_timeout:
+                        self._close_quietly(candidate.conn)
+                        self._count("discarded")
+                        continue
+                    pc = candidate
+                    break
+                if pc is None and pool.in_use < pool.max_size:
+                    pool.in_use += 1
+                    break
+                if pc is not None:
+                    pool.in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError("Timed out waiting for a pooled database connection")
+                pool.cond.wait(remaining)
+
+        if pc is not None:
+            if time.monotonic() - pc.last_used > self.ping_after_idle:
+                try:
+                    pc.conn.ping(reconnect=False)
+                except Exception:
+                    self._close_quietly(pc.conn)
+                    self._count("discarded")
+                    pc = None
+            if pc is not None:
+                self._count("reused")
+                return pool, pc
+        try:
+            conn = pymysql.connect(**pool.connect_kwargs)
+        except Exception:
+            with pool.cond:
+                pool.in_use -= 1
+                pool.cond.notify()
+            raise
+        self._count("created")
+        return pool, _PooledConnection(conn)
+
+    def release(self, pool: _Pool, pc: _PooledConnection, *, discard: bool = False) -> None:
+        if not discard:
+            try:
+                if pc.conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                    pc.conn.rollback()
+            except Exception:
+                discard = True
+        pc.last_used = time.monotonic()
+        with pool.cond:
+            pool.in_use -= 1
+            if (
+                discard
+                or pool.closed
+                or (pool.expires_at is not None and pool.expires_at <= time.time())
+                or pc.last_used - pc.created_at > self.max_lifetime
+                or len(pool.idle) >= pool.max_size
+            ):
+                close = True
+            else:
+                pool.idle.append(pc)
+                close = False
+            pool.cond.notify()
+        if close:
+            self._close_quietly(pc.conn)
+            if discard:
+                self._count("discarded")
+
+    def stats(self) -> dict:
+        with self._lock:
+            pools = list(self._pools.values())
+            counters = dict(self.stats_counters)
+        return {
+            "pools": len(pools),
+            "idle_connections": sum(len(p.idle) for p in pools),
+            "in_use_connections": sum(p.in_use for p in pools),
+            **counters,
+        }
+
+
+def _env_num(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+# Process-wide pools used by database_manager.execute_query.
+DB_CONNECTION_POOLS = MySQLConnectionPools(
+    max_size=int(_env_num("DB_POOL_MAX_SIZE", 4)),
+    max_pools=int(_env_num("DB_POOL_MAX_POOLS", 256)),
+    idle_timeout=_env_num("DB_POOL_IDLE_SECONDS", 60),
+    max_lifetime=_env_num("DB_POOL_MAX_LIFETIME_SECONDS", 600),
+    acquire_timeout=_env_num("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", 5),
+)
@@ -0,0 +1,260 @@
+"""
+Read-replica routing for SELECT-only JIT database sessions
+==========================================================
+
+Read-only sessions used to run against the endpoint the catalog lists
+(usually the primary), so heavy exploratory SELECTs competed with production
+writes. This module discovers the read capacity behind an RDS instance and
+picks where a SELECT-only session should read from:
+
+- RDS MySQL/MariaDB: `ReadReplicaDBInstanceIdentifiers` of the primary
+  (same-region replicas only; cross-region ARNs are skipped)
+- Aurora: the cluster reader endpoint, when the cluster has reader members
+
+A candidate is eligible when it is `available` and its replica lag, from the
+CloudWatch `ReplicaLag` / `AuroraReplicaLag` metric, is known and at or below
+`max_lag_seconds`. Among RDS replicas the one with the lowest lag wins. The
+Aurora reader endpoint balances over every reader, so it is only used when
+all available readers are under the limit. When nothing is eligible the
+decision falls back to the primary, with the reason.
+
+Topology is cached for `topology_ttl` and lag for `lag_ttl`. `revalidate()`
+re-checks a recorded decision against the cached lag, so a session moves back
+to the primary when its replica starts lagging.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.config import Config
+
+READ_ONLY_OPS = frozenset({"SELECT", "SHOW", "EXPLAIN", "DESCRIBE"})
+
+_AWS_CONFIG = Config(connect_timeout=3, read_timeout=5)
+
+
+def is_select_only(permissions, role: str = "") -> bool:
+    """True when the session's granted operations are all reads (see VaultManager op mapping)."""
+    if isinstance(permissions, str):
+        permissions = permissions.split(",")
+    ops = {" ".join(str(p or "").split()).upper() for p in (permissions or []) if str(p or "").strip()}
+    if ops:
+        return ops <= READ_ONLY_OPS
+    return str(role or "").strip().lower() == "read_only"
+
+
+def _endpoint(item) -> tuple[str, int]:
+    ep = (item or {}).get("Endpoint") or {}
+    return str(ep.get("Address") or ""), int(ep.get("Port") or 3306)
+
+
+class ReplicaRouter:
+    def __init__(self, client_factory=None, topology_ttl: float = 300, lag_ttl: float = 30):
+        self._client_factory = client_factory or (lambda service, region: boto3.client(service, region_name=region, config=_AWS_CONFIG))
+        self._clients = {}
+        self._topology_ttl = float(topology_ttl)
+        self._lag_ttl = float(lag_ttl)
+        self._lock = threading.Lock()
+        # (region, instance_id) -> (fetched_at, topology dict)
+        self._topology = {}
+        # (region, instance_id) -> (fetched_at, lag seconds or None)
+        self._lag = {}
+
+    # ---- clients / invalidation ----
+
+    def client(self, service: str, region: str):
+        key = (service, region)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._client_factory(service, region)
+                    self._clients[key] = client
+        return client
+
+    def invalidate(self, instance_id: str = "", region: str = "") -> None:
+        with self._lock:
+            if not instance_id:
+                self._topology.clear()
+                self._lag.clear()
+                return
+            self._topology.pop((region, instance_id), None)
+
+    def _cached(self, store: dict, key, ttl: float):
+        with self._lock:
+            entry = store.get(key)
+        if entry is not None and time.time() - entry[0] < ttl:
+            return True, entry[1]
+        return False, None
+
+    # ---- discovery ----
+
+    def _describe_instance(self, rds, instance_id: str) -> dict | None:
+        items = rds.describe_db_instances(DBInstanceIdentifier=instance_id).get("DBInstances") or []
+        return items[0] if items else None
+
+    def topology(self, instance_id: str, region: str) -> dict:
+        """Primary endpoint plus read candidates for an RDS instance (cached)."""
+        key = (region, instance_id)
+        hit, topo = self._cached(self._topology, key, self._topology_ttl)
+        if hit:
+            return topo
+        rds = self.client("rds", region)
+        primary = self._describe_instance(rds, instance_id)
+        if primary is None:
+            raise RuntimeError(f"RDS instance not found: {instance_id}")
+        host, port = _endpoint(primary)
+        topo = {
+            "instance_id": instance_id,
+            "host": host,
+            "port": port,
+            "engine": str(primary.get("Engine") or ""),
+            "aurora": False,
+            "reader_endpoint": None,
+            "candidates": [],
+        }
+        cluster_id = str(primary.get("DBClusterIdentifier") or "")
+        if cluster_id:
+            clusters = rds.describe_db_clusters(DBClusterIdentifier=cluster_id).get("DBClusters") or []
+            cluster = clusters[0] if clusters else {}
+            topo["aurora"] = True
+            readers = [m for m in cluster.get("DBClusterMembers") or [] if not m.get("IsClusterWriter")]
+            if readers and cluster.get("ReaderEndpoint"):
+                topo["reader_endpoint"] = {"host": str(cluster["ReaderEndpoint"]), "port": int(cluster.get("Port") or port)}
+            for m in readers:
+                rid = str(m.get("DBInstanceIdentifier") or "")
+                item = self._describe_instance(rds, rid) if rid else None
+                if item is not None:
+                    r_host, r_port = _endpoint(item)
+                    topo["candidates"].append({"instance_id": rid, "host": r_host, "port": r_port, "status": str(item.get("DBInstanceStatus") or ""), "kind": "aurora_reader"})
+        else:
+            for rid in primary.get("ReadReplicaDBInstanceIdentifiers") or []:
+                rid = str(rid or "")
+                if not rid or rid.startswith("arn:"):
+                    # Cross-region replica: another region's network path; not routed.
+                    continue
+                try:
+                    item = self._describe_instance(rds, rid)
+                except Exception:
+                    item = None
+                if item is not None:
+                    r_host, r_port = _endpoint(item)
+                    topo["candidates"].append({"instance_id": rid, "host": r_host, "port": r_port, "status": str(item.get("DBInstanceStatus") or ""), "kind": "rds_replica"})
+        with self._lock:
+            self._topology[key] = (time.time(), topo)
+        return topo
+
+    def replica_lag(self, instance_id: str, region: str, aurora: bool = False) -> float | None:
+        """Latest replica lag in seconds from CloudWatch, or None when unknown (cached)."""
+        key = (region, instance_id)
+        hit, lag = self._cached(self._lag, key, self._lag_ttl)
+        if hit:
+            return lag
+        metric = "AuroraReplicaLag" if aurora else "ReplicaLag"
+        now = datetime.now(timezone.utc)
+        lag = None
+        try:
+            resp = self.client("cloudwatch", region).get_metric_statistics(
+                Namespace="AWS/RDS",
+                MetricName=metric,
+                Dimensions=[{"Name": "DBInstanceIdentifier", "Value": instance_id}],
+                StartTime=now - timedelta(minutes=5),
+                EndTime=now,
+                Period=60,
+                Statistics=["Maximum"],
+            )
+            points = sorted(resp.get("Datapoints") or [], key=lambda p: p.get("Timestamp") or now)
+            if points:
+                value = float(points[-1].get("Maximum"))
+                # AuroraReplicaLag is reported in milliseconds, ReplicaLag in seconds.
+                lag = value / 1000.0 if aurora else value
+        except Exception:
+            lag = None
+        with self._lock:
+            self._lag[key] = (time.time(), lag)
+        return lag
+
+    # ---- decision ----
+
+    def _assess(self, topo: dict, region: str, max_lag: float) -> list[dict]:
+        out = []
+        for c in topo["candidates"]:
+            c = dict(c)
+            c["lag_seconds"] = self.replica_lag(c["instance_id"], region, aurora=topo["aurora"]) if c["status"] == "available" else None
+            c["eligible"] = c["status"] == "available" and c["lag_seconds"] is not None and c["lag_seconds"] <= max_lag
+            out.append(c)
+        return out
+
+    def choose(self, instance_id: str, region: str, *, max_lag_seconds: float) -> dict:
+        """Pick the read target for a SELECT-only session. Never raises; errors fall back to the primary."""
+        decision = {
+            "target": "primary",
+            "reason": "",
+            "primary_instance_id": instance_id,
+            "instance_id": instance_id,
+            "host": "",
+            "port": None,
+            "kind": "",
+            "lag_seconds": None,
+            "max_lag_seconds": max_lag_seconds,
+            "candidates": [],
+            "region": region,
+            "decided_at": datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            topo = self.topology(instance_id, region)
+        except Exception as e:
+            decision["reason"] = f"discovery_failed: {e}"
+            return decision
+        decision["host"], decision["port"] = topo["host"], topo["port"]
+        if not topo["candidates"]:
+            decision["reason"] = "no_replicas"
+            return decision
+        assessed = self._assess(topo, region, max_lag_seconds)
+        decision["candidates"] = [{k: c[k] for k in ("instance_id", "status", "lag_seconds", "eligible")} for c in assessed]
+        available = [c for c in assessed if c["status"] == "available"]
+        eligible = [c for c in assessed if c["eligible"]]
+        if not eligible:
+            decision["reason"] = "replicas_unavailable" if not available else "replica_lag_unknown_or_high"
+            return decision
+        if topo["aurora"]:
+            if topo["reader_endpoint"] is None or len(eligible) != len(available):
+                decision["reason"] = "replica_lag_unknown_or_high"
+                return decision
+            decision.update(
+                target="replica", reason="select_only", kind="aurora_reader",
+                instance_id=",".join(c["instance_id"] for c in eligible),
+                host=topo["reader_endpoint"]["host"], port=topo["reader_endpoint"]["port"],
+                lag_seconds=max(c["lag_seconds"] for c in eligible),
+            )
+            return decision
+        best = min(eligible, key=lambda c: c["lag_seconds"])
+        decision.update(
+            target="replica", reason="select_only", kind="rds_replica",
+            instance_id=best["instance_id"], host=best["host"], port=best["port"], lag_seconds=best["lag_seconds"],
+        )
+        return decision
+
+    def revalidate(self, decision: dict) -> tuple[bool, str]:
+        """Re-check a recorded replica decision against current (cached) lag."""
+        if not isinstance(decision, dict) or decision.get("target") != "replica":
+            return False, "not_routed"
+        region = str(decision.get("region") or "")
+        max_lag = float(decision.get("max_lag_seconds") or 0)
+        aurora = decision.get("kind") == "aurora_reader"
+        for rid in str(decision.get("instance_id") or "").split(","):
+            if not rid:
+                continue
+            lag = self.replica_lag(rid, region, aurora=aurora)
+            if lag is None or lag > max_lag:
+                return False, f"replica_lag_unknown_or_high: {rid}"
+        return True, ""
+
+
+# Process-wide router used by app.py for DB session activation and the PAM terminal.
+REPLICA_ROUTER = ReplicaRouter()
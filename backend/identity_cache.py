@@ -0,0 +1,166 @@
+"""
+Cross-request cache of resolved user identities
+===============================================
+
+When the SAML assertion has no usable email attribute, the request identity
+is resolved live against Identity Store, and group-based guardrails list the
+user's Identity Center groups on every check. A single admin page load can
+trigger several such lookups. This cache keeps, per SAML NameID:
+
+- the resolved email and display name
+- the Identity Center user ID
+- the user's Identity Center group keys (group IDs and names, lowercase);
+  group lookups are made by email, so these live under the email key, which
+  is the NameID for Identity Center logins
+
+Entries expire after `ttl_seconds`. Lookups that found nothing expire after
+the shorter `negative_ttl_seconds`, so a user created in Identity Center
+shows up quickly. The cache is bounded (LRU, `max_entries`). Fields are
+merged, so the email resolution and the group listing can fill one entry
+independently.
+
+Admin changes to users or groups call `invalidate()` (one identity) or
+`clear()`; an entry can be found by NameID, email or user ID.
+
+Group keys decide DB write guardrail exemptions, so an invalidation must
+reach every gunicorn worker, not only the one that served the admin call.
+With an NpamxStore attached, `invalidate()` and `clear()` also append to a
+shared invalidation log. Each worker replays new log entries before a
+lookup, checking at most every `check_seconds` (default 1s), so a removed
+group membership stops counting everywhere within about a second.
+"""
+
+from __future__ import annotations
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+
+def _norm(value) -> str:
+    return str(value or "").strip().lower()
+
+
+class IdentityCache:
+    def __init__(self, ttl_seconds: float = 300, negative_ttl_seconds: float = 30, max_entries: int = 4096):
+        self.ttl = float(ttl_seconds)
+        self.negative_ttl = float(negative_ttl_seconds)
+        self.max_entries = max(1, int(max_entries))
+        # key -> {field: (stored_at, value)}
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.backend = None
+        self.check_seconds = 1.0
+        self._seen_seq = 0
+        self._next_check = 0.0
+        self.stats_counters = {"hits": 0, "misses": 0, "invalidations": 0, "shared_invalidations": 0, "errors": 0}
+
+    def attach(self, backend, check_seconds: float = 1.0) -> None:
+        """Share invalidations with other workers through `backend` (an NpamxStore)."""
+        self._seen_seq = backend.last_identity_invalidation()
+        self.check_seconds = float(check_seconds)
+        self._next_check = 0.0
+        self.backend = backend
+
+    def _replay(self) -> None:
+        """Apply invalidations other workers logged since the last check."""
+        now = time.monotonic()
+        if self.backend is None or now < self._next_check:
+            return
+        self._next_check = now + self.check_seconds
+        try:
+            rows = self.backend.identity_invalidations_since(self._seen_seq)
+        except sqlite3.Error:
+            self.stats_counters["errors"] += 1
+            return
+        for row in rows:
+            self._seen_seq = max(self._seen_seq, int(row["seq"]))
+            wanted = {_norm(row[f]) for f in ("nameid", "email", "user_id") if _norm(row[f])}
+            self.stats_counters["shared_invalidations"] += self._drop(wanted) if wanted else self._drop_all()
+
+    def _record(self, **fields) -> None:
+        if self.backend is None:
+            return
+        try:
+            self.backend.record_identity_invalidation(**fields)
+        except sqlite3.Error:
+            self.stats_counters["errors"] += 1
+
+    def _fresh(self, stored_at: float, value) -> bool:
+        ttl = self.ttl if value else self.negative_ttl
+        return time.time() - stored_at <= ttl
+
+    def lookup(self, key: str, *fields):
+        """Return {field: value} when every field is cached and fresh, else None."""
+        key = _norm(key)
+        self._replay()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                items = [entry.get(f) for f in fields]
+                if all(item is not None and self._fresh(*item) for item in items):
+                    self._entries.move_to_end(key)
+                    self.stats_counters["hits"] += 1
+                    return {f: item[1] for f, item in zip(fields, items)}
+            self.stats_counters["misses"] += 1
+            return None
+
+    def put(self, key: str, **fields) -> None:
+        key = _norm(key)
+        if not key or self.ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._entries.setdefault(key, {})
+            for field, value in fields.items():
+                entry[field] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *, nameid: str = "", email: str = "", user_id: str = "") -> int:
+        """Drop entries whose NameID, email or user ID matches any given value, in every worker."""
+        wanted = {_norm(v) for v in (nameid, email, user_id) if _norm(v)}
+        if not wanted:
+            return 0
+        self._record(nameid=_norm(nameid), email=_norm(email), user_id=_norm(user_id))
+        n = self._drop(wanted)
+        self.stats_counters["invalidations"] += n
+        return n
+
+    def _drop(self, wanted: set) -> int:
+        with self._lock:
+            victims = [
+                key for key, entry in self._entries.items()
+                if key in wanted or any(_norm((entry.get(f) or (0, ""))[1]) in wanted for f in ("email", "user_id"))
+            ]
+            for key in victims:
+                self._entries.pop(key, None)
+        return len(victims)
+
+    def clear(self) -> int:
+        """Drop every entry, in every worker."""
+        self._record()
+        n = self._drop_all()
+        self.stats_counters["invalidations"] += n
+        return n
+
+    def _drop_all(self) -> int:
+        with self._lock:
+            n = len(self._entries)
+            self._entries.clear()
+        return n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), **self.stats_counters}
+
+
+# Process-wide cache used by app.py identity resolution and group lookups.
+IDENTITY_CACHE = IdentityCache(
+    ttl_seconds=float(os.getenv("IDENTITY_CACHE_SECONDS") or 300),
+    negative_ttl_seconds=float(os.getenv("IDENTITY_CACHE_NEGATIVE_SECONDS") or 30),
+    max_entries=int(os.getenv("IDENTITY_CACHE_SIZE") or 4096),
+)
@@ -8,6 +8,13 @@ tables for:
 - db_sessions
 - approvals
 - audit_logs
+- query_metrics (per-statement telemetry linked to its audit_logs row)
+- web_sessions (server-side Flask sessions, see session_store.py)
+
+Request tiering: `load_all(closed_before=...)` returns only open requests
+and those closed recently; the rest stay here and are read on demand
+(`get_request`, `query_requests`, `request_summary`) by
+request_repository.RequestRepository.
 
 Design goals (pragmatic):
 - Keep the existing in-memory `requests_db` / `approvals_db` contract in
@@ -21,14 +28,54 @@ from __future__ import annotations
 import json
 import os
 import sqlite3
+import time
 from datetime import datetime
 
 
+# Request statuses that end a request's lifecycle; such requests become cold once old enough.
+CLOSED_REQUEST_STATUSES = frozenset(("expired", "revoked", "denied", "rejected", "failed", "cancelled", "canceled", "deleted"))
+
+# A request is cold when it is closed and its latest timestamp is older than the cutoff.
+_COLD_REQUEST_SQL = (
+    "lower(trim(coalesce(status, ''))) IN ({}) AND "
+    "max(coalesce(created_at, ''), coalesce(modified_at, ''), coalesce(expires_at, '')) < ?"
+).format(", ".join("?" * len(CLOSED_REQUEST_STATUSES)))
+
+# select() criteria that map onto requests columns; the caller re-checks rows, so these only narrow.
+_REQUEST_FILTER_SQL = {
+    "user": "lower(trim(coalesce(user_email, '')))",
+    "status": "lower(trim(coalesce(status, '')))",
+    "type": "trim(type)",
+    "account": "trim(coalesce(account_id, ''))",
+    "permission_set": "lower(trim(coalesce(permission_set, '')))",
+}
+
+
 def _utcnow_iso() -> str:
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
 
+def _opt_float(value):
+    try:
+        return round(float(value), 2) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+
+    return {"avg": round(sum(samples) / len(samples), 2), "p50": pct(0.50), "p95": pct(0.95), "max": round(samples[-1], 2)}
+
+
 class NpamxStore:
+    closed_statuses = CLOSED_REQUEST_STATUSES
+
     def __init__(self, db_path: str):
         self.db_path = str(db_path or "").strip()
         if not self.db_path:
@@ -62,12 +109,33 @@ class NpamxStore:
                     created_at TEXT,
                     modified_at TEXT,
                     expires_at TEXT,
-                    payload_json TEXT NOT NULL
+                    payload_json TEXT NOT NULL,
+                    permission_set TEXT
                 );
                 """
             )
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(requests)")}
+            if "permission_set" not in columns:
+                # Added for request tiering (analytics over cold requests); backfill once from payloads.
+                conn.execute("ALTER TABLE requests ADD COLUMN permission_set TEXT;")
+                conn.execute("BEGIN;")
+                for row in conn.execute(
+                    "SELECT request_id, payload_json FROM requests WHERE instr(payload_json, '\"permission_set\"') > 0"
+                ).fetchall():
+                    try:
+                        value = (json.loads(row["payload_json"] or "{}") or {}).get("permission_set")
+                    except Exception:
+                        value = None
+                    if value:
+                        conn.execute("UPDATE requests SET permission_set = ? WHERE request_id = ?", (str(value), row["request_id"]))
+                conn.execute("COMMIT;")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_type ON requests(type);")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_user ON requests(user_email);")
+            # Cold-request lookups by user and the analytics summary (request_summary) read this index only.
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_requests_user_norm ON requests("
+                "lower(trim(coalesce(user_email, ''))), lower(trim(coalesce(permission_set, ''))), created_at);"
+            )
             conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status);")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_db ON requests(db_instance_id, db_name);")
 
@@ -88,6 +156,7 @@ class NpamxStore:
                 """
             )
             conn.execute("CREATE INDEX IF NOT EXISTS idx_db_sessions_expires ON db_sessions(expires_at);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_db_sessions_role ON db_sessions(vault_role_name);")
 
             conn.execute(
                 """
@@ -124,17 +193,111 @@ class NpamxStore:
             conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_logs(ts);")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_request ON audit_logs(request_id);")
 
+            # One narrow row per executed statement (numbers only), keyed to its audit row.
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_metrics (
+                    audit_id INTEGER PRIMARY KEY,
+                    ts_epoch INTEGER NOT NULL,
+                    source TEXT,
+                    user_email TEXT,
+                    instance TEXT,
+                    db_name TEXT,
+                    duration_ms REAL,
+                    acquire_ms REAL,
+                    first_row_ms REAL,
+                    queue_ms REAL,
+                    rows INTEGER,
+                    bytes INTEGER,
+                    truncated INTEGER,
+                    error_class TEXT
+                );
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_qm_instance_ts ON query_metrics(instance, ts_epoch);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_qm_user_ts ON query_metrics(user_email, ts_epoch);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_qm_ts ON query_metrics(ts_epoch);")
+
+            # Keyed by a hash of the session cookie, so rows here cannot be replayed as cookies.
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS web_sessions (
+                    session_key TEXT PRIMARY KEY,
+                    user_email TEXT,
+                    auth_type TEXT,
+                    created_epoch INTEGER NOT NULL,
+                    last_seen_epoch INTEGER NOT NULL,
+                    expires_epoch INTEGER NOT NULL,
+                    ip TEXT,
+                    user_agent TEXT,
+                    version INTEGER NOT NULL DEFAULT 1,
+                    payload_json TEXT NOT NULL,
+                    owner_email TEXT
+                );
+                """
+            )
+            if "owner_email" not in {row["name"] for row in conn.execute("PRAGMA table_info(web_sessions)")}:
+                # user_email holds the SAML NameID; the resolved email is kept beside it for revoke/list by email.
+                conn.execute("ALTER TABLE web_sessions ADD COLUMN owner_email TEXT;")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_web_sessions_user ON web_sessions(user_email);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_web_sessions_owner_email ON web_sessions(owner_email);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_web_sessions_last_seen ON web_sessions(last_seen_epoch);")
+
+            # Identity cache invalidations, replayed by every worker's IDENTITY_CACHE (see identity_cache.py).
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS identity_cache_invalidations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nameid TEXT,
+                    email TEXT,
+                    user_id TEXT,
+                    created_epoch INTEGER NOT NULL
+                );
+                """
+            )
+
+            # Bulk SCP attach/detach jobs, so any worker can answer progress polls.
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scp_bulk_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    policy_id TEXT,
+                    action TEXT,
+                    requested_by TEXT,
+                    status TEXT,
+                    total INTEGER NOT NULL,
+                    completed INTEGER NOT NULL,
+                    counts_json TEXT NOT NULL,
+                    created_at TEXT,
+                    finished_at TEXT,
+                    targets_json TEXT NOT NULL
+                );
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_scp_bulk_jobs_created ON scp_bulk_jobs(created_at);")
+
     def is_empty(self) -> bool:
         with self._connect() as conn:
             row = conn.execute("SELECT COUNT(1) AS c FROM requests").fetchone()
             return int(row["c"] or 0) == 0
 
-    def load_all(self) -> tuple[dict, dict]:
-        """Return (requests_db, approvals_db) matching the legacy in-memory shapes."""
+    def load_all(self, closed_before: str | None = None) -> tuple[dict, dict]:
+        """
+        Return (requests_db, approvals_db) matching the legacy in-memory shapes.
+
+        With `closed_before` (an ISO timestamp), requests that are closed and
+        whose created/modified/expires times are all older than it are left
+        out, together with their approvals; read them with get_request() or
+        query_requests().
+        """
         requests_db: dict = {}
         approvals_db: dict = {}
+        where, params = "", ()
+        if closed_before:
+            where = f" WHERE NOT ({_COLD_REQUEST_SQL})"
+            params = (*sorted(CLOSED_REQUEST_STATUSES), str(closed_before))
         with self._connect() as conn:
-            for row in conn.execute("SELECT request_id, payload_json FROM requests"):
+            for row in conn.execute("SELECT request_id, payload_json FROM requests" + where, params):
                 rid = str(row["request_id"])
                 try:
                     payload = json.loads(row["payload_json"] or "{}")
@@ -144,40 +307,152 @@ class NpamxStore:
                     requests_db[rid] = payload
 
             # approvals_db shape: { request_id: [ {approver_role, approved_at, ...}, ... ] }
-            for row in conn.execute(
-                "SELECT request_id, approver_role, approver_email, approved_at, payload_json FROM approvals ORDER BY id ASC"
-            ):
-                rid = str(row["request_id"])
-                approvals_db.setdefault(rid, [])
-                entry = {
-                    "approver_role": row["approver_role"],
-                    "approved_at": row["approved_at"],
-                }
-                if row["approver_email"]:
-                    entry["approver_email"] = row["approver_email"]
-                try:
-                    extra = json.loads(row["payload_json"] or "{}")
-                    if isinstance(extra, dict):
-                        entry.update(extra)
-                except Exception:
-                    pass
-                approvals_db[rid].append(entry)
+            approvals_sql = "SELECT request_id, approver_role, approver_email, approved_at, payload_json FROM approvals"
+            if where:
+                # Only the loaded requests' approvals, via their IDs rather than re-running the filter.
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS loaded_requests (request_id TEXT PRIMARY KEY);")
+                conn.execute("BEGIN;")
+                conn.execute("DELETE FROM temp.loaded_requests;")
+                conn.executemany("INSERT INTO temp.loaded_requests (request_id) VALUES (?);", ((rid,) for rid in requests_db))
+                conn.execute("COMMIT;")
+                approvals_sql += " WHERE request_id IN (SELECT request_id FROM temp.loaded_requests)"
+            for row in conn.execute(approvals_sql + " ORDER BY id ASC"):
+                approvals_db.setdefault(str(row["request_id"]), []).append(self._approval_entry(row))
+            if where:
+                conn.execute("DROP TABLE temp.loaded_requests;")
 
         return requests_db, approvals_db
 
-    def sync_from_memory(self, requests_db: dict, approvals_db: dict) -> None:
+    @staticmethod
+    def _approval_entry(row) -> dict:
+        entry = {
+            "approver_role": row["approver_role"],
+            "approved_at": row["approved_at"],
+        }
+        if row["approver_email"]:
+            entry["approver_email"] = row["approver_email"]
+        try:
+            extra = json.loads(row["payload_json"] or "{}")
+            if isinstance(extra, dict):
+                entry.update(extra)
+        except Exception:
+            pass
+        return entry
+
+    def get_request(self, request_id: str) -> tuple[dict, list] | None:
+        """(request, approvals) for one request, or None when it is not stored."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload_json FROM requests WHERE request_id = ?", (str(request_id),)).fetchone()
+            if row is None:
+                return None
+            try:
+                payload = json.loads(row["payload_json"] or "{}")
+            except Exception:
+                payload = {}
+            if not isinstance(payload, dict):
+                return None
+            approvals = [
+                self._approval_entry(r)
+                for r in conn.execute(
+                    "SELECT approver_role, approver_email, approved_at, payload_json FROM approvals WHERE request_id = ? ORDER BY id ASC",
+                    (str(request_id),),
+                )
+            ]
+        return payload, approvals
+
+    def query_requests(self, **criteria):
+        """
+        Yield (request_id, request) in insertion order for rows matching the
+        column criteria in _REQUEST_FILTER_SQL (each a list of normalized
+        values, any of which may match). Unknown criteria are ignored, so
+        callers must re-check the rows they get.
+        """
+        clauses, params = [], []
+        for name, values in criteria.items():
+            column = _REQUEST_FILTER_SQL.get(name)
+            if column is None or values is None:
+                continue
+            values = list(values)
+            if not values:
+                return
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        sql = "SELECT request_id, payload_json FROM requests"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        with self._connect() as conn:
+            for row in conn.execute(sql + " ORDER BY rowid", params):
+                try:
+                    payload = json.loads(row["payload_json"] or "{}")
+                except Exception:
+                    continue
+                if isinstance(payload, dict):
+                    yield str(row["request_id"]), payload
+
+    def request_summary(self, exclude_ids=()) -> list[dict]:
+        """
+        Per (user, permission_set) request counts and earliest created_at over
+        every stored request except `exclude_ids` (the ones held in memory),
+        both keys lowercased. Feeds admin analytics without loading payloads.
+
+        Totals come from idx_requests_user_norm and the excluded rows are
+        subtracted, so the scan never touches payload pages. first_created
+        still covers excluded rows: created_at does not change, and callers
+        merge it with the in-memory requests anyway.
+        """
+        user_sql, ps_sql = _REQUEST_FILTER_SQL["user"], _REQUEST_FILTER_SQL["permission_set"]
+        with self._connect() as conn:
+            totals = {
+                (row["user"], row["permission_set"]): [row["requests"], row["first_created"]]
+                for row in conn.execute(
+                    f"""
+                    SELECT {user_sql} AS user, {ps_sql} AS permission_set,
+                           COUNT(*) AS requests, MIN(NULLIF(created_at, '')) AS first_created
+                    FROM requests GROUP BY 1, 2
+                    """
+                )
+            }
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS resident_requests (request_id TEXT PRIMARY KEY);")
+            conn.execute("BEGIN;")
+            conn.execute("DELETE FROM temp.resident_requests;")
+            conn.executemany("INSERT OR IGNORE INTO temp.resident_requests (request_id) VALUES (?);", ((str(rid),) for rid in exclude_ids))
+            conn.execute("COMMIT;")
+            for row in conn.execute(
+                f"""
+                SELECT {user_sql} AS user, {ps_sql} AS permission_set, COUNT(*) AS requests
+                FROM requests WHERE request_id IN (SELECT request_id FROM temp.resident_requests) GROUP BY 1, 2
+                """
+            ):
+                totals[(row["user"], row["permission_set"])][0] -= row["requests"]
+            conn.execute("DROP TABLE temp.resident_requests;")
+        return [
+            {"user": user, "permission_set": ps, "requests": n, "first_created": first}
+            for (user, ps), (n, first) in totals.items()
+            if n > 0
+        ]
+
+    def sync_from_memory(self, requests_db: dict, approvals_db: dict, deleted=()) -> None:
         """
         Persist the current in-memory dictionaries to SQLite.
 
-        This is intentionally simple (full sync) to avoid missing edge cases while
-        the codebase is refactored.
+        This is intentionally simple (full sync of what is in memory) to avoid
+        missing edge cases while the codebase is refactored. Requests that are
+        not in memory (cold, see load_all) are left as they are, approvals
+        included; a resident request's approvals are exactly approvals_db's
+        entry for it (none when it has no entry); `deleted`
+        request IDs are removed along with their db_sessions and approvals.
         """
         reqs = requests_db or {}
         appr = approvals_db or {}
+        deleted = [str(rid) for rid in deleted or ()]
 
         with self._connect() as conn:
             conn.execute("BEGIN;")
             try:
+                # foreign_keys is per connection and off here, so cascade by hand.
+                for table in ("approvals", "db_sessions", "requests"):
+                    conn.executemany(f"DELETE FROM {table} WHERE request_id = ?;", ((rid,) for rid in deleted))
+
                 # Upsert requests
                 for rid, req in reqs.items():
                     if not isinstance(req, dict):
@@ -186,6 +461,7 @@ class NpamxStore:
                     rtype = str(req.get("type") or "")
                     user_email = str(req.get("user_email") or "")
                     account_id = str(req.get("account_id") or "")
+                    permission_set = str(req.get("permission_set") or "")
                     status = str(req.get("status") or "")
                     created_at = str(req.get("created_at") or "")
                     modified_at = str(req.get("modified_at") or "")
@@ -210,8 +486,8 @@ class NpamxStore:
                         """
                         INSERT INTO requests (
                             request_id, type, user_email, account_id, db_instance_id, db_name, engine,
-                            status, created_at, modified_at, expires_at, payload_json
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            status, created_at, modified_at, expires_at, payload_json, permission_set
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                         ON CONFLICT(request_id) DO UPDATE SET
                             type=excluded.type,
                             user_email=excluded.user_email,
@@ -223,7 +499,8 @@ class NpamxStore:
                             created_at=excluded.created_at,
                             modified_at=excluded.modified_at,
                             expires_at=excluded.expires_at,
-                            payload_json=excluded.payload_json;
+                            payload_json=excluded.payload_json,
+                            permission_set=excluded.permission_set;
                         """,
                         (
                             str(rid),
@@ -238,6 +515,7 @@ class NpamxStore:
                             modified_at,
                             expires_at,
                             payload_json,
+                            permission_set,
                         ),
                     )
 
@@ -286,8 +564,13 @@ class NpamxStore:
                             ),
                         )
 
-                # Approvals: simplest approach is to rebuild all rows from approvals_db.
-                conn.execute("DELETE FROM approvals;")
+                # Approvals: rebuild the rows of every resident request, including those whose
+                # approvals_db entry was dropped (modify_request resets approvals with del);
+                # cold requests keep theirs.
+                conn.executemany(
+                    "DELETE FROM approvals WHERE request_id = ?;",
+                    ((str(rid),) for rid in set(reqs) | set(appr)),
+                )
                 for rid, entries in (appr or {}).items():
                     if not isinstance(entries, list):
                         continue
@@ -310,6 +593,22 @@ class NpamxStore:
                 conn.execute("ROLLBACK;")
                 raise
 
+    def vault_role_holders(self, role_name: str, exclude_request_id: str = "") -> list[str]:
+        """
+        IDs of open (active/approved) requests whose DB session uses the Vault
+        role `role_name`, as last saved by any worker.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT s.request_id FROM db_sessions s JOIN requests r ON r.request_id = s.request_id
+                WHERE s.vault_role_name = ? AND s.request_id != ?
+                  AND lower(trim(coalesce(r.status, ''))) IN ('active', 'approved')
+                """,
+                (str(role_name or ""), str(exclude_request_id or "")),
+            ).fetchall()
+        return [str(row["request_id"]) for row in rows]
+
     def import_legacy_requests_json(self, json_path: str) -> tuple[int, int]:
         """
         One-time migration helper for legacy backend/data/requests.json.
@@ -345,26 +644,115 @@ class NpamxStore:
         error: str | None = None,
         query: str | None = None,
         payload: dict | None = None,
+        metrics: dict | None = None,
     ) -> None:
+        """Insert an audit row; `metrics` (query telemetry) goes to query_metrics in the same transaction."""
         with self._connect() as conn:
-            conn.execute(
-                """
-                INSERT INTO audit_logs (ts, user_email, request_id, role, action, allowed, rows_returned, error, query, payload_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            conn.execute("BEGIN")
+            try:
+                cur = conn.execute(
+                    """
+                    INSERT INTO audit_logs (ts, user_email, request_id, role, action, allowed, rows_returned, error, query, payload_json)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                    """,
+                    (
+                        ts or _utcnow_iso(),
+                        str(user_email or ""),
+                        str(request_id or ""),
+                        str(role or ""),
+                        str(action or ""),
+                        1 if allowed else 0,
+                        int(rows_returned) if rows_returned is not None else None,
+                        str(error or ""),
+                        str(query or ""),
+                        json.dumps(payload or {}, separators=(",", ":"), ensure_ascii=True),
+                    ),
+                )
+                if metrics:
+                    m = metrics
+                    conn.execute(
+                        """
+                        INSERT INTO query_metrics (audit_id, ts_epoch, source, user_email, instance, db_name, duration_ms,
+                                                   acquire_ms, first_row_ms, queue_ms, rows, bytes, truncated, error_class)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                        """,
+                        (
+                            cur.lastrowid,
+                            int(m.get("ts_epoch") or time.time()),
+                            str(m.get("source") or ""),
+                            str(user_email or ""),
+                            str(m.get("instance") or ""),
+                            str(m.get("db_name") or ""),
+                            _opt_float(m.get("duration_ms")),
+                            _opt_float(m.get("acquire_ms")),
+                            _opt_float(m.get("first_row_ms")),
+                            _opt_float(m.get("queue_ms")),
+                            int(m["rows"]) if m.get("rows") is not None else None,
+                            int(m["bytes"]) if m.get("bytes") is not None else None,
+                            1 if m.get("truncated") else 0,
+                            str(m.get("error_class") or ""),
+                        ),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def query_metrics_report(self, *, since_epoch: int, group_by: str = "instance", limit: int = 50) -> list[dict]:
+        """
+        Latency and volume per instance or per user since `since_epoch`,
+        heaviest (by bytes read) first.
+        """
+        column = {"instance": "instance", "user": "user_email"}.get(group_by)
+        if column is None:
+            raise ValueError("group_by must be 'instance' or 'user'")
+        groups: dict = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {column} AS grp, duration_ms, acquire_ms, first_row_ms, queue_ms, rows, bytes, truncated, error_class
+                FROM query_metrics
+                WHERE ts_epoch >= ?
                 """,
-                (
-                    ts or _utcnow_iso(),
-                    str(user_email or ""),
-                    str(request_id or ""),
-                    str(role or ""),
-                    str(action or ""),
-                    1 if allowed else 0,
-                    int(rows_returned) if rows_returned is not None else None,
-                    str(error or ""),
-                    str(query or ""),
-                    json.dumps(payload or {}, separators=(",", ":"), ensure_ascii=True),
-                ),
+                (int(since_epoch),),
             )
+            for row in rows:
+                g = groups.get(row["grp"])
+                if g is None:
+                    g = groups[row["grp"]] = {
+                        "durations": [], "acquire": [], "first_row": [], "queue": [],
+                        "queries": 0, "errors": 0, "truncated": 0, "rows": 0, "bytes": 0, "max_bytes": 0, "error_classes": {},
+                    }
+                g["queries"] += 1
+                for key, col in (("durations", "duration_ms"), ("acquire", "acquire_ms"), ("first_row", "first_row_ms"), ("queue", "queue_ms")):
+                    if row[col] is not None:
+                        g[key].append(row[col])
+                g["rows"] += int(row["rows"] or 0)
+                g["bytes"] += int(row["bytes"] or 0)
+                g["max_bytes"] = max(g["max_bytes"], int(row["bytes"] or 0))
+                g["truncated"] += int(row["truncated"] or 0)
+                if row["error_class"]:
+                    g["errors"] += 1
+                    g["error_classes"][row["error_class"]] = g["error_classes"].get(row["error_class"], 0) + 1
+
+        out = []
+        for key, g in groups.items():
+            out.append({
+                group_by: key,
+                "queries": g["queries"],
+                "errors": g["errors"],
+                "error_classes": g["error_classes"],
+                "truncated": g["truncated"],
+                "rows": g["rows"],
+                "bytes": g["bytes"],
+                "max_bytes": g["max_bytes"],
+                "duration_ms": _percentiles(g["durations"]),
+                "acquire_ms": _percentiles(g["acquire"]),
+                "first_row_ms": _percentiles(g["first_row"]),
+                "queue_ms": _percentiles(g["queue"]),
+            })
+        out.sort(key=lambda r: (r["bytes"], r["queries"]), reverse=True)
+        return out[: max(1, min(int(limit or 50), 1000))]
 
     def list_audit_logs(
         self,
@@ -398,3 +786,204 @@ class NpamxStore:
                 "payload": json.loads(row["payload_json"] or "{}"),
             })
         return out
+
+    def get_web_session(self, session_key: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM web_sessions WHERE session_key = ?", (str(session_key),)).fetchone()
+        return dict(row) if row else None
+
+    def insert_web_session(
+        self,
+        session_key: str,
+        *,
+        user_email: str,
+        auth_type: str,
+        created_epoch: int,
+        expires_epoch: int,
+        ip: str,
+        user_agent: str,
+        payload_json: str,
+        owner_email: str = "",
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO web_sessions (
+                    session_key, user_email, auth_type, created_epoch, last_seen_epoch, expires_epoch, ip, user_agent, payload_json, owner_email
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+                """,
+                (
+                    str(session_key),
+                    str(user_email or ""),
+                    str(auth_type or ""),
+                    int(created_epoch),
+                    int(created_epoch),
+                    int(expires_epoch),
+                    str(ip or "")[:64],
+                    str(user_agent or "")[:256],
+                    payload_json,
+                    str(owner_email or "").strip().lower(),
+                ),
+            )
+
+    def update_web_session(
+        self, session_key: str, *, user_email: str, auth_type: str, last_seen_epoch: int, payload_json: str, owner_email: str = ""
+    ) -> dict | None:
+        """
+        Replace an existing session's payload and bump its version. Returns
+        {version, created_epoch, expires_epoch}, or None when the session no
+        longer exists; a revoked session is never re-created by a late write.
+        """
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                UPDATE web_sessions SET
+                    user_email = ?,
+                    auth_type = ?,
+                    last_seen_epoch = MAX(last_seen_epoch, ?),
+                    payload_json = ?,
+                    owner_email = ?,
+                    version = version + 1
+                WHERE session_key = ?;
+                """,
+                (
+                    str(user_email or ""), str(auth_type or ""), int(last_seen_epoch), payload_json,
+                    str(owner_email or "").strip().lower(), str(session_key),
+                ),
+            )
+            if not cur.rowcount:
+                return None
+            row = conn.execute(
+                "SELECT version, created_epoch, expires_epoch FROM web_sessions WHERE session_key = ?", (str(session_key),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def touch_web_session(self, session_key: str, last_seen_epoch: int) -> bool:
+        """Record activity; False when the session no longer exists (revoked or purged)."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE web_sessions SET last_seen_epoch = MAX(last_seen_epoch, ?) WHERE session_key = ?",
+                (int(last_seen_epoch), str(session_key)),
+            )
+            return cur.rowcount > 0
+
+    def delete_web_sessions(self, *, session_keys=(), user_email: str = "") -> list[str]:
+        """Delete sessions by key and/or owner (SAML NameID or resolved email); returns the deleted keys."""
+        keys = [str(k) for k in (session_keys or ()) if k]
+        user_email = str(user_email or "").strip().lower()
+        if not keys and not user_email:
+            return []
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = []
+                if user_email:
+                    deleted += [r["session_key"] for r in conn.execute(
+                        "SELECT session_key FROM web_sessions WHERE user_email = ? OR owner_email = ?", (user_email, user_email)
+                    )]
+                    conn.execute("DELETE FROM web_sessions WHERE user_email = ? OR owner_email = ?", (user_email, user_email))
+                for key in keys:
+                    if conn.execute("DELETE FROM web_sessions WHERE session_key = ?", (key,)).rowcount:
+                        deleted.append(key)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    def list_web_sessions(self, *, idle_before: int, now: int, user_email: str = "", limit: int = 500) -> list[dict]:
+        """Sessions seen since `idle_before` and not past their absolute expiry, most recently active first."""
+        sql = (
+            "SELECT session_key, user_email, owner_email, auth_type, created_epoch, last_seen_epoch, expires_epoch, ip, user_agent "
+            "FROM web_sessions WHERE last_seen_epoch >= ? AND expires_epoch > ?"
+        )
+        params: list = [int(idle_before), int(now)]
+        if user_email:
+            sql += " AND (user_email = ? OR owner_email = ?)"
+            params += [str(user_email).strip().lower()] * 2
+        sql += " ORDER BY last_seen_epoch DESC LIMIT ?"
+        params.append(max(1, min(int(limit or 500), 5000)))
+        with self._connect() as conn:
+            return [dict(r) for r in conn.execute(sql, params)]
+
+    def purge_web_sessions(self, *, idle_before: int, now: int) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM web_sessions WHERE last_seen_epoch < ? OR expires_epoch <= ?",
+                (int(idle_before), int(now)),
+            ).rowcount
+
+    def save_scp_bulk_job(self, job: dict) -> None:
+        """Insert or replace a bulk SCP job snapshot (see scp_bulk.SCPBulkOperations)."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO scp_bulk_jobs (
+                    job_id, policy_id, action, requested_by, status, total, completed, counts_json, created_at, finished_at, targets_json
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job_id) DO UPDATE SET
+                    status = excluded.status,
+                    completed = excluded.completed,
+                    counts_json = excluded.counts_json,
+                    finished_at = excluded.finished_at,
+                    targets_json = excluded.targets_json;
+                """,
+                (
+                    str(job["job_id"]),
+                    str(job.get("policy_id") or ""),
+                    str(job.get("action") or ""),
+                    str(job.get("requested_by") or ""),
+                    str(job.get("status") or ""),
+                    int(job.get("total") or 0),
+                    int(job.get("completed") or 0),
+                    json.dumps(job.get("counts") or {}),
+                    str(job.get("created_at") or ""),
+                    str(job.get("finished_at") or ""),
+                    json.dumps(job.get("targets") or [], default=str),
+                ),
+            )
+
+    def get_scp_bulk_job(self, job_id: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM scp_bulk_jobs WHERE job_id = ?", (str(job_id),)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job["counts"] = json.loads(job.pop("counts_json") or "{}")
+        job["targets"] = json.loads(job.pop("targets_json") or "[]")
+        return job
+
+    def prune_scp_bulk_jobs(self, keep: int) -> int:
+        """Delete all but the `keep` most recent finished jobs. Returns the number deleted."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                """
+                DELETE FROM scp_bulk_jobs WHERE finished_at != '' AND job_id NOT IN (
+                    SELECT job_id FROM scp_bulk_jobs ORDER BY created_at DESC LIMIT ?
+                );
+                """,
+                (int(keep),),
+            )
+            return int(cur.rowcount or 0)
+
+    def record_identity_invalidation(self, *, nameid: str = "", email: str = "", user_id: str = "", keep_seconds: int = 86400) -> int:
+        """Append an identity cache invalidation (all fields empty: clear everything); returns its sequence number."""
+        now = int(time.time())
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO identity_cache_invalidations (nameid, email, user_id, created_epoch) VALUES (?, ?, ?, ?)",
+                (str(nameid or ""), str(email or ""), str(user_id or ""), now),
+            )
+            conn.execute("DELETE FROM identity_cache_invalidations WHERE created_epoch < ?", (now - int(keep_seconds),))
+            return int(cur.lastrowid)
+
+    def identity_invalidations_since(self, seq: int) -> list[dict]:
+        with self._connect() as conn:
+            return [dict(r) for r in conn.execute(
+                "SELECT seq, nameid, email, user_id FROM identity_cache_invalidations WHERE seq > ? ORDER BY seq", (int(seq),)
+            )]
+
+    def last_identity_invalidation(self) -> int:
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(seq) AS seq FROM identity_cache_invalidations").fetchone()
+        return int(row["seq"] or 0)
@@ -0,0 +1,408 @@
+"""
+Policy decision point over every rule source
+============================================
+
+An access request used to pass through independent evaluators, each
+re-reading its own config and walking its own lists: AccessRules (group
+service restrictions), EnforcementEngine over org_policies.json,
+StrictPolicies (forbidden / configurable actions, duration, approval) and
+PolicyTemplateEngine (glob action patterns re-compiled as regexes per call).
+`POLICY_ENGINE.decide()` evaluates them from one compiled structure:
+
+- access rules bucketed by group, so a user only visits rules for groups
+  they are in
+- org policy role restrictions and the destructive-action check as one
+  compiled substring matcher each
+- strict action lists as hash sets
+- template action patterns as a `PatternSet`: exact names in a hash set,
+  `prefix*` patterns in a character trie, anything else as precompiled
+  regexes
+
+Compiled state is keyed on the CONFIG_REGISTRY versions of
+access_rules.json, org_policies.json and policy_config.json, so an edit
+takes effect on the next decision. Templates are compiled per
+(template, updated_at).
+
+A decision is a dict: allowed, effect (ALLOW / WARN / DENY), the denying
+stage with its error and guidance, org policy violations, approval fields
+and a trace with one entry per evaluated stage. Evaluation stops at the
+first DENY, in the order of `stages`. Entry points pass the stages they
+enforce, so each endpoint keeps the checks and messages it had.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from datetime import datetime
+
+from access_rules import AccessRules
+from config_registry import CONFIG_REGISTRY
+from strict_policies import StrictPolicies
+
+DEFAULT_STAGES = ("access_rules", "org_policies", "strict_actions", "duration", "approval")
+
+_REGEX_SPECIALS = set(".^$+?{}[]\\|()")
+_READ_PREFIXES = ("get", "list", "describe", "read", "view", "fetch", "query", "scan")
+_ESCALATION_MARKERS = ("createuser", "createrole", "attachpolicy")
+_DESTRUCTIVE_MARKERS = ("delete", "terminate", "remove")
+
+
+def _substring_matcher(needles):
+    """Compiled equivalent of `any(n in text for n in needles)`; None when there are no needles."""
+    needles = [str(n) for n in (needles or [])]
+    if not needles:
+        return None
+    return re.compile("|".join(re.escape(n) for n in sorted(set(needles), key=len, reverse=True)))
+
+
+class PatternSet:
+    """Action patterns with '*' wildcards, matched as PolicyTemplateEngine._matches_pattern does."""
+
+    _END = ""  # trie terminal key; real keys are single characters
+
+    def __init__(self, patterns=()):
+        self.exact = {}
+        self.trie = {}
+        self.other = []
+        for pattern in patterns or ():
+            self.add(str(pattern))
+
+    def add(self, pattern: str) -> None:
+        body = pattern[:-1] if pattern.endswith("*") else pattern
+        literal = "*" not in body and not (_REGEX_SPECIALS & set(body))
+        if literal and not pattern.endswith("*"):
+            self.exact.setdefault(pattern, pattern)
+        elif literal:
+            node = self.trie
+            for ch in body:
+                node = node.setdefault(ch, {})
+            node.setdefault(self._END, pattern)
+        else:
+            self.other.append((pattern, re.compile(f"^{pattern.replace('*', '.*')}$")))
+
+    def match(self, value):
+        """First pattern matching `value`, or None."""
+        value = str(value)
+        hit = self.exact.get(value)
+        if hit is not None:
+            return hit
+        node = self.trie
+        if self._END in node:
+            return node[self._END]
+        for ch in value:
+            node = node.get(ch)
+            if node is None:
+                break
+            if self._END in node:
+                return node[self._END]
+        for pattern, rx in self.other:
+            if rx.match(value):
+                return pattern
+        return None
+
+    def __len__(self):
+        return len(self.exact) + len(self.other) + self._count(self.trie)
+
+    def _count(self, node) -> int:
+        return sum(1 if k == self._END else self._count(v) for k, v in node.items())
+
+
+class _Compiled:
+    """Everything decide() needs from the config files, built once per config version."""
+
+    def __init__(self):
+        rules = AccessRules.get_rules().get("rules") or []
+        self.access_rules = [r for r in rules if isinstance(r, dict)]
+        self.rules_by_group = {}
+        for pos, rule in enumerate(self.access_rules):
+            if not rule.get("enabled"):
+                continue
+            for group in rule.get("groups") or []:
+                if isinstance(group, str):
+                    positions = self.rules_by_group.setdefault(group, [])
+                    if not positions or positions[-1] != pos:
+                        positions.append(pos)
+
+        self.org = CONFIG_REGISTRY.get("org_policies") or {}
+        self.role_forbidden = {
+            role: _substring_matcher((policy or {}).get("forbidden_actions"))
+            for role, policy in (self.org.get("roles") or {}).items()
+        }
+        self.destructive = _substring_matcher(_DESTRUCTIVE_MARKERS)
+        self.admin_marker = _substring_matcher(["admin"])
+
+        self.strict = StrictPolicies._current_config()
+        self.always_forbidden = frozenset(StrictPolicies.ALWAYS_FORBIDDEN_ACTIONS)
+        self.configurable_delete = frozenset(StrictPolicies.CONFIGURABLE_DELETE_ACTIONS)
+        self.read_marker = _substring_matcher(_READ_PREFIXES)
+        self.escalation_marker = _substring_matcher(_ESCALATION_MARKERS)
+
+
+class PolicyDecisionPoint:
+    def __init__(self):
+        self._entry = (None, None)
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.counters = {"decisions": 0, "compiles": 0}
+
+    # ------------------------------------------------------------------
+    # Compilation
+    # ------------------------------------------------------------------
+
+    def _key(self):
+        return (
+            CONFIG_REGISTRY.entry_version("access_rules"),
+            CONFIG_REGISTRY.entry_version("org_policies"),
+            CONFIG_REGISTRY.entry_version("strict_policies"),
+        )
+
+    def compiled(self) -> _Compiled:
+        key = self._key()
+        cached_key, compiled = self._entry
+        if cached_key == key:
+            return compiled
+        with self._lock:
+            cached_key, compiled = self._entry
+            if cached_key != key:
+                compiled = _Compiled()
+                self._entry = (key, compiled)
+                self.counters["compiles"] += 1
+            return compiled
+
+    def _template_patterns(self, template, level_name, level_config):
+        key = (template["id"], level_name)
+        stamp = template.get("updated_at")
+        cached = self._templates.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        config = template["config"]
+        patterns = (
+            PatternSet((config.get("global_guardrails") or {}).get("always_deny", [])),
+            PatternSet(level_config.get("denied_actions", [])),
+            PatternSet(level_config.get("allowed_actions", [])),
+        )
+        self._templates[key] = (stamp, patterns)
+        return patterns
+
+    # ------------------------------------------------------------------
+    # Stages
+    # ------------------------------------------------------------------
+
+    def _access_rules(self, c: _Compiled, ctx: dict):
+        """Group service restrictions, as request_access applied AccessRules."""
+        positions = set()
+        for group in ctx.get("user_groups") or []:
+            positions.update(c.rules_by_group.get(group, ()) if isinstance(group, str) else ())
+        if not positions:
+            return None, "no restricting rule for the user's groups"
+        use_case = str(ctx.get("use_case") or "").lower()
+        selected = ctx.get("selected_services")
+        for pos in sorted(positions):
+            rule = c.access_rules[pos]
+            for denied in rule.get("denied_services", []):
+                if selected is not None:
+                    hit = denied.lower() in use_case or denied in selected
+                else:
+                    hit = denied in use_case
+                if hit:
+                    allowed_services = ", ".join([s.upper() for s in rule.get("allowed_services", [])])
+                    error = (
+                        f"❌ Access Denied\n\nYour group is restricted from requesting {denied.upper()} access.\n\n"
+                        f"Allowed services: {allowed_services}\n\nContact your administrator for access to other services."
+                    )
+                    return {"error": error, "rule": rule.get("id") or pos, "service": denied}, f"rule {rule.get('id') or pos} denies {denied}"
+        return None, f"{len(positions)} group rule(s) checked, none denies the request"
+
+    def _org_policies(self, c: _Compiled, ctx: dict):
+        """EnforcementEngine.enforce_policy over the compiled org policies."""
+        org = c.org
+        violations = []
+        account_id = ctx.get("account_id")
+        account_policy = (org.get("accounts") or {}).get(account_id, {})
+
+        if account_policy.get("jit_required") and not ctx.get("is_jit"):
+            violations.append({"rule": "JIT_REQUIRED", "message": f"Account {account_id} requires JIT access only", "severity": "BLOCK"})
+
+        max_duration = account_policy.get("max_duration_hours", 120)
+        if ctx.get("duration_hours", 0) > max_duration:
+            violations.append({"rule": "MAX_DURATION_EXCEEDED", "message": f"Max duration for this account is {max_duration}h", "severity": "BLOCK"})
+
+        env = account_policy.get("environment", "nonprod")
+        env_policy = (org.get("environments") or {}).get(env, {})
+        actions = (ctx.get("ai_permissions") or {}).get("actions", [])
+
+        if env == "prod" and not env_policy.get("allow_delete", False):
+            destructive = [a for a in actions if c.destructive.search(a.lower())]
+            if destructive:
+                violations.append({
+                    "rule": "PROD_DELETE_BLOCKED",
+                    "message": f"Delete operations blocked in production: {destructive}",
+                    "severity": "BLOCK",
+                    "contact": (org.get("contacts") or {}).get("delete_operations"),
+                })
+
+        forbidden = c.role_forbidden.get(ctx.get("user_role", "user"))
+        blocked = [a for a in actions if forbidden.search(a.lower())] if forbidden else []
+        if blocked:
+            violations.append({"rule": "ROLE_FORBIDDEN_ACTION", "message": f"Your role cannot request: {blocked}", "severity": "BLOCK"})
+
+        if (org.get("time_restrictions") or {}).get("business_hours_only"):
+            hour = datetime.now().hour
+            if hour < 9 or hour > 17:
+                violations.append({"rule": "BUSINESS_HOURS_ONLY", "message": "Requests only allowed during business hours (9 AM - 5 PM)", "severity": "BLOCK"})
+
+        approval_policy = org.get("approvals") or {}
+        approvers = []
+        if env == "prod":
+            approvers.extend(approval_policy.get("prod_approvers", ["manager", "security_lead"]))
+        if any(c.admin_marker.search(a.lower()) for a in actions):
+            approvers.extend(approval_policy.get("admin_approvers", ["manager", "security_lead", "ciso"]))
+
+        if any(v["severity"] == "BLOCK" for v in violations):
+            return "DENY", violations, approvers
+        return ("WARN" if violations else "ALLOW"), violations, approvers
+
+    def validate_actions(self, actions, account_environment="nonprod", compiled: _Compiled | None = None):
+        """StrictPolicies.validate_actions from hash sets and compiled matchers: (is_valid, error, guidance)."""
+        if not actions or not isinstance(actions, list):
+            return False, "Actions must be a non-empty list", None
+        c = compiled or self.compiled()
+        contacts = c.strict["contact_emails"]
+        is_prod = account_environment in ["prod", "production"]
+        for action in actions:
+            action_lower = action.lower()
+            if action in c.always_forbidden:
+                if any(create_word in action_lower for create_word in ["create", "runinstances"]):
+                    guidance = f"Infrastructure provisioning requests should be submitted through DevOps. Please contact {contacts['create']} or create a JIRA ticket."
+                    return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", guidance
+                if "iam:" in action_lower or "assumerole" in action_lower:
+                    guidance = f"IAM and security actions require special approval. Please contact {contacts['iam']}."
+                    return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", guidance
+                return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", None
+
+            if action in c.configurable_delete:
+                if is_prod and not c.strict["allow_delete_prod"]:
+                    guidance = f"Delete actions in production require special approval. Please contact {contacts['delete']} for L3-Delete permission set requests."
+                    return False, "❌ Delete actions disabled in production", guidance
+                if not is_prod and not c.strict["allow_delete_nonprod"]:
+                    guidance = f"Delete actions are currently disabled. Please contact {contacts['delete']} for delete permission requests."
+                    return False, "❌ Delete actions disabled", guidance
+
+            if "*" in action and not c.read_marker.search(action_lower):
+                return False, f"❌ POLICY VIOLATION: Wildcard action '{action}' is not allowed for write operations", None
+
+            if c.escalation_marker.search(action_lower):
+                return False, f"❌ POLICY VIOLATION: Action '{action}' can lead to privilege escalation", None
+        return True, None, None
+
+    def evaluate_template(self, org_id, user_role, user_team, requested_actions, account_env):
+        """PolicyTemplateEngine.validate_request_against_template with compiled patterns."""
+        # Imported here: the template module seeds its demo template on import.
+        from policy_template_engine import PolicyTemplateEngine
+
+        template = PolicyTemplateEngine.get_template(org_id)
+        if not template:
+            return False, [], [], True
+        user_level = PolicyTemplateEngine.map_user_to_level(org_id, user_role, user_team)
+        if not user_level:
+            return False, [], [], True
+        level_config = user_level["config"]
+        global_deny, level_deny, level_allow = self._template_patterns(template, user_level["level"], level_config)
+        allowed, denied = [], []
+        for action in requested_actions:
+            if global_deny.match(action) is not None or level_deny.match(action) is not None:
+                denied.append(action)
+            elif level_allow.match(action) is not None:
+                allowed.append(action)
+            else:
+                denied.append(action)
+        approval_required = level_config.get("requires_approval", False)
+        account_rules = (template["config"].get("account_classifications") or {}).get(account_env)
+        if account_rules and account_rules.get("requires_dual_approval"):
+            approval_required = True
+        return len(allowed) > 0, allowed, denied, approval_required
+
+    # ------------------------------------------------------------------
+    # Decision
+    # ------------------------------------------------------------------
+
+    def decide(self, ctx: dict, stages=DEFAULT_STAGES) -> dict:
+        """
+        One decision for an access request. ctx carries the request fields
+        (account_id, account_env, use_case, ai_permissions / actions,
+        duration_hours, user_role, is_jit) plus user_groups (local group ids),
+        optional selected_services, and org_id / user_team for the template stage.
+        """
+        c = self.compiled()
+        self.counters["decisions"] += 1
+        decision = {
+            "allowed": True, "effect": "ALLOW", "stage": "", "error": "", "guidance": None,
+            "violations": [], "approval_required": False, "approval_type": "self",
+            "required_approvers": [], "trace": [],
+        }
+        env = ctx.get("account_env") or "nonprod"
+        actions = ctx.get("actions")
+        if actions is None:
+            actions = (ctx.get("ai_permissions") or {}).get("actions", [])
+        trace = decision["trace"]
+
+        def deny(stage, error, guidance=None):
+            decision.update(allowed=False, effect="DENY", stage=stage, error=error, guidance=guidance)
+            return decision
+
+        for stage in stages:
+            if stage == "access_rules":
+                hit, detail = self._access_rules(c, ctx)
+                trace.append({"stage": stage, "effect": "DENY" if hit else "ALLOW", "detail": detail})
+                if hit:
+                    return deny(stage, hit["error"])
+            elif stage == "org_policies":
+                effect, violations, approvers = self._org_policies(c, ctx)
+                decision["violations"] = violations
+                decision["required_approvers"] = approvers
+                trace.append({"stage": stage, "effect": effect, "detail": [v["rule"] for v in violations]})
+                if effect == "DENY":
+                    return deny(stage, "Request blocked by organizational policy")
+                if effect == "WARN":
+                    decision["effect"] = "WARN"
+            elif stage == "strict_actions":
+                ok, error, guidance = self.validate_actions(actions, env, compiled=c)
+                trace.append({"stage": stage, "effect": "ALLOW" if ok else "DENY", "detail": error or f"{len(actions)} action(s) allowed"})
+                if not ok:
+                    return deny(stage, error, guidance)
+            elif stage == "duration":
+                ok, error = StrictPolicies.validate_duration(ctx.get("duration_hours", 8), env)
+                trace.append({"stage": stage, "effect": "ALLOW" if ok else "DENY", "detail": error or f"within {env} limit"})
+                if not ok:
+                    return deny(stage, error)
+            elif stage == "approval":
+                required, approval_type = StrictPolicies.requires_approval(actions, env)
+                decision["approval_required"] = decision["approval_required"] or required
+                decision["approval_type"] = approval_type
+                trace.append({"stage": stage, "effect": "ALLOW", "detail": approval_type})
+            elif stage == "template":
+                ok, allowed, denied, required = self.evaluate_template(
+                    ctx.get("org_id"), str(ctx.get("user_role") or ""), ctx.get("user_team"), actions, env
+                )
+                decision["approval_required"] = decision["approval_required"] or required
+                trace.append({"stage": stage, "effect": "ALLOW" if ok else "DENY", "detail": {"allowed": allowed, "denied": denied}})
+                if not ok:
+                    return deny(stage, f"No requested action is allowed by the policy template: {denied}")
+            else:
+                raise ValueError(f"unknown policy stage: {stage}")
+        return decision
+
+    def stats(self) -> dict:
+        key, compiled = self._entry
+        return {
+            **self.counters,
+            "config_versions": dict(zip(("access_rules", "org_policies", "strict_policies"), key or ())),
+            "access_rules": len(compiled.access_rules) if compiled else 0,
+            "rule_groups": len(compiled.rules_by_group) if compiled else 0,
+            "compiled_templates": len(self._templates),
+        }
+
+
+# Process-wide decision point used by app.py and StrictPolicies.validate_actions.
+POLICY_ENGINE = PolicyDecisionPoint()
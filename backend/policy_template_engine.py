@@ -1,7 +1,16 @@
 # Policy Template Engine - Organization-specific privilege configurations
 
 import json
+import re
 from datetime import datetime
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def _compiled_pattern(pattern):
+    regex_pattern = pattern.replace('*', '.*')
+    return re.compile(f"^{regex_pattern}$")
+
 
 class PolicyTemplateEngine:
     """
@@ -149,60 +158,13 @@ class PolicyTemplateEngine:
         Validate if requested actions are allowed per org template
         Returns: (is_valid, allowed_actions, denied_actions, approval_required)
         """
-        template = PolicyTemplateEngine.get_template(org_id)
-        if not template:
-            return False, [], [], True
-        
-        config = template['config']
-        user_level = PolicyTemplateEngine.map_user_to_level(org_id, user_role, user_team)
-        
-        if not user_level:
-            return False, [], [], True
-        
-        level_config = user_level['config']
-        
-        # Check global guardrails first
-        global_deny = config.get('global_guardrails', {}).get('always_deny', [])
-        
-        allowed = []
-        denied = []
-        
-        for action in requested_actions:
-            # Check global deny list
-            if any(PolicyTemplateEngine._matches_pattern(action, deny_pattern) for deny_pattern in global_deny):
-                denied.append(action)
-                continue
-            
-            # Check level-specific deny list
-            level_deny = level_config.get('denied_actions', [])
-            if any(PolicyTemplateEngine._matches_pattern(action, deny_pattern) for deny_pattern in level_deny):
-                denied.append(action)
-                continue
-            
-            # Check level-specific allow list
-            level_allow = level_config.get('allowed_actions', [])
-            if any(PolicyTemplateEngine._matches_pattern(action, allow_pattern) for allow_pattern in level_allow):
-                allowed.append(action)
-            else:
-                denied.append(action)
-        
-        # Check if approval required
-        approval_required = level_config.get('requires_approval', False)
-        
-        # Check account-specific rules
-        if account_env in config.get('account_classifications', {}):
-            account_rules = config['account_classifications'][account_env]
-            if account_rules.get('requires_dual_approval'):
-                approval_required = True
-        
-        return len(allowed) > 0, allowed, denied, approval_required
+        from policy_engine import POLICY_ENGINE
+        return POLICY_ENGINE.evaluate_template(org_id, user_role, user_team, requested_actions, account_env)
     
     @staticmethod
     def _matches_pattern(action, pattern):
         """Check if action matches pattern (supports wildcards)"""
-        import re
-        regex_pattern = pattern.replace('*', '.*')
-        return re.match(f"^{regex_pattern}$", action) is not None
+        return _compiled_pattern(pattern).match(action) is not None
     
     @staticmethod
     def _validate_template(template_config):
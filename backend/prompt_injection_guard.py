@@ -2,6 +2,8 @@
 
 import re
 
+from sql_lexer import SQLPolicy, analyze
+
 # Max input length to prevent overflow attacks
 MAX_INPUT_LENGTH = 2000
 
@@ -87,29 +89,26 @@ ROLE_ALLOWED_KEYWORDS = {
                         'MERGE', 'ANALYZE', 'TRUNCATE', 'CREATE', 'ALTER', 'DROP', 'RENAME'],
     'admin': None,  # All allowed (except always-blocked)
 }
+# Keyword / keyword-pair rules, matched on SQL tokens (not inside literals or comments).
 ALWAYS_BLOCKED = [
     ('DROP DATABASE', 'Database deletion is not allowed'),
+    ('DROP SCHEMA', 'Database deletion is not allowed'),
     ('DROP USER', 'User deletion is not allowed'),
     ('CREATE USER', 'User creation requires admin role'),
-    ('GRANT ', 'Grant requires admin role'),
-    ('REVOKE ', 'Revoke requires admin role'),
+    ('GRANT', 'Grant requires admin role'),
+    ('REVOKE', 'Revoke requires admin role'),
     ('SHUTDOWN', 'Shutdown is not allowed'),
-    ('SYSTEM ', 'System commands are not allowed'),
+    ('SYSTEM', 'System commands are not allowed'),
 ]
+# Allow GRANT/REVOKE only for admin role (still blocked for others).
+_ADMIN_EXEMPT = ('GRANT', 'REVOKE')
+_ROLE_POLICY = SQLPolicy(ALWAYS_BLOCKED)
+_ADMIN_POLICY = SQLPolicy([r for r in ALWAYS_BLOCKED if r[0] not in _ADMIN_EXEMPT])
 
 
 def _get_first_sql_keyword(query):
     """Extract first SQL keyword from query (handles comments)."""
-    q = query.strip()
-    while q.upper().startswith('--') or q.upper().startswith('/*'):
-        if q.upper().startswith('--'):
-            idx = q.find('\n')
-            q = q[idx + 1:].strip() if idx >= 0 else ''
-        else:
-            idx = q.find('*/')
-            q = q[idx + 2:].strip() if idx >= 0 else ''
-    m = re.match(r'^(\w+)', q, re.IGNORECASE)
-    return m.group(1).upper() if m else ''
+    return analyze(query).first_keyword
 
 
 def validate_sql_query(query, role='read_only'):
@@ -120,24 +119,21 @@ def validate_sql_query(query, role='read_only'):
     if not query or not isinstance(query, str):
         return False, "Query is required"
     
-    query_upper = query.strip().upper()
-    
-    for pattern, msg in ALWAYS_BLOCKED:
-        if pattern in query_upper:
-            # Allow GRANT/REVOKE only for admin role (still blocked for others).
-            if role == 'admin' and pattern in ('GRANT ', 'REVOKE '):
-                continue
-            return False, f"❌ SECURITY: {msg}"
+    analysis = (_ADMIN_POLICY if role == 'admin' else _ROLE_POLICY).evaluate(query)
+    if analysis.error:
+        return False, f"❌ SECURITY: {analysis.error}"
+    if analysis.denied:
+        return False, f"❌ SECURITY: {analysis.denied}"
     
     if role == 'admin':
         return True, None
     
-    keyword = _get_first_sql_keyword(query)
-    if not keyword:
+    if not analysis.statements or not all(s.keyword for s in analysis.statements):
         return False, "Invalid query"
     
     allowed = ROLE_ALLOWED_KEYWORDS.get(role, ROLE_ALLOWED_KEYWORDS['read_only'])
-    if keyword not in allowed:
-        return False, f"❌ SECURITY: {keyword} is not allowed for role '{role}'. Allowed: {', '.join(allowed)}"
+    for stmt in analysis.statements:
+        if stmt.verb not in allowed:
+            return False, f"❌ SECURITY: {stmt.verb} is not allowed for role '{role}'. Allowed: {', '.join(allowed)}"
     
     return True, None
@@ -0,0 +1,426 @@
+"""
+Admission control for PAM terminal queries
+==========================================
+
+`execute_database_query` had no concurrency control beyond the per-endpoint
+rate limit, so one user firing many parallel heavy queries (or an AI chat
+loop) could tie up every gunicorn thread and the target database's
+connection budget. Every statement now needs a slot:
+
+- at most `max_per_user` in flight per user, `max_per_session` per JIT
+  session and `max_per_instance` per database instance
+- a caller over a cap waits in a short queue (`max_wait` seconds); freed
+  slots go to waiting users round-robin, FIFO within a user, so one user's
+  backlog cannot starve everyone else
+- when the queue is full (`max_queue` overall, `max_queue_per_user` per
+  user) or the wait times out, `AdmissionRejected` carries a Retry-After hint
+  for a 429
+
+`stats()` reports in-flight counts, queue depth, wait-time percentiles and
+outcome counters.
+
+The caps count slots across every gunicorn worker on the host: admitted
+slots are also rows in a shared SQLite file (`SQLiteSlotLedger`; WAL, one
+row per in-flight statement). Waiters re-check it every
+`_SHARED_POLL_SECONDS`, since slots freed by another worker do not wake
+them. Rows of crashed workers are swept by pid and by lease expiry. On a
+database error admission falls back to this process's counts.
+DB_QUERY_ADMISSION_BACKEND=sqlite|memory selects the backend (memory: caps
+apply per worker); DB_QUERY_ADMISSION_SQLITE_PATH sets the shared file.
+"""
+
+from __future__ import annotations
+
+import collections
+import math
+import os
+import sqlite3
+import threading
+import time
+
+_WINDOW = 1000
+_SHARED_POLL_SECONDS = 0.05
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int, message: str = ""):
+        super().__init__(message or f"Too many concurrent queries ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("user", "session", "instance", "event", "admitted", "slot_id", "enqueued_at")
+
+    def __init__(self, user: str, session: str, instance: str):
+        self.user = user
+        self.session = session
+        self.instance = instance
+        self.event = threading.Event()
+        self.admitted = False
+        self.slot_id = None
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionTicket:
+    """Held slot; release exactly once (context manager or release())."""
+
+    __slots__ = ("_controller", "user", "session", "instance", "slot_id", "admitted_at", "waited_ms", "_released")
+
+    def __init__(self, controller, user, session, instance, waited_ms, slot_id=None):
+        self._controller = controller
+        self.user = user
+        self.session = session
+        self.instance = instance
+        self.slot_id = slot_id
+        self.admitted_at = time.monotonic()
+        self.waited_ms = waited_ms
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class release_after:
+    """
+    Wrap a streaming response body so the ticket is released when the stream
+    ends or the server closes it. The server calls close() even when the body
+    was never iterated, which a generator's `finally` would miss.
+    """
+
+    def __init__(self, iterable, ticket: AdmissionTicket):
+        self._it = iter(iterable)
+        self._ticket = ticket
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._it)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        try:
+            close = getattr(self._it, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._ticket.release()
+
+
+class SQLiteSlotLedger:
+    """In-flight admission slots in a SQLite file shared by all workers on the host."""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, lease_seconds: float = 900, sweep_interval: float = 30, busy_timeout_ms: int = 200):
+        self.path = path
+        self._lease_seconds = float(lease_seconds)
+        self._sweep_interval = float(sweep_interval)
+        self._busy_timeout_ms = int(busy_timeout_ms)
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        self.counters = {"swept": 0}
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS admission_slots ("
+            "slot_id INTEGER PRIMARY KEY, pid INTEGER NOT NULL, user_email TEXT, session_id TEXT, instance TEXT, expires_epoch REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_admission_user ON admission_slots(user_email)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_admission_session ON admission_slots(session_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_admission_instance ON admission_slots(instance)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE below).
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout_ms / 1000.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Slot rows are disposable; skip fsync on every query.
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drop expired leases and rows left by workers that died holding slots."""
+        swept = conn.execute("DELETE FROM admission_slots WHERE expires_epoch <= ?", (now,)).rowcount
+        for (pid,) in conn.execute("SELECT DISTINCT pid FROM admission_slots").fetchall():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                swept += conn.execute("DELETE FROM admission_slots WHERE pid = ?", (pid,)).rowcount
+            except OSError:
+                pass
+        self.counters["swept"] += swept
+
+    def try_take(self, user: str, session: str, instance: str, limits: dict) -> tuple[str, int | None]:
+        """Check the caps against every worker's slots and take one atomically: ('', slot_id) or (cap, None)."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if now >= self._next_sweep:
+                self._next_sweep = now + self._sweep_interval
+                self._sweep(conn, now)
+            for cap, column, value in (("user", "user_email", user), ("session", "session_id", session), ("instance", "instance", instance)):
+                held = conn.execute(f"SELECT COUNT(*) FROM admission_slots WHERE {column} = ?", (value,)).fetchone()[0]
+                if held >= limits[cap]:
+                    conn.execute("COMMIT")
+                    return cap, None
+            cur = conn.execute(
+                "INSERT INTO admission_slots (pid, user_email, session_id, instance, expires_epoch) VALUES (?, ?, ?, ?, ?)",
+                (os.getpid(), user, session, instance, now + self._lease_seconds),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return "", cur.lastrowid
+
+    def release(self, slot_id: int) -> None:
+        self._conn().execute("DELETE FROM admission_slots WHERE slot_id = ?", (int(slot_id),))
+
+    def stats(self) -> dict:
+        try:
+            in_flight = self._conn().execute("SELECT COUNT(*) FROM admission_slots").fetchone()[0]
+        except sqlite3.Error:
+            in_flight = None
+        return {"backend": self.backend, "path": self.path, "in_flight": in_flight, **self.counters}
+
+
+class QueryAdmission:
+    def __init__(
+        self,
+        *,
+        max_per_user: int = 2,
+        max_per_session: int = 2,
+        max_per_instance: int = 8,
+        max_queue: int = 32,
+        max_queue_per_user: int = 4,
+        max_wait: float = 5,
+        ledger: SQLiteSlotLedger | None = None,
+    ):
+        self.max_per_user = max(1, int(max_per_user))
+        self.max_per_session = max(1, int(max_per_session))
+        self.max_per_instance = max(1, int(max_per_instance))
+        self.max_queue = max(0, int(max_queue))
+        self.max_queue_per_user = max(0, int(max_queue_per_user))
+        self.max_wait = max(0.0, float(max_wait))
+        self._ledger = ledger
+        self._next_shared_dispatch = 0.0
+        self._lock = threading.Lock()
+        self._by_user = collections.Counter()
+        self._by_session = collections.Counter()
+        self._by_instance = collections.Counter()
+        # user -> FIFO of waiters; the OrderedDict order is the round-robin order.
+        self._queues: collections.OrderedDict = collections.OrderedDict()
+        self._queued = 0
+        self._max_queued_seen = 0
+        self._wait_ms = collections.deque(maxlen=_WINDOW)
+        self._hold_ms = collections.deque(maxlen=_WINDOW)
+        self.counters = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_wait_timeout": 0, "shared_errors": 0}
+
+    # ---- slot accounting (lock held) ----
+
+    def _fits(self, user: str, session: str, instance: str) -> str:
+        if self._by_user[user] >= self.max_per_user:
+            return "user"
+        if self._by_session[session] >= self.max_per_session:
+            return "session"
+        if self._by_instance[instance] >= self.max_per_instance:
+            return "instance"
+        return ""
+
+    def _admit(self, user: str, session: str, instance: str) -> tuple[str, int | None]:
+        """Take a slot if every cap allows it: ('', shared slot id or None) or (cap that was hit, None)."""
+        cap = self._fits(user, session, instance)
+        if cap:
+            return cap, None
+        slot_id = None
+        if self._ledger is not None:
+            limits = {"user": self.max_per_user, "session": self.max_per_session, "instance": self.max_per_instance}
+            try:
+                cap, slot_id = self._ledger.try_take(user, session, instance, limits)
+            except sqlite3.Error:
+                self.counters["shared_errors"] += 1
+            if cap:
+                return cap, None
+        self._by_user[user] += 1
+        self._by_session[session] += 1
+        self._by_instance[instance] += 1
+        self.counters["admitted"] += 1
+        return "", slot_id
+
+    def _dispatch(self) -> None:
+        """Hand freed slots to waiters: round-robin across users, FIFO within a user."""
+        progress = True
+        while progress and self._queued:
+            progress = False
+            for user in list(self._queues):
+                queue = self._queues[user]
+                for w in queue:
+                    cap, slot_id = self._admit(w.user, w.session, w.instance)
+                    if not cap:
+                        queue.remove(w)
+                        self._queued -= 1
+                        w.slot_id = slot_id
+                        w.admitted = True
+                        w.event.set()
+                        progress = True
+                        break
+                if not queue:
+                    del self._queues[user]
+                elif progress:
+                    # Served: this user goes to the back of the rotation.
+                    self._queues.move_to_end(user)
+                if progress:
+                    break
+
+    def _retry_after(self) -> int:
+        holds = self._hold_ms
+        mean_hold_s = (sum(holds) / len(holds) / 1000.0) if holds else 1.0
+        backlog = 1 + self._queued / max(1, self.max_per_instance)
+        return int(min(30, max(1, math.ceil(mean_hold_s * backlog))))
+
+    # ---- public API ----
+
+    def acquire(self, user: str, session: str, instance: str) -> AdmissionTicket:
+        user, session, instance = str(user or ""), str(session or ""), str(instance or "")
+        started = time.monotonic()
+        with self._lock:
+            if not self._queued:
+                cap, slot_id = self._admit(user, session, instance)
+                if not cap:
+                    self._wait_ms.append(0.0)
+                    return AdmissionTicket(self, user, session, instance, 0.0, slot_id)
+            user_queue = self._queues.get(user)
+            if self._queued >= self.max_queue or (user_queue is not None and len(user_queue) >= self.max_queue_per_user) or self.max_wait <= 0:
+                self.counters["rejected_queue_full"] += 1
+                raise AdmissionRejected("queue_full", self._retry_after(), "Too many concurrent queries; the wait queue is full")
+            waiter = _Waiter(user, session, instance)
+            self._queues.setdefault(user, collections.deque()).append(waiter)
+            self._queued += 1
+            self._max_queued_seen = max(self._max_queued_seen, self._queued)
+            self.counters["queued"] += 1
+            # Someone may be queued only on another instance; this waiter might fit right away.
+            self._dispatch()
+
+        poll = self.max_wait if self._ledger is None else _SHARED_POLL_SECONDS
+        while True:
+            remaining = started + self.max_wait - time.monotonic()
+            if waiter.event.wait(max(0.0, min(poll, remaining))) or remaining <= poll:
+                break
+            # Slots freed by other workers do not wake us; look again (one waiter per interval does it).
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._next_shared_dispatch:
+                    self._next_shared_dispatch = now + poll
+                    self._dispatch()
+        with self._lock:
+            waited_ms = (time.monotonic() - started) * 1000.0
+            if not waiter.admitted:
+                queue = self._queues.get(user)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    self._queued -= 1
+                    if not queue:
+                        del self._queues[user]
+                self.counters["rejected_wait_timeout"] += 1
+                raise AdmissionRejected("wait_timeout", self._retry_after(), "Too many concurrent queries; timed out waiting for a slot")
+            self._wait_ms.append(waited_ms)
+        return AdmissionTicket(self, user, session, instance, waited_ms, waiter.slot_id)
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        with self._lock:
+            if ticket.slot_id is not None:
+                try:
+                    self._ledger.release(ticket.slot_id)
+                except sqlite3.Error:
+                    # The row expires with its lease.
+                    self.counters["shared_errors"] += 1
+            for counter, key in ((self._by_user, ticket.user), (self._by_session, ticket.session), (self._by_instance, ticket.instance)):
+                counter[key] -= 1
+                if counter[key] <= 0:
+                    del counter[key]
+            self._hold_ms.append((time.monotonic() - ticket.admitted_at) * 1000.0)
+            self._dispatch()
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        samples = sorted(samples)
+        if not samples:
+            return {"samples": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+
+        return {"samples": len(samples), "mean_ms": round(sum(samples) / len(samples), 2), "p50_ms": pct(0.50), "p95_ms": pct(0.95), "max_ms": round(samples[-1], 2)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": sum(self._by_instance.values()),
+                "in_flight_by_instance": dict(self._by_instance),
+                "users_in_flight": len(self._by_user),
+                "queue_depth": self._queued,
+                "queue_depth_max": self._max_queued_seen,
+                "queued_users": len(self._queues),
+                "wait": self._percentiles(self._wait_ms),
+                "hold": self._percentiles(self._hold_ms),
+                **self.counters,
+                "shared": self._ledger.stats() if self._ledger is not None else {"backend": "memory"},
+                "limits": {
+                    "max_per_user": self.max_per_user,
+                    "max_per_session": self.max_per_session,
+                    "max_per_instance": self.max_per_instance,
+                    "max_queue": self.max_queue,
+                    "max_queue_per_user": self.max_queue_per_user,
+                    "max_wait_seconds": self.max_wait,
+                },
+            }
+
+
+def _env_num(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _create_ledger() -> SQLiteSlotLedger | None:
+    backend = str(os.getenv("DB_QUERY_ADMISSION_BACKEND") or "sqlite").strip().lower()
+    if backend != "sqlite":
+        return None
+    path = os.getenv("DB_QUERY_ADMISSION_SQLITE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "query_admission.db")
+    try:
+        return SQLiteSlotLedger(path, lease_seconds=_env_num("DB_QUERY_ADMISSION_LEASE_SECONDS", 900))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Query admission: SQLite ledger unavailable ({e}); caps apply per worker", flush=True)
+        return None
+
+
+# Process-wide admission control used by app.execute_database_query.
+QUERY_ADMISSION = QueryAdmission(
+    max_per_user=int(_env_num("DB_QUERY_MAX_PER_USER", 2)),
+    max_per_session=int(_env_num("DB_QUERY_MAX_PER_SESSION", 2)),
+    max_per_instance=int(_env_num("DB_QUERY_MAX_PER_INSTANCE", 8)),
+    max_queue=int(_env_num("DB_QUERY_QUEUE_SIZE", 32)),
+    max_queue_per_user=int(_env_num("DB_QUERY_QUEUE_PER_USER", 4)),
+    max_wait=_env_num("DB_QUERY_QUEUE_WAIT_SECONDS", 5),
+    ledger=_create_ledger(),
+)
@@ -0,0 +1,253 @@
+"""
+EXPLAIN-based cost admission gate for PAM terminal queries
+==========================================================
+
+An approved read-only session can still run a full scan over a huge table
+through `execute_database_query`. When enabled, read queries are pre-flighted
+with `EXPLAIN` and the plan is summarized:
+
+- estimated rows examined (nested-loop estimate over the join order:
+  each table adds prefix_rows * rows, and the prefix grows by
+  rows * filtered%; summed across SELECT ids)
+- full table / full index scans (type ALL / index) on large tables
+- filesorts / temporary tables over large row counts
+
+Queries above the environment's thresholds are rejected, or need a
+justification (`action=justify`), depending on configuration. Thresholds are
+read per environment so prod can be stricter than nonprod:
+
+  DB_COST_GATE_ENABLED[_PROD|_NONPROD|_SANDBOX]          (default off)
+  DB_COST_GATE_MAX_ROWS[_...]                            (prod 1M, else 10M)
+  DB_COST_GATE_LARGE_TABLE_ROWS[_...]                    (prod 100k, else 1M)
+  DB_COST_GATE_ACTION[_...]        reject | justify      (default justify)
+
+Plan summaries are cached per (instance, database, query fingerprint); the
+fingerprint replaces literals with `?` and collapses whitespace, so repeated
+queries that only differ in values skip the EXPLAIN round trip. Thresholds
+are applied to the cached summary, so config changes take effect at once.
+"""
+
+from __future__ import annotations
+
+import collections
+import hashlib
+import os
+import re
+import threading
+import time
+
+from sql_lexer import analyze
+
+_ENV_SUFFIXES = {
+    "prod": ("PROD", "PRODUCTION"),
+    "sandbox": ("SANDBOX",),
+    "nonprod": ("NONPROD", "NON_PROD", "DEV"),
+}
+
+_DEFAULTS = {
+    "prod": {"max_rows": 1_000_000, "large_table_rows": 100_000},
+    "nonprod": {"max_rows": 10_000_000, "large_table_rows": 1_000_000},
+}
+
+MIN_JUSTIFICATION_LENGTH = 10
+
+_FINGERPRINT_RE = re.compile(
+    r"""(?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*(?!!).*?\*/)"""
+    r"""|(?P<literal>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|\b0x[0-9a-f]+\b|(?<![\w$.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b)"""
+    r"""|(?P<ident>`(?:[^`]|``)*`)"""
+    r"""|(?P<space>\s+)""",
+    re.IGNORECASE | re.DOTALL,
+)
+_PUNCT_SPACE_RE = re.compile(r"\s*([^\w\s`$])\s*")
+_IN_LIST_RE = re.compile(r"\(\?(?:,\?)+\)")
+
+
+def fingerprint(query: str) -> str:
+    """Literal-free, whitespace-normalized query text hashed to a stable key."""
+
+    def repl(m):
+        kind = m.lastgroup
+        if kind == "comment":
+            return " "
+        if kind == "literal":
+            return "?"
+        if kind == "space":
+            return " "
+        return m.group()
+
+    normalized = _FINGERPRINT_RE.sub(repl, str(query or "")).strip().rstrip(";").strip()
+    normalized = _IN_LIST_RE.sub("(?+)", _PUNCT_SPACE_RE.sub(r"\1", normalized))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+
+def _as_int(value, default=0) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def summarize_plan(plan_rows) -> dict:
+    """Reduce tabular EXPLAIN rows to the numbers the gate decides on."""
+    rows_examined = 0.0
+    prefix = {}
+    tables = []
+    for r in plan_rows or []:
+        r = {str(k).lower(): v for k, v in (r or {}).items()}
+        rows = max(0, _as_int(r.get("rows")))
+        filtered = r.get("filtered")
+        filtered = 100.0 if filtered in (None, "") else max(0.0, min(100.0, float(filtered)))
+        sid = str(r.get("id") or "")
+        p = prefix.get(sid, 1.0)
+        rows_examined += p * rows
+        prefix[sid] = p * max(1.0, rows * filtered / 100.0)
+        extra = str(r.get("extra") or "")
+        tables.append({
+            "table": str(r.get("table") or ""),
+            "type": str(r.get("type") or "").upper(),
+            "rows": rows,
+            "filesort": "filesort" in extra.lower(),
+            "temporary": "temporary" in extra.lower(),
+        })
+    return {"rows_examined": int(min(rows_examined, 1e18)), "tables": tables}
+
+
+class QueryCostGate:
+    def __init__(self, cache_ttl_seconds: float = 600, cache_size: int = 2048):
+        self._ttl = float(cache_ttl_seconds)
+        self._size = max(1, int(cache_size))
+        self._cache: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {"checks": 0, "cache_hits": 0, "explains": 0, "explain_errors": 0, "rejected": 0, "justification_required": 0, "justified": 0}
+
+    # ---- configuration ----
+
+    @staticmethod
+    def _env_value(name: str, env: str) -> str:
+        for suffix in _ENV_SUFFIXES.get(env, _ENV_SUFFIXES["nonprod"]):
+            v = str(os.getenv(f"DB_COST_GATE_{name}_{suffix}") or "").strip()
+            if v:
+                return v
+        return str(os.getenv(f"DB_COST_GATE_{name}") or "").strip()
+
+    def thresholds(self, env: str) -> dict:
+        env = str(env or "").strip().lower()
+        env = env if env in _ENV_SUFFIXES else "nonprod"
+        defaults = _DEFAULTS["prod" if env == "prod" else "nonprod"]
+        action = self._env_value("ACTION", env).lower()
+        return {
+            "enabled": self._env_value("ENABLED", env).lower() in ("1", "true", "yes", "on"),
+            "max_rows": _as_int(self._env_value("MAX_ROWS", env), defaults["max_rows"]) or defaults["max_rows"],
+            "large_table_rows": _as_int(self._env_value("LARGE_TABLE_ROWS", env), defaults["large_table_rows"]) or defaults["large_table_rows"],
+            "action": action if action in ("reject", "justify") else "justify",
+        }
+
+    # ---- plan cache ----
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self._ttl:
+                self._cache.pop(key, None)
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _store(self, key, summary) -> None:
+        with self._lock:
+            self._cache[key] = (time.time(), summary)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._size:
+                self._cache.popitem(last=False)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats_counters[name] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached_plans": len(self._cache), **self.stats_counters}
+
+    # ---- decision ----
+
+    @staticmethod
+    def _violations(summary: dict, limits: dict) -> list[str]:
+        reasons = []
+        large = limits["large_table_rows"]
+        if summary["rows_examined"] > limits["max_rows"]:
+            reasons.append(f"estimated {summary['rows_examined']:,} rows examined (limit {limits['max_rows']:,})")
+        for t in summary["tables"]:
+            if t["rows"] < large:
+                continue
+            if t["type"] in ("ALL", "INDEX"):
+                kind = "full table scan" if t["type"] == "ALL" else "full index scan"
+                reasons.append(f"{kind} on {t['table'] or '?'} (~{t['rows']:,} rows)")
+            if t["filesort"] or t["temporary"]:
+                reasons.append(f"{'filesort' if t['filesort'] else 'temporary table'} over {t['table'] or '?'} (~{t['rows']:,} rows)")
+        return reasons
+
+    def check(self, *, env: str, instance_key: str, database: str, query: str, run_explain, justification: str = "") -> dict:
+        """
+        Decide whether `query` may run.
+
+        run_explain(sql) must return an execute_query-style dict
+        ({'results': [...]} or {'error': ...}). Returns {'allowed', 'action',
+        'reasons', 'estimate', 'cached', 'fingerprint', 'justified'}; action is
+        'allow', 'reject' or 'justify'. EXPLAIN failures fail open (the query
+        itself will report the error).
+        """
+        decision = {"allowed": True, "action": "allow", "reasons": [], "estimate": None, "cached": False, "fingerprint": "", "justified": False}
+        limits = self.thresholds(env)
+        if not limits["enabled"]:
+            return decision
+        analysis = analyze(query)
+        if analysis.error or len(analysis.statements) != 1 or analysis.statements[0].verb != "SELECT":
+            # Only plain reads are gated (SHOW/DESCRIBE/EXPLAIN are cheap; writes are governed elsewhere).
+            return decision
+
+        self._count("checks")
+        fp = fingerprint(query)
+        decision["fingerprint"] = fp
+        key = (str(instance_key or ""), str(database or ""), fp)
+        summary = self._cached(key)
+        if summary is not None:
+            self._count("cache_hits")
+            decision["cached"] = True
+        else:
+            self._count("explains")
+            result = run_explain("EXPLAIN " + query.strip().rstrip(";"))
+            if not isinstance(result, dict) or result.get("error") or not isinstance(result.get("results"), list):
+                self._count("explain_errors")
+                return decision
+            summary = summarize_plan(result["results"])
+            self._store(key, summary)
+
+        decision["estimate"] = {"rows_examined": summary["rows_examined"], "tables": summary["tables"]}
+        reasons = self._violations(summary, limits)
+        if not reasons:
+            return decision
+        decision["reasons"] = reasons
+        if limits["action"] == "justify":
+            if len(str(justification or "").strip()) >= MIN_JUSTIFICATION_LENGTH:
+                self._count("justified")
+                decision["justified"] = True
+                return decision
+            self._count("justification_required")
+            decision.update(allowed=False, action="justify")
+            return decision
+        self._count("rejected")
+        decision.update(allowed=False, action="reject")
+        return decision
+
+
+# Process-wide gate used by app.execute_database_query.
+QUERY_COST_GATE = QueryCostGate(
+    cache_ttl_seconds=float(os.getenv("DB_COST_GATE_CACHE_SECONDS") or 600),
+    cache_size=int(os.getenv("DB_COST_GATE_CACHE_SIZE") or 2048),
+)
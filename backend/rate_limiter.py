@@ -0,0 +1,167 @@
+"""
+GCRA rate limiter for the API before_request hook
+=================================================
+
+security.py used to keep a list of raw request timestamps per key and rebuild
+it on every request under one global lock; keys were never evicted and every
+gunicorn worker counted separately. This limiter uses GCRA (generic cell rate
+algorithm), which is O(1) time and one float of state per key:
+
+- a limit of `max_requests` per `window_seconds` has emission interval
+  T = window / max; each key stores its theoretical arrival time (TAT)
+- a request is allowed when TAT - now <= window - T, which admits a burst of
+  `max_requests` and then one request every T; the TAT then moves forward T
+- a rejected request gets `retry_after`, the time until it would be allowed
+
+A key whose TAT is in the past is indistinguishable from a new key, so idle
+keys are dropped by a periodic sweep and memory tracks active keys only.
+
+Backends:
+- `MemoryRateLimiter` (default): per process, `stripes` dicts each with its
+  own lock so concurrent requests for different keys rarely contend
+- `SQLiteRateLimiter`: one SQLite file shared by every worker on the host
+  (WAL, one row per key), so configured limits hold across workers. On a
+  database error the check falls back to a per-process limiter.
+
+RATE_LIMIT_BACKEND=memory|sqlite selects the backend; RATE_LIMIT_SQLITE_PATH
+sets the shared file.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+
+
+def _gcra(tat: float | None, now: float, max_requests: int, window_seconds: float):
+    """Return (allowed, new_tat, retry_after) for one request."""
+    interval = float(window_seconds) / max(1, int(max_requests))
+    tat = now if tat is None or tat < now else tat
+    wait = tat - now - (float(window_seconds) - interval)
+    if wait > 0:
+        return False, tat, wait
+    return True, tat + interval, 0.0
+
+
+class _Stripe:
+    __slots__ = ("lock", "tats", "next_sweep")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tats = {}
+        self.next_sweep = 0.0
+
+
+class MemoryRateLimiter:
+    backend = "memory"
+
+    def __init__(self, stripes: int = 64, sweep_interval: float = 30):
+        self._stripes = [_Stripe() for _ in range(max(1, int(stripes)))]
+        self._sweep_interval = float(sweep_interval)
+        self.counters = {"allowed": 0, "limited": 0, "evicted": 0}
+
+    def _stripe(self, key: str) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def check(self, key: str, max_requests: int, window_seconds: float) -> tuple[bool, float]:
+        """Return (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if now >= stripe.next_sweep:
+                self._sweep(stripe, now)
+            allowed, tat, retry_after = _gcra(stripe.tats.get(key), now, max_requests, window_seconds)
+            if allowed:
+                stripe.tats[key] = tat
+        # Counter updates are unlocked; they are approximate under contention.
+        self.counters["allowed" if allowed else "limited"] += 1
+        return allowed, retry_after
+
+    def _sweep(self, stripe: _Stripe, now: float) -> None:
+        idle = [k for k, tat in stripe.tats.items() if tat <= now]
+        for k in idle:
+            del stripe.tats[k]
+        stripe.next_sweep = now + self._sweep_interval
+        self.counters["evicted"] += len(idle)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "keys": sum(len(s.tats) for s in self._stripes), "stripes": len(self._stripes), **self.counters}
+
+
+class SQLiteRateLimiter:
+    """GCRA state in a SQLite file shared by all workers on the host."""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, sweep_interval: float = 60, busy_timeout_ms: int = 200):
+        self.path = path
+        self._sweep_interval = float(sweep_interval)
+        self._busy_timeout_ms = int(busy_timeout_ms)
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        self._fallback = MemoryRateLimiter()
+        self.counters = {"allowed": 0, "limited": 0, "evicted": 0, "errors": 0}
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE below).
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout_ms / 1000.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Limiter state is disposable; skip fsync on every request.
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def check(self, key: str, max_requests: int, window_seconds: float) -> tuple[bool, float]:
+        # Wall clock: TATs are compared across processes.
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tat FROM rate_limit WHERE key = ?", (key,)).fetchone()
+                allowed, tat, retry_after = _gcra(row[0] if row else None, now, max_requests, window_seconds)
+                if allowed:
+                    conn.execute("INSERT OR REPLACE INTO rate_limit (key, tat) VALUES (?, ?)", (key, tat))
+                if now >= self._next_sweep:
+                    self._next_sweep = now + self._sweep_interval
+                    self.counters["evicted"] += conn.execute("DELETE FROM rate_limit WHERE tat <= ?", (now,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self.counters["errors"] += 1
+            return self._fallback.check(key, max_requests, window_seconds)
+        self.counters["allowed" if allowed else "limited"] += 1
+        return allowed, retry_after
+
+    def stats(self) -> dict:
+        try:
+            keys = self._conn().execute("SELECT COUNT(*) FROM rate_limit").fetchone()[0]
+        except sqlite3.Error:
+            keys = None
+        return {"backend": self.backend, "path": self.path, "keys": keys, **self.counters}
+
+
+def create_rate_limiter():
+    backend = str(os.getenv("RATE_LIMIT_BACKEND") or "memory").strip().lower()
+    if backend == "sqlite":
+        path = os.getenv("RATE_LIMIT_SQLITE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rate_limit.db")
+        try:
+            return SQLiteRateLimiter(path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Rate limiter: SQLite backend unavailable ({e}); using per-process limits", flush=True)
+    return MemoryRateLimiter(stripes=int(os.getenv("RATE_LIMIT_STRIPES") or 64))
+
+
+# Process-wide limiter used by security.init_rate_limit.
+RATE_LIMITER = create_rate_limiter()
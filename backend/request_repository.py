@@ -0,0 +1,575 @@
+"""
+Indexed in-memory request store
+===============================
+
+`requests_db` is a dict of request_id -> request dict, and listing
+endpoints, analytics, the pending-approval views and background_cleanup
+used to scan all of it and filter in Python, so their cost grew with
+every request ever made rather than with the rows they return.
+
+RequestRepository keeps the dict contract (`requests_db[rid] = req`,
+`del`, `.pop`, `.items()`, ...) that app.py and persistence.py rely on,
+and maintains secondary indexes as requests change:
+
+- user (lowercase user_email), status (lowercase), type, account_id,
+  db_instance_id, approver (each role in approval_required, lowercase)
+  and permission_set (lowercase): key -> set of request IDs
+- expires_at and created_at: sorted lists, for "expired by now" and
+  "created since" range queries
+
+Stored requests are TrackedRequest dicts, which report writes to indexed
+fields back to the repository, so the usual in-place updates
+(`req['status'] = 'approved'`) keep the indexes current. A plain dict
+assigned into the repository is copied into a TrackedRequest; callers that
+keep mutating a request after storing it must re-read it from the
+repository. Copies (dict(req), req.copy(), copy.deepcopy, pickle) are
+plain dicts and are not tracked.
+
+Queries return (request_id, request) pairs in storage order, i.e. the
+order a scan of the dict would have produced, so callers keep their
+existing per-row checks and output order and only the candidate set
+shrinks. Times are parsed like _is_db_request_expired: a trailing Z or
++00:00 is dropped and the value compared as naive local time; values
+that do not parse (or carry another offset) are not in the range indexes.
+
+Tiering. With a `cold` store (persistence.NpamxStore), only the requests
+NpamxStore.load_all(closed_before=...) returned are resident; closed
+requests older than the hot window stay in SQLite:
+
+- `rid in repo`, `repo[rid]`, `repo.get(rid)` and `repo.pop(rid)` fall back
+  to SQLite on a miss and promote the request (and its approvals, through
+  `on_promote`) into memory, so lookups behave as if everything were loaded.
+- select() appends matching cold rows, oldest first, ahead of the resident
+  ones, unless a status criterion names only open statuses. Cold rows are
+  plain dicts: read them, or look the request up to get a tracked copy.
+- index_keys('user' / 'permission_set'), first_created_by_user() and
+  users_with() add cold requests from NpamxStore.request_summary(),
+  computed on first use and then kept current by promotions and demotions.
+- expiring(), created_since(), len() and iteration cover resident requests
+  only; cold requests are closed, so expiry cleanup never needs them.
+
+Deletions (del, pop, popitem) are recorded and handed to
+NpamxStore.sync_from_memory(deleted=...) so they also leave SQLite.
+demote() evicts resident requests that have been closed for longer than the
+window, saving first.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+from datetime import datetime
+
+# Request fields -> index name. A write to any of these re-indexes the request.
+_INDEXED_FIELDS = {
+    "user_email": "user",
+    "status": "status",
+    "type": "type",
+    "account_id": "account",
+    "db_instance_id": "db_instance",
+    "approval_required": "approver",
+    "permission_set": "permission_set",
+}
+_RANGE_FIELDS = ("expires_at", "created_at")
+_TRACKED_FIELDS = frozenset(_INDEXED_FIELDS) | frozenset(_RANGE_FIELDS)
+INDEXES = tuple(_INDEXED_FIELDS.values())
+_CASE_INSENSITIVE = frozenset(("user", "status", "approver", "permission_set"))
+
+
+def _norm(value) -> str:
+    return str(value or "").strip().lower()
+
+
+def parse_request_time(value):
+    """Naive datetime for an ISO timestamp the way the app compares them, or None."""
+    s = str(value or "").strip()
+    if not s:
+        return None
+    try:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00").replace("+00:00", ""))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo is None else None
+
+
+def _index_keys(req: dict) -> tuple:
+    """((index, key), ...) for one request; empty keys are not indexed."""
+    keys = []
+    for field, index in _INDEXED_FIELDS.items():
+        value = req.get(field)
+        if not value:
+            continue
+        if index == "approver":
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            keys.extend((index, k) for k in {_norm(v) for v in values} if k)
+            continue
+        key = str(value).strip()
+        if index in _CASE_INSENSITIVE:
+            key = key.lower()
+        if key:
+            keys.append((index, key))
+    return tuple(keys)
+
+
+def _criterion_values(index: str, wanted) -> list:
+    values = [wanted] if isinstance(wanted, str) else list(wanted)
+    return [_norm(v) if index in _CASE_INSENSITIVE else str(v or "").strip() for v in values]
+
+
+def _last_activity(req: dict) -> str:
+    """The latest of created/modified/expires as stored strings, compared the way NpamxStore does."""
+    return max(str(req.get(field) or "") for field in ("created_at", "modified_at", "expires_at"))
+
+
+class TrackedRequest(dict):
+    """A request dict that re-indexes itself in its repository when an indexed field changes."""
+
+    __slots__ = ("_repo", "_rid")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._repo = None
+        self._rid = None
+
+    def _changed(self, key=None) -> None:
+        if self._repo is not None and (key is None or key in _TRACKED_FIELDS):
+            self._repo._reindex(self._rid, self)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed(key)
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._changed(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._changed(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def __ior__(self, other):
+        super().update(other)
+        self._changed()
+        return self
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class RequestRepository(dict):
+    """request_id -> request dict, with secondary indexes (see module docstring)."""
+
+    def __init__(self, initial=None, cold=None, on_promote=None):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._cold = cold  # NpamxStore holding the requests that are not resident, or None
+        self._on_promote = on_promote  # fn(rid, approvals) when a cold request is loaded
+        self._deleted = set()  # removed request IDs not yet deleted from SQLite
+        self._cold_summary = None  # (user, permission_set) -> [count, earliest created], see _summary()
+        self._seq = {}  # rid -> storage position (dict order)
+        self._next_seq = 0
+        self._keys = {}  # rid -> (index keys, expires, created)
+        self._index = {name: {} for name in INDEXES}
+        self._expires = []  # sorted (datetime, seq, rid)
+        self._created = []
+        self._first_created = {}  # user -> earliest created_at, recomputed for _dirty_users on read
+        self._dirty_users = set()
+        self._bulk = False
+        self.counters = {"queries": 0, "candidates": 0, "reindexes": 0, "cold_queries": 0, "cold_rows": 0, "promotions": 0, "demotions": 0}
+        if initial:
+            # Bulk load: append to the range lists and sort once instead of insort per row.
+            self._bulk = True
+            try:
+                for rid, req in initial.items():
+                    self[rid] = req
+            finally:
+                self._bulk = False
+                self._expires.sort()
+                self._created.sort()
+
+    # -- dict mutation -------------------------------------------------
+
+    def __setitem__(self, rid, req):
+        with self._lock:
+            old = dict.get(self, rid)
+            if old is req and isinstance(req, TrackedRequest):
+                return
+            if isinstance(old, TrackedRequest):
+                old._repo = None
+            if isinstance(req, dict):
+                if not isinstance(req, TrackedRequest) or req._repo is not None:
+                    req = TrackedRequest(req)
+                req._repo, req._rid = self, rid
+            if rid not in self._seq:
+                self._seq[rid] = self._next_seq
+                self._next_seq += 1
+            self._deleted.discard(rid)
+            dict.__setitem__(self, rid, req)
+            self._reindex(rid, req)
+
+    def __delitem__(self, rid):
+        with self._lock:
+            if rid not in self:
+                raise KeyError(rid)
+            req = dict.pop(self, rid)
+            self._forget(rid, req)
+            self._deleted.add(rid)
+
+    def pop(self, rid, *default):
+        with self._lock:
+            if rid not in self:
+                if default:
+                    return default[0]
+                raise KeyError(rid)
+            req = dict.pop(self, rid)
+            self._forget(rid, req)
+            self._deleted.add(rid)
+            return req
+
+    def popitem(self):
+        with self._lock:
+            rid, req = dict.popitem(self)
+            self._forget(rid, req)
+            self._deleted.add(rid)
+            return rid, req
+
+    def setdefault(self, rid, default=None):
+        with self._lock:
+            if rid not in self:
+                self[rid] = default
+            return self[rid]
+
+    def update(self, *args, **kwargs):
+        for rid, req in dict(*args, **kwargs).items():
+            self[rid] = req
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        with self._lock:
+            for req in dict.values(self):
+                if isinstance(req, TrackedRequest):
+                    req._repo = None
+            dict.clear(self)
+            self._seq.clear()
+            self._keys.clear()
+            self._index = {name: {} for name in INDEXES}
+            self._expires = []
+            self._created = []
+            self._first_created.clear()
+            self._dirty_users.clear()
+            self._cold_summary = None  # cleared requests are cold again
+
+    # -- cold tier -----------------------------------------------------
+
+    def __contains__(self, rid):
+        return dict.__contains__(self, rid) or self._promote(rid) is not None
+
+    def __missing__(self, rid):
+        req = self._promote(rid)
+        if req is None:
+            raise KeyError(rid)
+        return req
+
+    def get(self, rid, default=None):
+        req = dict.get(self, rid)
+        if req is None and not dict.__contains__(self, rid):
+            req = self._promote(rid)
+        return default if req is None else req
+
+    def peek(self, rid, default=None):
+        """The resident request, without falling back to SQLite."""
+        return dict.get(self, rid, default)
+
+    def _promote(self, rid):
+        """Load a cold request into memory; None when there is no such request."""
+        if self._cold is None or not isinstance(rid, str) or rid in self._deleted:
+            return None
+        found = self._cold.get_request(rid)
+        if found is None:
+            return None
+        req, approvals = found
+        with self._lock:
+            if dict.__contains__(self, rid):
+                return dict.__getitem__(self, rid)
+            if rid in self._deleted:
+                return None
+            self._count_cold(req, -1)
+            self[rid] = req
+            self.counters["promotions"] += 1
+        if self._on_promote is not None and approvals:
+            self._on_promote(rid, approvals)
+        return dict.get(self, rid)
+
+    def demote(self, closed_before: str, save=None) -> int:
+        """
+        Drop resident requests that are closed and whose latest timestamp is
+        older than `closed_before` (ISO); they stay readable from SQLite.
+        `save()` runs first (under the lock) when there is anything to drop,
+        so the evicted requests are persisted as they are in memory.
+        """
+        if self._cold is None:
+            return 0
+        with self._lock:
+            buckets = [self._index["status"].get(status, ()) for status in self._cold.closed_statuses]
+            stale = [rid for rid in set().union(*buckets) if _last_activity(dict.__getitem__(self, rid)) < closed_before]
+            if not stale:
+                return 0
+            if save is not None:
+                save()
+            for rid in stale:
+                req = dict.pop(self, rid)
+                self._forget(rid, req)
+                self._count_cold(req, 1)
+            self.counters["demotions"] += len(stale)
+            return len(stale)
+
+    def pending_deletes(self) -> list:
+        """Request IDs removed since the last save, for NpamxStore.sync_from_memory(deleted=...)."""
+        with self._lock:
+            return list(self._deleted)
+
+    def deletes_saved(self, rids) -> None:
+        with self._lock:
+            self._deleted.difference_update(rids)
+
+    def _summary(self) -> dict:
+        if self._cold_summary is None and self._cold is not None:
+            with self._lock:
+                exclude = list(dict.keys(self)) + list(self._deleted)
+            summary = {}
+            for row in self._cold.request_summary(exclude):
+                summary[(row["user"], row["permission_set"])] = [row["requests"], parse_request_time(row["first_created"])]
+            with self._lock:
+                if self._cold_summary is None:
+                    self._cold_summary = summary
+        return self._cold_summary or {}
+
+    def _count_cold(self, req: dict, delta: int) -> None:
+        """Move one request into (delta=1) or out of (-1) the cold summary, if it has been computed."""
+        if self._cold_summary is None:
+            return
+        key = (_norm(req.get("user_email")), _norm(req.get("permission_set")))
+        entry = self._cold_summary.setdefault(key, [0, None])
+        entry[0] += delta
+        created = parse_request_time(req.get("created_at"))
+        if delta > 0 and created is not None and (entry[1] is None or created < entry[1]):
+            entry[1] = created
+        if entry[0] <= 0:
+            del self._cold_summary[key]
+
+    def _cold_rows(self, criteria: dict) -> list:
+        """Cold requests matching `criteria` (normalized), oldest first."""
+        status = criteria.get("status")
+        if self._cold is None or (status is not None and not set(status) & self._cold.closed_statuses):
+            return []
+        rows = []
+        self.counters["cold_queries"] += 1
+        for rid, req in self._cold.query_requests(**criteria):
+            if dict.__contains__(self, rid) or rid in self._deleted:
+                continue
+            keys = set(_index_keys(req))
+            if all(any((index, v) in keys for v in values) for index, values in criteria.items()):
+                rows.append((rid, req))
+        self.counters["cold_rows"] += len(rows)
+        return rows
+
+    def copy(self):
+        return {rid: dict(req) if isinstance(req, dict) else req for rid, req in self.items()}
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+
+    # -- index maintenance ---------------------------------------------
+
+    def _forget(self, rid, req) -> None:
+        if isinstance(req, TrackedRequest) and req._repo is self:
+            req._repo = None
+        self._unindex(rid)
+        self._seq.pop(rid, None)
+
+    def _unindex(self, rid) -> None:
+        entry = self._keys.pop(rid, None)
+        if entry is None:
+            return
+        keys, expires, created = entry
+        for index, key in keys:
+            bucket = self._index[index].get(key)
+            if bucket is not None:
+                bucket.discard(rid)
+                if not bucket:
+                    del self._index[index][key]
+            if index == "user":
+                self._dirty_users.add(key)
+        seq = self._seq[rid]
+        for items, at in ((self._expires, expires), (self._created, created)):
+            if at is not None:
+                i = bisect.bisect_left(items, (at, seq, rid))
+                if i < len(items) and items[i][2] == rid:
+                    del items[i]
+
+    def _reindex(self, rid, req) -> None:
+        with self._lock:
+            if dict.get(self, rid) is not req:
+                return  # a replaced or removed request; its writes no longer count
+            if not isinstance(req, dict):
+                self._unindex(rid)
+                return
+            entry = (_index_keys(req), parse_request_time(req.get("expires_at")), parse_request_time(req.get("created_at")))
+            if self._keys.get(rid) == entry:
+                return
+            self._unindex(rid)
+            self._keys[rid] = entry
+            keys, expires, created = entry
+            for index, key in keys:
+                self._index[index].setdefault(key, set()).add(rid)
+                if index == "user":
+                    self._dirty_users.add(key)
+            seq = self._seq[rid]
+            add = list.append if self._bulk else bisect.insort
+            if expires is not None:
+                add(self._expires, (expires, seq, rid))
+            if created is not None:
+                add(self._created, (created, seq, rid))
+            self.counters["reindexes"] += 1
+
+    # -- queries ---------------------------------------------------------
+
+    def _candidates(self, criteria: dict):
+        """Request IDs matching every given index criterion, or None when no criterion is given."""
+        sets = []
+        for index, wanted in criteria.items():
+            if wanted is None:
+                continue
+            if index not in self._index:
+                raise ValueError(f"unknown index: {index}")
+            values = _criterion_values(index, wanted)
+            buckets = [self._index[index].get(v, ()) for v in values]
+            sets.append(buckets[0] if len(buckets) == 1 else set().union(*buckets))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = set(sets[0])
+        for s in sets[1:]:
+            result &= s
+            if not result:
+                break
+        return result
+
+    def _rows(self, rids) -> list:
+        rows = [(rid, dict.__getitem__(self, rid)) for rid in sorted(rids, key=self._seq.__getitem__)]
+        self.counters["queries"] += 1
+        self.counters["candidates"] += len(rows)
+        return rows
+
+    def select(self, **criteria) -> list:
+        """
+        [(request_id, request)] in storage order matching every criterion:
+        user, status, type, account, db_instance, approver, permission_set.
+        A criterion is one value or an iterable of values (any of them).
+        Cold requests (see module docstring) come first.
+        """
+        with self._lock:
+            rids = self._candidates(criteria)
+            rows = list(dict.items(self)) if rids is None else self._rows(rids)
+        if self._cold is None:
+            return rows
+        wanted = {index: _criterion_values(index, value) for index, value in criteria.items() if value is not None}
+        return self._cold_rows(wanted) + rows
+
+    def _in_range(self, items: list, lo: int, hi: int, slot: int, criteria: dict, test) -> list:
+        """Rows in items[lo:hi] that match `criteria`; probes the smaller of the range and the criteria candidates."""
+        narrow = self._candidates(criteria)
+        if narrow is not None and len(narrow) < hi - lo:
+            rids = {rid for rid in narrow if (at := self._keys[rid][slot]) is not None and test(at)}
+        else:
+            rids = {rid for _, _, rid in items[lo:hi]}
+            if narrow is not None:
+                rids &= narrow
+        return self._rows(rids)
+
+    def expiring(self, before: datetime, **criteria) -> list:
+        """Requests whose expires_at is at or before `before` (and match `criteria`), in storage order."""
+        with self._lock:
+            end = bisect.bisect_right(self._expires, (before, float("inf")))
+            return self._in_range(self._expires, 0, end, 1, criteria, lambda at: at <= before)
+
+    def created_since(self, since: datetime, **criteria) -> list:
+        """Requests whose created_at is at or after `since` (and match `criteria`), in storage order."""
+        with self._lock:
+            start = bisect.bisect_left(self._created, (since,))
+            return self._in_range(self._created, start, len(self._created), 2, criteria, lambda at: at >= since)
+
+    def first_created_by_user(self) -> dict:
+        """{user: earliest created_at}; only users whose requests changed since the last call are recomputed."""
+        summary = self._summary()
+        with self._lock:
+            users = self._index["user"]
+            for user in self._dirty_users:
+                times = [self._keys[rid][2] for rid in users.get(user, ()) if self._keys[rid][2] is not None]
+                if times:
+                    self._first_created[user] = min(times)
+                else:
+                    self._first_created.pop(user, None)
+            self._dirty_users.clear()
+            first = dict(self._first_created)
+            for (user, _), (_, created) in summary.items():
+                if user and created is not None and (user not in first or created < first[user]):
+                    first[user] = created
+            return first
+
+    def index_keys(self, index: str) -> dict:
+        """{key: number of requests} for one index, e.g. requests per user; cold requests count for user and permission_set."""
+        with self._lock:
+            if index not in self._index:
+                raise ValueError(f"unknown index: {index}")
+            counts = {key: len(rids) for key, rids in self._index[index].items()}
+        if index in ("user", "permission_set"):
+            slot = 0 if index == "user" else 1
+            for key, (n, _) in self._summary().items():
+                if key[slot]:
+                    counts[key[slot]] = counts.get(key[slot], 0) + n
+        return counts
+
+    def users_with(self, permission_set) -> set:
+        """Users (lowercase) with at least one request for any of the given permission sets."""
+        wanted = set(_criterion_values("permission_set", permission_set))
+        users = {user for (user, ps), _ in self._summary().items() if user and ps in wanted}
+        with self._lock:
+            for rid in self._candidates({"permission_set": list(wanted)}) or ():
+                users.update(key for index, key in self._keys[rid][0] if index == "user")
+        return users
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": len(self),
+                "tiered": self._cold is not None,
+                "pending_deletes": len(self._deleted),
+                "indexes": {name: len(buckets) for name, buckets in self._index.items()},
+                "expiry_entries": len(self._expires),
+                "created_entries": len(self._created),
+                **self.counters,
+            }
@@ -0,0 +1,253 @@
+"""
+Schema metadata cache and prefix completion for the PAM DB terminal
+===================================================================
+
+Without completion, users explore a database by typing `SHOW TABLES` /
+`information_schema` queries through their JIT session, which is slow and
+fills the audit trail with noise. This module keeps one schema snapshot per
+(instance, database):
+
+- tables (type, estimated rows), columns (type, key) and indexes
+- loaded lazily through the requesting user's own session (three
+  `information_schema` reads scoped to `DATABASE()`), so nothing is fetched
+  with elevated credentials and nothing is fetched for unused databases
+- refreshed after `ttl_seconds`: an expired snapshot is still served while a
+  single background load replaces it; only a cold miss waits for the database
+- served from sorted prefix indexes (bisect), so a completion lookup is a
+  few microseconds once the snapshot exists
+
+Names are matched case-insensitively. `complete("ord")` returns tables and
+columns starting with "ord"; `complete("o.cre")` or `complete("cre",
+table="orders")` returns columns of that table.
+"""
+
+from __future__ import annotations
+
+import bisect
+import collections
+import os
+import threading
+import time
+
+_TABLES_SQL = (
+    "SELECT TABLE_NAME, TABLE_TYPE, TABLE_ROWS FROM information_schema.TABLES "
+    "WHERE TABLE_SCHEMA = DATABASE()"
+)
+_COLUMNS_SQL = (
+    "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, COLUMN_KEY FROM information_schema.COLUMNS "
+    "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, ORDINAL_POSITION"
+)
+_INDEXES_SQL = (
+    "SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS "
+    "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+)
+
+
+def _rows(result) -> tuple[list, bool]:
+    """Columnar execute_query result -> (rows, truncated); errors raise."""
+    if not isinstance(result, dict) or result.get("error"):
+        raise RuntimeError((result or {}).get("error") if isinstance(result, dict) else "Schema query failed")
+    return list(result.get("rows") or []), bool(result.get("truncated"))
+
+
+def load_mysql_schema(run_query) -> dict:
+    """
+    Read table/column/index metadata for the session's current database.
+
+    run_query(sql) must return an execute_query(result_format='columnar')
+    dict. Returns the plain dict SchemaSnapshot is built from.
+    """
+    table_rows, t1 = _rows(run_query(_TABLES_SQL))
+    column_rows, t2 = _rows(run_query(_COLUMNS_SQL))
+    index_rows, t3 = _rows(run_query(_INDEXES_SQL))
+
+    tables: dict[str, dict] = {}
+    for name, table_type, est_rows in table_rows:
+        tables[str(name)] = {
+            "name": str(name),
+            "type": "view" if "VIEW" in str(table_type or "").upper() else "table",
+            "rows": int(est_rows) if est_rows is not None else None,
+            "columns": [],
+            "indexes": [],
+        }
+    for table, column, column_type, key in column_rows:
+        t = tables.get(str(table))
+        if t is not None:
+            t["columns"].append({"name": str(column), "type": str(column_type or ""), "key": str(key or "")})
+    for table, index, non_unique, column in index_rows:
+        t = tables.get(str(table))
+        if t is None:
+            continue
+        if not t["indexes"] or t["indexes"][-1]["name"] != str(index):
+            t["indexes"].append({"name": str(index), "unique": not int(non_unique or 0), "columns": []})
+        t["indexes"][-1]["columns"].append(str(column))
+    return {"tables": tables, "truncated": t1 or t2 or t3}
+
+
+class SchemaSnapshot:
+    """Immutable schema metadata plus the sorted prefix indexes built from it."""
+
+    def __init__(self, tables: dict, truncated: bool = False, loaded_at: float | None = None):
+        self.tables = tables
+        self.truncated = bool(truncated)
+        self.loaded_at = time.time() if loaded_at is None else loaded_at
+        self._by_lower = {name.lower(): t for name, t in tables.items()}
+        # Sorted (lowercase name, ...) tuples for bisect. Column names repeat across
+        # tables, so the global column index has one entry per name.
+        self._table_index = sorted((name.lower(), name) for name in tables)
+        columns: dict[str, list] = {}
+        for t in tables.values():
+            for c in t["columns"]:
+                columns.setdefault(c["name"], []).append(t["name"])
+        self._column_index = sorted((name.lower(), name, tuple(owners)) for name, owners in columns.items())
+        self._table_columns = {
+            lower: sorted((c["name"].lower(), c["name"], c) for c in t["columns"])
+            for lower, t in self._by_lower.items()
+        }
+
+    @property
+    def table_count(self) -> int:
+        return len(self.tables)
+
+    def table(self, name: str) -> dict | None:
+        return self._by_lower.get(str(name or "").strip("`").lower())
+
+    @staticmethod
+    def _scan(index: list, prefix: str, limit: int):
+        i = bisect.bisect_left(index, (prefix,))
+        while i < len(index) and limit > 0 and index[i][0].startswith(prefix):
+            yield index[i]
+            i += 1
+            limit -= 1
+
+    def _table_item(self, name: str) -> dict:
+        t = self.tables[name]
+        return {"name": name, "kind": t["type"], "rows": t["rows"], "columns": len(t["columns"])}
+
+    def complete(self, prefix: str = "", *, table: str = "", kinds=None, limit: int = 50) -> list[dict]:
+        prefix = str(prefix or "").strip().strip("`")
+        table = str(table or "").strip().strip("`")
+        if not table and "." in prefix:
+            table, prefix = prefix.rsplit(".", 1)
+            table = table.strip("`").rsplit(".", 1)[-1]
+        lower = prefix.lower()
+        limit = max(1, min(int(limit or 50), 500))
+        kinds = set(kinds or ("table", "view", "column"))
+        out: list[dict] = []
+        if table:
+            t = self.table(table)
+            if t is None:
+                return out
+            for _l, name, col in self._scan(self._table_columns[t["name"].lower()], lower, limit):
+                out.append({"name": name, "kind": "column", "table": t["name"], "type": col["type"], "key": col["key"]})
+            return out
+        if kinds & {"table", "view"}:
+            for _l, name in self._scan(self._table_index, lower, limit):
+                if self.tables[name]["type"] in kinds:
+                    out.append(self._table_item(name))
+        if "column" in kinds:
+            for _l, name, owners in self._scan(self._column_index, lower, limit - len(out)):
+                out.append({"name": name, "kind": "column", "tables": list(owners[:20]), "table_count": len(owners)})
+        return out
+
+
+class SchemaCache:
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 256, load_timeout: float = 20):
+        self.ttl = float(ttl_seconds)
+        self.max_entries = max(1, int(max_entries))
+        self.load_timeout = float(load_timeout)
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._loading: dict[tuple, threading.Event] = {}
+        self._errors: dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        self.stats_counters = {"hits": 0, "stale_hits": 0, "loads": 0, "load_errors": 0}
+
+    @staticmethod
+    def key(instance_key: str, database: str) -> tuple:
+        return (str(instance_key or ""), str(database or ""))
+
+    def _store(self, key, snapshot: SchemaSnapshot) -> None:
+        with self._lock:
+            self._entries[key] = snapshot
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _run_load(self, key, loader, event: threading.Event) -> None:
+        try:
+            data = loader()
+            self._store(key, SchemaSnapshot(data.get("tables") or {}, data.get("truncated", False)))
+            with self._lock:
+                self.stats_counters["loads"] += 1
+                self._errors.pop(key, None)
+        except Exception as e:
+            with self._lock:
+                self.stats_counters["load_errors"] += 1
+                self._errors[key] = str(e)
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            event.set()
+
+    def get(self, instance_key: str, database: str, loader, *, refresh: bool = False) -> tuple[SchemaSnapshot, str]:
+        """
+        Return (snapshot, status); status is 'hit', 'stale' or 'loaded'.
+
+        loader() returns load_mysql_schema()-style data using the caller's
+        session. Raises RuntimeError when there is no snapshot and the load
+        fails or times out.
+        """
+        key = self.key(instance_key, database)
+        with self._lock:
+            snapshot = self._entries.get(key)
+            fresh = snapshot is not None and not refresh and time.time() - snapshot.loaded_at <= self.ttl
+            if fresh:
+                self._entries.move_to_end(key)
+                self.stats_counters["hits"] += 1
+                return snapshot, "hit"
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._loading[key] = event
+            if snapshot is not None:
+                self.stats_counters["stale_hits"] += 1
+
+        if snapshot is not None:
+            # Serve the expired snapshot; one background load replaces it.
+            if owner:
+                threading.Thread(target=self._run_load, args=(key, loader, event), daemon=True).start()
+            return snapshot, "stale"
+
+        if owner:
+            self._run_load(key, loader, event)
+        elif not event.wait(self.load_timeout):
+            raise RuntimeError("Timed out loading schema metadata")
+        with self._lock:
+            snapshot = self._entries.get(key)
+            error = self._errors.get(key)
+        if snapshot is None:
+            raise RuntimeError(error or "Schema metadata unavailable")
+        return snapshot, "loaded"
+
+    def invalidate(self, instance_key: str = "", database: str = "") -> int:
+        """Drop cached snapshots (one database, one instance, or everything)."""
+        with self._lock:
+            victims = [
+                k for k in self._entries
+                if (not instance_key or k[0] == str(instance_key)) and (not database or k[1] == str(database))
+            ]
+            for k in victims:
+                self._entries.pop(k, None)
+        return len(victims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "loading": len(self._loading), **self.stats_counters}
+
+
+# Process-wide cache used by the /api/databases/schema endpoint.
+SCHEMA_CACHE = SchemaCache(
+    ttl_seconds=float(os.getenv("DB_SCHEMA_CACHE_SECONDS") or 300),
+    max_entries=int(os.getenv("DB_SCHEMA_CACHE_SIZE") or 256),
+)
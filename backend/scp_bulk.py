@@ -0,0 +1,305 @@
+"""
+Bulk SCP attach/detach
+======================
+
+Rolling a guardrail SCP out across an OU subtree used to take one browser
+round trip per target (`/api/admin/scps/<id>/attach`). `SCPBulkOperations`
+accepts a policy plus a target set, resolves OUs to their accounts through
+the Organizations hierarchy when asked, and runs the attach/detach calls
+concurrently under a shared Organizations request-rate limit.
+
+Each bulk operation is a job with an ID; callers poll `get_job()` for
+per-target progress. The worker running a job keeps it in memory and writes
+a snapshot to the attached NpamxStore at most every
+SCP_BULK_PERSIST_SECONDS (and once when the job finishes), so any gunicorn
+worker can answer the poll. `wait=True` blocks for at most
+SCP_BULK_MAX_WAIT_SECONDS (below the gunicorn timeout); poll after that.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from scp_cache import SCP_CACHE
+
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+_MAX_JOBS = 50
+_STORE = None
+
+# gunicorn kills a sync worker after --timeout 120s; a blocking request must return before that.
+_MAX_WAIT_SECONDS = float(os.getenv("SCP_BULK_MAX_WAIT_SECONDS") or 90)
+# A snapshot holds every target; writing one per finished target would be quadratic in the job size.
+_PERSIST_SECONDS = float(os.getenv("SCP_BULK_PERSIST_SECONDS") or 1)
+
+# Organizations throttles write APIs aggressively; stay under it across all jobs in this process.
+_MAX_TPS = float(os.getenv("SCP_BULK_MAX_TPS") or 4)
+_MAX_WORKERS = int(os.getenv("SCP_BULK_MAX_WORKERS") or 8)
+_MAX_ATTEMPTS = 5
+
+_RETRYABLE_CODES = {"TooManyRequestsException", "ConcurrentModificationException", "ThrottlingException"}
+_ALREADY_DONE_CODES = {
+    "attach": {"DuplicatePolicyAttachmentException"},
+    "detach": {"PolicyNotAttachedException"},
+}
+
+
+class _RateLimiter:
+    """Token bucket shared by all bulk workers in the process."""
+
+    def __init__(self, rate_per_second: float):
+        self._interval = 1.0 / max(0.1, float(rate_per_second))
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self._interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+_RATE_LIMITER = _RateLimiter(_MAX_TPS)
+_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, _MAX_WORKERS), thread_name_prefix="scp-bulk")
+
+
+def _error_code(err) -> str:
+    try:
+        return str(err.response.get("Error", {}).get("Code") or "")
+    except Exception:
+        return ""
+
+
+class SCPBulkOperations:
+
+    @staticmethod
+    def _accounts_under(parent_id, org=None):
+        """All account IDs under an OU/root, recursively."""
+        org = org or SCP_CACHE.client()
+        accounts = []
+        queue = [parent_id]
+        seen = set()
+        while queue:
+            current = queue.pop(0)
+            if current in seen:
+                continue
+            seen.add(current)
+            for page in org.get_paginator("list_accounts_for_parent").paginate(ParentId=current):
+                for acct in page.get("Accounts", []) or []:
+                    aid = str(acct.get("Id") or "").strip()
+                    if aid:
+                        accounts.append({"id": aid, "name": str(acct.get("Name") or "").strip(), "type": "ACCOUNT", "via": parent_id})
+            for page in org.get_paginator("list_organizational_units_for_parent").paginate(ParentId=current):
+                for ou in page.get("OrganizationalUnits", []) or []:
+                    oid = str(ou.get("Id") or "").strip()
+                    if oid:
+                        queue.append(oid)
+        return accounts
+
+    @staticmethod
+    def resolve_targets(target_ids=None, ou_accounts=None):
+        """
+        Build the de-duplicated target list.
+
+        target_ids: accounts/OUs/roots to attach to directly.
+        ou_accounts: OU/root IDs whose accounts (whole subtree) become targets.
+        """
+        targets = []
+        seen = set()
+        for tid in target_ids or []:
+            tid = str(tid or "").strip()
+            if not tid or tid in seen:
+                continue
+            seen.add(tid)
+            ttype = "ROOT" if tid.startswith("r-") else ("ORGANIZATIONAL_UNIT" if tid.startswith("ou-") else "ACCOUNT")
+            targets.append({"id": tid, "name": "", "type": ttype, "via": ""})
+        for parent_id in ou_accounts or []:
+            parent_id = str(parent_id or "").strip()
+            if not parent_id:
+                continue
+            for acct in SCPBulkOperations._accounts_under(parent_id):
+                if acct["id"] in seen:
+                    continue
+                seen.add(acct["id"])
+                targets.append(acct)
+        return targets
+
+    @staticmethod
+    def attach(store) -> None:
+        """Persist job snapshots in `store` (an NpamxStore) so every worker can serve polls."""
+        global _STORE
+        _STORE = store
+
+    @staticmethod
+    def _persist(job, snapshot) -> None:
+        """Write a snapshot taken under job["lock"]; called without it. Older snapshots never overwrite newer ones."""
+        if _STORE is None:
+            return
+        with job["persist_lock"]:
+            if snapshot["completed"] < job["persisted_completed"]:
+                return
+            try:
+                _STORE.save_scp_bulk_job(snapshot)
+                job["persisted_completed"] = snapshot["completed"]
+            except Exception as e:
+                print(f"SCP bulk job {job['job_id']} not persisted: {e}", flush=True)
+
+    @staticmethod
+    def _apply_one(job, policy_id, action, target):
+        try:
+            target["status"] = "running"
+            org = SCP_CACHE.client()
+            call = org.attach_policy if action == "attach" else org.detach_policy
+            for attempt in range(1, _MAX_ATTEMPTS + 1):
+                _RATE_LIMITER.acquire()
+                target["attempts"] = attempt
+                try:
+                    call(PolicyId=policy_id, TargetId=target["id"])
+                    target["status"] = "success"
+                    break
+                except Exception as e:
+                    code = _error_code(e)
+                    if code in _ALREADY_DONE_CODES.get(action, set()):
+                        target["status"] = "skipped"
+                        target["message"] = "already attached" if action == "attach" else "not attached"
+                        break
+                    if code in _RETRYABLE_CODES and attempt < _MAX_ATTEMPTS:
+                        time.sleep(min(8.0, 0.5 * (2 ** (attempt - 1))))
+                        continue
+                    target["status"] = "error"
+                    target["error"] = str(e)
+                    break
+            SCP_CACHE.invalidate(target_id=target["id"])
+        except Exception as e:
+            if target["status"] not in ("success", "skipped"):
+                target["status"] = "error"
+                target["error"] = str(e)
+        finally:
+            # Always count the target, or the job would stay "running" forever.
+            snapshot = None
+            with job["lock"]:
+                job["completed"] += 1
+                job["counts"][target["status"]] = job["counts"].get(target["status"], 0) + 1
+                finished = job["completed"] >= job["total"]
+                if finished:
+                    job["status"] = "completed" if not job["counts"].get("error") else "completed_with_errors"
+                    job["finished_at"] = datetime.now().isoformat()
+                now = time.monotonic()
+                if finished or now >= job["persist_due"]:
+                    job["persist_due"] = now + _PERSIST_SECONDS
+                    snapshot = SCPBulkOperations._snapshot(job)
+            if snapshot is not None:
+                SCPBulkOperations._persist(job, snapshot)
+            if finished:
+                job["done"].set()
+                if job["on_complete"] is not None:
+                    try:
+                        job["on_complete"](SCPBulkOperations.get_job(job["job_id"]))
+                    except Exception as e:
+                        print(f"SCP bulk job {job['job_id']} completion hook failed: {e}", flush=True)
+
+    @staticmethod
+    def _prune_jobs():
+        if _STORE is not None:
+            try:
+                _STORE.prune_scp_bulk_jobs(_MAX_JOBS)
+            except Exception:
+                pass
+        with _JOBS_LOCK:
+            if len(_JOBS) < _MAX_JOBS:
+                return
+            finished = sorted(
+                (j for j in _JOBS.values() if j["done"].is_set()),
+                key=lambda j: j["created_at"],
+            )
+            for j in finished[: len(_JOBS) - _MAX_JOBS + 1]:
+                _JOBS.pop(j["job_id"], None)
+
+    @staticmethod
+    def start(policy_id, action, targets, requested_by="", wait=False, wait_timeout=None, on_complete=None, job_id=""):
+        """
+        Start a bulk attach/detach job. Returns the job snapshot.
+
+        `job_id` lets the caller audit the job before it starts (default: a new UUID).
+        `wait` blocks until the job finishes or `wait_timeout` seconds pass
+        (capped at SCP_BULK_MAX_WAIT_SECONDS). `on_complete(snapshot)` runs
+        once, on the worker thread that finishes the last target.
+        """
+        action = str(action or "").strip().lower()
+        if action not in ("attach", "detach"):
+            raise ValueError("action must be 'attach' or 'detach'")
+        if not targets:
+            raise ValueError("No targets resolved")
+
+        SCPBulkOperations._prune_jobs()
+        job_id = str(job_id or uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "policy_id": policy_id,
+            "action": action,
+            "requested_by": requested_by,
+            "status": "running",
+            "total": len(targets),
+            "completed": 0,
+            "counts": {},
+            "created_at": datetime.now().isoformat(),
+            "finished_at": "",
+            "targets": [dict(t, status="pending", attempts=0, error="", message="") for t in targets],
+            "lock": threading.Lock(),
+            "done": threading.Event(),
+            "on_complete": on_complete,
+            "persist_lock": threading.Lock(),
+            "persist_due": time.monotonic() + _PERSIST_SECONDS,
+            "persisted_completed": -1,
+        }
+        with _JOBS_LOCK:
+            _JOBS[job_id] = job
+        with job["lock"]:
+            snapshot = SCPBulkOperations._snapshot(job)
+        SCPBulkOperations._persist(job, snapshot)
+        for target in job["targets"]:
+            _EXECUTOR.submit(SCPBulkOperations._apply_one, job, policy_id, action, target)
+        if wait:
+            timeout = _MAX_WAIT_SECONDS if wait_timeout is None else min(float(wait_timeout), _MAX_WAIT_SECONDS)
+            job["done"].wait(timeout)
+        return SCPBulkOperations.get_job(job_id)
+
+    @staticmethod
+    def get_job(job_id):
+        """Snapshot of a job; jobs started by another worker are read from the store."""
+        job = _JOBS.get(str(job_id or ""))
+        if not job:
+            if _STORE is None:
+                return None
+            stored = _STORE.get_scp_bulk_job(str(job_id or ""))
+            if stored:
+                stored["progress_percent"] = int(100 * stored["completed"] / stored["total"]) if stored["total"] else 100
+            return stored
+        with job["lock"]:
+            return SCPBulkOperations._snapshot(job)
+
+    @staticmethod
+    def _snapshot(job):
+        """Plain-dict view of a job; caller holds job["lock"]."""
+        return {
+            "job_id": job["job_id"],
+            "policy_id": job["policy_id"],
+            "action": job["action"],
+            "requested_by": job["requested_by"],
+            "status": job["status"],
+            "total": job["total"],
+            "completed": job["completed"],
+            "progress_percent": int(100 * job["completed"] / job["total"]) if job["total"] else 100,
+            "counts": dict(job["counts"]),
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+            "targets": [dict(t) for t in job["targets"]],
+        }
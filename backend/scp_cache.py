@@ -0,0 +1,300 @@
+"""
+SCP cache and local effective-policy evaluator
+==============================================
+
+`SCPManager` and `SCPTroubleshoot` used to create a new Organizations client
+per call and `describe_policy` every attached SCP on every conversation turn.
+This module keeps:
+
+- one shared Organizations client (boto3 clients are thread-safe)
+- SCP documents keyed by policy ID
+- SCPs attached per target (account / OU / root)
+- the parent chain per target (account -> OU ... -> root)
+
+all with a TTL, plus explicit invalidation from the SCP write paths.
+
+On top of the cache, `is_action_blocked(account_id, action)` evaluates the
+effective SCPs locally. Statements are precompiled into action matchers
+(exact-name set + one regex for wildcard patterns), so once an account's
+chain is warm the check costs a few dict/regex lookups and no API calls.
+
+Evaluation model (SCPs only filter; they never grant):
+- an explicit Deny at any level of the chain blocks the action
+- at every level, some attached SCP must Allow the action, otherwise it is
+  implicitly denied
+- statements with a Condition, or scoped to specific resources, cannot be
+  decided without request context; they are reported as `conditional`
+  instead of blocking
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+
+import boto3
+
+DEFAULT_TTL_SECONDS = 300
+PARENT_TTL_SECONDS = 3600
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+class ActionMatcher:
+    """Case-insensitive IAM action matcher (supports `*` and `?` wildcards)."""
+
+    __slots__ = ("exact", "pattern", "match_all")
+
+    def __init__(self, patterns):
+        exact = set()
+        wild = []
+        match_all = False
+        for raw in _as_list(patterns):
+            p = str(raw or "").strip().lower()
+            if not p:
+                continue
+            if p == "*":
+                match_all = True
+            elif "*" in p or "?" in p:
+                wild.append(re.escape(p).replace(r"\*", ".*").replace(r"\?", "."))
+            else:
+                exact.add(p)
+        self.exact = frozenset(exact)
+        self.pattern = re.compile("^(?:" + "|".join(wild) + ")$") if wild else None
+        self.match_all = match_all
+
+    def matches(self, action_lower: str) -> bool:
+        if self.match_all or action_lower in self.exact:
+            return True
+        return bool(self.pattern and self.pattern.match(action_lower))
+
+
+class CompiledStatement:
+    __slots__ = ("sid", "effect", "matcher", "negated", "conditional")
+
+    def __init__(self, stmt: dict):
+        self.sid = str(stmt.get("Sid") or "")
+        self.effect = str(stmt.get("Effect") or "").strip().lower()
+        self.negated = "NotAction" in stmt and "Action" not in stmt
+        self.matcher = ActionMatcher(stmt.get("NotAction") if self.negated else stmt.get("Action"))
+        resources = [str(r).strip() for r in _as_list(stmt.get("Resource", "*"))]
+        self.conditional = bool(stmt.get("Condition")) or "NotResource" in stmt or any(r != "*" for r in resources)
+
+    def applies_to(self, action_lower: str) -> bool:
+        hit = self.matcher.matches(action_lower)
+        return (not hit) if self.negated else hit
+
+
+class CompiledPolicy:
+    __slots__ = ("policy_id", "name", "denies", "allows")
+
+    def __init__(self, policy_id: str, name: str, content: dict):
+        self.policy_id = policy_id
+        self.name = name
+        stmts = [CompiledStatement(s) for s in _as_list((content or {}).get("Statement")) if isinstance(s, dict)]
+        self.denies = [s for s in stmts if s.effect == "deny"]
+        self.allows = [s for s in stmts if s.effect == "allow"]
+
+
+class SCPCache:
+    def __init__(self, client_factory=None, ttl_seconds: float = DEFAULT_TTL_SECONDS, parent_ttl_seconds: float = PARENT_TTL_SECONDS):
+        self._client_factory = client_factory or (lambda: boto3.client("organizations"))
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._ttl = float(ttl_seconds)
+        self._parent_ttl = float(parent_ttl_seconds)
+        self._lock = threading.Lock()
+        # policy_id -> (fetched_at, {"id", "name", "description", "content"}, CompiledPolicy)
+        self._policies = {}
+        # target_id -> (fetched_at, [{"id", "name", "type"}])
+        self._target_policies = {}
+        # target_id -> (fetched_at, parent_id or "" for root)
+        self._parents = {}
+
+    # ---- client ----
+
+    def client(self):
+        client = self._client
+        if client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+                client = self._client
+        return client
+
+    def set_client_factory(self, factory) -> None:
+        with self._client_lock:
+            self._client_factory = factory
+            self._client = None
+        self.invalidate()
+
+    # ---- invalidation ----
+
+    def invalidate(self, policy_id: str = "", target_id: str = "") -> None:
+        """Drop cached entries. With no arguments, clear everything."""
+        with self._lock:
+            if not policy_id and not target_id:
+                self._policies.clear()
+                self._target_policies.clear()
+                self._parents.clear()
+                return
+            if policy_id:
+                self._policies.pop(policy_id, None)
+                # Attachment lists may mention the policy; they are cheap to refetch.
+                for tid in [t for t, (_, pols) in self._target_policies.items() if any(p.get("id") == policy_id for p in pols)]:
+                    self._target_policies.pop(tid, None)
+            if target_id:
+                self._target_policies.pop(target_id, None)
+
+    def _fresh(self, entry, ttl: float) -> bool:
+        return entry is not None and (time.time() - entry[0]) < ttl
+
+    # ---- documents ----
+
+    def _policy_entry(self, policy_id: str):
+        entry = self._policies.get(policy_id)
+        if self._fresh(entry, self._ttl):
+            return entry
+        resp = self.client().describe_policy(PolicyId=policy_id)
+        policy = resp["Policy"]
+        summary = policy.get("PolicySummary") or {}
+        content = json.loads(policy.get("Content") or "{}")
+        doc = {
+            "id": summary.get("Id", policy_id),
+            "name": summary.get("Name", ""),
+            "description": summary.get("Description", ""),
+            "content": content,
+        }
+        entry = (time.time(), doc, CompiledPolicy(doc["id"], doc["name"], content))
+        with self._lock:
+            self._policies[policy_id] = entry
+        return entry
+
+    def get_policy(self, policy_id: str) -> dict:
+        """Return {"id", "name", "description", "content"} for an SCP."""
+        return self._policy_entry(policy_id)[1]
+
+    def policies_for_target(self, target_id: str) -> list[dict]:
+        """SCPs attached directly to an account, OU or root."""
+        entry = self._target_policies.get(target_id)
+        if self._fresh(entry, self._ttl):
+            return entry[1]
+        policies = []
+        paginator = self.client().get_paginator("list_policies_for_target")
+        for page in paginator.paginate(TargetId=target_id, Filter="SERVICE_CONTROL_POLICY"):
+            for p in page.get("Policies", []):
+                policies.append({"id": p["Id"], "name": p.get("Name", ""), "type": p.get("Type", "SERVICE_CONTROL_POLICY")})
+        with self._lock:
+            self._target_policies[target_id] = (time.time(), policies)
+        return policies
+
+    def documents_for_target(self, target_id: str) -> list[dict]:
+        """Directly attached SCPs with content, e.g. for the troubleshooting prompt."""
+        return [self.get_policy(p["id"]) for p in self.policies_for_target(target_id)]
+
+    # ---- hierarchy ----
+
+    def _parent_of(self, target_id: str) -> str:
+        entry = self._parents.get(target_id)
+        if self._fresh(entry, self._parent_ttl):
+            return entry[1]
+        parent = ""
+        if not str(target_id).startswith("r-"):
+            parents = self.client().list_parents(ChildId=target_id).get("Parents") or []
+            if parents:
+                parent = str(parents[0].get("Id") or "")
+        with self._lock:
+            self._parents[target_id] = (time.time(), parent)
+        return parent
+
+    def target_chain(self, target_id: str) -> list[str]:
+        """[target, parent OU, ..., root] following the OU chain upwards."""
+        chain = [target_id]
+        seen = {target_id}
+        current = target_id
+        while True:
+            parent = self._parent_of(current)
+            if not parent or parent in seen:
+                break
+            chain.append(parent)
+            seen.add(parent)
+            current = parent
+        return chain
+
+    def effective_policies(self, account_id: str) -> list[dict]:
+        """SCPs in effect for an account, inherited along the OU chain, with the level they attach at."""
+        out = []
+        for target in self.target_chain(account_id):
+            for p in self.policies_for_target(target):
+                out.append({**p, "attached_to": target})
+        return out
+
+    # ---- evaluation ----
+
+    def is_action_blocked(self, account_id: str, action: str) -> dict:
+        """
+        Evaluate one IAM action against the account's effective SCPs.
+
+        Returns {"action", "blocked", "reason", "policy_id", "policy_name",
+        "statement_sid", "attached_to", "conditional": [...]}. `blocked` is True
+        only for unconditional denies (explicit, or no Allow at some level).
+        """
+        action_lower = str(action or "").strip().lower()
+        result = {
+            "action": action,
+            "blocked": False,
+            "reason": "",
+            "policy_id": "",
+            "policy_name": "",
+            "statement_sid": "",
+            "attached_to": "",
+            "conditional": [],
+        }
+        for target in self.target_chain(account_id):
+            attached = self.policies_for_target(target)
+            if not attached:
+                # Nothing attached at this level (SCPs disabled or not returned); no filtering.
+                continue
+            level_allows = False
+            for p in attached:
+                compiled = self._policy_entry(p["id"])[2]
+                for stmt in compiled.denies:
+                    if not stmt.applies_to(action_lower):
+                        continue
+                    hit = {"policy_id": compiled.policy_id, "policy_name": compiled.name, "statement_sid": stmt.sid, "attached_to": target}
+                    if stmt.conditional:
+                        result["conditional"].append(hit)
+                        continue
+                    result.update(hit)
+                    result["blocked"] = True
+                    result["reason"] = "explicit_deny"
+                    return result
+                if not level_allows:
+                    level_allows = any(s.applies_to(action_lower) for s in compiled.allows)
+            if not level_allows:
+                result["blocked"] = True
+                result["reason"] = "no_allow"
+                result["attached_to"] = target
+                return result
+        return result
+
+    def blocked_actions(self, account_id: str, actions) -> list[dict]:
+        """Evaluate several actions; returns only the blocked ones."""
+        out = []
+        for action in _as_list(actions):
+            r = self.is_action_blocked(account_id, str(action))
+            if r["blocked"]:
+                out.append(r)
+        return out
+
+
+# Process-wide cache shared by SCPManager, SCPTroubleshoot and app.py.
+SCP_CACHE = SCPCache()
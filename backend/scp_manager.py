@@ -3,17 +3,18 @@ Service Control Policy (SCP) Manager
 Manage AWS SCPs without accessing AWS Console
 """
 
-import boto3
 import json
 from botocore.exceptions import ClientError
 
+from scp_cache import SCP_CACHE
+
 class SCPManager:
     
     @staticmethod
     def list_policies():
         """List all SCPs in organization"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             policies = []
             paginator = org.get_paginator('list_policies')
             
@@ -34,17 +35,13 @@ class SCPManager:
     def get_policy_content(policy_id):
         """Get SCP content"""
         try:
-            org = boto3.client('organizations')
-            response = org.describe_policy(PolicyId=policy_id)
-            
-            policy = response['Policy']
-            content = json.loads(policy['Content'])
+            policy = SCP_CACHE.get_policy(policy_id)
             
             return {
-                'id': policy['PolicySummary']['Id'],
-                'name': policy['PolicySummary']['Name'],
-                'description': policy['PolicySummary'].get('Description', ''),
-                'content': content,
+                'id': policy['id'],
+                'name': policy['name'],
+                'description': policy['description'],
+                'content': policy['content'],
                 'targets': SCPManager._get_policy_targets(policy_id)
             }
         except Exception as e:
@@ -54,7 +51,7 @@ class SCPManager:
     def _get_policy_targets(policy_id):
         """Get accounts/OUs where policy is attached"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             targets = []
             paginator = org.get_paginator('list_targets_for_policy')
             
@@ -74,7 +71,7 @@ class SCPManager:
     def create_policy(name, description, content):
         """Create new SCP"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             
             response = org.create_policy(
                 Content=json.dumps(content),
@@ -95,7 +92,7 @@ class SCPManager:
     def update_policy(policy_id, name=None, description=None, content=None):
         """Update existing SCP"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             
             if name or description:
                 org.update_policy(
@@ -109,6 +106,7 @@ class SCPManager:
                     PolicyId=policy_id,
                     Content=json.dumps(content)
                 )
+            SCP_CACHE.invalidate(policy_id=policy_id)
             
             return {
                 'status': 'success',
@@ -121,8 +119,9 @@ class SCPManager:
     def delete_policy(policy_id):
         """Delete SCP"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             org.delete_policy(PolicyId=policy_id)
+            SCP_CACHE.invalidate(policy_id=policy_id)
             
             return {
                 'status': 'success',
@@ -135,8 +134,9 @@ class SCPManager:
     def attach_policy(policy_id, target_id):
         """Attach SCP to account or OU"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             org.attach_policy(PolicyId=policy_id, TargetId=target_id)
+            SCP_CACHE.invalidate(target_id=target_id)
             
             return {
                 'status': 'success',
@@ -149,8 +149,9 @@ class SCPManager:
     def detach_policy(policy_id, target_id):
         """Detach SCP from account or OU"""
         try:
-            org = boto3.client('organizations')
+            org = SCP_CACHE.client()
             org.detach_policy(PolicyId=policy_id, TargetId=target_id)
+            SCP_CACHE.invalidate(target_id=target_id)
             
             return {
                 'status': 'success',
@@ -163,18 +164,19 @@ class SCPManager:
     def get_account_policies(account_id):
         """Get all SCPs attached to an account"""
         try:
-            org = boto3.client('organizations')
-            policies = []
-            paginator = org.get_paginator('list_policies_for_target')
-            
-            for page in paginator.paginate(TargetId=account_id, Filter='SERVICE_CONTROL_POLICY'):
-                for policy in page['Policies']:
-                    policies.append({
-                        'id': policy['Id'],
-                        'name': policy['Name'],
-                        'type': policy['Type']
-                    })
-            
-            return {'policies': policies}
+            return {'policies': list(SCP_CACHE.policies_for_target(account_id))}
+        except Exception as e:
+            return {'error': str(e)}
+    
+    @staticmethod
+    def evaluate_actions(account_id, actions):
+        """Evaluate actions against the account's effective SCPs (local, cached)"""
+        try:
+            results = [SCP_CACHE.is_action_blocked(account_id, action) for action in actions]
+            return {
+                'account_id': account_id,
+                'effective_policies': SCP_CACHE.effective_policies(account_id),
+                'results': results
+            }
         except Exception as e:
             return {'error': str(e)}
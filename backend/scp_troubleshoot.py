@@ -3,6 +3,8 @@ import json
 import uuid
 from datetime import datetime
 
+from scp_cache import SCP_CACHE
+
 class SCPTroubleshoot:
     """AI assistant for troubleshooting SCP-related access issues (READ-ONLY)"""
     
@@ -123,49 +125,25 @@ Provide a helpful response to investigate the SCP issue. If you need more inform
         
         if account_id:
             try:
-                org_client = boto3.client('organizations')
-                
-                # Get policies attached to account
-                response = org_client.list_policies_for_target(
-                    TargetId=account_id,
-                    Filter='SERVICE_CONTROL_POLICY'
-                )
-                
-                policies = []
-                for policy_summary in response.get('Policies', []):
-                    policy_id = policy_summary['Id']
-                    policy_detail = org_client.describe_policy(PolicyId=policy_id)
-                    policies.append({
-                        'name': policy_summary['Name'],
-                        'id': policy_id,
-                        'content': json.loads(policy_detail['Policy']['Content'])
-                    })
-                
+                policies = SCP_CACHE.documents_for_target(account_id)
                 context += f"\n\nSCPs attached to account {account_id}:\n"
                 context += json.dumps(policies, indent=2)
                 
+                # Inherited SCPs (OU chain up to root) also apply to the account.
+                inherited = [p for p in SCP_CACHE.effective_policies(account_id) if p['attached_to'] != account_id]
+                if inherited:
+                    context += f"\n\nSCPs inherited by account {account_id} from its OU chain:\n"
+                    context += json.dumps(
+                        [{**SCP_CACHE.get_policy(p['id']), 'attached_to': p['attached_to']} for p in inherited],
+                        indent=2,
+                    )
+                
             except Exception as e:
                 context += f"\n\nCould not fetch SCPs for account {account_id}: {str(e)}"
         
         if ou_id:
             try:
-                org_client = boto3.client('organizations')
-                
-                response = org_client.list_policies_for_target(
-                    TargetId=ou_id,
-                    Filter='SERVICE_CONTROL_POLICY'
-                )
-                
-                policies = []
-                for policy_summary in response.get('Policies', []):
-                    policy_id = policy_summary['Id']
-                    policy_detail = org_client.describe_policy(PolicyId=policy_id)
-                    policies.append({
-                        'name': policy_summary['Name'],
-                        'id': policy_id,
-                        'content': json.loads(policy_detail['Policy']['Content'])
-                    })
-                
+                policies = SCP_CACHE.documents_for_target(ou_id)
                 context += f"\n\nSCPs attached to OU {ou_id}:\n"
                 context += json.dumps(policies, indent=2)
                 
@@ -178,17 +156,9 @@ Provide a helpful response to investigate the SCP issue. If you need more inform
     def check_default_scps(account_id, actions):
         """Check if default SCPs block any of the requested actions"""
         try:
-            org_client = boto3.client('organizations')
-            response = org_client.list_policies_for_target(
-                TargetId=account_id,
-                Filter='SERVICE_CONTROL_POLICY'
-            )
-            
             warnings = []
-            for policy_summary in response.get('Policies', []):
-                policy_id = policy_summary['Id']
-                policy_detail = org_client.describe_policy(PolicyId=policy_id)
-                policy_content = json.loads(policy_detail['Policy']['Content'])
+            for policy_summary in SCP_CACHE.policies_for_target(account_id):
+                policy_content = SCP_CACHE.get_policy(policy_summary['id'])['content']
                 
                 # Check for S3 public access blocks
                 for statement in policy_content.get('Statement', []):
@@ -204,9 +174,22 @@ Provide a helpful response to investigate the SCP issue. If you need more inform
                                 warnings.append({
                                     'type': 's3_public_block',
                                     'message': 'Your cloud admin has created an SCP that prevents public S3 buckets. You can still create private buckets.',
-                                    'policy_name': policy_summary['Name']
+                                    'policy_name': policy_summary['name']
                                 })
             
+            # Effective SCPs (including inherited ones), evaluated locally from the cache.
+            for blocked in SCP_CACHE.blocked_actions(account_id, actions):
+                if blocked['reason'] == 'explicit_deny':
+                    message = f"{blocked['action']} is denied by SCP \"{blocked['policy_name']}\" attached to {blocked['attached_to']}."
+                else:
+                    message = f"{blocked['action']} is not allowed by the SCPs attached to {blocked['attached_to']}."
+                warnings.append({
+                    'type': 'scp_deny',
+                    'message': message,
+                    'action': blocked['action'],
+                    'policy_name': blocked['policy_name'],
+                })
+            
             return warnings
         except Exception as e:
             print(f"Error checking SCPs: {e}")
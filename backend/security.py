@@ -4,15 +4,12 @@ Security Baseline: RBAC for admin is in app.py (enforce_admin_api_access).
 """
 from __future__ import annotations
 
+import math
 import os
 import secrets
-import time
-from collections import defaultdict
-from threading import Lock
 
-# Rate limit: in-memory (per process). For multi-worker use Redis in production.
-_RATE_LIMIT_STORE = defaultdict(list)
-_RATE_LIMIT_LOCK = Lock()
+# Rate limit: GCRA (see rate_limiter.py); per process, or shared across workers with RATE_LIMIT_BACKEND=sqlite.
+from rate_limiter import RATE_LIMITER
 
 # Limits: (max_requests, window_seconds)
 RATE_LIMIT_AUTH = (10, 60)       # login/SAML: 10 per minute per IP
@@ -42,14 +39,14 @@ def _rate_limit_key(prefix: str = "", user: str = None):
 
 def _check_rate_limit(key: str, max_requests: int, window_seconds: int) -> bool:
     """Return True if allowed, False if rate limited."""
-    now = time.time()
-    with _RATE_LIMIT_LOCK:
-        times = _RATE_LIMIT_STORE[key]
-        times[:] = [t for t in times if now - t < window_seconds]
-        if len(times) >= max_requests:
-            return False
-        times.append(now)
-    return True
+    return RATE_LIMITER.check(key, max_requests, window_seconds)[0]
+
+
+def _too_many_requests(retry_after: float):
+    from flask import jsonify
+    resp = jsonify({"error": "Too many requests"})
+    resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return resp, 429
 
 
 def rate_limit_exempt(view):
@@ -79,7 +76,7 @@ def init_rate_limit(app):
     """Register before_request: rate limit per IP and per user (when authenticated)."""
     @app.before_request
     def _rate_limit():
-        from flask import request, jsonify
+        from flask import request
         view = request.endpoint and app.view_functions.get(request.endpoint)
         if getattr(view, "_rate_limit_exempt", False):
             return None
@@ -96,15 +93,19 @@ def init_rate_limit(app):
         else:
             key = key_global
             max_r, window = RATE_LIMIT_GLOBAL
-        if not _check_rate_limit(key, max_r, window):
-            return jsonify({"error": "Too many requests"}), 429
-        if key != key_global and not _check_rate_limit(key_global, RATE_LIMIT_GLOBAL[0], RATE_LIMIT_GLOBAL[1]):
-            return jsonify({"error": "Too many requests"}), 429
+        allowed, retry_after = RATE_LIMITER.check(key, max_r, window)
+        if not allowed:
+            return _too_many_requests(retry_after)
+        if key != key_global:
+            allowed, retry_after = RATE_LIMITER.check(key_global, RATE_LIMIT_GLOBAL[0], RATE_LIMIT_GLOBAL[1])
+            if not allowed:
+                return _too_many_requests(retry_after)
         # Per-user limit for authenticated requests (so one user cannot exhaust IP quota)
         if user and path.startswith("/api/"):
             key_user = _rate_limit_key("user", user=user)
-            if not _check_rate_limit(key_user, RATE_LIMIT_PER_USER[0], RATE_LIMIT_PER_USER[1]):
-                return jsonify({"error": "Too many requests"}), 429
+            allowed, retry_after = RATE_LIMITER.check(key_user, RATE_LIMIT_PER_USER[0], RATE_LIMIT_PER_USER[1])
+            if not allowed:
+                return _too_many_requests(retry_after)
         return None
     return app
 
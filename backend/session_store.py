@@ -0,0 +1,385 @@
+"""
+Server-side Flask sessions
+==========================
+
+Flask's default session is a signed cookie holding the whole session dict,
+including `session['attributes']` (every SAML attribute), so a large cookie
+rode along on every API and static request, and a session could not be
+ended server-side: a copied cookie stayed valid until the secret changed.
+
+With this store the cookie holds only an opaque random session ID. The
+session dict lives in the `web_sessions` table of the NpamxStore SQLite
+database, keyed by a SHA-256 of the ID (a leaked database row is not a
+usable cookie), with a per-process LRU in front:
+
+- a cached session is re-read from SQLite at most every
+  `revalidate_seconds`, so a revocation or an update made by another worker
+  is seen within that window (immediately in the worker that made it)
+- activity is written back at most every `touch_seconds`
+- a session ends after `idle_seconds` without a request or `absolute_seconds`
+  after it was created, whichever comes first; expired rows are purged
+  periodically
+- the session ID is replaced when the logged-in user changes (login), so an
+  ID planted before login is never authenticated
+
+`revoke_user()` ends every session of a user, `revoke()` single sessions by
+key. A session's owner is its SAML NameID (`session['user']`), which is not
+always an email, so the resolved email (`email_of`, supplied by app.py) is
+stored beside it; users are matched on either. SESSION_IDLE_TIMEOUT_MINUTES, SESSION_ABSOLUTE_TIMEOUT_HOURS,
+SESSION_CACHE_SIZE and SESSION_CACHE_REVALIDATE_SECONDS configure the
+process-wide SESSION_STORE.
+"""
+
+from __future__ import annotations
+
+import collections
+import hashlib
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+_SID_RE = re.compile(r"^[A-Za-z0-9_-]{32,128}$")
+
+
+def session_key(sid: str) -> str:
+    return hashlib.sha256(str(sid or "").encode("utf-8")).hexdigest()
+
+
+def _iso(epoch) -> str:
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+class _Entry:
+    __slots__ = ("data", "user", "email", "auth_type", "created", "expires", "last_seen", "touched", "validated", "version")
+
+    def __init__(self, data: dict, row: dict, now: float):
+        self.data = data
+        self.user = row["user_email"] or ""
+        self.email = row["owner_email"] or ""
+        self.auth_type = row["auth_type"] or ""
+        self.created = int(row["created_epoch"])
+        self.expires = int(row["expires_epoch"])
+        self.last_seen = float(row["last_seen_epoch"])
+        self.touched = float(row["last_seen_epoch"])
+        self.validated = now
+        self.version = int(row["version"])
+
+
+class SessionStore:
+    def __init__(
+        self,
+        idle_seconds: float = 1800,
+        absolute_seconds: float = 12 * 3600,
+        max_entries: int = 4096,
+        revalidate_seconds: float = 5,
+        touch_seconds: float = 60,
+        purge_seconds: float = 300,
+    ):
+        self.idle_seconds = float(idle_seconds)
+        self.absolute_seconds = float(absolute_seconds)
+        self.max_entries = max(1, int(max_entries))
+        self.revalidate_seconds = float(revalidate_seconds)
+        self.touch_seconds = float(touch_seconds)
+        self.purge_seconds = float(purge_seconds)
+        self.serializer = TaggedJSONSerializer()
+        self.backend = None
+        # session key -> _Entry, least recently used first
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        self.counters = {"hits": 0, "misses": 0, "revalidations": 0, "created": 0, "updated": 0, "expired": 0, "revoked": 0, "purged": 0, "errors": 0}
+
+    def attach(self, backend) -> None:
+        """Use `backend` (an NpamxStore) for persistence."""
+        self.backend = backend
+        self.clear_cache()
+
+    def _cache_put(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cache_drop(self, keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now >= entry.expires or now - entry.last_seen >= self.idle_seconds
+
+    def load(self, sid: str):
+        """Return the live session entry for a cookie value, or None."""
+        if not sid or not _SID_RE.match(sid):
+            return None
+        key = session_key(sid)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None or now - entry.validated >= self.revalidate_seconds:
+            try:
+                row = self.backend.get_web_session(key)
+            except sqlite3.Error:
+                self.counters["errors"] += 1
+                row = None
+                if entry is None:
+                    return None
+            else:
+                if row is None:
+                    self.counters["misses"] += 1
+                    self._cache_drop([key])
+                    return None
+            if row is not None:
+                if entry is not None and entry.version == int(row["version"]):
+                    entry.validated = now
+                    entry.last_seen = max(entry.last_seen, float(row["last_seen_epoch"]))
+                    self.counters["revalidations"] += 1
+                else:
+                    self.counters["misses" if entry is None else "revalidations"] += 1
+                    fresh = _Entry(self.serializer.loads(row["payload_json"]), row, now)
+                    if entry is not None:
+                        fresh.last_seen = max(fresh.last_seen, entry.last_seen)
+                    entry = fresh
+                self._cache_put(key, entry)
+        else:
+            self.counters["hits"] += 1
+        if self._expired(entry, now):
+            self.counters["expired"] += 1
+            self._cache_drop([key])
+            self._delete_keys([key])
+            return None
+        entry.last_seen = now
+        if now - entry.touched >= self.touch_seconds:
+            entry.touched = now
+            try:
+                if not self.backend.touch_web_session(key, int(now)):
+                    self._cache_drop([key])
+                    return None
+            except sqlite3.Error:
+                self.counters["errors"] += 1
+        return entry
+
+    def save(self, sid: str, data: dict, *, user: str, email: str = "", auth_type: str = "", ip: str = "", user_agent: str = "") -> str:
+        """
+        Persist `data` under `sid`, or under a new ID when `sid` is empty.
+        Returns the session ID, or "" when `sid` no longer exists (revoked
+        during the request), in which case nothing is written.
+        """
+        now = time.time()
+        payload_json = self.serializer.dumps(data)
+        email = str(email or "").strip().lower()
+        if sid:
+            key = session_key(sid)
+            row = self.backend.update_web_session(
+                key, user_email=user, auth_type=auth_type, last_seen_epoch=int(now), payload_json=payload_json, owner_email=email,
+            )
+            if row is None:
+                self._cache_drop([key])
+                return ""
+            self.counters["updated"] += 1
+        else:
+            sid = secrets.token_urlsafe(32)
+            key = session_key(sid)
+            row = {"version": 1, "created_epoch": int(now), "expires_epoch": int(now + self.absolute_seconds)}
+            self.backend.insert_web_session(
+                key,
+                user_email=user,
+                auth_type=auth_type,
+                created_epoch=row["created_epoch"],
+                expires_epoch=row["expires_epoch"],
+                ip=ip,
+                user_agent=user_agent,
+                payload_json=payload_json,
+                owner_email=email,
+            )
+            self.counters["created"] += 1
+        self._cache_put(key, _Entry(dict(data), dict(row, user_email=user, owner_email=email, auth_type=auth_type, last_seen_epoch=int(now)), now))
+        self._maybe_purge(now)
+        return sid
+
+    def expires_at(self, sid: str) -> int:
+        with self._lock:
+            entry = self._entries.get(session_key(sid))
+        return entry.expires if entry else 0
+
+    def delete(self, sid: str) -> None:
+        if sid:
+            self._delete_keys([session_key(sid)])
+
+    def _delete_keys(self, keys) -> list:
+        self._cache_drop(keys)
+        try:
+            return self.backend.delete_web_sessions(session_keys=keys)
+        except sqlite3.Error:
+            self.counters["errors"] += 1
+            return []
+
+    def revoke(self, keys) -> int:
+        """End sessions by key (as listed by active_sessions)."""
+        deleted = self._delete_keys([str(k) for k in keys if k])
+        self.counters["revoked"] += len(deleted)
+        return len(deleted)
+
+    def revoke_user(self, user: str) -> int:
+        """End every session of `user`: the session owner's NameID or resolved email, any case."""
+        user = str(user or "").strip().lower()
+        if not user:
+            return 0
+        deleted = self.backend.delete_web_sessions(user_email=user)
+        with self._lock:
+            deleted_set = set(deleted)
+            for key in [k for k, e in self._entries.items() if k in deleted_set or user in (e.user, e.email)]:
+                del self._entries[key]
+        self.counters["revoked"] += len(deleted)
+        return len(deleted)
+
+    def active_sessions(self, user: str = "", limit: int = 500) -> list:
+        now = time.time()
+        rows = self.backend.list_web_sessions(idle_before=int(now - self.idle_seconds), now=int(now), user_email=user, limit=limit)
+        with self._lock:
+            cached = {k: self._entries[k].last_seen for k in (r["session_key"] for r in rows) if k in self._entries}
+        out = []
+        for r in rows:
+            last_seen = max(r["last_seen_epoch"], int(cached.get(r["session_key"], 0)))
+            out.append({
+                "id": r["session_key"],
+                "user": r["user_email"],
+                "email": r["owner_email"] or "",
+                "auth_type": r["auth_type"],
+                "ip": r["ip"],
+                "user_agent": r["user_agent"],
+                "created_at": _iso(r["created_epoch"]),
+                "last_seen_at": _iso(last_seen),
+                "expires_at": _iso(min(r["expires_epoch"], last_seen + self.idle_seconds)),
+            })
+        return out
+
+    def _maybe_purge(self, now: float) -> None:
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_seconds
+        try:
+            self.counters["purged"] += self.backend.purge_web_sessions(idle_before=int(now - self.idle_seconds), now=int(now))
+        except sqlite3.Error:
+            self.counters["errors"] += 1
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._entries)
+        return {
+            "cached": cached,
+            "idle_timeout_seconds": self.idle_seconds,
+            "absolute_timeout_seconds": self.absolute_seconds,
+            **self.counters,
+        }
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: str = "", user: str = ""):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.user = user
+        self.new = not sid
+        self.modified = False
+
+
+def _session_owner(session) -> str:
+    return str(session.get("user") or "").strip().lower()
+
+
+def _client_ip(request) -> str:
+    return request.headers.get("X-Real-IP") or request.headers.get("X-Forwarded-For", "").split(",")[0].strip() or request.remote_addr or ""
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface over a SessionStore; the cookie carries only the session ID."""
+
+    def __init__(self, store: SessionStore, email_of=None):
+        self.store = store
+        # email_of(session) -> the owner's resolved email ("" when unknown).
+        self.email_of = email_of
+
+    def _owner_email(self, session) -> str:
+        if self.email_of is None:
+            return ""
+        try:
+            return str(self.email_of(session) or "")
+        except Exception:
+            return ""
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app)) or ""
+        entry = self.store.load(sid)
+        if entry is None:
+            return ServerSession()
+        return ServerSession(entry.data, sid=sid, user=entry.user)
+
+    def save_session(self, app, session, response):
+        from flask import request
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.sid and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        response.vary.add("Cookie")
+        user = _session_owner(session)
+        if session.sid and user != session.user:
+            # Login or user switch: never carry an ID across identities.
+            self.store.delete(session.sid)
+            session.sid = ""
+        if session.sid and not session.modified:
+            return
+        sid = self.store.save(
+            session.sid,
+            dict(session),
+            user=user,
+            email=self._owner_email(session) if user else "",
+            auth_type=str(session.get("auth_type") or ("saml" if user else "")),
+            ip=_client_ip(request),
+            user_agent=request.headers.get("User-Agent") or "",
+        )
+        if not sid:
+            response.delete_cookie(name, domain=domain, path=path)
+        elif sid != session.sid:
+            response.set_cookie(
+                name,
+                sid,
+                expires=self.store.expires_at(sid) or None,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        session.sid = sid
+
+
+# Process-wide store; app.py attaches the NpamxStore and installs the interface.
+SESSION_STORE = SessionStore(
+    idle_seconds=float(os.getenv("SESSION_IDLE_TIMEOUT_MINUTES") or 30) * 60,
+    absolute_seconds=float(os.getenv("SESSION_ABSOLUTE_TIMEOUT_HOURS") or 12) * 3600,
+    max_entries=int(os.getenv("SESSION_CACHE_SIZE") or 4096),
+    revalidate_seconds=float(os.getenv("SESSION_CACHE_REVALIDATE_SECONDS") or 5),
+)
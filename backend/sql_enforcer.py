@@ -6,7 +6,7 @@ The proxy uses this INSTEAD of trusting the client or the broader validate_sql_q
 Principle: "Deterministic over intelligent" — code rules, not AI judgment.
 """
 
-import re
+from sql_lexer import SQLPolicy, analyze
 
 # Maximum query length to prevent DoS
 MAX_QUERY_LENGTH = 10000
@@ -14,46 +14,37 @@ MAX_QUERY_LENGTH = 10000
 # ONLY these keywords allowed for proxy (read-only access)
 PROXY_ALLOWED_KEYWORDS = {'SELECT', 'EXPLAIN', 'SHOW', 'DESCRIBE', 'DESC', 'WITH'}
 
-# Block these even if they appear in subqueries or comments
+# Blocked anywhere in the statement (subqueries, executable comments, later statements).
+# Matched on SQL tokens, so words inside string literals, `identifiers` and comments do not count.
+# Order matters: the first matching rule supplies the message.
 BLOCKED_PATTERNS = [
-    (r'\bINSERT\b', 'INSERT is not allowed (write operation)'),
-    (r'\bUPDATE\b', 'UPDATE is not allowed (write operation)'),
-    (r'\bDELETE\b', 'DELETE is not allowed (write operation)'),
-    (r'\bDROP\b', 'DROP is not allowed (destructive)'),
-    (r'\bTRUNCATE\b', 'TRUNCATE is not allowed (destructive)'),
-    (r'\bCREATE\b', 'CREATE is not allowed (DDL)'),
-    (r'\bALTER\b', 'ALTER is not allowed (DDL)'),
-    (r'\bGRANT\b', 'GRANT is not allowed'),
-    (r'\bREVOKE\b', 'REVOKE is not allowed'),
-    (r'\bEXEC\b', 'EXEC is not allowed'),
-    (r'\bEXECUTE\b', 'EXECUTE is not allowed'),
-    (r'\bCALL\b', 'CALL is not allowed'),
-    (r'\bINTO\s+OUTFILE\b', 'SELECT INTO OUTFILE is not allowed'),
-    (r'\bINTO\s+DUMPFILE\b', 'SELECT INTO DUMPFILE is not allowed'),
-    (r'\bLOAD_FILE\b', 'LOAD_FILE is not allowed'),
-    (r'\bINTO\s+', 'SELECT INTO (writes elsewhere) is not allowed'),
+    ('INSERT', 'INSERT is not allowed (write operation)'),
+    ('UPDATE', 'UPDATE is not allowed (write operation)'),
+    ('DELETE', 'DELETE is not allowed (write operation)'),
+    ('DROP', 'DROP is not allowed (destructive)'),
+    ('TRUNCATE', 'TRUNCATE is not allowed (destructive)'),
+    ('CREATE', 'CREATE is not allowed (DDL)'),
+    ('ALTER', 'ALTER is not allowed (DDL)'),
+    ('GRANT', 'GRANT is not allowed'),
+    ('REVOKE', 'REVOKE is not allowed'),
+    ('EXEC', 'EXEC is not allowed'),
+    ('EXECUTE', 'EXECUTE is not allowed'),
+    ('CALL', 'CALL is not allowed'),
+    ('INTO OUTFILE', 'SELECT INTO OUTFILE is not allowed'),
+    ('INTO DUMPFILE', 'SELECT INTO DUMPFILE is not allowed'),
+    ('LOAD_FILE', 'LOAD_FILE is not allowed'),
+    ('INTO', 'SELECT INTO (writes elsewhere) is not allowed'),
 ]
 
+PROXY_POLICY = SQLPolicy(BLOCKED_PATTERNS)
+
 
 def get_first_sql_keyword(query: str) -> str:
     """
     Extract the first SQL keyword, skipping comments.
     TEACHING: We need the "main" verb of the query to decide if it's read-only.
     """
-    q = query.strip()
-    # Skip leading comments
-    while q:
-        q_upper = q.upper()
-        if q_upper.startswith('--'):
-            idx = q.find('\n')
-            q = q[idx + 1:].strip() if idx >= 0 else ''
-        elif q_upper.startswith('/*'):
-            idx = q.find('*/')
-            q = q[idx + 2:].strip() if idx >= 0 else ''
-        else:
-            break
-    match = re.match(r'^(\w+)', q, re.IGNORECASE)
-    return match.group(1).upper() if match else ''
+    return analyze(query or '').first_keyword
 
 
 def enforce_select_only(query: str):
@@ -71,18 +62,20 @@ def enforce_select_only(query: str):
     if len(query) > MAX_QUERY_LENGTH:
         return False, f"Query exceeds maximum length of {MAX_QUERY_LENGTH} characters"
     
-    # Check blocked patterns first (catches INSERT in subquery, etc.)
-    for pattern, msg in BLOCKED_PATTERNS:
-        if re.search(pattern, query, re.IGNORECASE):
-            return False, f"❌ PROXY BLOCKED: {msg}"
+    # One pass: tokenize, split statements and check blocked keywords (catches INSERT in subquery, etc.)
+    analysis = PROXY_POLICY.evaluate(query)
+    if analysis.error:
+        return False, f"❌ PROXY BLOCKED: {analysis.error}"
+    if analysis.denied:
+        return False, f"❌ PROXY BLOCKED: {analysis.denied}"
     
-    # First keyword must be allowed
-    keyword = get_first_sql_keyword(query)
-    if not keyword:
+    # Every statement must start with an allowed keyword
+    if not analysis.statements:
         return False, "Invalid or empty query"
-    
-    if keyword not in PROXY_ALLOWED_KEYWORDS:
-        return False, f"❌ PROXY BLOCKED: '{keyword}' is not allowed. Only read-only queries (SELECT, SHOW, etc.) are permitted."
+    for stmt in analysis.statements:
+        if not stmt.keyword:
+            return False, "Invalid or empty query"
+        if stmt.verb not in PROXY_ALLOWED_KEYWORDS:
+            return False, f"❌ PROXY BLOCKED: '{stmt.verb}' is not allowed. Only read-only queries (SELECT, SHOW, etc.) are permitted."
     
     return True, None
-
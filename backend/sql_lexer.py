@@ -0,0 +1,277 @@
+"""
+Single-pass SQL lexer and policy evaluation
+===========================================
+
+Shared by `sql_enforcer` (proxy SELECT-only) and `prompt_injection_guard`
+(role-based SQL checks). Both used to run a list of regexes over the raw
+query text, so keywords inside string literals, quoted identifiers and
+comments were treated as SQL (`SELECT 'please update'` was blocked), and
+every rule was another full scan of the query.
+
+`SQLPolicy.evaluate()` walks the query once, left to right (MySQL dialect):
+
+- '...' and "..." literals (backslash and doubled-quote escapes), `backtick`
+  identifiers and @variables are opaque
+- `-- `, `#` and /* */ comments are skipped; MySQL executable comments
+  (/*! ... */) are lexed as SQL because the server runs them
+- a keyword right after `.` is a qualified identifier (t.update)
+- `;` separates statements; each statement records its first keyword and its
+  effective verb (for WITH, the top-level SELECT/UPDATE/DELETE after the CTEs)
+- deny rules are single keywords or keyword pairs (INTO OUTFILE); a pair
+  matches across whitespace and comments, so `INTO/**/OUTFILE` is caught
+
+Unterminated literals/comments make the query invalid (fail closed).
+
+The scan is one compiled `search()` over the upper-cased query. The regex
+engine skips plain identifiers, numbers, operators and whitespace itself;
+Python only sees literals, comments, separators and rule keywords.
+"""
+
+from __future__ import annotations
+
+import re
+
+_WORD = r"[^\W\d][\w$]*"
+_WORD_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_$")
+
+# Start of a statement: the first word (after whitespace/comments) is the statement keyword.
+_HEAD_RE = re.compile(
+    r"(?:\s+|(?:--(?=\s|$)|\#)[^\n]*|/\*(?!!).*?\*/)*"
+    rf"(?:(?P<word>{_WORD})|(?P<open>\()|(?P<exec_open>/\*!\d*)|(?P<semicolon>;)|(?P<end>\Z)|(?P<other>))",
+    re.DOTALL,
+)
+
+# Body tokens. No named groups (they defeat the engine's fast paths); the
+# first character of a match tells what it is. Literal patterns are written
+# in unrolled form so they run in a single linear sweep.
+_SCAN_TOKENS = (
+    r"'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'"
+    r'|"[^"\\]*(?:(?:\\.|"")[^"\\]*)*"'
+    r"|`[^`]*(?:``[^`]*)*`"
+    r"|--(?=\s|$)[^\n]*|#[^\n]*"
+    r"|/\*!\d*|/\*.*?\*/|\*/"
+    r"|@@?(?:[\w$.]+|'[^'\\]*(?:\\.[^'\\]*)*'|`[^`]*`)?"
+    r"|;|['\"`]|/\*"
+)
+
+# Verbs that can follow a WITH clause.
+_CTE_VERBS = frozenset({"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "TABLE", "VALUES"})
+
+
+def _in_variable(text: str, start: int) -> bool:
+    """True when the name starting at `start` is part of an @variable (@a, @@version, @@session.x)."""
+    i = start
+    while i > 0 and (text[i - 1] in _WORD_CHARS or text[i - 1] == "."):
+        i -= 1
+    return i > 0 and text[i - 1] == "@"
+
+
+def _after_qualifier(text: str, start: int) -> bool:
+    """
+    True when the word at `start` follows "name." (t.update, `t`.update,
+    t. update). A number before the dot (1. INTO OUTFILE) is a literal, and
+    an @variable before it (@a. INTO OUTFILE) is lexed whole by MySQL, so in
+    both cases the word after it is still a keyword.
+    """
+    dot = start - 1
+    if dot >= 1 and text[dot].isspace():
+        dot -= 1
+    if dot < 1 or text[dot] != ".":
+        return False
+    if text[dot - 1] == "`":
+        opening = dot - 1
+        while True:
+            opening = text.rfind("`", 0, opening)
+            if opening > 0 and text[opening - 1] == "`":
+                # Doubled backtick inside the name.
+                opening -= 1
+                continue
+            break
+        return not _in_variable(text, opening)
+    i = dot
+    while i > 0 and text[i - 1] in _WORD_CHARS:
+        i -= 1
+    return i < dot and not text[i].isdigit() and not _in_variable(text, i)
+
+
+def _scan_re(keywords, with_parens: bool) -> re.Pattern:
+    kw = "|".join(sorted((re.escape(k) for k in keywords), key=len, reverse=True))
+    pattern = _SCAN_TOKENS
+    if kw:
+        pattern += rf"|\b(?:{kw})\b"
+    if with_parens:
+        pattern += r"|[()]"
+    return re.compile(pattern, re.DOTALL)
+
+
+class Statement:
+    __slots__ = ("keyword", "verb", "start")
+
+    def __init__(self, keyword: str, start: int):
+        self.keyword = keyword
+        # Effective verb; differs from `keyword` only for WITH ... <verb>.
+        self.verb = keyword
+        self.start = start
+
+    def __repr__(self):
+        return f"Statement(keyword={self.keyword!r}, verb={self.verb!r})"
+
+
+class SQLAnalysis:
+    __slots__ = ("statements", "error", "denied", "denied_rule")
+
+    def __init__(self):
+        self.statements: list[Statement] = []
+        self.error = ""
+        self.denied = ""
+        self.denied_rule = ""
+
+    @property
+    def first_keyword(self) -> str:
+        return self.statements[0].keyword if self.statements else ""
+
+    @property
+    def verbs(self) -> list[str]:
+        return [s.verb for s in self.statements]
+
+
+class SQLPolicy:
+    """
+    Ordered deny rules evaluated during lexing.
+
+    rules: [(pattern, message)], pattern is a keyword ("DROP") or a
+    space-separated keyword pair ("INTO OUTFILE"). When several rules match,
+    the earliest rule in the list wins, so specific messages can precede
+    generic ones (INTO OUTFILE before INTO).
+    """
+
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self._words: dict[str, int] = {}
+        self._pairs: dict[tuple[str, str], int] = {}
+        for idx, (pattern, _msg) in enumerate(self.rules):
+            parts = str(pattern).strip().upper().split()
+            if len(parts) == 1:
+                self._words.setdefault(parts[0], idx)
+            elif len(parts) == 2:
+                self._pairs.setdefault((parts[0], parts[1]), idx)
+            else:
+                raise ValueError(f"Rule pattern must be one or two keywords: {pattern!r}")
+        rule_words = set(self._words) | {w for pair in self._pairs for w in pair}
+        self._scan = _scan_re(rule_words, with_parens=False)
+        # Only WITH statements need paren depth and the candidate verbs.
+        self._scan_cte = _scan_re(rule_words | _CTE_VERBS, with_parens=True)
+
+    def _check(self, word: str, prev_word: str, best: int) -> int:
+        idx = self._words.get(word)
+        if idx is not None and idx < best:
+            best = idx
+        if prev_word:
+            idx = self._pairs.get((prev_word, word))
+            if idx is not None and idx < best:
+                best = idx
+        return best
+
+    def evaluate(self, query: str) -> SQLAnalysis:
+        result = SQLAnalysis()
+        query = query or ""
+        text = query.upper()
+        if len(text) != len(query):
+            # A few non-ASCII characters change length when upper-cased; keep offsets stable.
+            text = "".join(c.upper() if len(c.upper()) == 1 else c for c in query)
+        head_match = _HEAD_RE.match
+        statements = result.statements
+        best = len(self.rules)
+        current = None
+        depth = 0
+        # Last keyword and where it ended; pairs match across whitespace/comments only.
+        prev_word = ""
+        prev_end = 0
+        in_exec_comment = False
+        pos = 0
+
+        while True:
+            if current is None:
+                m = head_match(text, pos)
+                kind = m.lastgroup
+                pos = m.end()
+                if kind == "other":
+                    # Starts with a literal/operator: not a statement we can classify.
+                    current = Statement("", pos)
+                    statements.append(current)
+                    prev_word = ""
+                elif kind == "word":
+                    word = m.group("word")
+                    current = Statement(word, m.start("word"))
+                    statements.append(current)
+                    best = self._check(word, "", best)
+                    prev_word, prev_end = word, pos
+                elif kind == "open":
+                    depth += 1
+                elif kind == "exec_open":
+                    in_exec_comment = True
+                elif kind == "end":
+                    break
+                continue
+
+            m = (self._scan_cte if current.verb == "WITH" else self._scan).search(text, pos)
+            if m is None:
+                break
+            start, pos = m.span()
+            token = m.group()
+            ch = token[0]
+            adjacent = bool(prev_word) and (start == prev_end or text[prev_end:start].isspace())
+
+            if ch == "-" or ch == "#" or (ch == "/" and len(token) >= 4 and token[2] != "!"):
+                # Comment: transparent for keyword pairs.
+                if adjacent:
+                    prev_end = pos
+                else:
+                    prev_word = ""
+                continue
+            if ch in _WORD_CHARS:
+                before = text[start - 1] if start else " "
+                if before in _WORD_CHARS or _after_qualifier(text, start):
+                    # Part of a longer identifier or a qualified name (t.update).
+                    prev_word = ""
+                    continue
+                if current.verb == "WITH" and depth == 0 and token in _CTE_VERBS:
+                    current.verb = token
+                best = self._check(token, prev_word if adjacent else "", best)
+                prev_word, prev_end = token, pos
+                continue
+
+            prev_word = ""
+            if ch in "'\"`":
+                if len(token) == 1:
+                    result.error = f"Unterminated quoted string at position {start}"
+                    break
+            elif ch == ";":
+                current = None
+                depth = 0
+            elif ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth = max(0, depth - 1)
+            elif ch == "*":
+                in_exec_comment = False
+            elif ch == "/":
+                if token.startswith("/*!"):
+                    in_exec_comment = True
+                else:
+                    result.error = f"Unterminated comment at position {start}"
+                    break
+
+        if not result.error and in_exec_comment:
+            result.error = "Unterminated comment"
+        if best < len(self.rules):
+            result.denied_rule, result.denied = self.rules[best]
+        return result
+
+
+_NO_RULES = SQLPolicy()
+
+
+def analyze(query: str) -> SQLAnalysis:
+    """Lex and classify statements without any deny rules."""
+    return _NO_RULES.evaluate(query)
@@ -1,7 +1,8 @@
 # Strict Policies - CANNOT be overridden by AI or user input
 
 import json
-import os
+
+from config_registry import CONFIG_REGISTRY, thaw
 
 class StrictPolicies:
     """
@@ -31,28 +32,27 @@ class StrictPolicies:
         }
     }
     
-    # Load configuration from file or use defaults
-    _config = None
+    @staticmethod
+    def _parse_config(raw):
+        """Config file contents over the defaults (defaults when missing or invalid)"""
+        if not isinstance(raw, dict):
+            return StrictPolicies._default_config
+        return {**StrictPolicies._default_config, **raw}
     
     @staticmethod
-    def _load_config():
-        """Load configuration from file"""
-        if os.path.exists(StrictPolicies._config_file):
-            try:
-                with open(StrictPolicies._config_file, 'r') as f:
-                    return json.load(f)
-            except:
-                pass
-        return StrictPolicies._default_config.copy()
+    def _current_config():
+        """Read-only snapshot, re-read only when the file changes"""
+        return CONFIG_REGISTRY.get('strict_policies')
     
     @staticmethod
-    def _save_config():
+    def _save_config(config):
         """Save configuration to file"""
         try:
             with open(StrictPolicies._config_file, 'w') as f:
-                json.dump(StrictPolicies._config, f, indent=2)
+                json.dump(config, f, indent=2)
         except Exception as e:
             print(f"Error saving config: {e}")
+        CONFIG_REGISTRY.invalidate('strict_policies')
     
     # STRICT RULE 1: ALWAYS Forbidden Actions (NEVER allowed regardless of config)
     ALWAYS_FORBIDDEN_ACTIONS = [
@@ -135,17 +135,14 @@ class StrictPolicies:
     @staticmethod
     def update_config(config):
         """Update configuration from admin settings and persist to file"""
-        if StrictPolicies._config is None:
-            StrictPolicies._config = StrictPolicies._load_config()
-        StrictPolicies._config.update(config)
-        StrictPolicies._save_config()
+        updated = thaw(StrictPolicies._current_config())
+        updated.update(config)
+        StrictPolicies._save_config(updated)
     
     @staticmethod
     def get_config():
         """Get current configuration"""
-        if StrictPolicies._config is None:
-            StrictPolicies._config = StrictPolicies._load_config()
-        return StrictPolicies._config.copy()
+        return thaw(StrictPolicies._current_config())
     
     @staticmethod
     def validate_actions(actions, account_environment='nonprod'):
@@ -153,59 +150,9 @@ class StrictPolicies:
         Validate that requested actions don't violate strict policies
         Returns: (is_valid, error_message, guidance)
         """
-        if not actions or not isinstance(actions, list):
-            return False, "Actions must be a non-empty list", None
-        
-        # Check for forbidden actions
-        for action in actions:
-            action_lower = action.lower()
-            
-            # Check ALWAYS forbidden actions
-            if action in StrictPolicies.ALWAYS_FORBIDDEN_ACTIONS:
-                # Check if it's a CREATE action
-                if any(create_word in action_lower for create_word in ['create', 'runinstances']):
-                    email = StrictPolicies._config['contact_emails']['create']
-                    guidance = f"Infrastructure provisioning requests should be submitted through DevOps. Please contact {email} or create a JIRA ticket."
-                    return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", guidance
-                
-                # Check if it's an IAM action
-                if 'iam:' in action_lower or 'assumerole' in action_lower:
-                    email = StrictPolicies._config['contact_emails']['iam']
-                    guidance = f"IAM and security actions require special approval. Please contact {email}."
-                    return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", guidance
-                
-                return False, f"❌ POLICY VIOLATION: Action '{action}' is strictly forbidden", None
-            
-            # Check CONFIGURABLE delete actions
-            if action in StrictPolicies.CONFIGURABLE_DELETE_ACTIONS:
-                is_prod = account_environment in ['prod', 'production']
-                
-                if is_prod and not StrictPolicies._config['allow_delete_prod']:
-                    email = StrictPolicies._config['contact_emails']['delete']
-                    guidance = f"Delete actions in production require special approval. Please contact {email} for L3-Delete permission set requests."
-                    return False, f"❌ Delete actions disabled in production", guidance
-                
-                if not is_prod and not StrictPolicies._config['allow_delete_nonprod']:
-                    email = StrictPolicies._config['contact_emails']['delete']
-                    guidance = f"Delete actions are currently disabled. Please contact {email} for delete permission requests."
-                    return False, f"❌ Delete actions disabled", guidance
-                
-                # If allowed, mark as requiring L3-Delete permission set
-                # This will be handled by approval workflow
-            
-            # Check wildcard patterns - allow for read-only actions
-            if '*' in action:
-                read_prefixes = ['get', 'list', 'describe', 'read', 'view', 'fetch', 'query', 'scan']
-                action_lower = action.lower()
-                is_read_action = any(prefix in action_lower for prefix in read_prefixes)
-                if not is_read_action:
-                    return False, f"❌ POLICY VIOLATION: Wildcard action '{action}' is not allowed for write operations", None
-            
-            # Check for privilege escalation patterns
-            if any(forbidden in action_lower for forbidden in ['createuser', 'createrole', 'attachpolicy']):
-                return False, f"❌ POLICY VIOLATION: Action '{action}' can lead to privilege escalation", None
-        
-        return True, None, None
+        # Evaluated by the policy decision point from compiled action sets.
+        from policy_engine import POLICY_ENGINE
+        return POLICY_ENGINE.validate_actions(actions, account_environment)
     
     @staticmethod
     def validate_user_input(user_input):
@@ -274,3 +221,6 @@ class StrictPolicies:
             return True, 'manager'
         
         return False, 'self'
+
+
+CONFIG_REGISTRY.register('strict_policies', StrictPolicies._config_file, StrictPolicies._parse_config)
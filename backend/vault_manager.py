@@ -8,21 +8,126 @@ Python environment.
 NPAMX uses Vault's Database Secrets Engine to mint short-lived DB credentials.
 For this phase, the "vault token" shown to the user is the Vault-generated
 database password for the dynamic user (time-bound and revoked by Vault).
+
+HTTP: calls go through a small keep-alive connection pool per Vault origin
+(one per plane in practice), so an activation's login/role/creds calls reuse
+one TCP+TLS connection. Tunables (plane-suffixed variants are honoured, e.g.
+VAULT_HTTP_POOL_SIZE_PROD):
+  VAULT_HTTP_POOL_SIZE          idle connections kept per origin (default 4; 0 disables keep-alive)
+  VAULT_HTTP_CONNECT_TIMEOUT    seconds (default 3)
+  VAULT_HTTP_TIMEOUT            read timeout seconds (default 8)
+  VAULT_HTTP_IDLE_SECONDS       drop pooled connections idle longer than this (default 60)
+  VAULT_CACERT                  CA bundle for Vault TLS (optional)
 """
 
 from __future__ import annotations
 
+import hashlib
+import http.client
 import json
 import os
 import re
+import socket
+import ssl
+import threading
 import time
-import urllib.request
-import urllib.error
+import urllib.parse
 from datetime import datetime, timedelta
 
 
+class _VaultHttpPool:
+    """Keep-alive HTTP(S) connections to one Vault origin (stdlib only)."""
+
+    # Errors that mean a pooled connection went stale before the request reached Vault.
+    _STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, http.client.CannotSendRequest)
+
+    def __init__(self, scheme: str, host: str, port: int | None, *, size: int, connect_timeout: float, idle_seconds: float, cafile: str = ""):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = max(0, int(size))
+        self.connect_timeout = float(connect_timeout)
+        self.idle_seconds = float(idle_seconds)
+        self._ssl_context = ssl.create_default_context(cafile=cafile or None) if scheme == "https" else None
+        self._idle = []  # [(conn, last_used_monotonic)], LIFO
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _new_connection(self):
+        if self.scheme == "https":
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        # Small JSON requests on a reused connection must not wait on Nagle/delayed ACK.
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_seconds:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+        return self._new_connection(), False
+
+    def _checkin(self, conn) -> None:
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method: str, path: str, headers: dict, body: bytes | None, timeout: float) -> tuple[int, str, bytes, dict]:
+        headers = dict(headers)
+        if self.size <= 0:
+            headers["Connection"] = "close"
+        for attempt in (1, 2):
+            conn, reused = self._checkout()
+            try:
+                conn.sock.settimeout(timeout)
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except self._STALE_ERRORS:
+                conn.close()
+                if reused and attempt == 1:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if resp.will_close or self.size <= 0:
+                conn.close()
+            else:
+                self._checkin(conn)
+            return resp.status, resp.reason, raw, {k.lower(): v for k, v in resp.getheaders()}
+        raise ConnectionError("Vault connection retry exhausted")
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "size": self.size, "created": self.created, "reused": self.reused}
+
+
 class VaultManager:
     _cached_tokens = {}
+    _http_pools = {}
+    _http_pools_lock = threading.Lock()
+    # (plane, mount, role_name) -> {"hash": content hash, "written_at": epoch, "refs": {request_id, ...}}
+    _role_cache = {}
+    _role_cache_lock = threading.Lock()
 
     @staticmethod
     def _normalize_plane(plane: str) -> str:
@@ -67,42 +172,84 @@ class VaultManager:
         norm = VaultManager._normalize_plane(plane)
         return norm or "default"
 
+    @staticmethod
+    def _http_pool(scheme: str, netloc: str, plane: str = "") -> _VaultHttpPool:
+        key = (VaultManager._cache_key_for_plane(plane), scheme, netloc)
+        pool = VaultManager._http_pools.get(key)
+        if pool is not None:
+            return pool
+        with VaultManager._http_pools_lock:
+            pool = VaultManager._http_pools.get(key)
+            if pool is None:
+                parsed = urllib.parse.urlsplit(f"{scheme}://{netloc}")
+                pool = _VaultHttpPool(
+                    scheme,
+                    parsed.hostname or "",
+                    parsed.port,
+                    size=int(VaultManager._env("VAULT_HTTP_POOL_SIZE", plane) or 4),
+                    connect_timeout=float(VaultManager._env("VAULT_HTTP_CONNECT_TIMEOUT", plane) or 3),
+                    idle_seconds=float(VaultManager._env("VAULT_HTTP_IDLE_SECONDS", plane) or 60),
+                    cafile=VaultManager._env("VAULT_CACERT", plane),
+                )
+                VaultManager._http_pools[key] = pool
+            return pool
+
+    @staticmethod
+    def http_pool_stats() -> dict:
+        """Connection reuse counters per (plane, origin), for diagnostics/benchmarks."""
+        return {"/".join(k): pool.stats() for k, pool in list(VaultManager._http_pools.items())}
+
+    @staticmethod
+    def reset_http_pools() -> None:
+        with VaultManager._http_pools_lock:
+            pools, VaultManager._http_pools = VaultManager._http_pools, {}
+        for pool in pools.values():
+            pool.close()
+
     @staticmethod
     def _http_json(
         method: str,
         url: str,
         token: str | None,
         body: dict | None = None,
-        timeout: int = 8,
+        timeout: int | None = None,
         namespace: str | None = None,
+        plane: str = "",
     ) -> dict:
         headers = {
             "Content-Type": "application/json",
         }
-        ns = str(namespace if namespace is not None else VaultManager._vault_namespace()).strip()
+        ns = str(namespace if namespace is not None else VaultManager._vault_namespace(plane)).strip()
         if ns:
             headers["X-Vault-Namespace"] = ns
         if token:
             headers["X-Vault-Token"] = token
+        if timeout is None:
+            timeout = float(VaultManager._env("VAULT_HTTP_TIMEOUT", plane) or 8)
 
         data = None
         if body is not None:
             data = json.dumps(body).encode("utf-8")
 
-        req = urllib.request.Request(url=url, data=data, headers=headers, method=method.upper())
-        try:
-            with urllib.request.urlopen(req, timeout=timeout) as resp:
-                raw = resp.read().decode("utf-8")
-                return json.loads(raw) if raw else {}
-        except urllib.error.HTTPError as e:
-            raw = ""
+        # Follow Vault standby redirects (307) to the active node, like urllib did.
+        for _ in range(3):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path = f"{path}?{parts.query}"
             try:
-                raw = e.read().decode("utf-8")
-            except Exception:
-                pass
-            raise RuntimeError(f"Vault HTTP {e.code}: {raw or e.reason}") from e
-        except urllib.error.URLError as e:
-            raise RuntimeError(f"Vault connection failed: {e}") from e
+                pool = VaultManager._http_pool(parts.scheme or "http", parts.netloc, plane)
+                status, reason, raw_bytes, resp_headers = pool.request(method.upper(), path, headers, data, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                raise RuntimeError(f"Vault connection failed: {e}") from e
+            if status in (301, 302, 307, 308) and resp_headers.get("location"):
+                url = urllib.parse.urljoin(url, resp_headers["location"])
+                continue
+            raw = raw_bytes.decode("utf-8", errors="replace")
+            if status >= 400:
+                raise RuntimeError(f"Vault HTTP {status}: {raw or reason}")
+            return json.loads(raw) if raw else {}
+        raise RuntimeError("Vault HTTP redirect limit exceeded")
 
     @staticmethod
     def _get_service_token(plane: str = "") -> str:
@@ -137,6 +284,7 @@ class VaultManager:
             token=None,
             body={"role_id": role_id, "secret_id": secret_id},
             namespace=namespace,
+            plane=plane,
         )
         auth = resp.get("auth") or {}
         token = str(auth.get("client_token") or "").strip()
@@ -154,6 +302,7 @@ class VaultManager:
                 token=token,
                 body=None,
                 namespace=namespace,
+                plane=plane,
             )
             policies = (lookup.get("data") or {}).get("policies") or []
             token_policies = (lookup.get("data") or {}).get("token_policies") or []
@@ -304,27 +453,27 @@ class VaultManager:
         return s
 
     @staticmethod
-    def _username_template_for(*, requester: str, request_id: str, engine: str) -> str:
+    def _username_template_for(*, requester: str, engine: str) -> str:
         """
         Generate a Vault `username_template` that embeds the requester identity.
 
-        Target format (example): d-<user>-<rid>-<rand>
+        Target format (example): d-<user>-<rand>
+        Roles are reused across a requester's activations of the same shape, so
+        the request id is not part of the template; the random suffix keeps
+        usernames unique per credential.
         Must respect engine identifier limits (MySQL users: 32 chars; Postgres: 63).
         """
         user_frag = VaultManager._normalize_user_fragment(requester)[:12].replace("_", "-")
-        rid_clean = re.sub(r"[^a-z0-9]", "", str(request_id or "").lower())
-        rid_short = (rid_clean[:8] or "req")
 
         eng = str(engine or "").lower()
         max_len = 63 if "postgres" in eng else 32
 
-        # Keep a small random suffix to avoid collisions if creds are minted more than once.
-        rand_len = 4
+        rand_len = 8
         suffix = f"-{{{{random {rand_len}}}}}"
 
-        base = f"d-{user_frag}-{rid_short}"
-        # Account for the rendered random suffix length (e.g. "-abcd" is 1+4 chars),
-        # not the literal template text length (e.g. "-{{random 4}}").
+        base = f"d-{user_frag}"
+        # Account for the rendered random suffix length (e.g. "-abcdefgh" is 1+8 chars),
+        # not the literal template text length (e.g. "-{{random 8}}").
         base_max = max_len - (1 + rand_len)
         if base_max < 1:
             base = base[: max_len]
@@ -333,6 +482,85 @@ class VaultManager:
             base = base[:base_max].rstrip("_-")
         return base + suffix
 
+    @staticmethod
+    def _role_name_for(*, requester: str, content_hash: str) -> str:
+        """Content-addressed role name: identical role definitions share one Vault role."""
+        requester_frag = VaultManager._normalize_user_fragment(requester)[:12]
+        role_name = f"jit_{requester_frag}_{content_hash[:12]}" if requester_frag else f"jit_{content_hash[:12]}"
+        # Keep role names URL-safe.
+        return re.sub(r"[^a-zA-Z0-9_.-]+", "_", role_name)
+
+    @staticmethod
+    def _ensure_role(*, plane: str, addr: str, mount: str, namespace: str, token: str, role_name: str, role_body: dict, content_hash: str, force: bool = False) -> bool:
+        """Write the Vault role unless this process already wrote the same content. Returns True when written."""
+        key = (VaultManager._cache_key_for_plane(plane), mount, role_name)
+        with VaultManager._role_cache_lock:
+            cached = VaultManager._role_cache.get(key)
+            if cached and cached.get("hash") == content_hash and not force:
+                return False
+        VaultManager._http_json(
+            "POST",
+            f"{addr}/v1/{mount}/roles/{role_name}",
+            token=token,
+            body=role_body,
+            namespace=namespace,
+            plane=plane,
+        )
+        with VaultManager._role_cache_lock:
+            entry = VaultManager._role_cache.setdefault(key, {"refs": set()})
+            entry["hash"] = content_hash
+            entry["written_at"] = time.time()
+        return True
+
+    @staticmethod
+    def register_role_reference(role_name: str, request_id: str, plane: str = "") -> None:
+        """Record that an open request holds credentials from `role_name` (call on startup for active sessions)."""
+        rn = str(role_name or "").strip()
+        rid = str(request_id or "").strip()
+        if not (rn and rid):
+            return
+        mount = VaultManager._env("VAULT_DB_MOUNT", plane) or "database"
+        key = (VaultManager._cache_key_for_plane(plane), mount, rn)
+        with VaultManager._role_cache_lock:
+            VaultManager._role_cache.setdefault(key, {"refs": set()})["refs"].add(rid)
+
+    @staticmethod
+    def release_database_role(role_name: str, request_id: str, plane: str = "", holders=None) -> bool:
+        """
+        Drop a request's reference to a shared role; delete the Vault role when
+        nothing references it any more. Returns True if the role was deleted.
+
+        `holders` are the other open requests using the role according to
+        persisted state (every worker's sessions); when given, it decides. When
+        omitted, only this process's references are known, so a role this
+        process has no entry for is left in place.
+        """
+        rn = str(role_name or "").strip()
+        rid = str(request_id or "").strip()
+        if not rn:
+            return False
+        mount = VaultManager._env("VAULT_DB_MOUNT", plane) or "database"
+        key = (VaultManager._cache_key_for_plane(plane), mount, rn)
+        with VaultManager._role_cache_lock:
+            entry = VaultManager._role_cache.get(key)
+            if entry is not None:
+                entry["refs"].discard(rid)
+            if holders is None:
+                if entry is None or entry["refs"]:
+                    return False
+            elif holders:
+                return False
+            VaultManager._role_cache.pop(key, None)
+        return VaultManager.delete_database_role(rn, plane=plane)
+
+    @staticmethod
+    def role_cache_stats() -> list[dict]:
+        with VaultManager._role_cache_lock:
+            return [
+                {"plane": k[0], "mount": k[1], "role_name": k[2], "hash": v.get("hash", ""), "references": len(v.get("refs") or ())}
+                for k, v in VaultManager._role_cache.items()
+            ]
+
     @staticmethod
     def create_database_session(
         *,
@@ -346,7 +574,12 @@ class VaultManager:
         plane: str = "",
     ) -> dict:
         """
-        Create a per-request Vault DB role and mint one set of dynamic DB credentials.
+        Mint one set of dynamic DB credentials from a shared, content-addressed Vault DB role.
+
+        The role is keyed by a hash of (plane, mount, connection, engine, databases,
+        privileges, auth type, TTL, requester): the first activation of a given
+        shape writes it, later ones only read creds. References are counted per
+        request; `release_database_role` deletes the role once none remain.
 
         Returns:
           {
@@ -385,18 +618,6 @@ class VaultManager:
         # Vault DB connection name (configured in Vault). The manual setup typically names it "my-mysql".
         connection = VaultManager._env("VAULT_DB_CONNECTION_NAME", plane) or "my-mysql"
 
-        # Per-request Vault role name (Vault config object).
-        #
-        # Keep it short and traceable (user + request-id fragment). This matters because
-        # Vault's DB username templating often derives from RoleName and DB engines like
-        # MySQL have strict identifier limits (32 chars).
-        requester_frag = VaultManager._normalize_user_fragment(requester)[:12]
-        rid_clean = re.sub(r"[^a-z0-9]", "", rid.lower())
-        rid_short = (rid_clean[:8] or "req")
-        role_name = f"jit_{requester_frag}-{rid_short}" if requester_frag else f"jit_{rid_short}"
-        # Keep role names URL-safe.
-        role_name = re.sub(r"[^a-zA-Z0-9_.-]+", "_", role_name)
-
         engine_l = str(engine or "").lower()
         auth_l = str(auth_type or "password").strip().lower()
         use_iam_auth = auth_l == "iam"
@@ -452,14 +673,14 @@ class VaultManager:
                 # IAM auth: DB user authenticates via AWSAuthenticationPlugin (token as password).
                 creation_statements = [
                     "CREATE USER '{{name}}'@'%' IDENTIFIED WITH AWSAuthenticationPlugin as 'RDS';",
-                    *[f"GRANT {privs_csv} ON `{db_name}`.* TO '{{{{name}}}}'@'%'{grant_opt};" for db_name in db_names],
+                    *[f"GRANT {privs_csv} ON `{db_name}`.* TO '{{{{name}}}}'@'%'{grant_opt};" for db_name in sorted(set(db_names))],
                     "FLUSH PRIVILEGES;",
                 ]
             else:
                 # Use backticks for db name and include IDENTIFIED BY so Vault controls password.
                 creation_statements = [
                     "CREATE USER '{{name}}'@'%' IDENTIFIED BY '{{password}}';",
-                    *[f"GRANT {privs_csv} ON `{db_name}`.* TO '{{{{name}}}}'@'%'{grant_opt};" for db_name in db_names],
+                    *[f"GRANT {privs_csv} ON `{db_name}`.* TO '{{{{name}}}}'@'%'{grant_opt};" for db_name in sorted(set(db_names))],
                     "FLUSH PRIVILEGES;",
                 ]
             revocation_statements = [
@@ -467,29 +688,43 @@ class VaultManager:
                 "FLUSH PRIVILEGES;"
             ]
 
+        role_body = {
+            "db_name": connection,
+            "creation_statements": creation_statements,
+            "revocation_statements": revocation_statements,
+            # Embed requester identity into the generated DB username.
+            "username_template": VaultManager._username_template_for(requester=requester, engine=engine_l),
+            "default_ttl": f"{duration_hours}h",
+            "max_ttl": f"{duration_hours}h",
+        }
+        content_hash = hashlib.sha256(
+            json.dumps(
+                {"plane": VaultManager._cache_key_for_plane(plane), "mount": mount, "role": role_body},
+                sort_keys=True,
+            ).encode("utf-8")
+        ).hexdigest()
+        role_name = VaultManager._role_name_for(requester=requester, content_hash=content_hash)
+
         token = VaultManager._get_service_token(plane)
 
-        # 1) Create/overwrite the Vault DB role (per request).
-        role_url = f"{addr}/v1/{mount}/roles/{role_name}"
-        VaultManager._http_json(
-            "POST",
-            role_url,
-            token=token,
-            body={
-                "db_name": connection,
-                "creation_statements": creation_statements,
-                "revocation_statements": revocation_statements,
-                # Embed requester identity into the generated DB username.
-                "username_template": VaultManager._username_template_for(requester=requester, request_id=rid, engine=engine_l),
-                "default_ttl": f"{duration_hours}h",
-                "max_ttl": f"{duration_hours}h",
-            },
-            namespace=namespace,
+        # 1) Make sure the shared role exists (skipped when this process already wrote it).
+        role_kwargs = dict(
+            plane=plane, addr=addr, mount=mount, namespace=namespace, token=token,
+            role_name=role_name, role_body=role_body, content_hash=content_hash,
         )
+        wrote_role = VaultManager._ensure_role(**role_kwargs)
 
         # 2) Generate one set of credentials for this session.
         creds_url = f"{addr}/v1/{mount}/creds/{role_name}"
-        creds = VaultManager._http_json("GET", creds_url, token=token, body=None, namespace=namespace)
+        try:
+            creds = VaultManager._http_json("GET", creds_url, token=token, body=None, namespace=namespace, plane=plane)
+        except RuntimeError as e:
+            # Role removed out-of-band (or by another worker's cleanup): rewrite once and retry.
+            if wrote_role or not ("HTTP 400" in str(e) or "HTTP 404" in str(e)):
+                raise
+            VaultManager._ensure_role(force=True, **role_kwargs)
+            creds = VaultManager._http_json("GET", creds_url, token=token, body=None, namespace=namespace, plane=plane)
+        VaultManager.register_role_reference(role_name, rid, plane=plane)
         data = creds.get("data") or {}
         db_username = str(data.get("username") or "").strip()
         db_password = str(data.get("password") or "").strip()
@@ -516,7 +751,7 @@ class VaultManager:
 
     @staticmethod
     def delete_database_role(role_name: str, plane: str = "") -> bool:
-        """Best-effort deletion of the Vault DB role (not required for TTL cleanup)."""
+        """Best-effort deletion of the Vault DB role (not required for TTL cleanup). Prefer release_database_role."""
         rn = str(role_name or "").strip()
         if not rn:
             return False
@@ -528,7 +763,7 @@ class VaultManager:
             mount = VaultManager._env("VAULT_DB_MOUNT", plane) or "database"
             token = VaultManager._get_service_token(plane)
             url = f"{addr}/v1/{mount}/roles/{rn}"
-            VaultManager._http_json("DELETE", url, token=token, body=None, namespace=namespace)
+            VaultManager._http_json("DELETE", url, token=token, body=None, namespace=namespace, plane=plane)
             return True
         except Exception:
             return False
@@ -543,5 +778,5 @@ class VaultManager:
         namespace = VaultManager._vault_namespace(plane)
         token = VaultManager._get_service_token(plane)
         url = f"{addr}/v1/sys/leases/revoke"
-        VaultManager._http_json("POST", url, token=token, body={"lease_id": lid}, namespace=namespace)
+        VaultManager._http_json("POST", url, token=token, body={"lease_id": lid}, namespace=namespace, plane=plane)
         return True
@@ -3460,22 +3460,33 @@ async function executeQuery() {
     document.getElementById('dbQuery').value = '';
     const userEmail = localStorage.getItem('userEmail') || '';
     try {
-        const res = await fetch(`${DB_API_BASE}/api/databases/execute-query`, {
+        const payload = {
+            request_id: window.dbConn.requestId,
+            user_email: userEmail,
+            query,
+            dbName: window.dbConn.dbName
+        };
+        const post = () => fetch(`${DB_API_BASE}/api/databases/execute-query`, {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                request_id: window.dbConn.requestId,
-                user_email: userEmail,
-                query,
-                dbName: window.dbConn.dbName
-            })
-        });
-        const data = await res.json();
+            body: JSON.stringify(payload)
+        }).then(r => r.json());
+        let data = await post();
+        if (data.code === 'QUERY_COST_JUSTIFICATION_REQUIRED') {
+            const why = prompt(`${data.error}\n\nWhy do you need to run this query?`);
+            if (why && why.trim()) {
+                payload.cost_justification = why.trim();
+                data = await post();
+            }
+        }
         if (data.error) {
             const errMsg = data.error.startsWith('❌') ? data.error.replace(/^❌\s*/, '[ERROR] ') : `[ERROR] ${data.error}`;
             appendOutput(`\n${errMsg}\n\n`);
         }
-        else if (data.results) appendOutput(formatResults(data.results) + '\n');
+        else if (data.results) {
+            appendOutput(formatResults(data.results) + '\n');
+            if (data.truncated) appendOutput(`[TRUNCATED] Showing first ${data.row_count} row(s); narrow the query with LIMIT/WHERE.\n\n`);
+        }
         else appendOutput(`\n[OK] ${data.affected_rows || 0} row(s)\n\n`);
     } catch (e) {
         appendOutput(`\n[ERROR] ${e.message}\n\n`);
@@ -235,7 +235,7 @@ function connectTerminalDb(host, port, engine, requestId, dbName, mode = 'databa
             </div>
             <div class="term-query-output" id="${id}-output"></div>
             <div class="term-query-input-row">
-                <input type="text" id="${id}-input" placeholder="Enter SQL, Ctrl+Enter to run" onkeydown="if(event.ctrlKey&&event.key==='Enter')submitTerminalQueryForTab('${id}', '${resolvedMode}')">
+                <input type="text" id="${id}-input" placeholder="Enter SQL, Tab to complete, Ctrl+Enter to run" onkeydown="handleTerminalInputKey(event, '${id}', '${resolvedMode}')">
                 <button class="btn-submit" onclick="submitTerminalQueryForTab('${id}', '${resolvedMode}')"><i class="fas fa-play"></i> Submit</button>
             </div>
         </div>
@@ -349,6 +349,68 @@ function escapeHtml(s) {
     return d.innerHTML;
 }
 
+function handleTerminalInputKey(event, id, mode = 'database') {
+    if (event.ctrlKey && event.key === 'Enter') {
+        submitTerminalQueryForTab(id, mode);
+    } else if (event.key === 'Tab' && !event.shiftKey) {
+        event.preventDefault();
+        completeTerminalInputForTab(id, mode);
+    }
+}
+
+async function completeTerminalInputForTab(id, mode = 'database') {
+    const resolvedMode = normalizeTerminalMode(mode);
+    const t = getTerminalState(resolvedMode).tabs.find(x => x.id === id);
+    if (!t || !t.conn || t.conn.type !== 'db' || !t.inputEl) return;
+
+    const input = t.inputEl;
+    const cursor = input.selectionStart ?? input.value.length;
+    const before = input.value.slice(0, cursor);
+    const word = (before.match(/[\w$.`]+$/) || [''])[0];
+    if (!word) return;
+    const segment = word.slice(word.lastIndexOf('.') + 1).replace(/`/g, '');
+
+    try {
+        const data = await fetch(`${TERMINAL_API_BASE}/api/databases/schema`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                request_id: t.conn.requestId,
+                user_email: localStorage.getItem('userEmail') || '',
+                dbName: t.conn.dbName,
+                prefix: word,
+                limit: 50
+            })
+        }).then(r => r.json());
+        if (data.error) {
+            appendTerminalOutputForTab(id, `[ERROR] ${data.error}\n`, resolvedMode);
+            return;
+        }
+        const names = (data.suggestions || []).map(s => s.name);
+        if (names.length === 0) return;
+
+        // Complete up to the longest prefix shared by every suggestion (case-insensitive).
+        let common = names[0];
+        for (const n of names.slice(1)) {
+            let i = 0;
+            while (i < common.length && i < n.length && common[i].toLowerCase() === n[i].toLowerCase()) i++;
+            common = common.slice(0, i);
+        }
+        const completion = names.length === 1 ? names[0] + ' ' : common;
+        if (completion.length > segment.length) {
+            const start = cursor - segment.length;
+            input.value = input.value.slice(0, start) + completion + input.value.slice(cursor);
+            input.selectionStart = input.selectionEnd = start + completion.length;
+        }
+        if (names.length > 1) {
+            const listed = (data.suggestions || []).slice(0, 20).map(s => s.kind === 'column' ? s.name : `${s.name} (${s.kind})`);
+            appendTerminalOutputForTab(id, `${listed.join('  ')}${names.length > 20 ? '  ...' : ''}\n`, resolvedMode);
+        }
+    } catch (e) {
+        appendTerminalOutputForTab(id, `[ERROR] ${e.message}\n`, resolvedMode);
+    }
+}
+
 async function submitTerminalQueryForTab(id, mode = 'database') {
     const resolvedMode = normalizeTerminalMode(mode);
     const state = getTerminalState(resolvedMode);
@@ -364,18 +426,27 @@ async function submitTerminalQueryForTab(id, mode = 'database') {
 
     const userEmail = localStorage.getItem('userEmail') || '';
     try {
-        const res = await fetch(`${TERMINAL_API_BASE}/api/databases/execute-query`, {
+        const payload = {
+            request_id: t.conn.requestId,
+            user_email: userEmail,
+            query,
+            dbName: t.conn.dbName
+        };
+        const post = () => fetch(`${TERMINAL_API_BASE}/api/databases/execute-query`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                request_id: t.conn.requestId,
-                user_email: userEmail,
-                query,
-                dbName: t.conn.dbName
-            })
-        });
-
-        const data = await res.json();
+            body: JSON.stringify(payload)
+        }).then(r => r.json());
+
+        let data = await post();
+        if (data.code === 'QUERY_COST_JUSTIFICATION_REQUIRED') {
+            // Expensive read (EXPLAIN pre-flight): allowed once the user says why.
+            const why = prompt(`${data.error}\n\nWhy do you need to run this query?`);
+            if (why && why.trim()) {
+                payload.cost_justification = why.trim();
+                data = await post();
+            }
+        }
         if (data.error) {
             const errMsg = data.error.startsWith('❌')
                 ? data.error.replace(/^❌\s*/, '[ERROR] ')
@@ -385,6 +456,9 @@ async function submitTerminalQueryForTab(id, mode = 'database') {
             const rows = data.results;
             if (rows.length === 0) appendTerminalOutputForTab(id, '(0 rows)\n', resolvedMode);
             else appendTerminalOutputForTab(id, JSON.stringify(rows, null, 2) + '\n', resolvedMode);
+            if (data.truncated) {
+                appendTerminalOutputForTab(id, `[TRUNCATED] Showing first ${data.row_count} row(s) (${data.truncated_reason === 'max_bytes' ? 'size' : 'row'} limit reached). Add a LIMIT/WHERE clause to narrow the result.\n`, resolvedMode);
+            }
         } else if (data.affected_rows !== undefined) {
             appendTerminalOutputForTab(id, `[OK] ${data.affected_rows} row(s) affected\n`, resolvedMode);
         }